@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Adaptive Compression Module
+Deteccion del contenido ya comprimido de moodledata
+
+La mayor parte de filedir son imagenes, videos, PDF y paquetes ZIP/SCORM que
+ya vienen comprimidos: pasarlos por gzip/zstd gasta CPU sin reducir su
+tamaño. El motor (AdaptiveTarPipeline) escribe el tar de moodledata en
+marcos: el contenido comprimible va al compresor como siempre y los archivos
+grandes que no lo son se guardan en marcos "stored" (miembros gzip con
+bloques deflate sin comprimir o frames zstd con bloques raw). El archivo
+sigue siendo un .tar.gz/.tar.zst valido para restore.sh y la verificacion.
+
+Los archivos de filedir no tienen extension (su nombre es el contenthash),
+por lo que se clasifican por sus magic bytes y, si no se reconocen,
+comprimiendo una muestra del inicio con zlib nivel 1.
+Solo usa la biblioteca estandar.
+"""
+
+import os
+import struct
+import sys
+import zlib
+from pathlib import Path
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backup.compression import GZIP_MAGIC, ZSTD_MAGIC
+
+
+# Bytes del inicio de cada archivo que se usan para clasificarlo
+SAMPLE_SIZE = 64 * 1024
+
+# Una muestra que no baja de esta proporcion al comprimirla se guarda sin comprimir
+INCOMPRESSIBLE_RATIO = 0.95
+
+# Los archivos mas chicos van siempre al compresor (no compensa cortar el marco)
+STORE_MIN_SIZE = 256 * 1024
+
+# Formatos que ya vienen comprimidos: (offset, firma, nombre)
+COMPRESSED_SIGNATURES = (
+    (0, b'\xff\xd8\xff', 'jpeg'),
+    (0, b'\x89PNG\r\n\x1a\n', 'png'),
+    (0, b'GIF8', 'gif'),
+    (4, b'ftyp', 'mp4'),
+    (0, b'\x1a\x45\xdf\xa3', 'webm'),
+    (0, b'ID3', 'mp3'),
+    (0, b'OggS', 'ogg'),
+    (0, b'fLaC', 'flac'),
+    (0, b'PK\x03\x04', 'zip'),
+    (0, GZIP_MAGIC, 'gzip'),
+    (0, ZSTD_MAGIC, 'zstd'),
+    (0, b'BZh', 'bzip2'),
+    (0, b'\xfd7zXZ\x00', 'xz'),
+    (0, b"7z\xbc\xaf'\x1c", '7z'),
+    (0, b'Rar!\x1a\x07', 'rar'),
+)
+
+# WebP/AVI comparten la cabecera RIFF; WAV (RIFF....WAVE) no viene comprimido
+RIFF_COMPRESSED = (b'WEBP', b'AVI ')
+
+# Tamaño maximo de un bloque raw de zstd (y ventana declarada en la cabecera)
+ZSTD_BLOCK_SIZE = 128 * 1024
+
+
+def signature(head):
+    """Nombre del formato comprimido reconocido por sus magic bytes (None si no se reconoce)"""
+    for offset, magic, name in COMPRESSED_SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            return name
+    if head[:4] == b'RIFF' and head[8:12] in RIFF_COMPRESSED:
+        return head[8:12].strip().decode().lower()
+    return None
+
+
+def sample_ratio(head):
+    """Proporcion tamaño comprimido / original de la muestra (zlib nivel 1)"""
+    if not head:
+        return 1.0
+    return len(zlib.compress(head[:SAMPLE_SIZE], 1)) / len(head[:SAMPLE_SIZE])
+
+
+def classify(head):
+    """
+    Decide si un archivo se comprime a partir de su inicio
+
+    Args:
+        head: Primeros bytes del archivo (hasta SAMPLE_SIZE)
+
+    Returns:
+        Tupla (comprimir, motivo): motivo es el formato reconocido o 'muestra'
+    """
+    name = signature(head)
+    if name is not None:
+        return False, name
+    return sample_ratio(head) < INCOMPRESSIBLE_RATIO, 'muestra'
+
+
+class StoredGzip:
+    """Miembro gzip con bloques deflate sin comprimir (solo copia y CRC32)"""
+
+    def __init__(self):
+        self._encoder = zlib.compressobj(0, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._encoder.compress(data)
+
+    def flush(self):
+        return self._encoder.flush()
+
+
+class StoredZstd:
+    """Frame zstd con bloques raw (sin checksum de contenido)"""
+
+    # Descriptor sin tamaño de contenido ni diccionario; ventana de 128 KB (2^(10+7))
+    HEADER = ZSTD_MAGIC + bytes([0x00, 7 << 3])
+
+    def __init__(self):
+        self._header = self.HEADER
+        self._pending = b''
+
+    @staticmethod
+    def _block(data, last):
+        return struct.pack('<I', (len(data) << 3) | int(last))[:3] + data
+
+    def compress(self, data):
+        # Se retiene el ultimo bloque: el que cierra el frame lleva la marca Last_Block
+        buffer, self._header = self._header, b''
+        self._pending += data
+        while len(self._pending) > ZSTD_BLOCK_SIZE:
+            buffer += self._block(self._pending[:ZSTD_BLOCK_SIZE], False)
+            self._pending = self._pending[ZSTD_BLOCK_SIZE:]
+        return buffer
+
+    def flush(self):
+        buffer = self._header + self._block(self._pending, True)
+        self._header = self._pending = b''
+        return buffer
+
+
+def stored_encoder(codec):
+    """Codificador de marcos sin compresion compatible con el formato del codec"""
+    if codec.extension == '.zst':
+        return StoredZstd()
+    return StoredGzip()
+
+
+def analyze(path, min_size=STORE_MIN_SIZE):
+    """
+    Estima cuanto contenido de un directorio se guardaria sin comprimir
+
+    Returns:
+        Dict con archivos y bytes comprimibles/guardados y los formatos encontrados
+    """
+    stats = {'files': 0, 'bytes': 0, 'stored_files': 0, 'stored_bytes': 0, 'formats': {}}
+    for root, _, names in os.walk(path):
+        for name in names:
+            file_path = os.path.join(root, name)
+            if os.path.islink(file_path) or not os.path.isfile(file_path):
+                continue
+            size = os.path.getsize(file_path)
+            stats['files'] += 1
+            stats['bytes'] += size
+            if size < min_size:
+                continue
+            with open(file_path, 'rb') as f:
+                compress, reason = classify(f.read(SAMPLE_SIZE))
+            if not compress:
+                stats['stored_files'] += 1
+                stats['stored_bytes'] += size
+                stats['formats'][reason] = stats['formats'].get(reason, 0) + size
+    return stats
+
+
+def main(argv):
+    usage = (
+        "Uso:\n"
+        "  adaptive.py classify <archivo>...\n"
+        "  adaptive.py analyze <directorio>   (ej. el punto de montaje de moodledata)"
+    )
+    command = argv[1] if len(argv) > 1 else None
+    if command not in ('classify', 'analyze') or len(argv) < 3:
+        print(usage, file=sys.stderr)
+        return 1
+
+    if command == 'classify':
+        for path in argv[2:]:
+            with open(path, 'rb') as f:
+                compress, reason = classify(f.read(SAMPLE_SIZE))
+            print(f"{'comprimir' if compress else 'guardar'}\t{reason}\t{path}")
+        return 0
+
+    stats = analyze(argv[2])
+    print(f"Archivos: {stats['files']} ({stats['bytes']} bytes)")
+    print(f"Sin comprimir: {stats['stored_files']} archivos ({stats['stored_bytes']} bytes)")
+    for name, size in sorted(stats['formats'].items(), key=lambda item: -item[1]):
+        print(f"  {name}: {size} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
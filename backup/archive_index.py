@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Archive Index Module
+Indice de archivos del tar de moodledata para recuperar archivos sueltos
+
+Recuperar un archivo borrado de un moodledata_<fecha>.tar.gz obligaba a
+descomprimir el stream completo. El motor escribe el tar en marcos
+comprimidos independientes de BACKUP_MOODLEDATA_FRAME_MB (ver
+AdaptiveTarPipeline); cada marco empieza en una entrada del tar, por lo que
+se puede descomprimir por separado. Junto al archivo se guarda
+<archivo>.index.json.gz: una cabecera JSON con los marcos y una linea por
+entrada del tar:
+
+    {"format": "moodledata-archive-index", "version": 1, "codec": "zstd", "frames": [...], ...}
+    {"path": "filedir/3f/a1/3fa1...", "type": "file", "size": 52311,
+     "contenthash": "3fa1...", "frame": 12, "offset": 1048576}
+
+offset es la posicion de la cabecera tar de la entrada dentro del contenido
+descomprimido de su marco. Para extraer archivos o subdirectorios solo se
+descomprimen sus marcos, hasta la ultima entrada pedida. Los archivos sin
+indice (backup.sh o respaldos anteriores) se recorren completos y los
+respaldos en fragmentos (sharded.py) se leen como un solo archivo.
+Solo usa la biblioteca estandar.
+"""
+
+import gzip
+import json
+import os
+import re
+import sys
+from datetime import datetime
+from pathlib import Path
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backup.incremental import filedir_hash
+from backup.integrity import HashingWriter
+from backup.seekable import _decompressed
+from backup.sharded import MANIFEST_FILE as SHARD_MANIFEST, SHARD_DIR, shard_archives
+from backup.volume import CHUNK_SIZE, ZERO_BLOCK, TarEntryReader
+
+FORMAT = 'moodledata-archive-index'
+ARCHIVE_INDEX_SUFFIX = '.index.json.gz'
+
+# Tipos de entrada tar como se guardan en el indice
+ENTRY_TYPES = {b'0': 'file', b'\0': 'file', b'7': 'file', b'5': 'dir', b'2': 'symlink', b'1': 'hardlink'}
+
+CONTENTHASH_PREFIX = re.compile(r'^[0-9a-f]{4,40}$')
+
+
+def find_archive(backup_dir):
+    """Tar de moodledata de un respaldo (None si no hay o es incremental)"""
+    for name in sorted(os.listdir(backup_dir)):
+        if name.startswith('moodledata_') and name.endswith(('.tar', '.tar.gz', '.tar.zst')):
+            return os.path.join(backup_dir, name)
+    return None
+
+
+def index_entry(entry, frame=None, offset=None):
+    """Linea del indice para una entrada de TarEntryReader"""
+    item = {'path': entry['name'], 'type': ENTRY_TYPES.get(entry['type'], 'other'), 'size': entry['size']}
+    contenthash = filedir_hash(entry['name'])
+    if contenthash:
+        item['contenthash'] = contenthash
+    if frame is not None:
+        item['frame'] = frame
+        item['offset'] = offset
+    return item
+
+
+class ArchiveIndexWriter:
+    """
+    Escribe el indice mientras se genera el archivo
+
+    Las entradas van a un archivo temporal sin comprimir; finish() escribe el
+    indice final con la cabecera (que incluye los marcos) en la primera linea.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries_file = path + '.entries.part'
+        self.count = 0
+        self._entries = open(self.entries_file, 'w', encoding='utf-8')
+
+    def add(self, entry, frame, offset):
+        self._entries.write(json.dumps(index_entry(entry, frame, offset)) + '\n')
+        self.count += 1
+
+    def finish(self, header):
+        """
+        Returns:
+            SHA-256 del indice escrito
+        """
+        self._entries.close()
+        header = dict(header, format=FORMAT, version=1, entries=self.count,
+                      created=datetime.now().isoformat(timespec='seconds'))
+        partial = self.path + '.part'
+        try:
+            with open(partial, 'wb') as raw:
+                hashing = HashingWriter(raw)
+                with gzip.open(hashing, 'wt', encoding='utf-8') as index, \
+                        open(self.entries_file, encoding='utf-8') as entries:
+                    index.write(json.dumps(header) + '\n')
+                    for line in entries:
+                        index.write(line)
+            os.replace(partial, self.path)
+        finally:
+            for path in (partial, self.entries_file):
+                if os.path.exists(path):
+                    os.remove(path)
+        return hashing.hexdigest()
+
+    def abort(self):
+        self._entries.close()
+        if os.path.exists(self.entries_file):
+            os.remove(self.entries_file)
+
+
+def read_index_header(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+    if header.get('format') != FORMAT:
+        raise ValueError(f"{path} no es un índice de moodledata")
+    return header
+
+
+def write_index_header(path, header):
+    """
+    Reescribe la cabecera de un indice conservando sus entradas (ej. al
+    recomprimir el archivo marco por marco en el almacenamiento frio)
+
+    Returns:
+        SHA-256 del indice escrito
+    """
+    partial = path + '.part'
+    with gzip.open(path, 'rt', encoding='utf-8') as source, open(partial, 'wb') as raw:
+        source.readline()
+        hashing = HashingWriter(raw)
+        with gzip.open(hashing, 'wt', encoding='utf-8') as index:
+            index.write(json.dumps(header) + '\n')
+            for line in source:
+                index.write(line)
+    os.replace(partial, path)
+    return hashing.hexdigest()
+
+
+class _ChunkReader:
+    """Interfaz read() sobre un iterador de bloques; position cuenta los bytes leidos"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buffer = b''
+        self.position = 0
+
+    def read(self, size=CHUNK_SIZE):
+        if not self.buffer:
+            self.buffer = next(self.chunks, b'')
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        self.position += len(data)
+        return data
+
+    def skip(self, size):
+        while size > 0:
+            data = self.read(min(size, CHUNK_SIZE))
+            if not data:
+                raise EOFError("Marco truncado")
+            size -= len(data)
+
+    def close(self):
+        self.chunks.close()
+
+
+def _matching(item, selection):
+    """Elementos de selection que cubren la entrada (su ruta, un directorio padre o su contenthash)"""
+    return [wanted for wanted in selection
+            if item['path'] == wanted or item['path'].startswith(wanted + '/') or item.get('contenthash') == wanted]
+
+
+class _EntrySearch:
+    """Listado y busqueda sobre entries()"""
+
+    def list(self, prefix=None):
+        """Entradas del archivo (solo las de prefix y su contenido si se indica)"""
+        prefix = (prefix or '').strip('/')
+        for item in self.entries():
+            if not prefix or item['path'] == prefix or item['path'].startswith(prefix + '/'):
+                yield item
+
+    def search(self, term):
+        """Entradas cuyo contenthash empieza por term o cuya ruta contiene term"""
+        term = term.strip().strip('/')
+        by_hash = bool(CONTENTHASH_PREFIX.match(term))
+        for item in self.entries():
+            if (by_hash and item.get('contenthash', '').startswith(term)) or term in item['path']:
+                yield item
+
+
+class ArchiveReader(_EntrySearch):
+    """
+    Lista, busca y extrae archivos del tar de moodledata de un respaldo
+
+    Con indice se leen solo los marcos de las entradas pedidas; sin indice
+    se recorre el archivo completo.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + ARCHIVE_INDEX_SUFFIX
+        self.header = None
+        if os.path.exists(self.index_path):
+            self.mode = 'indexed'
+            self.header = read_index_header(self.index_path)
+        else:
+            self.mode = 'plain'
+
+    def entries(self):
+        """Itera las entradas del archivo (dicts con path, type, size y contenthash)"""
+        if self.mode == 'indexed':
+            with gzip.open(self.index_path, 'rt', encoding='utf-8') as f:
+                f.readline()
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+            return
+
+        chunks = _decompressed(self.path)
+        try:
+            for entry in TarEntryReader(_ChunkReader(chunks)).entries():
+                yield index_entry(entry)
+        finally:
+            chunks.close()
+
+    def extract(self, selection, output):
+        """
+        Escribe en output un tar con las entradas pedidas
+
+        Args:
+            selection: Rutas (archivos o directorios) o contenthash
+            output: Archivo binario de destino
+
+        Returns:
+            Dict con entradas, archivos y bytes extraidos
+
+        Raises:
+            ValueError si alguna ruta o contenthash no esta en el archivo
+        """
+        return _extract([self], selection, output)
+
+    def _plan(self, selection, found):
+        """Offsets de las entradas pedidas por marco (None sin indice)"""
+        if self.mode != 'indexed':
+            return None
+        wanted_by_frame = {}
+        for item in self.entries():
+            matched = _matching(item, selection)
+            if matched:
+                wanted_by_frame.setdefault(item['frame'], []).append(item['offset'])
+                found.update(matched)
+        return wanted_by_frame
+
+    def _copy(self, selection, plan, copy, found):
+        """Copia las entradas pedidas: solo los marcos del plan o, sin indice, todo el archivo"""
+        if plan is not None:
+            frames = self.header['frames']
+            for number in sorted(plan):
+                frame = frames[number]
+                stream = _ChunkReader(_decompressed(self.path, frame['offset'], frame['length']))
+                try:
+                    # Se descomprime el marco solo hasta la ultima entrada pedida
+                    for offset in sorted(plan[number]):
+                        stream.skip(offset - stream.position)
+                        reader = TarEntryReader(stream)
+                        entry = next(reader.entries(), None)
+                        if entry is None:
+                            raise RuntimeError(f"Entrada no encontrada en el marco {number} de "
+                                               f"{os.path.basename(self.path)}")
+                        copy(entry, reader)
+                finally:
+                    stream.close()
+            return
+
+        chunks = _decompressed(self.path)
+        try:
+            reader = TarEntryReader(_ChunkReader(chunks))
+            for entry in reader.entries():
+                matched = _matching(index_entry(entry), selection)
+                if matched:
+                    found.update(matched)
+                    copy(entry, reader)
+        finally:
+            chunks.close()
+
+
+class ArchiveSet(_EntrySearch):
+    """
+    Varios tar de moodledata leidos como uno (respaldos en fragmentos, ver
+    sharded.py); cada fragmento usa su propio indice si lo tiene
+    """
+
+    def __init__(self, paths):
+        self.readers = [ArchiveReader(path) for path in paths]
+        self.mode = 'indexed' if all(reader.mode == 'indexed' for reader in self.readers) else 'plain'
+
+    def entries(self):
+        for reader in self.readers:
+            yield from reader.entries()
+
+    def extract(self, selection, output):
+        """Como ArchiveReader.extract, con las entradas de todos los fragmentos"""
+        return _extract(self.readers, selection, output)
+
+
+def _extract(readers, selection, output):
+    selection = [item.strip().strip('/') for item in selection if item.strip().strip('/')]
+    if not selection:
+        raise ValueError("No se indicó ningún archivo")
+    stats = {'entries': 0, 'files': 0, 'bytes': 0}
+    found = set()
+
+    def copy(entry, reader):
+        output.write(entry['header'])
+        for chunk in iter(reader.read, b''):
+            output.write(chunk)
+        stats['entries'] += 1
+        if ENTRY_TYPES.get(entry['type']) == 'file':
+            stats['files'] += 1
+            stats['bytes'] += entry['size']
+
+    # Con indice se valida la seleccion antes de descomprimir nada
+    plans = [reader._plan(selection, found) for reader in readers]
+    if all(plan is not None for plan in plans):
+        _check(selection, found)
+    for reader, plan in zip(readers, plans):
+        reader._copy(selection, plan, copy, found)
+    _check(selection, found)
+
+    output.write(ZERO_BLOCK * 2)
+    return stats
+
+
+def _check(selection, found):
+    missing = [item for item in selection if item not in found]
+    if missing:
+        raise ValueError(f"No se encontraron en el respaldo: {', '.join(missing)}")
+
+
+def open_archive(backup_dir):
+    """Lector del moodledata de un respaldo: su tar o sus fragmentos (None si no hay)"""
+    archive = find_archive(backup_dir)
+    if archive is not None:
+        return ArchiveReader(archive)
+    shard_dir = os.path.join(backup_dir, SHARD_DIR)
+    if os.path.exists(os.path.join(shard_dir, SHARD_MANIFEST)):
+        return ArchiveSet(shard_archives(shard_dir))
+    return None
+
+
+def main(argv):
+    usage = (
+        "Uso:\n"
+        "  archive_index.py list <directorio_backup> [ruta]\n"
+        "  archive_index.py search <directorio_backup> <contenthash|texto>\n"
+        "  archive_index.py extract <directorio_backup> <ruta|contenthash>...   (tar a stdout)"
+    )
+    command = argv[1] if len(argv) > 1 else None
+    if command not in ('list', 'search', 'extract') or len(argv) < 3 or \
+            (command != 'list' and len(argv) < 4):
+        print(usage, file=sys.stderr)
+        return 1
+
+    try:
+        reader = open_archive(argv[2])
+        if reader is None:
+            print(f"ERROR: {argv[2]} no tiene un tar de moodledata", file=sys.stderr)
+            return 1
+        if command == 'extract':
+            stats = reader.extract(argv[3:], sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+            print(f"{stats['files']} archivos ({stats['bytes']} bytes)", file=sys.stderr)
+            return 0
+        items = reader.list(argv[3] if len(argv) > 3 else None) if command == 'list' else reader.search(argv[3])
+        for item in items:
+            print(f"{item['type']:<8} {item['size']:>12} {item['path']}")
+    except BrokenPipeError:
+        return 1
+    except (ValueError, RuntimeError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -26,11 +26,13 @@ if [ -z "$BACKUP_BASE_PATH" ] || [ -z "$DB_NAME" ]; then
             DB_USER="${PROD_DB_USER}"
             DB_PASS="${PROD_DB_PASS}"
             DB_ROOT_PASS="${PROD_DB_ROOT_PASS}"
+            ENV_DB_MODE="${PROD_BACKUP_DB_MODE}"
         else
             DB_NAME="${TEST_DB_NAME}"
             DB_USER="${TEST_DB_USER}"
             DB_PASS="${TEST_DB_PASS}"
             DB_ROOT_PASS="${TEST_DB_ROOT_PASS}"
+            ENV_DB_MODE="${TEST_BACKUP_DB_MODE}"
         fi
     else
         echo "ADVERTENCIA: No se encontró archivo .env en $ENV_FILE"
@@ -42,6 +44,39 @@ BASE_BACKUP_DIR="${BACKUP_BASE_PATH:-/opt/docker-project/backups}"
 BACKUP_DIR="$BASE_BACKUP_DIR/$ENVIRONMENT/$FECHA"
 DAYS_TO_KEEP="${BACKUP_RETENTION_DAYS:-7}"
 
+# Compresión: gzip, pigz o zstd (nivel vacío = nivel por defecto del codec, 0 hilos = todos)
+COMPRESSION="${BACKUP_COMPRESSION:-gzip}"
+COMPRESSION_LEVEL="${BACKUP_COMPRESSION_LEVEL:-}"
+COMPRESSION_THREADS="${BACKUP_COMPRESSION_THREADS:-0}"
+
+# Modo de moodledata: full (tar), incremental (almacén de blobs compartido)
+# o sharded (fragmentos por prefijo de filedir en paralelo)
+MOODLEDATA_MODE="${BACKUP_MOODLEDATA_MODE:-full}"
+
+# Directorios de moodledata que no se respaldan (vacío = ninguno)
+export BACKUP_MOODLEDATA_EXCLUDE="${BACKUP_MOODLEDATA_EXCLUDE-cache,localcache,temp,sessions,trashdir}"
+BLOB_STORE="$BASE_BACKUP_DIR/blobs"
+
+# Modo de base de datos: single (mysqldump) o parallel (por tabla, varios workers);
+# PROD_/TEST_BACKUP_DB_MODE lo reemplazan por ambiente y BACKUP_DB_MODE_OVERRIDE (BackupManager) a ambos
+DB_MODE="${BACKUP_DB_MODE_OVERRIDE:-${ENV_DB_MODE:-${BACKUP_DB_MODE:-single}}}"
+
+# Respaldar base de datos y moodledata al mismo tiempo (true/false)
+CONCURRENT="${BACKUP_CONCURRENT:-true}"
+PROGRESS_INTERVAL=10
+
+# Prioridad y límites para no afectar la latencia de Moodle
+NICE_LEVEL="${BACKUP_NICE:-10}"
+IONICE_CLASS="${BACKUP_IONICE_CLASS:-idle}"
+RATE_LIMIT_MB="${BACKUP_RATE_LIMIT_MB:-0}"
+
+# Copia remota en almacenamiento compatible con S3 (configuración BACKUP_REMOTE_*)
+REMOTE_ENABLED="${BACKUP_REMOTE_ENABLED:-false}"
+
+# Binlogs para recuperación a un instante: el dump registra su posición
+BINLOG_ENABLED="${BACKUP_BINLOG_ENABLED:-false}"
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+
 # Nombres de contenedores
 MYSQL_CONTAINER="mysql_$ENVIRONMENT"
 MOODLE_CONTAINER="moodle_$ENVIRONMENT"
@@ -81,16 +116,156 @@ log_info() {
     log_message "[INFO] $1"
 }
 
+###############################################################################
+# Configurar el compresor (COMPRESS_CMD y COMPRESS_EXT)
+###############################################################################
+setup_compression() {
+    local threads="$COMPRESSION_THREADS"
+    if [ -z "$threads" ] || [ "$threads" -le 0 ] 2>/dev/null; then
+        threads=$(nproc 2>/dev/null || echo 1)
+    fi
+
+    if [ "$COMPRESSION" != "gzip" ] && ! command -v "$COMPRESSION" > /dev/null 2>&1; then
+        log_warning "Compresor '$COMPRESSION' no disponible, se usará gzip"
+        COMPRESSION="gzip"
+    fi
+
+    case "$COMPRESSION" in
+        pigz)
+            COMPRESS_CMD=(pigz -c "-${COMPRESSION_LEVEL:-6}" -p "$threads")
+            COMPRESS_EXT="gz"
+            ;;
+        zstd)
+            COMPRESS_CMD=(zstd -c -q "-${COMPRESSION_LEVEL:-3}" -T"$threads")
+            COMPRESS_EXT="zst"
+            ;;
+        gzip)
+            COMPRESS_CMD=(gzip -c "-${COMPRESSION_LEVEL:-6}")
+            COMPRESS_EXT="gz"
+            ;;
+        *)
+            log_warning "Compresor desconocido '$COMPRESSION', se usará gzip"
+            COMPRESSION="gzip"
+            COMPRESS_CMD=(gzip -c "-${COMPRESSION_LEVEL:-6}")
+            COMPRESS_EXT="gz"
+            ;;
+    esac
+
+    log_info "Compresión: ${COMPRESS_CMD[*]}"
+}
+
+###############################################################################
+# Configurar las exclusiones de moodledata (EXCLUDED_DIRS)
+###############################################################################
+setup_exclusions() {
+    local dirs=() dir
+    EXCLUDED_DIRS=()
+    IFS=',' read -ra dirs <<< "$BACKUP_MOODLEDATA_EXCLUDE"
+    for dir in "${dirs[@]}"; do
+        dir="${dir// /}"
+        dir="${dir#./}"
+        dir="${dir%/}"
+        if [ -n "$dir" ]; then
+            EXCLUDED_DIRS+=("$dir")
+        fi
+    done
+
+    if [ ${#EXCLUDED_DIRS[@]} -gt 0 ]; then
+        log_info "Directorios excluidos de moodledata: ${EXCLUDED_DIRS[*]}"
+    fi
+}
+
+###############################################################################
+# Configurar prioridad y límites (THROTTLE_CMD)
+###############################################################################
+setup_throttle() {
+    local summary=""
+
+    # Los procesos hijos (compresores, tee, scripts Python) heredan la prioridad
+    if [ "${NICE_LEVEL:-0}" -gt 0 ] 2>/dev/null && renice -n "$NICE_LEVEL" -p $$ > /dev/null 2>&1; then
+        summary="nice +$NICE_LEVEL"
+    fi
+
+    local io_class=""
+    case "$IONICE_CLASS" in
+        realtime) io_class=1 ;;
+        best-effort) io_class=2 ;;
+        idle) io_class=3 ;;
+    esac
+    if [ -n "$io_class" ] && command -v ionice > /dev/null 2>&1 && ionice -c "$io_class" -p $$ > /dev/null 2>&1; then
+        summary="${summary:+$summary, }ionice $IONICE_CLASS"
+    fi
+
+    # Límite de escritura: pv si está instalado, si no throttle.py
+    THROTTLE_CMD=(cat)
+    if awk "BEGIN { exit !($RATE_LIMIT_MB > 0) }" 2>/dev/null; then
+        if command -v pv > /dev/null 2>&1; then
+            THROTTLE_CMD=(pv -q -L "$(awk "BEGIN { printf \"%d\", $RATE_LIMIT_MB * 1048576 }")")
+        else
+            THROTTLE_CMD=(python3 "$SCRIPT_DIR/throttle.py" limit "$RATE_LIMIT_MB")
+        fi
+        summary="${summary:+$summary, }límite $RATE_LIMIT_MB MB/s"
+    fi
+
+    log_info "Prioridad y límites: ${summary:-sin límites}"
+}
+
+###############################################################################
+# Medidores de progreso (PROGRESS_DB_CMD / PROGRESS_MD_CMD)
+# Con BACKUP_PROGRESS_FILE (lo define backup_manager.py) progress.py registra
+# bytes, filas y archivos de cada etapa; si no, los pipes usan cat
+###############################################################################
+setup_progress() {
+    PROGRESS_DB_CMD=(cat)
+    PROGRESS_MD_CMD=(cat)
+    if [ -n "$BACKUP_PROGRESS_FILE" ]; then
+        PROGRESS_DB_CMD=(python3 "$SCRIPT_DIR/progress.py" meter database sql)
+        PROGRESS_MD_CMD=(python3 "$SCRIPT_DIR/progress.py" meter moodledata tar)
+    fi
+}
+
+###############################################################################
+# Registrar en SHA256SUMS el checksum calculado al escribir un archivo
+# Recibe el archivo; el hash se lee de <archivo>.sha256 (salida de sha256sum)
+###############################################################################
+record_checksum() {
+    local file="$1"
+    local digest=$(cut -d' ' -f1 "$file.sha256" 2>/dev/null)
+    rm -f "$file.sha256"
+    if [ -n "$digest" ]; then
+        echo "$digest  $(basename "$file")" >> "$BACKUP_DIR/SHA256SUMS"
+    fi
+}
+
 ###############################################################################
 # Función para respaldar base de datos MySQL
 ###############################################################################
 backup_mysql_database() {
+    if [ "$DB_MODE" = "parallel" ]; then
+        backup_mysql_database_parallel
+        return $?
+    fi
+
+    # El respaldo físico (plugin clone) solo lo implementa el motor nativo (engine.py)
+    if [ "$DB_MODE" = "physical" ]; then
+        log_error "El modo physical requiere el motor nativo: ejecute el respaldo desde main.py/daemon.py"
+        return 1
+    fi
+
     log_info "Iniciando respaldo de base de datos MySQL"
 
     local db_name="${DB_NAME:-moodle}"
     local db_user="${DB_USER:-moodle}"
     local db_pass="${DB_PASS:-moodle}"
-    local output_file="$BACKUP_DIR/${db_name}_${FECHA}.sql"
+    local output_file="$BACKUP_DIR/${db_name}_${FECHA}.sql.${COMPRESS_EXT}"
+    local binlog_args=()
+
+    if [ "$BINLOG_ENABLED" = "true" ]; then
+        # Como root para registrar la posición del binlog (recuperación a un instante)
+        db_user="root"
+        db_pass="${DB_ROOT_PASS}"
+        binlog_args=(--source-data=2)
+    fi
 
     # Verificar que el contenedor MySQL esté corriendo
     if ! docker ps | grep -q "$MYSQL_CONTAINER"; then
@@ -98,9 +273,9 @@ backup_mysql_database() {
         return 1
     fi
 
-    log_info "Exportando base de datos: $db_name"
+    log_info "Exportando y comprimiendo base de datos: $db_name ($COMPRESSION)"
 
-    # Realizar dump de la base de datos
+    # Realizar dump de la base de datos directamente hacia el compresor
     # Usamos variable MYSQL_PWD para evitar warning de seguridad
     # Agregamos --no-tablespaces para evitar error de privilegios PROCESS
     docker exec -e MYSQL_PWD="$db_pass" "$MYSQL_CONTAINER" mysqldump \
@@ -110,29 +285,69 @@ backup_mysql_database() {
         --triggers \
         --events \
         --no-tablespaces \
-        "$db_name" > "$output_file" 2>> "$LOG_FILE"
-
-    if [ $? -eq 0 ] && [ -s "$output_file" ]; then
-        log_success "Base de datos exportada correctamente"
-
-        # Comprimir el archivo SQL
-        log_info "Comprimiendo archivo SQL..."
-        gzip "$output_file"
-
-        if [ $? -eq 0 ]; then
-            local compressed_file="${output_file}.gz"
-            local file_size=$(du -h "$compressed_file" | cut -f1)
-            log_success "Base de datos comprimida: $compressed_file ($file_size)"
-            echo "$db_name" > "$BACKUP_DIR/DB_INFO.txt"
-            echo "Tamaño: $file_size" >> "$BACKUP_DIR/DB_INFO.txt"
-            date > "$BACKUP_DIR/FIN_DUMP_DB.log"
-            return 0
-        else
-            log_error "Error al comprimir el archivo SQL"
-            return 1
-        fi
+        "${binlog_args[@]}" \
+        "$db_name" 2>> "$LOG_FILE" | "${PROGRESS_DB_CMD[@]}" 2>> "$LOG_FILE" | \
+        "${COMPRESS_CMD[@]}" 2>> "$LOG_FILE" | \
+        "${THROTTLE_CMD[@]}" 2>> "$LOG_FILE" | tee "$output_file" | sha256sum > "$output_file.sha256"
+
+    local pipe_status=("${PIPESTATUS[@]}")
+
+    if [ "${pipe_status[0]}" -ne 0 ] || [ "${pipe_status[1]}" -ne 0 ]; then
+        log_error "Error al exportar la base de datos"
+        rm -f "$output_file" "$output_file.sha256"
+        return 1
+    fi
+
+    if [ "${pipe_status[2]}" -ne 0 ] || [ "${pipe_status[3]}" -ne 0 ] || [ "${pipe_status[4]}" -ne 0 ] || \
+       [ ! -s "$output_file" ]; then
+        log_error "Error al comprimir el archivo SQL"
+        rm -f "$output_file" "$output_file.sha256"
+        return 1
+    fi
+
+    # El SHA-256 se calculó mientras se escribía el archivo
+    record_checksum "$output_file"
+
+    local file_size=$(du -h "$output_file" | cut -f1)
+    log_success "Base de datos comprimida: $output_file ($file_size)"
+    echo "$db_name" > "$BACKUP_DIR/DB_INFO.txt"
+    echo "Tamaño: $file_size" >> "$BACKUP_DIR/DB_INFO.txt"
+    date > "$BACKUP_DIR/FIN_DUMP_DB.log"
+    return 0
+}
+
+###############################################################################
+# Función para respaldar la base de datos en paralelo (por tabla y rangos)
+###############################################################################
+backup_mysql_database_parallel() {
+    log_info "Iniciando respaldo paralelo de base de datos MySQL"
+
+    local db_name="${DB_NAME:-moodle}"
+    local output_dir="$BACKUP_DIR/mysql_parallel"
+
+    if ! docker ps | grep -q "$MYSQL_CONTAINER"; then
+        log_error "El contenedor MySQL ($MYSQL_CONTAINER) no está corriendo"
+        return 1
+    fi
+
+    log_info "Exportando base de datos: $db_name (${BACKUP_PARALLEL_WORKERS:-4} workers, $COMPRESSION)"
+
+    # FLUSH TABLES WITH READ LOCK requiere el usuario root
+    local summary
+    summary=$(MYSQL_PWD="$DB_ROOT_PASS" LOG_FILE="$LOG_FILE" BACKUP_COMPRESSION="$COMPRESSION" \
+        python3 "$SCRIPT_DIR/parallel_dump.py" dump "$MYSQL_CONTAINER" "$db_name" "$output_dir" 2>> "$LOG_FILE")
+
+    if [ $? -eq 0 ] && [ -f "$output_dir/index.json" ]; then
+        local file_size=$(du -sh "$output_dir" | cut -f1)
+        log_success "Base de datos exportada: $summary ($file_size)"
+        echo "$db_name" > "$BACKUP_DIR/DB_INFO.txt"
+        echo "Tamaño: $file_size" >> "$BACKUP_DIR/DB_INFO.txt"
+        echo "Modo: parallel" >> "$BACKUP_DIR/DB_INFO.txt"
+        date > "$BACKUP_DIR/FIN_DUMP_DB.log"
+        return 0
     else
         log_error "Error al exportar la base de datos"
+        rm -rf "$output_dir"
         return 1
     fi
 }
@@ -141,10 +356,19 @@ backup_mysql_database() {
 # Función para respaldar moodledata
 ###############################################################################
 backup_moodledata() {
+    if [ "$MOODLEDATA_MODE" = "incremental" ]; then
+        backup_moodledata_incremental
+        return $?
+    fi
+    if [ "$MOODLEDATA_MODE" = "sharded" ]; then
+        backup_moodledata_sharded
+        return $?
+    fi
+
     log_info "Iniciando respaldo de moodledata"
 
     local volume_name="moodledata_${ENVIRONMENT}"
-    local output_file="$BACKUP_DIR/moodledata_${FECHA}.tar.gz"
+    local output_file="$BACKUP_DIR/moodledata_${FECHA}.tar.${COMPRESS_EXT}"
 
     # Verificar que el volumen existe
     if ! docker volume ls | grep -q "$volume_name"; then
@@ -154,30 +378,172 @@ backup_moodledata() {
 
     log_info "Comprimiendo volumen: $volume_name"
 
-    # Crear backup del volumen usando un contenedor temporal
-    docker run --rm \
-        -v "$volume_name":/source:ro \
-        -v "$BACKUP_DIR":/backup \
-        alpine tar czf "/backup/moodledata_${FECHA}.tar.gz" -C /source . 2>> "$LOG_FILE"
+    # El daemon emite el tar por su API (volume.py aplica BACKUP_MOODLEDATA_EXCLUDE);
+    # la compresión corre en el host
+    python3 "$SCRIPT_DIR/volume.py" export "$volume_name" 2>> "$LOG_FILE" | "${PROGRESS_MD_CMD[@]}" 2>> "$LOG_FILE" | \
+        "${COMPRESS_CMD[@]}" 2>> "$LOG_FILE" | \
+        "${THROTTLE_CMD[@]}" 2>> "$LOG_FILE" | tee "$output_file" | sha256sum > "$output_file.sha256"
 
-    if [ $? -eq 0 ] && [ -f "$output_file" ]; then
+    local pipe_status=("${PIPESTATUS[@]}")
+
+    if [ "${pipe_status[0]}" -eq 0 ] && [ "${pipe_status[1]}" -eq 0 ] && [ "${pipe_status[2]}" -eq 0 ] && \
+       [ "${pipe_status[3]}" -eq 0 ] && [ "${pipe_status[4]}" -eq 0 ] && [ -f "$output_file" ]; then
+        record_checksum "$output_file"
         local file_size=$(du -h "$output_file" | cut -f1)
         log_success "Moodledata respaldado: $output_file ($file_size)"
         echo "Volumen: $volume_name" > "$BACKUP_DIR/MOODLEDATA_INFO.txt"
         echo "Tamaño: $file_size" >> "$BACKUP_DIR/MOODLEDATA_INFO.txt"
+        [ ${#EXCLUDED_DIRS[@]} -gt 0 ] && echo "Excluidos: ${EXCLUDED_DIRS[*]}" >> "$BACKUP_DIR/MOODLEDATA_INFO.txt"
         date > "$BACKUP_DIR/FIN_DUMP_MOODLEDATA.log"
         return 0
     else
         log_error "Error al respaldar moodledata"
+        rm -f "$output_file.sha256"
         return 1
     fi
 }
 
+###############################################################################
+# Función para respaldar moodledata en modo incremental (almacén de blobs)
+###############################################################################
+backup_moodledata_incremental() {
+    log_info "Iniciando respaldo incremental de moodledata"
+
+    local volume_name="moodledata_${ENVIRONMENT}"
+    local manifest_file="$BACKUP_DIR/moodledata_${FECHA}.manifest.json.gz"
+
+    if ! docker volume ls | grep -q "$volume_name"; then
+        log_warning "El volumen $volume_name no existe"
+        return 1
+    fi
+
+    local mountpoint=$(docker volume inspect -f '{{.Mountpoint}}' "$volume_name" 2>> "$LOG_FILE")
+    if [ -z "$mountpoint" ] || [ ! -d "$mountpoint" ]; then
+        log_error "No se pudo acceder al punto de montaje de $volume_name"
+        return 1
+    fi
+
+    log_info "Copiando blobs nuevos a: $BLOB_STORE"
+    local stats
+    stats=$(python3 "$SCRIPT_DIR/incremental.py" backup "$mountpoint" "$BLOB_STORE" "$manifest_file" 2>> "$LOG_FILE")
+
+    if [ $? -eq 0 ] && [ -f "$manifest_file" ]; then
+        # incremental.py calcula el SHA-256 del manifiesto al escribirlo
+        python3 -c 'import json, sys; print(json.load(sys.stdin)["sha256"])' <<< "$stats" > "$manifest_file.sha256"
+        record_checksum "$manifest_file"
+        log_success "Moodledata respaldado (incremental): $stats"
+        echo "Volumen: $volume_name" > "$BACKUP_DIR/MOODLEDATA_INFO.txt"
+        echo "Modo: incremental" >> "$BACKUP_DIR/MOODLEDATA_INFO.txt"
+        [ ${#EXCLUDED_DIRS[@]} -gt 0 ] && echo "Excluidos: ${EXCLUDED_DIRS[*]}" >> "$BACKUP_DIR/MOODLEDATA_INFO.txt"
+        echo "Estadísticas: $stats" >> "$BACKUP_DIR/MOODLEDATA_INFO.txt"
+        date > "$BACKUP_DIR/FIN_DUMP_MOODLEDATA.log"
+        return 0
+    else
+        log_error "Error al respaldar moodledata"
+        return 1
+    fi
+}
+
+###############################################################################
+# Función para respaldar moodledata en fragmentos por prefijo de filedir
+###############################################################################
+backup_moodledata_sharded() {
+    log_info "Iniciando respaldo de moodledata en fragmentos"
+
+    local volume_name="moodledata_${ENVIRONMENT}"
+    local output_dir="$BACKUP_DIR/moodledata_shards"
+
+    if ! docker volume ls | grep -q "$volume_name"; then
+        log_warning "El volumen $volume_name no existe"
+        return 1
+    fi
+
+    local mountpoint
+    mountpoint=$(docker volume inspect -f '{{.Mountpoint}}' "$volume_name" 2>> "$LOG_FILE")
+    if [ -z "$mountpoint" ] || [ ! -d "$mountpoint" ]; then
+        log_error "No se pudo acceder al punto de montaje de $volume_name"
+        return 1
+    fi
+
+    log_info "Comprimiendo volumen: $volume_name (${BACKUP_MOODLEDATA_SHARDS:-8} fragmentos de filedir, ${BACKUP_PARALLEL_WORKERS:-4} workers, $COMPRESSION)"
+
+    # sharded.py agrega los checksums de los fragmentos al SHA256SUMS del respaldo
+    local summary
+    summary=$(LOG_FILE="$LOG_FILE" BACKUP_COMPRESSION="$COMPRESSION" BACKUP_COMPRESSION_LEVEL="$COMPRESSION_LEVEL" \
+        BACKUP_COMPRESSION_THREADS="$COMPRESSION_THREADS" BACKUP_RATE_LIMIT_MB="$RATE_LIMIT_MB" \
+        python3 "$SCRIPT_DIR/sharded.py" backup "$mountpoint" "$output_dir" 2>> "$LOG_FILE")
+
+    if [ $? -eq 0 ] && [ -f "$output_dir/manifest.json" ]; then
+        local file_size
+        file_size=$(du -sh "$output_dir" | cut -f1)
+        log_success "Moodledata respaldado (fragmentos): $summary ($file_size)"
+        echo "Volumen: $volume_name" > "$BACKUP_DIR/MOODLEDATA_INFO.txt"
+        echo "Modo: sharded" >> "$BACKUP_DIR/MOODLEDATA_INFO.txt"
+        echo "Tamaño: $file_size" >> "$BACKUP_DIR/MOODLEDATA_INFO.txt"
+        [ ${#EXCLUDED_DIRS[@]} -gt 0 ] && echo "Excluidos: ${EXCLUDED_DIRS[*]}" >> "$BACKUP_DIR/MOODLEDATA_INFO.txt"
+        date > "$BACKUP_DIR/FIN_DUMP_MOODLEDATA.log"
+        return 0
+    else
+        log_error "Error al respaldar moodledata"
+        rm -rf "$output_dir"
+        return 1
+    fi
+}
+
+###############################################################################
+# Tamaño (legible) de los archivos del respaldo que coinciden con los patrones
+###############################################################################
+leg_size() {
+    local paths=()
+    local pattern path
+    for pattern in "$@"; do
+        for path in "$BACKUP_DIR"/$pattern; do
+            [ -e "$path" ] && paths+=("$path")
+        done
+    done
+
+    if [ ${#paths[@]} -eq 0 ]; then
+        echo "0"
+    else
+        du -csh "${paths[@]}" 2>/dev/null | tail -n 1 | cut -f1
+    fi
+}
+
+###############################################################################
+# Respaldar base de datos y moodledata al mismo tiempo
+# Deja el resultado de cada etapa en DB_RESULT y MOODLEDATA_RESULT
+###############################################################################
+backup_concurrent() {
+    log_info "Respaldando base de datos y moodledata en paralelo"
+
+    backup_mysql_database &
+    local db_pid=$!
+    backup_moodledata &
+    local moodledata_pid=$!
+
+    # Progreso combinado mientras ambas etapas corren (solo en consola)
+    local db_state moodledata_state
+    while kill -0 "$db_pid" 2>/dev/null || kill -0 "$moodledata_pid" 2>/dev/null; do
+        sleep "$PROGRESS_INTERVAL"
+        kill -0 "$db_pid" 2>/dev/null && db_state="en curso" || db_state="terminado"
+        kill -0 "$moodledata_pid" 2>/dev/null && moodledata_state="en curso" || moodledata_state="terminado"
+        if [ "$db_state" = "terminado" ] && [ "$moodledata_state" = "terminado" ]; then
+            break
+        fi
+        echo "  Progreso: base de datos $(leg_size "${DB_NAME:-moodle}_*" mysql_parallel) ($db_state) | moodledata $(leg_size "moodledata_*") ($moodledata_state)"
+    done
+
+    wait "$db_pid"
+    DB_RESULT=$?
+    wait "$moodledata_pid"
+    MOODLEDATA_RESULT=$?
+}
+
 ###############################################################################
 # Función para limpiar respaldos antiguos
 ###############################################################################
 cleanup_old_backups() {
-    log_info "Limpiando respaldos antiguos (manteniendo últimos $DAYS_TO_KEEP días)"
+    log_info "Aplicando retención: ${BACKUP_KEEP_DAILY:-$DAYS_TO_KEEP} diarios, ${BACKUP_KEEP_WEEKLY:-4} semanales, ${BACKUP_KEEP_MONTHLY:-3} mensuales"
 
     local env_backup_dir="$BASE_BACKUP_DIR/$ENVIRONMENT"
 
@@ -186,11 +552,19 @@ cleanup_old_backups() {
         return 0
     fi
 
-    # Encontrar y eliminar respaldos antiguos
-    find "$env_backup_dir" -maxdepth 1 -type d -mtime "+$DAYS_TO_KEEP" -exec rm -rf {} \; 2>> "$LOG_FILE"
+    # Plan calculado desde el catálogo; el respaldo en curso queda protegido
+    # y el borrado físico continúa en segundo plano
+    local summary
+    summary=$(BACKUP_RETENTION_DAYS="$DAYS_TO_KEEP" \
+        python3 "$SCRIPT_DIR/retention.py" apply "$BASE_BACKUP_DIR" "$ENVIRONMENT" "$FECHA" 2>> "$LOG_FILE")
 
     if [ $? -eq 0 ]; then
-        log_success "Respaldos antiguos eliminados"
+        log_success "$summary"
+
+        # Liberar blobs que ya no referencia ningún manifiesto
+        if [ -d "$BLOB_STORE" ]; then
+            python3 "$SCRIPT_DIR/incremental.py" gc "$BASE_BACKUP_DIR" "$BLOB_STORE" >> "$LOG_FILE" 2>&1
+        fi
         return 0
     else
         log_warning "Hubo problemas al eliminar respaldos antiguos"
@@ -198,16 +572,35 @@ cleanup_old_backups() {
     fi
 }
 
+###############################################################################
+# Replicar el respaldo al almacenamiento remoto (S3 compatible)
+###############################################################################
+upload_remote() {
+    log_info "Replicando respaldo a ${BACKUP_REMOTE_ENDPOINT} (bucket ${BACKUP_REMOTE_BUCKET})"
+
+    # Partes en paralelo; una subida interrumpida continúa en la siguiente ejecución
+    local summary
+    summary=$(python3 "$SCRIPT_DIR/remote.py" upload "$BASE_BACKUP_DIR" "$ENVIRONMENT" "$FECHA" 2>> "$LOG_FILE")
+
+    if [ $? -eq 0 ]; then
+        log_success "Respaldo replicado: $summary"
+        return 0
+    else
+        log_error "Error al replicar el respaldo (se reanuda en la próxima subida)"
+        return 1
+    fi
+}
+
 ###############################################################################
 # Función para enviar notificación por email
 ###############################################################################
 send_email_notification() {
     local status="$1"
     local details="$2"
+    local attachment="$3"
 
     # Verificar si existe el script de envío de email
-    local script_dir="$(dirname "$0")"
-    local email_script="$script_dir/send_mail.py"
+    local email_script="$SCRIPT_DIR/send_mail.py"
 
     if [ ! -f "$email_script" ]; then
         log_warning "Script de email no encontrado: $email_script"
@@ -223,10 +616,15 @@ send_email_notification() {
     local subject="[Backup Moodle] $ENVIRONMENT - $status"
     local message="Respaldo de Moodle $ENVIRONMENT\nFecha: $FECHA\nEstado: $status\n\nDetalles:\n$details"
 
-    python3 "$email_script" "$BACKUP_EMAIL_TO" "$subject" "$message" >> "$LOG_FILE" 2>&1
+    # Con BACKUP_EMAIL_SPOOL send_mail.py la encola para el correo de resumen
+    python3 "$email_script" "$BACKUP_EMAIL_TO" "$subject" "$message" ${attachment:+"$attachment"} >> "$LOG_FILE" 2>&1
 
     if [ $? -eq 0 ]; then
-        log_success "Notificación enviada por email"
+        if [ -n "$BACKUP_EMAIL_SPOOL" ]; then
+            log_success "Notificación agregada al correo de resumen"
+        else
+            log_success "Notificación enviada por email"
+        fi
         return 0
     else
         log_warning "No se pudo enviar la notificación por email"
@@ -260,14 +658,28 @@ main() {
     echo "INICIO RESPALDO MOODLE $ENVIRONMENT" > "$BACKUP_DIR/INICIO.log"
     date >> "$BACKUP_DIR/INICIO.log"
 
-    # Respaldar base de datos
-    if ! backup_mysql_database; then
+    # Seleccionar compresor y aplicar prioridad/límites
+    setup_compression
+    setup_throttle
+    setup_progress
+    setup_exclusions
+
+    # Respaldar base de datos y moodledata
+    if [ "$CONCURRENT" = "true" ]; then
+        backup_concurrent
+    else
+        backup_mysql_database
+        DB_RESULT=$?
+        backup_moodledata
+        MOODLEDATA_RESULT=$?
+    fi
+
+    if [ "$DB_RESULT" -ne 0 ]; then
         backup_status="FAILED"
         error_details="${error_details}\n- Error al respaldar base de datos MySQL"
     fi
 
-    # Respaldar moodledata
-    if ! backup_moodledata; then
+    if [ "$MOODLEDATA_RESULT" -ne 0 ]; then
         backup_status="FAILED"
         error_details="${error_details}\n- Error al respaldar moodledata"
     fi
@@ -286,11 +698,25 @@ main() {
     log_info "Tamaño total: $backup_size"
     log_info "=========================================="
 
+    # Registrar el respaldo en el catálogo (estado, tamaños y archivos)
+    python3 "$SCRIPT_DIR/catalog.py" record "$BASE_BACKUP_DIR" "$ENVIRONMENT" "$FECHA" "$SECONDS" >> "$LOG_FILE" 2>&1 || \
+        log_warning "No se pudo registrar el respaldo en el catálogo"
+
+    # Copia remota del respaldo
+    local remote_note=""
+    if [ "$REMOTE_ENABLED" = "true" ] && [ "$backup_status" = "SUCCESS" ]; then
+        if upload_remote; then
+            remote_note="\nCopia remota: OK"
+        else
+            remote_note="\nCopia remota: FALLIDA"
+        fi
+    fi
+
     # Enviar notificación
     if [ "$backup_status" = "SUCCESS" ]; then
-        send_email_notification "EXITOSO" "Respaldo completado correctamente\nUbicación: $BACKUP_DIR\nTamaño: $backup_size"
+        send_email_notification "EXITOSO" "Respaldo completado correctamente\nUbicación: $BACKUP_DIR\nTamaño: $backup_size$remote_note"
     else
-        send_email_notification "FALLIDO" "Errores durante el respaldo:$error_details\nUbicación: $BACKUP_DIR"
+        send_email_notification "FALLIDO" "Errores durante el respaldo:$error_details\nUbicación: $BACKUP_DIR" "$LOG_FILE"
     fi
 
     # Retornar código de salida apropiado
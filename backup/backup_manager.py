@@ -5,10 +5,33 @@ Integrado con scripts de backup y restore
 """
 
 import os
+import re
 import subprocess
+import tarfile
+import tempfile
+import time
 from datetime import datetime
 from pathlib import Path
 
+from backup.archive_index import ARCHIVE_INDEX_SUFFIX, open_archive
+from backup.binlog import BinlogArchiver, dump_position, parse_target_time, plan_replay, backup_epoch
+from backup.compression import detect_codec
+from backup.catalog import BackupCatalog, TIER_UNAVAILABLE
+from backup.clone import EnvironmentClone
+from backup.daemon import EnvironmentLock
+from backup.engine import BackupEngine, format_bytes
+from backup.incremental import MANIFEST_SUFFIX
+from backup.integrity import backup_artifacts, read_checksums, result_ok, verify_backup_files
+from backup.physical import ARCHIVE_PREFIX as PHYSICAL_PREFIX, METADATA_FILE as PHYSICAL_METADATA, read_metadata
+from backup.progress import ProgressReporter, expected_from_history, progress_file, record_history, stage_bytes
+from backup.remote import RemoteReplicator
+from backup.retention import RetentionManager, UNUSABLE_STATUS
+from backup.seekable import DumpReader, find_dump, is_index_file
+from backup.send_mail import SPOOL_DIR
+from backup.sharded import SHARD_DIR, read_manifest as read_shard_manifest
+from backup.tiering import TieringManager
+from backup.volume import VolumeStream
+
 
 class BackupManager:
     """Gestiona backups de Moodle y MySQL usando scripts de shell"""
@@ -19,6 +42,7 @@ class BackupManager:
         self.script_dir = Path(__file__).parent
         self.backup_script = self.script_dir / 'backup.sh'
         self.restore_script = self.script_dir / 'restore.sh'
+        self.catalog = BackupCatalog(self.backup_path)
 
     def _prepare_env_vars(self, environment):
         """Prepara variables de entorno para los scripts"""
@@ -32,26 +56,137 @@ class BackupManager:
             # Fallback a la ruta por defecto
             env_vars['ENV_FILE'] = '/opt/docker-project/.env'
 
+        # Configuración de compresión para backup.sh y restore.sh
+        env_vars['BACKUP_COMPRESSION'] = self.settings.BACKUP_COMPRESSION
+        env_vars['BACKUP_COMPRESSION_LEVEL'] = str(self.settings.BACKUP_COMPRESSION_LEVEL or '')
+        env_vars['BACKUP_COMPRESSION_THREADS'] = str(self.settings.BACKUP_COMPRESSION_THREADS)
+        env_vars['BACKUP_PARALLEL_WORKERS'] = str(self.settings.BACKUP_PARALLEL_WORKERS)
+        env_vars['BACKUP_PARALLEL_CHUNK_MB'] = str(self.settings.BACKUP_PARALLEL_CHUNK_MB)
+        env_vars['BACKUP_CONCURRENT'] = 'true' if self.settings.BACKUP_CONCURRENT else 'false'
+        env_vars['BACKUP_RESTORE_MODE'] = self.settings.BACKUP_RESTORE_MODE
+        env_vars['BACKUP_KEEP_DAILY'] = str(self.settings.BACKUP_KEEP_DAILY)
+        env_vars['BACKUP_KEEP_WEEKLY'] = str(self.settings.BACKUP_KEEP_WEEKLY)
+        env_vars['BACKUP_KEEP_MONTHLY'] = str(self.settings.BACKUP_KEEP_MONTHLY)
+        env_vars['BACKUP_NICE'] = str(self.settings.BACKUP_NICE)
+        env_vars['BACKUP_IONICE_CLASS'] = self.settings.BACKUP_IONICE_CLASS
+        env_vars['BACKUP_RATE_LIMIT_MB'] = f"{self.settings.BACKUP_RATE_LIMIT_MB:g}"
+        env_vars['BACKUP_MOODLEDATA_EXCLUDE'] = ','.join(self.settings.BACKUP_MOODLEDATA_EXCLUDE)
+        env_vars['BACKUP_REMOTE_ENABLED'] = 'true' if self.settings.BACKUP_REMOTE_ENABLED else 'false'
+        env_vars['BACKUP_REMOTE_ENDPOINT'] = self.settings.BACKUP_REMOTE_ENDPOINT
+        env_vars['BACKUP_REMOTE_BUCKET'] = self.settings.BACKUP_REMOTE_BUCKET
+        env_vars['BACKUP_REMOTE_ACCESS_KEY'] = self.settings.BACKUP_REMOTE_ACCESS_KEY
+        env_vars['BACKUP_REMOTE_SECRET_KEY'] = self.settings.BACKUP_REMOTE_SECRET_KEY
+        env_vars['BACKUP_REMOTE_REGION'] = self.settings.BACKUP_REMOTE_REGION
+        env_vars['BACKUP_REMOTE_PREFIX'] = self.settings.BACKUP_REMOTE_PREFIX
+        env_vars['BACKUP_REMOTE_WORKERS'] = str(self.settings.BACKUP_REMOTE_WORKERS)
+        env_vars['BACKUP_REMOTE_PART_MB'] = str(self.settings.BACKUP_REMOTE_PART_MB)
+        env_vars['BACKUP_REMOTE_RATE_LIMIT_MB'] = f"{self.settings.BACKUP_REMOTE_RATE_LIMIT_MB:g}"
+        env_vars['BACKUP_BINLOG_ENABLED'] = 'true' if self.settings.BACKUP_BINLOG_ENABLED else 'false'
+
         return env_vars
 
-    def create_backup(self, environment='testing'):
+    def create_backup(self, environment='testing', db_mode=None):
         """
-        Crea un backup completo de un ambiente usando el script backup.sh
+        Crea un backup completo de un ambiente
+        Usa el motor nativo (BACKUP_ENGINE=python) o el script backup.sh
 
         Args:
             environment: 'testing' o 'production'
+            db_mode: 'single', 'parallel' o 'physical' (None usa la configuracion del ambiente)
 
         Returns:
             True si el backup fue exitoso, False en caso contrario
         """
         print(f"\nCreando backup de {environment}...")
 
+        # Un respaldo programado (daemon.py) o manual del mismo ambiente no se solapa con este
+        lock = EnvironmentLock(self.backup_path, environment)
+        if not lock.acquire():
+            print(f"Error: Ya hay un backup de {environment} en curso ({lock.path})")
+            return False
+        progress = self._start_progress('backup', environment, self._expected_backup_bytes(environment))
+        ok = False
+        try:
+            ok = self._run_backup(environment, progress, db_mode)
+            return ok
+        finally:
+            self._finish_progress(progress, ok)
+            lock.release()
+
+    def clone_environment(self, source='production', target='testing'):
+        """
+        Clona un ambiente en otro en streaming (sin backup intermedio en disco)
+
+        Args:
+            source: ambiente de origen
+            target: ambiente a sobrescribir (nunca 'production')
+
+        Returns:
+            True si el clonado fue exitoso, False en caso contrario
+        """
+        clone = EnvironmentClone(self.settings, source, target)
+        print(f"\nClonando {source} en {target}...")
+
+        # Ni un backup ni otro clonado del destino pueden correr mientras se sobrescribe
+        lock = EnvironmentLock(self.backup_path, target)
+        if not lock.acquire():
+            print(f"Error: Ya hay una operacion de {target} en curso ({lock.path})")
+            return False
+        expected = (expected_from_history(self.backup_path, 'clone', target)
+                    or expected_from_history(self.backup_path, 'backup', source))
+        clone.progress = self._start_progress('clone', target, expected)
+        ok = False
+        try:
+            ok = clone.run()
+            return ok
+        finally:
+            self._finish_progress(clone.progress, ok)
+            lock.release()
+
+    def _expected_backup_bytes(self, environment):
+        """Bytes esperados por etapa (ETA): la ultima ejecucion o, si no hay, el ultimo STATS.json"""
+        expected = expected_from_history(self.backup_path, 'backup', environment)
+        if expected:
+            return expected
+        try:
+            for backup in self.catalog.list_backups(environment):
+                if backup['status'] == 'SUCCESS' and stage_bytes(backup['stats']):
+                    return stage_bytes(backup['stats'])
+        except Exception:
+            pass
+        return {}
+
+    def _start_progress(self, operation, environment, expected):
+        """Inicia el archivo de eventos de progreso de la operacion"""
+        return ProgressReporter(progress_file(self.backup_path, operation, environment)).start(
+            operation, environment, expected)
+
+    def _finish_progress(self, progress, ok):
+        """Cierra el progreso y guarda los tamaños de una operacion exitosa para la proxima ETA"""
+        progress.finish('SUCCESS' if ok else 'FAILED')
+        if ok:
+            try:
+                record_history(self.backup_path, progress.path)
+            except OSError as e:
+                print(f"Advertencia: No se pudo guardar el historial de progreso: {str(e)}")
+
+    def _run_backup(self, environment, progress=None, db_mode=None):
+        """Ejecuta el backup con el motor nativo o backup.sh (con el lock del ambiente tomado)"""
+        db_mode = db_mode or self.settings.backup_db_mode(environment)
+        # El respaldo fisico solo lo implementa el motor nativo
+        if self.settings.BACKUP_ENGINE != 'shell' or db_mode == 'physical':
+            return self._create_native_backup(environment, progress, db_mode)
+
         if not self.backup_script.exists():
             print(f"Error: Script de backup no encontrado: {self.backup_script}")
             return False
 
         try:
             env_vars = self._prepare_env_vars(environment)
+            env_vars['BACKUP_DB_MODE_OVERRIDE'] = db_mode
+            if progress is not None:
+                # backup.sh intercala progress.py en sus pipes
+                env_vars['BACKUP_PROGRESS_FILE'] = progress.path
 
             # Ejecutar script de backup sin capturar output para mostrar en tiempo real
             # Esto permite que el usuario vea el progreso mientras se ejecuta
@@ -72,33 +207,158 @@ class BackupManager:
             print(f"Error ejecutando backup: {str(e)}")
             return False
 
-    def restore_backup(self, environment, backup_timestamp):
+    def create_backups(self, environments=('testing', 'production')):
+        """
+        Crea los backups de varios ambientes con un solo correo de resumen
+
+        Las notificaciones de cada respaldo se encolan (BACKUP_EMAIL_SPOOL) y
+        al final se envían juntas por una sola sesión SMTP.
+
+        Returns:
+            Dict {ambiente: True si el backup fue exitoso}
+        """
+        spool = os.path.join(self.backup_path, SPOOL_DIR, datetime.now().strftime("%Y-%m-%d_%H-%M-%S"))
+        previous = os.environ.get('BACKUP_EMAIL_SPOOL')
+        os.environ['BACKUP_EMAIL_SPOOL'] = spool
+        try:
+            results = {environment: self.create_backup(environment) for environment in environments}
+        finally:
+            if previous is None:
+                os.environ.pop('BACKUP_EMAIL_SPOOL', None)
+            else:
+                os.environ['BACKUP_EMAIL_SPOOL'] = previous
+
+        if os.path.isdir(spool):
+            self._send_digest(spool)
+        return results
+
+    def _send_digest(self, spool):
+        """Envía el correo de resumen de las notificaciones encoladas"""
+        env = os.environ.copy()
+        env.update({k: str(v) for k, v in self.settings.env_vars.items() if k.startswith('SMTP_')})
+        result = subprocess.run(['python3', str(self.script_dir / 'send_mail.py'), 'flush', spool], env=env)
+        if result.returncode == 0:
+            print("Correo de resumen enviado")
+            return True
+        print(f"No se pudo enviar el correo de resumen (notificaciones pendientes en {spool})")
+        return False
+
+    def _create_native_backup(self, environment, progress=None, db_mode=None):
+        """Crea el backup con el motor nativo en streaming"""
+        try:
+            engine = BackupEngine(self.settings, environment, progress=progress, db_mode=db_mode)
+            if engine.run():
+                print(f"\nBackup de {environment} completado exitosamente")
+                return True
+            else:
+                print(f"\nError en backup de {environment}")
+                return False
+        except Exception as e:
+            print(f"Error ejecutando backup: {str(e)}")
+            return False
+
+    def restore_backup(self, environment, backup_timestamp, restore_mode=None, target_time=None):
         """
         Restaura un backup usando el script restore.sh
 
+        Con target_time la base de datos se recupera a ese instante: se
+        restaura el backup completo y se aplican los binlogs archivados.
+
         Args:
             environment: 'testing' o 'production'
-            backup_timestamp: Timestamp del backup a restaurar (ej: 2024-01-15_10-30-00)
+            backup_timestamp: Timestamp del backup a restaurar (ej: 2024-01-15_10-30-00);
+                              con target_time puede ser None (usa el anterior más cercano)
+            restore_mode: 'full' o 'differential' para moodledata (None usa BACKUP_RESTORE_MODE)
+            target_time: Instante a recuperar ('YYYY-MM-DD HH:MM:SS' o datetime, hora local)
 
         Returns:
             True si la restauración fue exitosa, False en caso contrario
         """
+        # Un backup (manual o del daemon) no puede leer el ambiente a medio restaurar,
+        # incluida la aplicación de binlogs
+        lock = EnvironmentLock(self.backup_path, environment)
+        if not lock.acquire():
+            print(f"Error: Ya hay una operacion de {environment} en curso ({lock.path})")
+            return False
+        try:
+            return self._restore_locked(environment, backup_timestamp, restore_mode, target_time)
+        finally:
+            lock.release()
+
+    def _restore_locked(self, environment, backup_timestamp, restore_mode, target_time):
+        """Restauración con el lock del ambiente tomado (ver restore_backup)"""
+        archiver = None
+        if target_time is not None:
+            try:
+                target = parse_target_time(target_time) if isinstance(target_time, str) else target_time
+            except ValueError as e:
+                print(f"Error: {str(e)}")
+                return False
+            archiver = BinlogArchiver.from_settings(self.settings, environment)
+            backup_timestamp = self._prepare_point_in_time(archiver, environment, backup_timestamp, target)
+            if not backup_timestamp:
+                return False
+
         print(f"\nRestaurando backup de {environment}: {backup_timestamp}")
 
         if not self.restore_script.exists():
             print(f"Error: Script de restore no encontrado: {self.restore_script}")
             return False
 
-        # Verificar que el backup existe
+        # Verificar que el backup existe (en disco o en el almacenamiento remoto)
         backup_dir = os.path.join(self.backup_path, environment, backup_timestamp)
-        if not os.path.exists(backup_dir):
-            print(f"Error: Backup no encontrado: {backup_dir}")
-            return False
-
+        local_names = sorted(os.listdir(backup_dir)) if os.path.exists(backup_dir) else []
+        if not local_names:
+            remote_names = []
+            if self.settings.BACKUP_REMOTE_ENABLED:
+                try:
+                    remote_names = RemoteReplicator.from_settings(self.settings).list_backup(
+                        environment, backup_timestamp)
+                except Exception as e:
+                    print(f"Error consultando el almacenamiento remoto: {str(e)}")
+            if not remote_names:
+                print(f"Error: Backup no encontrado: {backup_dir}")
+                return False
+            print(f"  Backup remoto: {len(remote_names)} archivos (se restaurará desde "
+                  f"{self.settings.BACKUP_REMOTE_BUCKET})")
+
+        # restore.sh restaura la BD segun el modo registrado en el respaldo
+        if PHYSICAL_METADATA in local_names:
+            metadata = read_metadata(backup_dir)
+            print(f"  Base de datos: respaldo físico (MySQL {metadata['mysql_version']}), "
+                  f"se reemplazará el directorio de datos de mysql_{environment}")
+
+        if SHARD_DIR in local_names:
+            manifest = read_shard_manifest(os.path.join(backup_dir, SHARD_DIR))
+            print(f"  {SHARD_DIR}: moodledata en {len(manifest['shards'])} fragmentos ({manifest['codec']})")
+
+        # Mostrar el formato detectado de cada archivo (restore.sh lo detecta igual)
+        for name in local_names:
+            if not os.path.isfile(os.path.join(backup_dir, name)):
+                continue
+            if name.endswith(MANIFEST_SUFFIX):
+                print(f"  {name}: manifiesto incremental")
+            elif is_index_file(name):
+                print(f"  {name}: índice de tablas")
+            elif name.endswith(ARCHIVE_INDEX_SUFFIX):
+                print(f"  {name}: índice de archivos de moodledata")
+            elif '.sql' in name or name.startswith(('moodledata_', PHYSICAL_PREFIX)):
+                codec = detect_codec(os.path.join(backup_dir, name))
+                print(f"  {name}: {codec.name if codec else 'sin comprimir'}")
+
+        progress = self._start_progress('restore', environment,
+                                        self._expected_restore_bytes(environment, backup_timestamp))
+        ok = False
         try:
             env_vars = self._prepare_env_vars(environment)
             # Saltar confirmación en el script de bash ya que se hizo en Python
             env_vars['SKIP_CONFIRMATION'] = 'yes'
+            env_vars['BACKUP_PROGRESS_FILE'] = progress.path
+            if restore_mode:
+                env_vars['BACKUP_RESTORE_MODE'] = restore_mode
+            if archiver is not None:
+                # Moodle no debe escribir en la BD hasta aplicar los binlogs
+                env_vars['SKIP_START'] = 'yes'
 
             # Ejecutar script de restore sin capturar output para mostrar en tiempo real
             # Esto permite que el usuario vea el progreso mientras se ejecuta
@@ -108,20 +368,132 @@ class BackupManager:
                 text=True
             )
 
-            if result.returncode == 0:
-                print(f"\nRestauración de {environment} completada exitosamente")
-                return True
-            else:
+            if result.returncode != 0:
                 print(f"\nError en restauración de {environment}")
+                if archiver is not None:
+                    print(f"El contenedor moodle_{environment} quedó detenido; restaure de nuevo el backup")
                 return False
+            ok = True
 
         except Exception as e:
             print(f"Error ejecutando restore: {str(e)}")
             return False
+        finally:
+            self._finish_progress(progress, ok)
+
+        if archiver is not None:
+            if not self._replay_binlogs(archiver, environment, backup_timestamp, target):
+                print(f"El contenedor moodle_{environment} quedó detenido; restaure de nuevo el backup")
+                return False
+            return self._start_web(environment)
+
+        print(f"\nRestauración de {environment} completada exitosamente")
+        return True
+
+    def _expected_restore_bytes(self, environment, backup_timestamp):
+        """Bytes esperados por etapa al restaurar: los del propio respaldo, o la ultima ejecucion"""
+        try:
+            backup = self.catalog.get_backup(environment, backup_timestamp)
+        except Exception:
+            backup = None
+        expected = stage_bytes(backup['stats']) if backup else {}
+        return (expected or expected_from_history(self.backup_path, 'restore', environment)
+                or expected_from_history(self.backup_path, 'backup', environment))
+
+    def find_base_backup(self, environment, target):
+        """
+        Backup completo más reciente anterior a un instante cuyo dump
+        registra la posición del binlog
+
+        Returns:
+            Timestamp del backup o None
+        """
+        for entry in self.catalog.list_backups(environment):
+            if entry['status'] in UNUSABLE_STATUS or backup_epoch(entry['timestamp']) > target.timestamp():
+                continue
+            if dump_position(entry['path']) is not None:
+                return entry['timestamp']
+        return None
+
+    def _prepare_point_in_time(self, archiver, environment, backup_timestamp, target):
+        """
+        Archiva los últimos binlogs y comprueba que el instante se puede recuperar
+        antes de sobrescribir nada
+
+        Returns:
+            Timestamp del backup base o None si no es posible
+        """
+        print(f"\nRecuperación de {environment} al instante {target}")
+
+        # Capturar los eventos más recientes antes de sobrescribir la base de datos
+        try:
+            archived = archiver.archive()
+            if archived:
+                print(f"  Binlogs archivados antes de restaurar: {len(archived)}")
+        except Exception as e:
+            print(f"  Advertencia: no se pudieron archivar los últimos binlogs ({str(e)})")
+
+        if not backup_timestamp:
+            backup_timestamp = self.find_base_backup(environment, target)
+            if not backup_timestamp:
+                print(f"Error: No hay un backup anterior a {target} con posición de binlog")
+                return None
+
+        if backup_epoch(backup_timestamp) > target.timestamp():
+            print(f"Error: El backup {backup_timestamp} es posterior a {target}")
+            return None
+
+        backup_dir = os.path.join(self.backup_path, environment, backup_timestamp)
+        position = dump_position(backup_dir) if os.path.isdir(backup_dir) else None
+        if position is None:
+            print(f"Error: El backup {backup_timestamp} no está en disco o no registra la posición del binlog")
+            return None
+
+        try:
+            plan = plan_replay(self.catalog.list_binlogs(environment), position[0],
+                               backup_epoch(backup_timestamp), target.timestamp())
+        except ValueError as e:
+            print(f"Error: {str(e)}")
+            return None
+
+        print(f"  Backup base: {backup_timestamp} (binlog {position[0]}:{position[1]})")
+        print(f"  Binlogs a aplicar: {len(plan)}")
+        print("  Moodledata se restaura desde el backup base (no tiene recuperación a un instante)")
+        return backup_timestamp
+
+    def _replay_binlogs(self, archiver, environment, backup_timestamp, target):
+        """Aplica los binlogs archivados sobre la base de datos restaurada"""
+        prefix = 'PROD' if environment == 'production' else 'TEST'
+        db_name = self.settings.get_env_var(f'{prefix}_DB_NAME', 'moodle')
+
+        print(f"\nAplicando binlogs hasta {target}...")
+        try:
+            result = archiver.replay(backup_timestamp, target, db_name)
+        except Exception as e:
+            print(f"Error aplicando binlogs: {str(e)}")
+            print("La base de datos quedó en un estado indefinido (con parte de los binlogs aplicados); "
+                  "debe restaurarse de nuevo")
+            return False
+
+        print(f"  Binlogs aplicados: {result['binlogs']} (desde {result['start']})")
+        if not result['complete']:
+            print(f"  Advertencia: el último evento archivado es de {result['last_event']}; "
+                  f"no hay cambios posteriores disponibles")
+        print(f"\nRecuperación de {environment} al instante {target} completada")
+        return True
+
+    def _start_web(self, environment):
+        """Inicia moodle_<ambiente> tras la recuperación a un instante"""
+        web = f"moodle_{environment}"
+        if subprocess.run(['docker', 'start', web], capture_output=True).returncode != 0:
+            print(f"Error al iniciar el contenedor {web}")
+            return False
+        print(f"Contenedor {web} iniciado")
+        return True
 
     def list_backups(self, environment=None):
         """
-        Lista los backups disponibles
+        Lista los backups disponibles desde el catálogo
 
         Args:
             environment: 'testing', 'production' o None para listar ambos
@@ -135,51 +507,421 @@ class BackupManager:
                 print(f"No hay backups para {environment}")
                 return []
 
-            backups = sorted(os.listdir(backup_dir), reverse=True)
+            entries = self.catalog.list_backups(environment)
             print(f"\nBackups disponibles de {environment}:")
-            for i, backup in enumerate(backups, 1):
-                backup_path = os.path.join(backup_dir, backup)
-                size = self._get_dir_size(backup_path)
-                print(f"  {i}. {backup} ({size})")
-            return backups
+            for i, entry in enumerate(entries, 1):
+                size = format_bytes(entry['size_bytes'])
+                mark = " [VERIFICACION FALLIDA]" if entry['verify_status'] == 'FAILED' else ""
+                if entry.get('tier') == 'cold':
+                    mark += " [ALMACENAMIENTO FRIO]"
+                elif entry.get('tier') == TIER_UNAVAILABLE:
+                    mark += " [ALMACENAMIENTO FRIO NO DISPONIBLE]"
+                print(f"  {i}. {entry['timestamp']} ({size}) [{entry['status']}]{mark}")
+            return [entry['timestamp'] for entry in entries]
         else:
             # Listar ambos ambientes
             testing_backups = self.list_backups('testing')
             production_backups = self.list_backups('production')
             return {'testing': testing_backups, 'production': production_backups}
 
-    def _get_dir_size(self, path):
-        """Obtiene el tamaño de un directorio en formato legible"""
-        try:
-            result = subprocess.run(
-                ['du', '-sh', path],
-                capture_output=True,
-                text=True
-            )
-            if result.returncode == 0:
-                return result.stdout.split()[0]
-        except:
-            pass
-        return 'N/A'
+    def rebuild_catalog(self):
+        """
+        Reconstruye el catálogo recorriendo BACKUPS_PATH
+
+        Returns:
+            Número de backups registrados
+        """
+        print(f"\nReconstruyendo catálogo en {self.catalog.db_path}...")
+        count = self.catalog.rebuild()
+        print(f"Catálogo reconstruido: {count} backups")
+        return count
+
+    def verify_backups(self, environment=None, threads=None):
+        """
+        Verifica la integridad de los backups
+
+        Relee todos los archivos en un pool de hilos, compara su SHA-256 con
+        SHA256SUMS y prueba los streams comprimidos (gzip -t / zstd -t).
+        El resultado queda en el catálogo y se marca en el listado.
+
+        Args:
+            environment: 'testing', 'production' o None para ambos
+            threads: Hilos de verificación (None usa BACKUP_PARALLEL_WORKERS)
+
+        Returns:
+            Dict {'ambiente/timestamp': True si el backup es válido}
+        """
+        environments = [environment] if environment else ['testing', 'production']
+        threads = threads or self.settings.BACKUP_PARALLEL_WORKERS
+
+        tasks = []
+        backups = []
+        for env in environments:
+            for entry in self.catalog.list_backups(env):
+                backup_dir = entry['path']
+                checksums = read_checksums(backup_dir)
+                backups.append((env, entry['timestamp'], bool(checksums)))
+                for name in backup_artifacts(backup_dir):
+                    tasks.append(((env, entry['timestamp'], name), os.path.join(backup_dir, name),
+                                  checksums.get(name)))
+
+        if not tasks:
+            print("\nNo hay backups para verificar")
+            return {}
+
+        print(f"\nVerificando {len(tasks)} archivos de {len(backups)} backups ({threads} hilos)...")
+        started = time.monotonic()
+        results = verify_backup_files(tasks, threads)
+        elapsed = time.monotonic() - started
+
+        summary = {}
+        for env, timestamp, has_checksums in backups:
+            files = {key[2]: result for key, result in results.items() if key[:2] == (env, timestamp)}
+            failed = {name: result for name, result in files.items() if not result_ok(result)}
+            total = sum(result['bytes'] for result in files.values())
+            status = 'FAILED' if failed else 'OK'
+            self.catalog.set_verification(env, timestamp, status)
+            summary[f"{env}/{timestamp}"] = not failed
+
+            note = "" if has_checksums else " (sin SHA256SUMS, solo prueba de stream)"
+            print(f"  {env}/{timestamp}: {status} - {len(files)} archivos, {format_bytes(total)}{note}")
+            for name, result in sorted(failed.items()):
+                if 'error' in result:
+                    reason = result['error']
+                elif result['hash_ok'] is False:
+                    reason = "SHA-256 distinto"
+                else:
+                    reason = f"stream {result['codec']} dañado"
+                print(f"    FALLO {name}: {reason}")
+
+        total_bytes = sum(result['bytes'] for result in results.values())
+        throughput = total_bytes / elapsed if elapsed > 0 else 0
+        print(f"\nVerificados {format_bytes(total_bytes)} en {elapsed:.1f}s ({format_bytes(throughput)}/s)")
+        return summary
+
+    def clean_old_backups(self, environment, dry_run=False):
+        """
+        Aplica la política de retención abuelo-padre-hijo
 
-    def clean_old_backups(self, environment, keep_last=None):
+        Args:
+            environment: 'testing' o 'production'
+            dry_run: Solo mostrar qué se conservaría y qué se eliminaría
+
+        Returns:
+            Lista de timestamps eliminados (o que se eliminarían en dry_run)
         """
-        Elimina backups antiguos
-        La limpieza se realiza automáticamente por el script de backup
-        basándose en BACKUP_RETENTION_DAYS
+        retention = RetentionManager(
+            self.backup_path,
+            daily=self.settings.BACKUP_KEEP_DAILY,
+            weekly=self.settings.BACKUP_KEEP_WEEKLY,
+            monthly=self.settings.BACKUP_KEEP_MONTHLY
+        )
+        print(f"\nRetención de {environment}: {retention.daily} diarios, "
+              f"{retention.weekly} semanales, {retention.monthly} mensuales")
+
+        keep, delete = retention.plan(environment)
+        for backup, reasons in keep:
+            print(f"  CONSERVAR  {backup['timestamp']} ({format_bytes(backup['size_bytes'])}) - {', '.join(reasons)}")
+        for backup in delete:
+            print(f"  ELIMINAR   {backup['timestamp']} ({format_bytes(backup['size_bytes'])})")
+
+        freed = format_bytes(sum(backup['size_bytes'] for backup in delete))
+        if dry_run or not delete:
+            print(f"\n{len(delete)} backups fuera de la política ({freed})")
+            return [backup['timestamp'] for backup in delete]
+
+        deleted = retention.apply(environment)
+        print(f"\nEliminados {len(deleted)} backups ({freed}); el borrado continúa en segundo plano")
+        return [backup['timestamp'] for backup in deleted]
+
+    def tier_backups(self, environment, dry_run=False):
+        """
+        Mueve los backups antiguos al almacenamiento frío (BACKUP_COLD_PATH)
+
+        Se recomprimen con BACKUP_COLD_COMPRESSION a prioridad idle; en el
+        directorio de backups queda un enlace, por lo que se listan y
+        restauran igual que los demás.
 
         Args:
             environment: 'testing' o 'production'
-            keep_last: Número de backups a mantener (ignorado, usa BACKUP_RETENTION_DAYS)
+            dry_run: Solo mostrar qué backups se moverían
+
+        Returns:
+            Lista de timestamps movidos (o que se moverían en dry_run), None si hubo un error
+        """
+        try:
+            tiering = TieringManager.from_settings(
+                self.settings, log_file=os.path.join(self.settings.LOGS_PATH, f"tiering_{environment}.log"))
+        except ValueError as e:
+            print(f"Error: {str(e)}")
+            return None
+
+        candidates = tiering.plan(environment)
+        print(f"\nAlmacenamiento frío de {environment}: backups con más de {tiering.after_days} días "
+              f"a {tiering.cold_path} ({tiering.codec.name} nivel {tiering.level})")
+        for backup in candidates:
+            print(f"  MOVER  {backup['timestamp']} ({format_bytes(backup['size_bytes'])})")
+        if dry_run or not candidates:
+            print(f"\n{len(candidates)} backups para mover")
+            return [backup['timestamp'] for backup in candidates]
+
+        # Un backup o restauración del ambiente no corre mientras se mueven sus directorios
+        lock = EnvironmentLock(self.backup_path, environment)
+        if not lock.acquire():
+            print(f"Error: Ya hay una operacion de {environment} en curso ({lock.path})")
+            return None
+        try:
+            moved = tiering.run(environment)
+        finally:
+            lock.release()
+
+        before = sum(stats['bytes_before'] for stats in moved)
+        after = sum(stats['bytes_after'] for stats in moved)
+        print(f"\nMovidos {len(moved)} de {len(candidates)} backups: {format_bytes(before)} -> {format_bytes(after)}")
+        return [stats['timestamp'] for stats in moved]
+
+    def upload_backup(self, environment, backup_timestamp):
+        """
+        Replica un backup al almacenamiento remoto
+
+        Tambien reanuda una subida interrumpida: los archivos que ya estan
+        completos se omiten y los multipart continuan con las partes faltantes.
+
+        Returns:
+            True si la subida fue exitosa, False en caso contrario
+        """
+        if not self.settings.BACKUP_REMOTE_ENDPOINT or not self.settings.BACKUP_REMOTE_BUCKET:
+            print("\nConfigura BACKUP_REMOTE_ENDPOINT y BACKUP_REMOTE_BUCKET en el .env")
+            return False
+
+        print(f"\nSubiendo {environment}/{backup_timestamp} a {self.settings.BACKUP_REMOTE_ENDPOINT} "
+              f"({self.settings.BACKUP_REMOTE_WORKERS} hilos)...")
+        try:
+            stats = RemoteReplicator.from_settings(self.settings).upload_backup(environment, backup_timestamp)
+        except Exception as e:
+            print(f"Error al subir el backup: {str(e)}")
+            return False
+
+        throughput = stats['bytes'] / stats['seconds'] if stats['seconds'] else 0
+        print(f"  Subidos: {stats['uploaded']} archivos ({format_bytes(stats['bytes'])}, "
+              f"{format_bytes(throughput)}/s)")
+        print(f"  Sin cambios: {stats['skipped']} archivos")
+        if stats['blobs']:
+            print(f"  Blobs incrementales: {stats['blobs']}")
+        return True
+
+    def _dump_reader(self, environment, backup_timestamp):
+        """Lector del volcado de la base de datos de un backup (None si no existe)"""
+        backup_dir = os.path.join(self.backup_path, environment, backup_timestamp)
+        if not os.path.isdir(backup_dir):
+            print(f"Error: Backup no encontrado: {backup_dir}")
+            return None
+        dump = find_dump(backup_dir)
+        if dump is None:
+            print(f"Error: El backup {backup_timestamp} no tiene volcado de la base de datos")
+            return None
+        reader = DumpReader(dump)
+        if reader.mode == 'plain':
+            print("  Dump sin índice de tablas: se descomprime completo")
+        return reader
+
+    def list_backup_tables(self, environment, backup_timestamp):
+        """
+        Lista las tablas del volcado de un backup
+
+        Returns:
+            Lista de dicts (name, rows, bytes, compressed_bytes) o None si no se pudo leer
+        """
+        reader = self._dump_reader(environment, backup_timestamp)
+        if reader is None:
+            return None
+        try:
+            return reader.tables()
+        except RuntimeError as e:
+            print(f"Error leyendo el volcado: {str(e)}")
+            return None
+
+    def export_tables(self, environment, backup_timestamp, tables, output_file):
+        """
+        Exporta a un archivo .sql las tablas indicadas de un backup
+
+        Returns:
+            True si la exportacion fue exitosa, False en caso contrario
+        """
+        reader = self._dump_reader(environment, backup_timestamp)
+        if reader is None:
+            return False
+
+        partial_file = output_file + '.part'
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+            with open(partial_file, 'wb') as output:
+                stats = reader.extract(tables, output)
+            os.replace(partial_file, output_file)
+        except (ValueError, RuntimeError, OSError) as e:
+            print(f"Error al exportar tablas: {str(e)}")
+            if os.path.exists(partial_file):
+                os.remove(partial_file)
+            return False
+
+        print(f"  Exportadas: {', '.join(stats['tables'])} ({format_bytes(stats['bytes'])}) -> {output_file}")
+        return True
+
+    def restore_tables(self, environment, backup_timestamp, tables, database=None):
+        """
+        Restaura tablas sueltas de un backup sin tocar el resto de la base de datos
+
+        Las tablas indicadas se recrean (DROP TABLE + CREATE + datos). Con
+        database se cargan en otra base de datos del mismo MySQL (se crea si
+        no existe), por ejemplo para copiar de ahi solo las filas perdidas.
+
+        Returns:
+            True si la restauracion fue exitosa, False en caso contrario
+        """
+        if database and not re.fullmatch(r'[A-Za-z0-9_]+', database):
+            print(f"Error: Nombre de base de datos invalido: {database}")
+            return False
+        reader = self._dump_reader(environment, backup_timestamp)
+        if reader is None:
+            return False
+
+        prefix = 'PROD' if environment == 'production' else 'TEST'
+        db_name = database or self.settings.get_env_var(f'{prefix}_DB_NAME', 'moodle')
+        container = f"mysql_{environment}"
+        env = os.environ.copy()
+        env['MYSQL_PWD'] = self.settings.get_env_var(f'{prefix}_DB_ROOT_PASS', '')
+        mysql = ['docker', 'exec', '-i', '-e', 'MYSQL_PWD', container, 'mysql', '-uroot',
+                 '--default-character-set=utf8mb4']
+
+        print(f"\nRestaurando {len(tables)} tabla(s) de {backup_timestamp} en {container}/{db_name}...")
+        if database:
+            result = subprocess.run(mysql + ['-e', f"CREATE DATABASE IF NOT EXISTS `{database}` "
+                                                   f"CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci"],
+                                    env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                print(f"Error al crear la base de datos {database}: {result.stderr.strip()}")
+                return False
+
+        client = subprocess.Popen(mysql + [db_name], stdin=subprocess.PIPE, env=env)
+        error = None
+        stats = None
+        try:
+            stats = reader.extract(tables, client.stdin)
+        except BrokenPipeError:
+            error = "el cliente mysql terminó antes de tiempo"
+        except (ValueError, RuntimeError) as e:
+            error = str(e)
+        finally:
+            try:
+                client.stdin.close()
+            except BrokenPipeError:
+                pass
+        code = client.wait()
+
+        if error or code != 0:
+            print(f"Error al restaurar tablas: {error or f'mysql terminó con código {code}'}")
+            return False
+        print(f"  Restauradas: {', '.join(stats['tables'])} ({format_bytes(stats['bytes'])} de SQL)")
+        return True
+
+    def _archive_reader(self, environment, backup_timestamp):
+        """Lector del tar de moodledata de un backup (None si no existe)"""
+        backup_dir = os.path.join(self.backup_path, environment, backup_timestamp)
+        if not os.path.isdir(backup_dir):
+            print(f"Error: Backup no encontrado: {backup_dir}")
+            return None
+        try:
+            reader = open_archive(backup_dir)
+        except (ValueError, OSError) as e:
+            print(f"Error leyendo moodledata: {str(e)}")
+            return None
+        if reader is None:
+            print(f"Error: El backup {backup_timestamp} no tiene un tar de moodledata")
+            return None
+        if reader.mode == 'plain':
+            print("  Moodledata sin índice de archivos: se descomprime completo")
+        return reader
+
+    def list_moodledata_files(self, environment, backup_timestamp, prefix=None):
+        """
+        Lista los archivos del moodledata de un backup
+
+        Args:
+            prefix: Directorio a listar (ej. 'filedir/3f'), None = todo
+
+        Returns:
+            Lista de dicts (path, type, size, contenthash) o None si no se pudo leer
+        """
+        reader = self._archive_reader(environment, backup_timestamp)
+        if reader is None:
+            return None
+        try:
+            return list(reader.list(prefix))
+        except (ValueError, RuntimeError, OSError) as e:
+            print(f"Error leyendo moodledata: {str(e)}")
+            return None
+
+    def search_moodledata_files(self, environment, backup_timestamp, term):
+        """
+        Busca archivos del moodledata de un backup por contenthash (prefijo) o ruta
+
+        Returns:
+            Lista de dicts (path, type, size, contenthash) o None si no se pudo leer
+        """
+        reader = self._archive_reader(environment, backup_timestamp)
+        if reader is None:
+            return None
+        try:
+            return list(reader.search(term))
+        except (ValueError, RuntimeError, OSError) as e:
+            print(f"Error leyendo moodledata: {str(e)}")
+            return None
+
+    def extract_moodledata_files(self, environment, backup_timestamp, selection, target_dir=None):
+        """
+        Recupera archivos o directorios del moodledata de un backup
+
+        Con indice solo se descomprimen los marcos que los contienen.
+
+        Args:
+            selection: Rutas (ej. 'filedir/3f/a1/3fa1...', 'lang/es') o contenthash
+            target_dir: Directorio donde extraerlos; None los restaura en el
+                volumen moodledata del ambiente (reemplaza los existentes)
+
+        Returns:
+            True si la recuperacion fue exitosa, False en caso contrario
         """
-        print(f"\nLimpieza de backups antiguos de {environment}")
-        print(f"Los backups se mantienen por {self.settings.BACKUP_RETENTION_DAYS} días")
-        print("La limpieza se ejecuta automáticamente durante el backup")
+        reader = self._archive_reader(environment, backup_timestamp)
+        if reader is None:
+            return False
+
+        started = time.monotonic()
+        try:
+            # El tar de la seleccion se arma en disco junto a los backups (puede ser grande)
+            with tempfile.TemporaryFile(dir=self.backup_path) as selected:
+                stats = reader.extract(selection, selected)
+                selected.seek(0)
+                if target_dir:
+                    os.makedirs(target_dir, exist_ok=True)
+                    with tarfile.open(fileobj=selected, mode='r:') as tar:
+                        if hasattr(tarfile, 'data_filter'):
+                            tar.extractall(target_dir, filter='data')
+                        else:
+                            tar.extractall(target_dir)
+                else:
+                    VolumeStream(f"moodledata_{environment}").import_tar(selected)
+        except (ValueError, RuntimeError, OSError, tarfile.TarError) as e:
+            print(f"Error al recuperar archivos de moodledata: {str(e)}")
+            return False
+
+        destination = target_dir or f"volumen moodledata_{environment}"
+        print(f"  Recuperados: {stats['files']} archivos ({format_bytes(stats['bytes'])}) -> {destination} "
+              f"en {time.monotonic() - started:.1f}s")
         return True
 
     def get_backup_info(self, environment, backup_timestamp):
         """
-        Obtiene información detallada de un backup
+        Obtiene información detallada de un backup desde el catálogo
 
         Args:
             environment: 'testing' o 'production'
@@ -192,21 +934,31 @@ class BackupManager:
         if not os.path.exists(backup_dir):
             return None
 
+        entry = self.catalog.get_backup(environment, backup_timestamp)
+        if entry is None:
+            self.catalog.record_backup(environment, backup_timestamp)
+            entry = self.catalog.get_backup(environment, backup_timestamp)
+
         info = {
             'environment': environment,
             'timestamp': backup_timestamp,
             'path': backup_dir,
-            'size': self._get_dir_size(backup_dir),
+            'size': format_bytes(entry['size_bytes']),
+            'status': entry['status'],
+            'codec': entry['codec'] or 'N/A',
+            'duration': entry['duration_seconds'],
+            'throughput': format_bytes(entry['throughput_bps']) + '/s' if entry['throughput_bps'] else None,
+            'verify_status': entry['verify_status'] or 'sin verificar',
+            # Compresion adaptativa de moodledata (ver adaptive.py)
+            'adaptive': entry['stats'].get('moodledata_adaptive'),
             'files': []
         }
 
-        # Listar archivos del backup
-        for file in os.listdir(backup_dir):
-            file_path = os.path.join(backup_dir, file)
-            file_size = self._get_dir_size(file_path) if os.path.isfile(file_path) else 'N/A'
+        for file_info in entry['files']:
             info['files'].append({
-                'name': file,
-                'size': file_size
+                'name': file_info['name'],
+                'size': format_bytes(file_info['size_bytes']),
+                'sha256': file_info['sha256']
             })
 
         return info
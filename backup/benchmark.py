@@ -0,0 +1,741 @@
+#!/usr/bin/env python3
+"""
+Benchmark Module
+Datos sinteticos de Moodle y medicion de respaldo/restauracion
+
+Genera un moodledata con la estructura de filedir (archivos nombrados por su
+SHA-1 en filedir/ab/cd/) y una distribucion de tamaños log-normal, junto con
+una base de datos con tablas del estilo de Moodle (usuarios, cursos, archivos,
+registro de eventos y calificaciones). Con ellos levanta un ambiente aislado
+('benchmark': mysql_benchmark, moodle_benchmark y moodledata_benchmark) y
+mide BackupManager.create_backup, verify_backups y restore_backup de punta a
+punta y por etapa.
+
+Los resultados se guardan en JSON en BACKUPS_PATH/benchmarks/ y se agregan a
+history.jsonl para seguir las regresiones entre versiones. Los datos se
+generan con una semilla, por lo que dos corridas con los mismos parametros
+miden exactamente el mismo conjunto.
+"""
+
+import hashlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backup.exclusions import DEFAULT_EXCLUDES
+from backup.volume import VolumeStream
+
+
+BENCH_ENVIRONMENT = 'benchmark'
+RESULTS_DIR = 'benchmarks'
+HISTORY_FILE = 'history.jsonl'
+MYSQL_IMAGE = 'mysql:8.0'
+# Ruta de moodledata en el contenedor de Moodle (ver compose_generator.py)
+MOODLEDATA_PATH = '/var/moodledata'
+
+# Permisos por defecto de Moodle ($CFG->directorypermissions) y usuario www-data
+DIR_MODE = 0o2777
+FILE_MODE = 0o666
+WWW_DATA = 33
+
+# Distribucion de tamaños de filedir: mediana 32 KB, cola larga hasta 64 MB
+SIZE_MEDIAN = 32 * 1024
+SIZE_SIGMA = 1.6
+SIZE_MAX = 64 * 1024 * 1024
+# Fraccion de archivos comprimibles (texto); el resto imita PDF, imagenes y video
+TEXT_FRACTION = 0.3
+# Fraccion del tamaño total en los directorios que Moodle regenera (cache, temp...)
+REGENERABLE_FRACTION = 0.05
+
+INSERT_BATCH = 500
+MYSQL_READY_TIMEOUT = 180
+
+# Reparto de las filas entre las tablas
+TABLE_SHARES = (
+    ('mdl_logstore_standard_log', 0.60),
+    ('mdl_grade_grades', 0.25),
+    ('mdl_files', 0.09),
+    ('mdl_user', 0.05),
+    ('mdl_course', 0.01),
+)
+
+SCHEMA = """
+CREATE TABLE mdl_user (
+    id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    username VARCHAR(100) NOT NULL,
+    firstname VARCHAR(100) NOT NULL,
+    lastname VARCHAR(100) NOT NULL,
+    email VARCHAR(100) NOT NULL,
+    timecreated BIGINT NOT NULL,
+    lastaccess BIGINT NOT NULL,
+    UNIQUE KEY mdl_user_use_uix (username)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ROW_FORMAT=DYNAMIC;
+CREATE TABLE mdl_course (
+    id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    category BIGINT NOT NULL,
+    fullname VARCHAR(254) NOT NULL,
+    shortname VARCHAR(255) NOT NULL,
+    summary LONGTEXT,
+    timecreated BIGINT NOT NULL,
+    KEY mdl_cour_cat_ix (category)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ROW_FORMAT=DYNAMIC;
+CREATE TABLE mdl_files (
+    id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    contenthash VARCHAR(40) NOT NULL,
+    pathnamehash VARCHAR(40) NOT NULL,
+    contextid BIGINT NOT NULL,
+    component VARCHAR(100) NOT NULL,
+    filearea VARCHAR(50) NOT NULL,
+    filename VARCHAR(255) NOT NULL,
+    filesize BIGINT NOT NULL,
+    mimetype VARCHAR(100),
+    timecreated BIGINT NOT NULL,
+    UNIQUE KEY mdl_file_pat_uix (pathnamehash),
+    KEY mdl_file_con_ix (contenthash)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ROW_FORMAT=DYNAMIC;
+CREATE TABLE mdl_logstore_standard_log (
+    id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    eventname VARCHAR(255) NOT NULL,
+    component VARCHAR(100) NOT NULL,
+    action VARCHAR(100) NOT NULL,
+    target VARCHAR(100) NOT NULL,
+    userid BIGINT NOT NULL,
+    courseid BIGINT,
+    contextid BIGINT,
+    other LONGTEXT,
+    timecreated BIGINT NOT NULL,
+    origin VARCHAR(10),
+    ip VARCHAR(45),
+    KEY mdl_logsstanlog_tim_ix (timecreated),
+    KEY mdl_logsstanlog_useconconcr_ix (userid, contextid, timecreated)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ROW_FORMAT=DYNAMIC;
+CREATE TABLE mdl_grade_grades (
+    id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    itemid BIGINT NOT NULL,
+    userid BIGINT NOT NULL,
+    finalgrade DECIMAL(10,5),
+    feedback LONGTEXT,
+    timemodified BIGINT,
+    KEY mdl_gradgrad_ite_ix (itemid),
+    KEY mdl_gradgrad_use_ix (userid)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ROW_FORMAT=DYNAMIC;
+"""
+
+WORDS = (
+    'curso', 'tarea', 'entrega', 'foro', 'cuestionario', 'calificacion', 'alumno', 'docente',
+    'unidad', 'lectura', 'actividad', 'recurso', 'evaluacion', 'semana', 'proyecto', 'grupo',
+    'examen', 'practica', 'modulo', 'contenido', 'retroalimentacion', 'rubrica', 'plazo', 'nota',
+)
+EVENTS = (
+    ('\\\\core\\\\event\\\\course_viewed', 'core', 'viewed', 'course'),
+    ('\\\\mod_forum\\\\event\\\\discussion_viewed', 'mod_forum', 'viewed', 'discussion'),
+    ('\\\\mod_assign\\\\event\\\\submission_created', 'mod_assign', 'created', 'submission'),
+    ('\\\\mod_quiz\\\\event\\\\attempt_submitted', 'mod_quiz', 'submitted', 'attempt'),
+    ('\\\\core\\\\event\\\\user_loggedin', 'core', 'loggedin', 'user'),
+)
+MIMETYPES = ('application/pdf', 'image/png', 'image/jpeg', 'video/mp4', 'application/zip', 'text/plain')
+
+
+def _sql_string(value):
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+class SyntheticMoodledata:
+    """Arbol de moodledata reproducible a partir de una semilla"""
+
+    def __init__(self, total_bytes, seed=42, exclude=DEFAULT_EXCLUDES):
+        self.total_bytes = int(total_bytes)
+        self.seed = seed
+        self.exclude = list(exclude)
+        self.stats = {}
+
+    def _text(self, rng, size):
+        # Parrafos de palabras repetidas: se comprimen como los documentos reales
+        words = rng.choices(WORDS, k=max(size // 8, 1))
+        data = ' '.join(words).encode('ascii')
+        while len(data) < size:
+            data += data
+        return data[:size]
+
+    def entries(self):
+        """
+        Genera las entradas del volumen
+
+        Yields:
+            Tuplas (ruta relativa, bytes); bytes None para directorios
+        """
+        rng = random.Random(self.seed)
+        stats = {'files': 0, 'bytes': 0, 'directories': 0, 'regenerable_files': 0,
+                 'regenerable_bytes': 0, 'largest_file': 0}
+        self.stats = stats
+        directories = set()
+
+        def parents(path):
+            parts = path.split('/')[:-1]
+            for depth in range(1, len(parts) + 1):
+                directory = '/'.join(parts[:depth])
+                if directory not in directories:
+                    directories.add(directory)
+                    stats['directories'] += 1
+                    yield directory, None
+
+        # filedir: contenido direccionado por SHA-1, como el file storage de Moodle
+        filedir_bytes = int(self.total_bytes * (1 - REGENERABLE_FRACTION))
+        while stats['bytes'] < filedir_bytes:
+            size = min(int(rng.lognormvariate(math.log(SIZE_MEDIAN), SIZE_SIGMA)), SIZE_MAX,
+                       filedir_bytes - stats['bytes'])
+            size = max(size, 1)
+            if rng.random() < TEXT_FRACTION:
+                data = self._text(rng, size)
+            else:
+                data = rng.randbytes(size)
+            digest = hashlib.sha1(data).hexdigest()
+            path = f"filedir/{digest[:2]}/{digest[2:4]}/{digest}"
+            yield from parents(path)
+            yield path, data
+            stats['files'] += 1
+            stats['bytes'] += size
+            stats['largest_file'] = max(stats['largest_file'], size)
+
+        # Directorios que Moodle regenera: muchos archivos pequeños
+        regenerable_bytes = self.total_bytes - filedir_bytes
+        targets = self.exclude or ['cache']
+        written = 0
+        index = 0
+        while written < regenerable_bytes:
+            size = min(rng.randint(512, 16 * 1024), regenerable_bytes - written)
+            base = targets[index % len(targets)]
+            path = f"{base}/{index % 64:02x}/{index:08d}.cache"
+            yield from parents(path)
+            yield path, self._text(rng, size)
+            written += size
+            index += 1
+            if self.exclude:
+                stats['regenerable_files'] += 1
+                stats['regenerable_bytes'] += size
+            else:
+                stats['files'] += 1
+                stats['bytes'] += size
+
+    def write_tar(self, output):
+        """Escribe el arbol como stream tar (entradas ./ruta, dueño www-data)"""
+        mtime = time.time()
+        with tarfile.open(fileobj=output, mode='w|') as tar:
+            root = tarfile.TarInfo('.')
+            root.type = tarfile.DIRTYPE
+            root.mode = DIR_MODE
+            root.uid = root.gid = WWW_DATA
+            root.mtime = mtime
+            tar.addfile(root)
+            for path, data in self.entries():
+                info = tarfile.TarInfo('./' + path)
+                info.uid = info.gid = WWW_DATA
+                info.mtime = mtime
+                if data is None:
+                    info.type = tarfile.DIRTYPE
+                    info.mode = DIR_MODE
+                    tar.addfile(info)
+                else:
+                    info.size = len(data)
+                    info.mode = FILE_MODE
+                    tar.addfile(info, io.BytesIO(data))
+        return self.stats
+
+    def write_dir(self, target):
+        """Escribe el arbol en un directorio local"""
+        os.makedirs(target, exist_ok=True)
+        for path, data in self.entries():
+            full_path = os.path.join(target, path)
+            if data is None:
+                os.makedirs(full_path, exist_ok=True)
+            else:
+                with open(full_path, 'wb') as f:
+                    f.write(data)
+        return self.stats
+
+
+class SyntheticDatabase:
+    """Esquema y filas del estilo de Moodle generados a partir de una semilla"""
+
+    def __init__(self, rows, seed=42):
+        self.rows = int(rows)
+        self.seed = seed
+
+    def table_rows(self):
+        """Filas de cada tabla (al menos una por tabla)"""
+        return {table: max(int(self.rows * share), 1) for table, share in TABLE_SHARES}
+
+    def _row(self, rng, table, row_id, counts, now):
+        users = counts['mdl_user']
+        courses = counts['mdl_course']
+        if table == 'mdl_user':
+            first, last = rng.choice(WORDS).title(), rng.choice(WORDS).title()
+            return (f"({row_id},'usuario{row_id}',{_sql_string(first)},{_sql_string(last)},"
+                    f"'usuario{row_id}@example.com',{now - rng.randint(0, 10 ** 8)},{now - rng.randint(0, 10 ** 6)})")
+        if table == 'mdl_course':
+            summary = ' '.join(rng.choices(WORDS, k=rng.randint(20, 200)))
+            return (f"({row_id},{rng.randint(1, 20)},'Curso {row_id}','C{row_id}',"
+                    f"{_sql_string(summary)},{now - rng.randint(0, 10 ** 8)})")
+        if table == 'mdl_files':
+            content = hashlib.sha1(f"{self.seed}-{row_id}".encode()).hexdigest()
+            pathname = hashlib.sha1(f"path-{row_id}".encode()).hexdigest()
+            return (f"({row_id},'{content}','{pathname}',{rng.randint(1, 10 ** 6)},'mod_assign','submission_files',"
+                    f"'archivo{row_id}.pdf',{int(rng.lognormvariate(math.log(SIZE_MEDIAN), SIZE_SIGMA))},"
+                    f"'{rng.choice(MIMETYPES)}',{now - rng.randint(0, 10 ** 8)})")
+        if table == 'mdl_logstore_standard_log':
+            eventname, component, action, target = rng.choice(EVENTS)
+            other = json.dumps({'instanceid': rng.randint(1, 10 ** 5), 'relateduserid': None})
+            return (f"({row_id},'{eventname}','{component}','{action}','{target}',{rng.randint(1, users)},"
+                    f"{rng.randint(1, courses)},{rng.randint(1, 10 ** 6)},{_sql_string(other)},"
+                    f"{now - rng.randint(0, 10 ** 7)},'web','10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}')")
+        feedback = ' '.join(rng.choices(WORDS, k=rng.randint(0, 30)))
+        return (f"({row_id},{rng.randint(1, 10 ** 4)},{rng.randint(1, users)},{rng.uniform(0, 100):.5f},"
+                f"{_sql_string(feedback)},{now - rng.randint(0, 10 ** 7)})")
+
+    def statements(self):
+        """Genera el SQL de carga (esquema + INSERT por lotes)"""
+        rng = random.Random(self.seed)
+        counts = self.table_rows()
+        now = int(time.time())
+        yield "SET autocommit=0, unique_checks=0, foreign_key_checks=0;\n"
+        yield SCHEMA
+        for table, rows in counts.items():
+            for start in range(1, rows + 1, INSERT_BATCH):
+                values = ','.join(self._row(rng, table, row_id, counts, now)
+                                  for row_id in range(start, min(start + INSERT_BATCH, rows + 1)))
+                yield f"INSERT INTO {table} VALUES {values};\n"
+            yield "COMMIT;\n"
+
+
+class BenchmarkEnvironment:
+    """Contenedores y volumen aislados del ambiente de benchmark"""
+
+    def __init__(self, settings, environment=BENCH_ENVIRONMENT):
+        self.settings = settings
+        self.environment = environment
+        self.mysql_container = f"mysql_{environment}"
+        self.moodle_container = f"moodle_{environment}"
+        self.volume = f"moodledata_{environment}"
+        self.mysql_volume = f"mysql_{environment}"
+        # Los ambientes distintos de production usan las credenciales TEST_*
+        self.db_name = settings.get_env_var('TEST_DB_NAME', 'moodle')
+        self.db_user = settings.get_env_var('TEST_DB_USER', 'moodle')
+        self.db_pass = settings.get_env_var('TEST_DB_PASS', 'moodle')
+        self.root_pass = settings.get_env_var('TEST_DB_ROOT_PASS', '') or 'benchmark'
+
+    def _docker(self, *args, check=True, **kwargs):
+        return subprocess.run(['docker', *args], check=check, capture_output=True, text=True, **kwargs)
+
+    def _mysql_env(self):
+        env = os.environ.copy()
+        env['MYSQL_PWD'] = self.root_pass
+        return env
+
+    def start(self):
+        """Crea (desde cero) MySQL, el volumen de moodledata y el contenedor de Moodle"""
+        self.stop()
+        self._docker('volume', 'create', self.volume)
+        self._docker('volume', 'create', self.mysql_volume)
+        command = []
+        if self.settings.BACKUP_BINLOG_ENABLED:
+            # El dump registra la posicion del binlog (--source-data=2)
+            command = ['--server-id=1', '--log-bin=mysql-bin', '--binlog-format=ROW']
+        self._docker(
+            'run', '-d', '--name', self.mysql_container,
+            '-e', f"MYSQL_ROOT_PASSWORD={self.root_pass}",
+            '-e', f"MYSQL_DATABASE={self.db_name}",
+            '-e', f"MYSQL_USER={self.db_user}",
+            '-e', f"MYSQL_PASSWORD={self.db_pass}",
+            '-v', f"{self.mysql_volume}:/var/lib/mysql",
+            MYSQL_IMAGE, *command)
+        # restore.sh detiene y arranca moodle_<ambiente>: basta un contenedor que monte moodledata
+        self._docker(
+            'run', '-d', '--name', self.moodle_container,
+            '-v', f"{self.volume}:{MOODLEDATA_PATH}",
+            '--entrypoint', 'sleep', MYSQL_IMAGE, 'infinity')
+        self.wait_mysql()
+
+    def wait_mysql(self):
+        """Espera al servidor definitivo (la imagen arranca uno temporal para inicializar)"""
+        deadline = time.monotonic() + MYSQL_READY_TIMEOUT
+        while time.monotonic() < deadline:
+            logs = self._docker('logs', self.mysql_container, check=False)
+            output = logs.stdout + logs.stderr
+            if 'ready for connections' in output and 'port: 3306' in output:
+                ping = self._docker('exec', '-e', 'MYSQL_PWD', self.mysql_container,
+                                    'mysqladmin', '-uroot', 'ping', check=False, env=self._mysql_env())
+                if ping.returncode == 0:
+                    return
+            time.sleep(2)
+        raise RuntimeError(f"{self.mysql_container} no estuvo listo en {MYSQL_READY_TIMEOUT}s")
+
+    def load_database(self, database):
+        """Carga el SQL sintetico en la base de datos del ambiente"""
+        process = subprocess.Popen(
+            ['docker', 'exec', '-i', '-e', 'MYSQL_PWD', self.mysql_container, 'mysql', '-uroot', self.db_name],
+            stdin=subprocess.PIPE, stderr=subprocess.PIPE, env=self._mysql_env())
+        try:
+            for statement in database.statements():
+                process.stdin.write(statement.encode('utf-8'))
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        error = process.stderr.read().decode('utf-8', 'replace')
+        if process.wait() != 0:
+            raise RuntimeError(f"Error cargando la base de datos: {error.strip()}")
+
+    def load_moodledata(self, moodledata):
+        """Transmite el moodledata sintetico al volumen (sin pasar por el disco)"""
+        read_fd, write_fd = os.pipe()
+        errors = []
+
+        def produce():
+            try:
+                with os.fdopen(write_fd, 'wb') as output:
+                    moodledata.write_tar(output)
+            except Exception as e:
+                errors.append(e)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        with os.fdopen(read_fd, 'rb') as source:
+            VolumeStream(self.volume).import_tar(source)
+        producer.join()
+        if errors:
+            raise errors[0]
+        return moodledata.stats
+
+    def query(self, sql):
+        """Ejecuta SQL como root en la base de datos del ambiente y devuelve la salida tabulada"""
+        result = self._docker('exec', '-e', 'MYSQL_PWD', self.mysql_container, 'mysql', '-uroot',
+                              '-N', '-B', '-e', sql, self.db_name, env=self._mysql_env())
+        return result.stdout
+
+    def table_counts(self):
+        """Filas de cada tabla sintetica en la base de datos actual"""
+        output = self.query(' UNION ALL '.join(
+            f"SELECT '{table}', COUNT(*) FROM {table}" for table, _ in TABLE_SHARES))
+        counts = {}
+        for line in output.splitlines():
+            table, count = line.split('\t')
+            counts[table] = int(count)
+        return counts
+
+    def volume_summary(self, exclude=()):
+        """Archivos y bytes del volumen fuera de los directorios excluidos"""
+        read_fd, write_fd = os.pipe()
+        summary = {'files': 0, 'bytes': 0}
+
+        def export():
+            with os.fdopen(write_fd, 'wb') as output:
+                VolumeStream(self.volume).export(output, exclude)
+
+        exporter = threading.Thread(target=export, daemon=True)
+        exporter.start()
+        with os.fdopen(read_fd, 'rb') as source, tarfile.open(fileobj=source, mode='r|') as tar:
+            for member in tar:
+                if member.isfile():
+                    summary['files'] += 1
+                    summary['bytes'] += member.size
+        exporter.join()
+        return summary
+
+    def stop(self):
+        """Elimina contenedores y volumenes del ambiente"""
+        self._docker('rm', '-f', self.moodle_container, self.mysql_container, check=False)
+        self._docker('volume', 'rm', '-f', self.volume, self.mysql_volume, check=False)
+
+
+def stage_times(stats):
+    """
+    Tiempos por etapa a partir de STATS.json del motor
+
+    Returns:
+        Dict {etapa: {'seconds', 'bytes'}} (dump, compresion y archivo de moodledata)
+    """
+    stages = {}
+    database = stats.get('database') or {}
+    if 'source' in database:
+        stages['dump'] = {'seconds': database['source']['seconds'], 'bytes': database['source']['bytes']}
+        stages['dump_compress'] = {'seconds': database['compress']['seconds'],
+                                   'bytes': database['compress']['bytes']}
+    elif 'seconds' in database:
+        stages['dump'] = {'seconds': database['seconds'], 'bytes': database.get('bytes', 0)}
+        stages['dump_compress'] = {'seconds': database['seconds'],
+                                   'bytes': database.get('compressed_bytes', 0)}
+    moodledata = stats.get('moodledata') or {}
+    if 'source' in moodledata:
+        stages['archive'] = {'seconds': moodledata['source']['seconds'], 'bytes': moodledata['source']['bytes']}
+        stages['archive_compress'] = {'seconds': moodledata['compress']['seconds'],
+                                      'bytes': moodledata['compress']['bytes']}
+    elif 'seconds' in moodledata:
+        stages['archive'] = {'seconds': moodledata['seconds'], 'bytes': moodledata.get('bytes', 0)}
+    return stages
+
+
+def compare_runs(previous, current, threshold=0.10):
+    """
+    Compara los tiempos de dos corridas
+
+    Returns:
+        Lista de dicts {'metric', 'previous', 'current', 'change', 'regression'}
+    """
+    rows = []
+    for metric, seconds in sorted(current['timings'].items()):
+        before = previous['timings'].get(metric)
+        if not before or seconds is None:
+            continue
+        change = (seconds - before) / before
+        rows.append({
+            'metric': metric,
+            'previous': before,
+            'current': seconds,
+            'change': round(change, 4),
+            'regression': change > threshold,
+        })
+    return rows
+
+
+def _flatten_timings(results):
+    timings = {}
+    for phase in ('backup', 'verify', 'restore'):
+        if phase in results:
+            timings[phase] = results[phase]['seconds']
+    for name, stage in results.get('backup', {}).get('stages', {}).items():
+        timings[f"backup.{name}"] = stage['seconds']
+    return timings
+
+
+def _git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=Path(__file__).parent)
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+
+class BackupBenchmark:
+    """Mide respaldo, verificacion y restauracion sobre el ambiente de benchmark"""
+
+    def __init__(self, settings, moodledata_mb=256, rows=200000, seed=42, keep=False):
+        self.settings = settings
+        self.moodledata_mb = moodledata_mb
+        self.rows = rows
+        self.seed = seed
+        self.keep = keep
+        self.environment = BenchmarkEnvironment(settings)
+        self.results_dir = os.path.join(settings.BACKUPS_PATH, RESULTS_DIR)
+
+    def _configuration(self):
+        s = self.settings
+        return {
+            'engine': s.BACKUP_ENGINE,
+            'compression': s.BACKUP_COMPRESSION,
+            'compression_level': s.BACKUP_COMPRESSION_LEVEL,
+            'compression_threads': s.BACKUP_COMPRESSION_THREADS,
+            'db_mode': s.BACKUP_DB_MODE,
+            'moodledata_mode': s.BACKUP_MOODLEDATA_MODE,
+            'restore_mode': s.BACKUP_RESTORE_MODE,
+            'concurrent': s.BACKUP_CONCURRENT,
+            'parallel_workers': s.BACKUP_PARALLEL_WORKERS,
+            'rate_limit_mb': s.BACKUP_RATE_LIMIT_MB,
+            'binlog': s.BACKUP_BINLOG_ENABLED,
+        }
+
+    def _timed(self, function, *args):
+        started = time.monotonic()
+        result = function(*args)
+        return result, round(time.monotonic() - started, 3)
+
+    def run(self):
+        """
+        Ejecuta el benchmark completo
+
+        Returns:
+            Dict con los resultados (tambien se guarda en BACKUPS_PATH/benchmarks)
+        """
+        from backup.backup_manager import BackupManager
+
+        manager = BackupManager(self.settings)
+        env = self.environment.environment
+        excludes = self.settings.BACKUP_MOODLEDATA_EXCLUDE
+        moodledata = SyntheticMoodledata(self.moodledata_mb * 1024 * 1024, self.seed, excludes)
+        database = SyntheticDatabase(self.rows, self.seed)
+        results = {}
+
+        try:
+            print(f"Preparando ambiente {env} ({MYSQL_IMAGE})...")
+            _, setup_seconds = self._timed(self.environment.start)
+            print(f"Cargando {self.rows} filas sintéticas...")
+            _, load_db_seconds = self._timed(self.environment.load_database, database)
+            print(f"Generando moodledata sintético ({self.moodledata_mb} MB)...")
+            dataset, load_md_seconds = self._timed(self.environment.load_moodledata, moodledata)
+            expected_counts = database.table_rows()
+            results['setup'] = {'seconds': setup_seconds, 'load_database_seconds': load_db_seconds,
+                                'load_moodledata_seconds': load_md_seconds}
+
+            before = {entry['timestamp'] for entry in manager.catalog.list_backups(env)}
+            ok, seconds = self._timed(manager.create_backup, env)
+            created = [entry for entry in manager.catalog.list_backups(env) if entry['timestamp'] not in before]
+            if not ok or not created:
+                raise RuntimeError("El respaldo del benchmark falló")
+            backup = created[0]
+            stats = backup.get('stats') or {}
+            results['backup'] = {
+                'seconds': seconds,
+                'size_bytes': backup['size_bytes'],
+                'stages': stage_times(stats),
+            }
+
+            summary, seconds = self._timed(manager.verify_backups, env)
+            results['verify'] = {'seconds': seconds, 'ok': all(summary.values())}
+
+            # Se cambian los datos para comprobar que la restauracion los reemplaza
+            self.environment.query('DELETE FROM mdl_user')
+            ok, seconds = self._timed(manager.restore_backup, env, backup['timestamp'])
+            counts = self.environment.table_counts()
+            volume = self.environment.volume_summary(excludes)
+            results['restore'] = {
+                'seconds': seconds,
+                'ok': ok,
+                'tables_match': counts == expected_counts,
+                'files_match': volume == {'files': dataset['files'], 'bytes': dataset['bytes']},
+            }
+        finally:
+            if not self.keep:
+                self.environment.stop()
+                self._remove_backups(manager, env)
+
+        report = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'host': {
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'cpus': os.cpu_count(),
+            },
+            'configuration': self._configuration(),
+            'dataset': {
+                'seed': self.seed,
+                'moodledata_mb': self.moodledata_mb,
+                'rows': self.rows,
+                'tables': expected_counts,
+                'moodledata': dataset,
+            },
+            'results': results,
+            'timings': _flatten_timings(results),
+        }
+        self.save(report)
+        return report
+
+    def _remove_backups(self, manager, env):
+        for entry in manager.catalog.list_backups(env):
+            manager.catalog.remove_backup(env, entry['timestamp'])
+        shutil.rmtree(os.path.join(self.settings.BACKUPS_PATH, env), ignore_errors=True)
+
+    def save(self, report):
+        """Guarda el resultado y lo agrega al historial"""
+        os.makedirs(self.results_dir, exist_ok=True)
+        name = report['timestamp'].replace(':', '-').replace('T', '_')
+        with open(os.path.join(self.results_dir, f"{name}.json"), 'w') as f:
+            json.dump(report, f, indent=2)
+        with open(os.path.join(self.results_dir, HISTORY_FILE), 'a') as f:
+            f.write(json.dumps(report, sort_keys=True) + '\n')
+
+
+def read_history(results_dir):
+    """Corridas guardadas en history.jsonl (de la mas antigua a la mas reciente)"""
+    path = os.path.join(results_dir, HISTORY_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def previous_comparable(history, report):
+    """Corrida anterior con el mismo conjunto de datos y configuracion"""
+    def key(run):
+        dataset = run['dataset']
+        return (dataset['seed'], dataset['moodledata_mb'], dataset['rows'],
+                json.dumps(run['configuration'], sort_keys=True))
+
+    for candidate in reversed(history):
+        if candidate['timestamp'] != report['timestamp'] and key(candidate) == key(report):
+            return candidate
+    return None
+
+
+def main(argv):
+    usage = (
+        "Uso:\n"
+        "  benchmark.py run [moodledata_mb] [filas] [semilla] [--keep]\n"
+        "  benchmark.py compare [umbral_%]     (ultima corrida contra la anterior comparable)\n"
+        "  benchmark.py generate <directorio> [moodledata_mb] [semilla]\n"
+        "La configuracion se lee del .env de BASE_PATH; requiere Docker e imagen mysql:8.0"
+    )
+    command = argv[1] if len(argv) > 1 else None
+    args = [arg for arg in argv[2:] if not arg.startswith('--')]
+    try:
+        if command == 'generate' and args:
+            moodledata = SyntheticMoodledata(float(args[1] if len(args) > 1 else 64) * 1024 * 1024,
+                                             int(args[2]) if len(args) > 2 else 42)
+            print(json.dumps(moodledata.write_dir(args[0])))
+            return 0
+        if command not in ('run', 'compare'):
+            print(usage, file=sys.stderr)
+            return 1
+
+        from config.settings import Settings
+        settings = Settings()
+        settings.load_env_file()
+        results_dir = os.path.join(settings.BACKUPS_PATH, RESULTS_DIR)
+
+        if command == 'run':
+            benchmark = BackupBenchmark(
+                settings,
+                moodledata_mb=float(args[0]) if args else 256,
+                rows=int(args[1]) if len(args) > 1 else 200000,
+                seed=int(args[2]) if len(args) > 2 else 42,
+                keep='--keep' in argv)
+            report = benchmark.run()
+            print(json.dumps(report, indent=2))
+            restore = report['results']['restore']
+            return 0 if restore['ok'] and restore['tables_match'] and restore['files_match'] else 1
+
+        history = read_history(results_dir)
+        if not history:
+            print("No hay corridas en el historial", file=sys.stderr)
+            return 1
+        threshold = float(args[0]) / 100 if args else 0.10
+        previous = previous_comparable(history[:-1], history[-1])
+        if previous is None:
+            print("No hay una corrida anterior con el mismo conjunto de datos y configuracion", file=sys.stderr)
+            return 1
+        rows = compare_runs(previous, history[-1], threshold)
+        for row in rows:
+            flag = 'REGRESION' if row['regression'] else 'ok'
+            print(f"{row['metric']:<24} {row['previous']:>10.2f}s {row['current']:>10.2f}s "
+                  f"{row['change'] * 100:>+7.1f}%  {flag}")
+        return 1 if any(row['regression'] for row in rows) else 0
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+"""
+Binlog Module
+Archivado continuo de binlogs de MySQL y recuperacion a un instante (PITR)
+
+MySQL escribe sus binlogs en el volumen mysql_<ambiente> (ver
+ComposeGenerator._build_mysql_service). Un cron ejecuta el archivador cada
+BACKUP_BINLOG_INTERVAL minutos: rota el binlog activo si tiene eventos nuevos
+y transmite los binlogs cerrados, comprimidos, a BACKUPS_PATH/<ambiente>/binlogs,
+registrando en el catalogo el rango de tiempo de cada uno.
+
+Para restaurar a un instante se carga el respaldo completo anterior (su dump
+registra la posicion del binlog) y se aplican los binlogs desde esa posicion
+con mysqlbinlog --stop-datetime.
+"""
+
+import fcntl
+import json
+import os
+import re
+import struct
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backup.catalog import BackupCatalog
+from backup.compression import detect_codec, resolve_codec
+from backup.engine import StreamPipeline
+from backup.parallel_dump import INDEX_FILE, PARALLEL_DIR
+from backup.physical import read_metadata
+from backup.retention import TIMESTAMP_FORMAT, UNUSABLE_STATUS
+from backup.throttle import Throttle
+
+
+BINLOG_DIR = 'binlogs'
+STATE_FILE = '.active.json'
+LOCK_FILE = '.lock'
+
+# Directorio temporal dentro del contenedor MySQL durante la recuperacion
+REPLAY_DIR = '/tmp/moodle-pitr'
+
+# Firma de un binlog y cabecera comun de cada evento (v4, 19 bytes):
+# timestamp, tipo, server_id, tamaño del evento, posicion siguiente, flags
+BINLOG_MAGIC = b'\xfebin'
+EVENT_HEADER = struct.Struct('<IBIIIH')
+
+# Posicion registrada por mysqldump --source-data=2 (o --master-data en versiones previas)
+DUMP_POSITION = re.compile(r"(?:SOURCE|MASTER)_LOG_FILE='([^']+)',\s*(?:SOURCE|MASTER)_LOG_POS=(\d+)")
+
+# Lineas del inicio del dump en las que se busca la posicion
+DUMP_HEADER_LINES = 200
+
+TARGET_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', TIMESTAMP_FORMAT)
+
+
+class BinlogScanner:
+    """
+    Recorre las cabeceras de eventos de un binlog mientras se transmite
+
+    Solo conserva los bytes de una cabecera incompleta entre bloques, por lo
+    que no agrega lecturas ni memoria al archivado.
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self.next_event = len(BINLOG_MAGIC)
+        self.pending = b''
+        self.valid = None
+        self.events = 0
+        self.first_event = None
+        self.last_event = None
+
+    def feed(self, data):
+        buffer = self.pending + data if self.pending else data
+        buffer_start = self.offset - len(self.pending)
+        self.offset += len(data)
+
+        if self.valid is None:
+            if len(buffer) < len(BINLOG_MAGIC):
+                self.pending = buffer
+                return
+            self.valid = buffer[:len(BINLOG_MAGIC)] == BINLOG_MAGIC
+        if not self.valid:
+            self.pending = b''
+            return
+
+        while True:
+            position = self.next_event - buffer_start
+            if position + EVENT_HEADER.size > len(buffer):
+                self.pending = buffer[position:] if position < len(buffer) else b''
+                return
+            timestamp, _, _, size, _, _ = EVENT_HEADER.unpack_from(buffer, position)
+            if size < EVENT_HEADER.size:
+                # Binlog cifrado o dañado: no se pueden leer los tiempos
+                self.valid = False
+                self.pending = b''
+                return
+            if timestamp:
+                if self.first_event is None:
+                    self.first_event = timestamp
+                self.last_event = max(self.last_event or 0, timestamp)
+            self.events += 1
+            self.next_event += size
+
+
+def binlog_number(name):
+    """('mysql-bin', 42) para 'mysql-bin.000042'"""
+    base, _, number = name.rpartition('.')
+    return base, int(number) if number.isdigit() else None
+
+
+def plan_replay(binlogs, start_file, backup_epoch, target_epoch):
+    """
+    Selecciona los binlogs a aplicar sobre un respaldo
+
+    Args:
+        binlogs: Binlogs archivados en orden cronologico (catalogo)
+        start_file: Binlog de la posicion registrada en el dump
+        backup_epoch: Inicio del respaldo completo
+        target_epoch: Instante hasta el que se recupera
+
+    Returns:
+        Lista de binlogs desde el de la posicion del dump
+
+    Raises:
+        ValueError si falta el binlog inicial o hay huecos en la secuencia
+    """
+    candidates = [index for index, binlog in enumerate(binlogs)
+                  if binlog['name'] == start_file
+                  and (binlog['first_event'] is None or binlog['first_event'] <= backup_epoch)]
+    if not candidates:
+        raise ValueError(f"El binlog {start_file} (posición del respaldo) no está archivado")
+
+    start = candidates[-1]
+    plan = [binlogs[start]]
+    for binlog in binlogs[start + 1:]:
+        if binlog['first_event'] is not None and binlog['first_event'] > target_epoch:
+            break
+        base, number = binlog_number(binlog['name'])
+        previous_base, previous_number = binlog_number(plan[-1]['name'])
+        # Un cambio de nombre base (ej. al activar --log-bin) inicia otra secuencia
+        if base == previous_base and None not in (number, previous_number) and number != previous_number + 1:
+            raise ValueError(f"Falta el binlog siguiente a {plan[-1]['name']} (el próximo archivado es "
+                             f"{binlog['name']})")
+        plan.append(binlog)
+    return plan
+
+
+def parse_target_time(value):
+    """Convierte 'YYYY-MM-DD HH:MM[:SS]' (hora local) en datetime"""
+    value = value.strip()
+    for fmt in TARGET_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Fecha inválida: {value} (formato: YYYY-MM-DD HH:MM:SS)")
+
+
+def backup_epoch(timestamp):
+    """Epoch del inicio de un respaldo a partir del nombre de su directorio"""
+    return datetime.strptime(timestamp, TIMESTAMP_FORMAT).timestamp()
+
+
+def dump_position(backup_dir):
+    """
+    Posicion del binlog registrada en el dump de un respaldo
+
+    El volcado paralelo la guarda en index.json, el respaldo fisico en
+    mysql_physical.json; mysqldump --source-data=2 la deja comentada en la
+    cabecera del .sql.
+
+    Returns:
+        Tupla (archivo, posicion) o None si el respaldo no la registra
+    """
+    index_path = os.path.join(backup_dir, PARALLEL_DIR, INDEX_FILE)
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            binlog = json.load(f).get('binlog')
+        return (binlog['file'], int(binlog['position'])) if binlog else None
+
+    metadata = read_metadata(backup_dir)
+    if metadata is not None:
+        binlog = metadata.get('binlog')
+        return (binlog['file'], int(binlog['position'])) if binlog else None
+
+    for name in sorted(os.listdir(backup_dir)):
+        if '.sql' not in name or name.endswith(('.sha256', '.part', '.json')):
+            continue
+        path = os.path.join(backup_dir, name)
+        codec = detect_codec(path)
+        with open(path, 'rb') as source:
+            reader = subprocess.Popen(codec.decompress_command(1), stdin=source, stdout=subprocess.PIPE,
+                                      stderr=subprocess.DEVNULL) if codec else None
+            stream = reader.stdout if reader else source
+            try:
+                for _, line in zip(range(DUMP_HEADER_LINES), stream):
+                    match = DUMP_POSITION.search(line.decode('utf-8', 'replace'))
+                    if match:
+                        return match.group(1), int(match.group(2))
+            finally:
+                if reader:
+                    reader.kill()
+                    reader.wait()
+    return None
+
+
+class BinlogArchiver:
+    """Archiva los binlogs de un ambiente y los aplica en una recuperacion"""
+
+    def __init__(self, container, password, backups_path, environment, codec,
+                 level=None, threads=None, throttle=None, log_file=None):
+        self.container = container
+        self.password = password
+        self.backups_path = backups_path
+        self.environment = environment
+        self.codec = codec
+        self.level = level
+        self.threads = threads
+        self.throttle = throttle
+        self.log_file = log_file
+        self.archive_dir = os.path.join(backups_path, environment, BINLOG_DIR)
+        self.catalog = BackupCatalog(backups_path)
+
+    @classmethod
+    def from_settings(cls, settings, environment, log_file=None):
+        prefix = 'PROD' if environment == 'production' else 'TEST'
+        return cls(
+            f"mysql_{environment}",
+            settings.get_env_var(f'{prefix}_DB_ROOT_PASS', ''),
+            settings.BACKUPS_PATH,
+            environment,
+            resolve_codec(settings.BACKUP_COMPRESSION),
+            level=settings.BACKUP_COMPRESSION_LEVEL,
+            threads=settings.BACKUP_COMPRESSION_THREADS,
+            throttle=Throttle.from_settings(settings),
+            log_file=log_file
+        )
+
+    def _env(self):
+        env = os.environ.copy()
+        env['MYSQL_PWD'] = self.password
+        return env
+
+    def _query(self, sql):
+        """Ejecuta una sentencia como root y devuelve las filas"""
+        result = subprocess.run(
+            ['docker', 'exec', '-e', 'MYSQL_PWD', self.container, 'mysql', '-uroot',
+             '--batch', '--skip-column-names', '-e', sql],
+            capture_output=True, text=True, env=self._env()
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"Error en MySQL ({sql}): {result.stderr.strip()}")
+        return [line.split('\t') for line in result.stdout.splitlines() if line]
+
+    def server_binlogs(self):
+        """
+        Binlogs del servidor
+
+        Returns:
+            Tupla (directorio en el contenedor, [(nombre, tamaño)]); el ultimo es el activo
+        """
+        basename = self._query("SELECT @@log_bin_basename")
+        if not basename or basename[0][0] == 'NULL':
+            raise RuntimeError(f"{self.container} no tiene binlogs activos (regenera docker-compose.yml)")
+        logs = [(row[0], int(row[1])) for row in self._query("SHOW BINARY LOGS")]
+        return os.path.dirname(basename[0][0]), logs
+
+    def _read_state(self):
+        try:
+            with open(os.path.join(self.archive_dir, STATE_FILE)) as f:
+                return tuple(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def _write_state(self, active):
+        with open(os.path.join(self.archive_dir, STATE_FILE), 'w') as f:
+            json.dump(list(active), f)
+
+    def archive(self, flush=True):
+        """
+        Rota el binlog activo y archiva los binlogs cerrados pendientes
+
+        Solo se rota si el binlog activo cambio desde la ultima rotacion, para
+        no generar un archivo vacio en cada ejecucion del cron.
+
+        Returns:
+            Lista de binlogs archivados o None si otro archivado esta en curso
+        """
+        os.makedirs(self.archive_dir, exist_ok=True)
+        with open(os.path.join(self.archive_dir, LOCK_FILE), 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            try:
+                directory, logs = self.server_binlogs()
+                if flush and logs and tuple(logs[-1]) != self._read_state():
+                    self._query("FLUSH BINARY LOGS")
+                    directory, logs = self.server_binlogs()
+                    self._write_state(logs[-1])
+
+                archived = {(b['name'], b['size_bytes']) for b in self.catalog.list_binlogs(self.environment)}
+                return [self._archive_file(directory, name, size)
+                        for name, size in logs[:-1] if (name, size) not in archived]
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _archive_file(self, directory, name, size):
+        """Transmite un binlog cerrado al compresor leyendo sus tiempos en el camino"""
+        scanner = BinlogScanner()
+        output_file = os.path.join(self.archive_dir, f"{name}{self.codec.extension}")
+        pipeline = StreamPipeline(
+            ['docker', 'exec', self.container, 'cat', f"{directory}/{name}"],
+            self.codec, output_file,
+            level=self.level, threads=self.threads, log_file=self.log_file,
+            throttle=self.throttle, observer=scanner.feed
+        )
+        pipeline.run()
+        if scanner.offset != size:
+            os.remove(output_file)
+            raise RuntimeError(f"{name}: se leyeron {scanner.offset} de {size} bytes")
+
+        # El prefijo con la fecha del primer evento evita choques si el servidor reinicia la numeracion
+        started = scanner.first_event or time.time()
+        file = f"{datetime.fromtimestamp(started).strftime(TIMESTAMP_FORMAT)}_{name}{self.codec.extension}"
+        os.replace(output_file, os.path.join(self.archive_dir, file))
+
+        binlog = {
+            'file': file,
+            'name': name,
+            'size_bytes': size,
+            'compressed_bytes': os.path.getsize(os.path.join(self.archive_dir, file)),
+            'sha256': pipeline.sha256,
+            'first_event': scanner.first_event,
+            'last_event': scanner.last_event,
+        }
+        self.catalog.record_binlog(self.environment, binlog)
+        return binlog
+
+    def prune(self):
+        """
+        Elimina los binlogs anteriores al respaldo valido mas antiguo
+
+        Un binlog se conserva mientras el siguiente empiece despues de ese
+        respaldo, porque puede contener la posicion registrada en su dump.
+
+        Returns:
+            Lista de binlogs eliminados
+        """
+        backups = [b for b in self.catalog.list_backups(self.environment) if b['status'] not in UNUSABLE_STATUS]
+        if not backups:
+            return []
+        oldest = min(backup_epoch(b['timestamp']) for b in backups)
+
+        binlogs = self.catalog.list_binlogs(self.environment)
+        removed = []
+        for binlog, following in zip(binlogs, binlogs[1:]):
+            if following['first_event'] is None or following['first_event'] > oldest:
+                break
+            path = os.path.join(self.archive_dir, binlog['file'])
+            if os.path.exists(path):
+                os.remove(path)
+            self.catalog.remove_binlog(self.environment, binlog['file'])
+            removed.append(binlog)
+        return removed
+
+    def _docker_sh(self, script, *args, stdin=None):
+        command = ['docker', 'exec'] + (['-i'] if stdin is not None else []) + \
+            ['-e', 'MYSQL_PWD', '-e', 'TZ=UTC', self.container, 'bash', '-o', 'pipefail', '-c', script] + list(args)
+        stderr = open(self.log_file, 'ab') if self.log_file else subprocess.DEVNULL
+        try:
+            process = subprocess.Popen(command, stdin=stdin, stderr=stderr, env=self._env())
+            if stdin is not None:
+                # El productor recibe SIGPIPE si docker termina antes
+                stdin.close()
+            return process.wait()
+        finally:
+            if stderr is not subprocess.DEVNULL:
+                stderr.close()
+
+    def _copy_to_container(self, binlog, target):
+        """Descomprime un binlog archivado directamente dentro del contenedor"""
+        path = os.path.join(self.archive_dir, binlog['file'])
+        codec = detect_codec(path)
+        with open(path, 'rb') as source:
+            if codec is None:
+                return self._docker_sh('cat > "$0"', target, stdin=source)
+            reader = subprocess.Popen(codec.decompress_command(self.threads), stdin=source,
+                                      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            code = self._docker_sh('cat > "$0"', target, stdin=reader.stdout)
+            return code or reader.wait()
+
+    def replay(self, backup_timestamp, target, database):
+        """
+        Aplica los binlogs archivados sobre un respaldo ya restaurado
+
+        Args:
+            backup_timestamp: Respaldo completo restaurado
+            target: datetime (hora local) hasta el que se recupera
+            database: Base de datos de Moodle (solo se aplican sus cambios)
+
+        Returns:
+            Dict con binlogs aplicados, posicion inicial y ultimo evento disponible
+        """
+        backup_dir = os.path.join(self.backups_path, self.environment, backup_timestamp)
+        position = dump_position(backup_dir)
+        if position is None:
+            raise RuntimeError(f"El respaldo {backup_timestamp} no registra la posición del binlog "
+                               f"(se creó sin BACKUP_BINLOG_ENABLED)")
+
+        target_epoch = target.timestamp()
+        plan = plan_replay(self.catalog.list_binlogs(self.environment), position[0],
+                           backup_epoch(backup_timestamp), target_epoch)
+        # mysqlbinlog interpreta --stop-datetime en su zona horaria (TZ=UTC)
+        stop = datetime.fromtimestamp(target_epoch, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+        if self._docker_sh('rm -rf "$0" && mkdir -p "$0"', REPLAY_DIR) != 0:
+            raise RuntimeError(f"No se pudo preparar {REPLAY_DIR} en {self.container}")
+        try:
+            for number, binlog in enumerate(plan):
+                # El prefijo mantiene el orden de aplicacion en el glob
+                if self._copy_to_container(binlog, f"{REPLAY_DIR}/{number:06d}-{binlog['name']}") != 0:
+                    raise RuntimeError(f"No se pudo copiar {binlog['file']} al contenedor")
+            code = self._docker_sh(
+                'mysqlbinlog --skip-gtids --database="$1" --start-position="$2" --stop-datetime="$3" "$0"/* '
+                '| mysql -uroot',
+                REPLAY_DIR, database, str(position[1]), stop)
+            if code != 0:
+                raise RuntimeError(f"mysqlbinlog/mysql terminó con código {code}")
+        finally:
+            self._docker_sh('rm -rf "$0"', REPLAY_DIR)
+
+        last_event = max((b['last_event'] or 0) for b in plan)
+        return {
+            'binlogs': len(plan),
+            'start': f"{position[0]}:{position[1]}",
+            'last_event': datetime.fromtimestamp(last_event) if last_event else None,
+            'complete': last_event >= target_epoch,
+        }
+
+
+def main(argv):
+    usage = (
+        "Uso:\n"
+        "  binlog.py archive <ambiente>              (rota, archiva y depura; usado por cron)\n"
+        "  binlog.py list <ambiente>\n"
+        "  binlog.py position <directorio_backup>\n"
+        "La configuracion se lee del .env de BASE_PATH"
+    )
+    command = argv[1] if len(argv) > 1 else None
+    if command == 'position' and len(argv) >= 3:
+        position = dump_position(argv[2])
+        if position is None:
+            print("El respaldo no registra la posicion del binlog", file=sys.stderr)
+            return 1
+        print(f"{position[0]}:{position[1]}")
+        return 0
+    if command not in ('archive', 'list') or len(argv) < 3:
+        print(usage, file=sys.stderr)
+        return 1
+
+    from config.settings import Settings
+    settings = Settings()
+    settings.load_env_file()
+    archiver = BinlogArchiver.from_settings(settings, argv[2])
+    try:
+        if command == 'list':
+            for binlog in archiver.catalog.list_binlogs(argv[2]):
+                first = datetime.fromtimestamp(binlog['first_event']) if binlog['first_event'] else '?'
+                last = datetime.fromtimestamp(binlog['last_event']) if binlog['last_event'] else '?'
+                print(f"{binlog['file']}  {binlog['size_bytes']} bytes  {first} -> {last}")
+            return 0
+
+        archived = archiver.archive()
+        if archived is None:
+            print("Otro archivado de binlogs está en curso")
+            return 0
+        removed = archiver.prune()
+        print(f"Binlogs archivados: {len(archived)} "
+              f"({sum(b['size_bytes'] for b in archived)} bytes), depurados: {len(removed)}")
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Backup Catalog Module
+Indice persistente (SQLite) de los respaldos en BACKUPS_PATH
+
+Evita recorrer los directorios con du en cada listado: el motor de respaldos
+registra cada respaldo al terminar y el catalogo se puede reconstruir con
+un solo recorrido usando os.scandir.
+Solo usa la biblioteca estandar para poder ejecutarse desde backup.sh.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import sys
+from datetime import datetime
+from pathlib import Path
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backup.integrity import read_checksums
+
+
+CATALOG_FILE = 'catalog.db'
+ENVIRONMENTS = ('testing', 'production')
+
+# Formato de los directorios de respaldo: 2024-01-15_10-30-00
+TIMESTAMP_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}$')
+
+# Nivel de un respaldo en almacenamiento frio cuyo disco no esta montado
+TIER_UNAVAILABLE = 'unavailable'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    environment TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    path TEXT NOT NULL,
+    status TEXT,
+    codec TEXT,
+    size_bytes INTEGER DEFAULT 0,
+    file_count INTEGER DEFAULT 0,
+    duration_seconds REAL,
+    recorded_at TEXT,
+    stats TEXT,
+    verify_status TEXT,
+    verified_at TEXT,
+    PRIMARY KEY (environment, timestamp)
+);
+CREATE TABLE IF NOT EXISTS backup_files (
+    environment TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size_bytes INTEGER DEFAULT 0,
+    sha256 TEXT,
+    PRIMARY KEY (environment, timestamp, name)
+);
+CREATE TABLE IF NOT EXISTS binlogs (
+    environment TEXT NOT NULL,
+    file TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size_bytes INTEGER DEFAULT 0,
+    compressed_bytes INTEGER DEFAULT 0,
+    sha256 TEXT,
+    first_event INTEGER,
+    last_event INTEGER,
+    archived_at TEXT,
+    PRIMARY KEY (environment, file)
+);
+"""
+
+# Columnas agregadas despues de la primera version del catalogo
+MIGRATIONS = {
+    'verify_status': "ALTER TABLE backups ADD COLUMN verify_status TEXT",
+    'verified_at': "ALTER TABLE backups ADD COLUMN verified_at TEXT",
+    'throughput_bps': "ALTER TABLE backups ADD COLUMN throughput_bps REAL",
+    'tier': "ALTER TABLE backups ADD COLUMN tier TEXT",
+}
+
+
+def scan_backup_dir(path):
+    """
+    Recorre un directorio de respaldo con os.scandir
+
+    Returns:
+        Lista de tuplas (ruta relativa, tamaño en bytes)
+    """
+    files = []
+    pending = [('', path)]
+    while pending:
+        prefix, directory = pending.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                name = f"{prefix}{entry.name}"
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append((f"{name}/", entry.path))
+                elif entry.is_file(follow_symlinks=False):
+                    files.append((name, entry.stat(follow_symlinks=False).st_size))
+    files.sort()
+    return files
+
+
+def _infer_status(path, stats):
+    """Obtiene el estado desde STATS.json o desde backup.log (backup.sh)"""
+    if stats.get('status'):
+        return stats['status']
+    log_file = os.path.join(path, 'backup.log')
+    try:
+        with open(log_file, errors='replace') as f:
+            for line in f:
+                if 'Respaldo completado con estado:' in line:
+                    return line.rsplit(':', 1)[1].strip()
+    except OSError:
+        pass
+    if os.path.exists(os.path.join(path, 'FIN_RESPALDO.log')):
+        return 'UNKNOWN'
+    return 'INCOMPLETE'
+
+
+def _infer_codec(files, stats):
+    if stats.get('codec'):
+        return stats['codec']
+    for name, _ in files:
+        if name.endswith('.zst'):
+            return 'zstd'
+        if name.endswith('.gz') and not name.endswith('.json.gz'):
+            return 'gzip'
+    return None
+
+
+class BackupCatalog:
+    """Catalogo SQLite de respaldos"""
+
+    def __init__(self, backups_path):
+        self.backups_path = backups_path
+        self.db_path = os.path.join(backups_path, CATALOG_FILE)
+
+    def _connect(self):
+        os.makedirs(self.backups_path, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(backups)")}
+        for column, statement in MIGRATIONS.items():
+            if column not in columns:
+                conn.execute(statement)
+        return conn
+
+    def record_backup(self, environment, timestamp, status=None, codec=None,
+                      duration_seconds=None, stats=None, checksums=None):
+        """
+        Registra (o actualiza) un respaldo en el catalogo
+
+        Args:
+            environment: 'testing' o 'production'
+            timestamp: Nombre del directorio del respaldo
+            status: SUCCESS / FAILED (se infiere de los archivos si es None)
+            codec: Codec de compresion (se infiere si es None)
+            duration_seconds: Duracion total del respaldo
+            stats: Dict con estadisticas del motor
+            checksums: Dict {archivo: sha256} (se lee de SHA256SUMS si es None)
+        """
+        path = os.path.join(self.backups_path, environment, timestamp)
+        # Los respaldos en almacenamiento frio son un enlace al directorio real (ver tiering.py)
+        tier = 'cold' if os.path.islink(path) else 'hot'
+        path = os.path.realpath(path) if tier == 'cold' else path
+        files = scan_backup_dir(path)
+        stats = stats if stats is not None else self._read_stats(path)
+        checksums = checksums if checksums is not None else read_checksums(path)
+        status = status or _infer_status(path, stats)
+        codec = codec or _infer_codec(files, stats)
+        if duration_seconds is None:
+            duration_seconds = stats.get('seconds')
+        size_bytes = sum(size for _, size in files)
+        # Tasa efectiva de escritura (permite ajustar BACKUP_RATE_LIMIT_MB)
+        throughput = size_bytes / duration_seconds if duration_seconds else None
+
+        with self._connect() as conn:
+            # La verificacion registrada (verify_status/verified_at) se conserva
+            conn.execute(
+                "INSERT INTO backups (environment, timestamp, path, status, codec, size_bytes, "
+                "file_count, duration_seconds, recorded_at, stats, throughput_bps, tier) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (environment, timestamp) DO UPDATE SET path = excluded.path, "
+                "status = excluded.status, codec = excluded.codec, size_bytes = excluded.size_bytes, "
+                "file_count = excluded.file_count, duration_seconds = excluded.duration_seconds, "
+                "recorded_at = excluded.recorded_at, stats = excluded.stats, "
+                "throughput_bps = excluded.throughput_bps, tier = excluded.tier",
+                (environment, timestamp, path, status, codec, size_bytes, len(files), duration_seconds,
+                 datetime.now().isoformat(timespec='seconds'), json.dumps(stats), throughput, tier)
+            )
+            conn.execute("DELETE FROM backup_files WHERE environment = ? AND timestamp = ?",
+                         (environment, timestamp))
+            conn.executemany(
+                "INSERT INTO backup_files (environment, timestamp, name, size_bytes, sha256) VALUES (?, ?, ?, ?, ?)",
+                [(environment, timestamp, name, size, checksums.get(name)) for name, size in files]
+            )
+        conn.close()
+
+    def _read_stats(self, path):
+        try:
+            with open(os.path.join(path, 'STATS.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def set_verification(self, environment, timestamp, status):
+        """
+        Guarda el resultado de la ultima verificacion de integridad
+
+        Args:
+            status: 'OK' o 'FAILED'
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE backups SET verify_status = ?, verified_at = ? WHERE environment = ? AND timestamp = ?",
+                (status, datetime.now().isoformat(timespec='seconds'), environment, timestamp))
+        conn.close()
+
+    def remove_backup(self, environment, timestamp):
+        """Elimina un respaldo del catalogo"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM backups WHERE environment = ? AND timestamp = ?", (environment, timestamp))
+            conn.execute("DELETE FROM backup_files WHERE environment = ? AND timestamp = ?",
+                         (environment, timestamp))
+        conn.close()
+
+    def record_binlog(self, environment, binlog):
+        """
+        Registra un binlog archivado
+
+        Args:
+            binlog: Dict con file (archivo en binlogs/), name (nombre en el servidor),
+                    size_bytes, compressed_bytes, sha256, first_event y last_event
+                    (epoch del primer y ultimo evento)
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO binlogs (environment, file, name, size_bytes, compressed_bytes, "
+                "sha256, first_event, last_event, archived_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (environment, binlog['file'], binlog['name'], binlog['size_bytes'], binlog['compressed_bytes'],
+                 binlog['sha256'], binlog['first_event'], binlog['last_event'],
+                 datetime.now().isoformat(timespec='seconds'))
+            )
+        conn.close()
+
+    def list_binlogs(self, environment):
+        """Binlogs archivados de un ambiente en orden cronologico"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM binlogs WHERE environment = ? ORDER BY first_event, name", (environment,)
+            ).fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+
+    def remove_binlog(self, environment, file):
+        """Elimina un binlog archivado del catalogo"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM binlogs WHERE environment = ? AND file = ?", (environment, file))
+        conn.close()
+
+    def list_backups(self, environment):
+        """
+        Lista los respaldos de un ambiente (mas recientes primero)
+        Registra los directorios nuevos y descarta los que ya no existen
+
+        Returns:
+            Lista de dicts con los datos de cada respaldo
+        """
+        env_dir = os.path.join(self.backups_path, environment)
+        on_disk = set()
+        if os.path.isdir(env_dir):
+            # Un enlace al almacenamiento frio se conserva aunque su disco no este montado
+            on_disk = {name for name in os.listdir(env_dir)
+                       if TIMESTAMP_PATTERN.match(name) and (os.path.isdir(os.path.join(env_dir, name))
+                                                             or os.path.islink(os.path.join(env_dir, name)))}
+
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM backups WHERE environment = ? ORDER BY timestamp DESC", (environment,)
+            ).fetchall()
+        conn.close()
+
+        known = {row['timestamp'] for row in rows}
+        for timestamp in on_disk - known:
+            if os.path.isdir(os.path.join(env_dir, timestamp)):
+                self.record_backup(environment, timestamp)
+        for timestamp in known - on_disk:
+            self.remove_backup(environment, timestamp)
+
+        if on_disk != known:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT * FROM backups WHERE environment = ? ORDER BY timestamp DESC", (environment,)
+                ).fetchall()
+            conn.close()
+
+        return [self._row_to_dict(row) for row in rows]
+
+    def get_backup(self, environment, timestamp):
+        """
+        Obtiene un respaldo con su lista de archivos
+
+        Returns:
+            Dict con los datos del respaldo o None si no esta en el catalogo
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM backups WHERE environment = ? AND timestamp = ?",
+                               (environment, timestamp)).fetchone()
+            files = conn.execute(
+                "SELECT name, size_bytes, sha256 FROM backup_files WHERE environment = ? AND timestamp = ? "
+                "ORDER BY name", (environment, timestamp)).fetchall()
+        conn.close()
+
+        if row is None:
+            return None
+        backup = self._row_to_dict(row)
+        backup['files'] = [dict(f) for f in files]
+        return backup
+
+    def _row_to_dict(self, row):
+        backup = dict(row)
+        backup['stats'] = json.loads(backup['stats']) if backup.get('stats') else {}
+        return backup
+
+    def rebuild(self):
+        """
+        Reconstruye el catalogo completo recorriendo BACKUPS_PATH
+
+        Actualiza cada respaldo sin perder su verificacion y elimina los que
+        ya no existen. Un enlace al almacenamiento frio cuyo disco no esta
+        montado conserva su fila, marcada como TIER_UNAVAILABLE.
+
+        Returns:
+            Numero de respaldos registrados
+        """
+        found = set()
+        unavailable = []
+        for environment in ENVIRONMENTS:
+            env_dir = os.path.join(self.backups_path, environment)
+            if not os.path.isdir(env_dir):
+                continue
+            with os.scandir(env_dir) as entries:
+                for entry in entries:
+                    if not TIMESTAMP_PATTERN.match(entry.name):
+                        continue
+                    if entry.is_dir():
+                        self.record_backup(environment, entry.name)
+                    elif entry.is_symlink():
+                        unavailable.append((TIER_UNAVAILABLE, environment, entry.name))
+                    else:
+                        continue
+                    found.add((environment, entry.name))
+
+        with self._connect() as conn:
+            conn.executemany("UPDATE backups SET tier = ? WHERE environment = ? AND timestamp = ?", unavailable)
+            stale = [(row['environment'], row['timestamp'])
+                     for row in conn.execute("SELECT environment, timestamp FROM backups")
+                     if (row['environment'], row['timestamp']) not in found]
+            conn.executemany("DELETE FROM backups WHERE environment = ? AND timestamp = ?", stale)
+            conn.execute("DELETE FROM backup_files WHERE NOT EXISTS (SELECT 1 FROM backups b "
+                         "WHERE b.environment = backup_files.environment AND b.timestamp = backup_files.timestamp)")
+            count = conn.execute("SELECT COUNT(*) FROM backups").fetchone()[0]
+        conn.close()
+        return count
+
+
+def main(argv):
+    usage = (
+        "Uso:\n"
+        "  catalog.py record <directorio_backups> <ambiente> <timestamp> [segundos]\n"
+        "  catalog.py rebuild <directorio_backups>"
+    )
+    if len(argv) >= 5 and argv[1] == 'record':
+        duration = float(argv[5]) if len(argv) > 5 else None
+        BackupCatalog(argv[2]).record_backup(argv[3], argv[4], duration_seconds=duration)
+        return 0
+    if len(argv) >= 3 and argv[1] == 'rebuild':
+        count = BackupCatalog(argv[2]).rebuild()
+        print(f"Catálogo reconstruido: {count} respaldos")
+        return 0
+    print(usage, file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
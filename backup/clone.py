@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Environment Clone Module
+Clona un ambiente en otro (production -> testing) sin archivos intermedios
+
+Refrescar testing con un backup de produccion escribe el respaldo completo
+en disco y lo vuelve a leer al restaurarlo. Aqui mysqldump del origen se
+carga directamente en el MySQL del destino y el tar del volumen moodledata
+del origen se extrae en el volumen destino a medida que se lee, por la API
+de Docker (ver volume.py). Ambas etapas corren al mismo tiempo.
+
+Al terminar se corrigen las URLs: $CFG->wwwroot del config.php del destino
+y las referencias a la URL del origen guardadas en la base de datos
+(herramienta tool_replace de Moodle), y se purgan las caches.
+Solo usa la biblioteca estandar.
+"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backup.progress import count_rows
+from backup.volume import TarCounter, VolumeStream
+
+CHUNK_SIZE = 1024 * 1024
+
+# Ruta de Moodle dentro del contenedor web (ver docker/dockerfile_generator.py)
+MOODLE_ROOT = '/var/www/html'
+MOODLE_USER = 'www-data'
+
+
+def env_prefix(environment):
+    return 'PROD' if environment == 'production' else 'TEST'
+
+
+class MeteredReader:
+    """Lector que entrega cada bloque leido a un observador (progreso de put_archive)"""
+
+    def __init__(self, source, observer=None):
+        self.source = source
+        self.observer = observer
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        if data and self.observer is not None:
+            self.observer(data)
+        return data
+
+
+class EnvironmentClone:
+    """Copia base de datos y moodledata de un ambiente a otro en streaming"""
+
+    # Colores para output
+    RED = '\033[0;31m'
+    GREEN = '\033[0;32m'
+    YELLOW = '\033[1;33m'
+    NC = '\033[0m'
+
+    def __init__(self, settings, source='production', target='testing', progress=None):
+        if source == target:
+            raise ValueError("El ambiente de origen y el de destino deben ser distintos")
+        if target == 'production':
+            raise ValueError("No se clona sobre production: restaure un backup en su lugar")
+        self.settings = settings
+        self.source = source
+        self.target = target
+        self.excludes = settings.BACKUP_MOODLEDATA_EXCLUDE
+        self.log_file = os.path.join(settings.LOGS_PATH, f"clone_{target}.log")
+        # ProgressReporter de la operacion (ver BackupManager.clone_environment)
+        self.progress = progress
+
+    # ------------------------------------------------------------------
+    # Funciones auxiliares
+    # ------------------------------------------------------------------
+
+    def _log(self, message, tag='[INFO]', color=''):
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        reset = self.NC if color else ''
+        print(f"{timestamp} - {color}{tag}{reset} {message}")
+        try:
+            with open(self.log_file, 'a') as f:
+                f.write(f"{timestamp} - {tag} {message}\n")
+        except OSError:
+            pass
+
+    def log_info(self, message):
+        self._log(message)
+
+    def log_success(self, message):
+        self._log(message, '[OK]', self.GREEN)
+
+    def log_warning(self, message):
+        self._log(message, '[WARNING]', self.YELLOW)
+
+    def log_error(self, message):
+        self._log(message, '[ERROR]', self.RED)
+
+    def _env(self, environment, key, default=''):
+        return self.settings.get_env_var(f"{env_prefix(environment)}_{key}", default)
+
+    def _url(self, environment):
+        return str(self._env(environment, 'URL')).strip("'\"").rstrip('/')
+
+    def _container_running(self, name):
+        result = subprocess.run(['docker', 'ps', '--format', '{{.Names}}'], capture_output=True, text=True)
+        return result.returncode == 0 and name in result.stdout.split()
+
+    def _volume_exists(self, name):
+        result = subprocess.run(['docker', 'volume', 'inspect', name], capture_output=True, text=True)
+        return result.returncode == 0
+
+    def _moodle(self, *args):
+        """Ejecuta un comando en el contenedor web del destino como www-data"""
+        with open(self.log_file, 'a') as log:
+            return subprocess.run(['docker', 'exec', '-u', MOODLE_USER, f"moodle_{self.target}"] + list(args),
+                                  stdout=log, stderr=log).returncode
+
+    def _progress_stage(self, name):
+        """Medidor de progreso de la etapa (None sin ProgressReporter)"""
+        return self.progress.stage(name) if self.progress is not None else None
+
+    def _tracked(self, name, function):
+        """Ejecuta una etapa registrando su inicio y fin en el progreso"""
+        self._progress_stage(name)
+        ok = False
+        try:
+            ok = function()
+            return ok
+        finally:
+            if self.progress is not None:
+                self.progress.end_stage(name, ok)
+
+    # ------------------------------------------------------------------
+    # Etapas
+    # ------------------------------------------------------------------
+
+    def database_commands(self):
+        """
+        Comandos de volcado (origen) y carga (destino) de la base de datos
+
+        Returns:
+            Tupla ((comando, entorno) del volcado, (comando, entorno) de la carga)
+        """
+        source_name = self._env(self.source, 'DB_NAME', 'moodle')
+        target_name = self._env(self.target, 'DB_NAME', 'moodle')
+
+        # MYSQL_PWD se hereda del entorno para no exponer las contraseñas en argv
+        dump_env = os.environ.copy()
+        dump_env['MYSQL_PWD'] = self._env(self.source, 'DB_PASS', 'moodle')
+        load_env = os.environ.copy()
+        load_env['MYSQL_PWD'] = self._env(self.target, 'DB_ROOT_PASS')
+
+        dump = [
+            'docker', 'exec', '-e', 'MYSQL_PWD', f"mysql_{self.source}", 'mysqldump',
+            f"-u{self._env(self.source, 'DB_USER', 'moodle')}",
+            '--single-transaction',
+            '--routines',
+            '--triggers',
+            '--events',
+            '--no-tablespaces',
+            source_name
+        ]
+        load = ['docker', 'exec', '-i', '-e', 'MYSQL_PWD', f"mysql_{self.target}", 'mysql', '-uroot', target_name]
+        return (dump, dump_env), (load, load_env)
+
+    def clone_database(self):
+        """Carga mysqldump del origen directamente en el MySQL del destino"""
+        for container in (f"mysql_{self.source}", f"mysql_{self.target}"):
+            if not self._container_running(container):
+                self.log_error(f"El contenedor MySQL ({container}) no está corriendo")
+                return False
+
+        self.log_info(f"Copiando base de datos de {self.source} a {self.target}")
+        (dump_cmd, dump_env), (load_cmd, load_env) = self.database_commands()
+        meter = self._progress_stage('database')
+        total = 0
+
+        with open(self.log_file, 'a') as log:
+            dump = subprocess.Popen(dump_cmd, stdout=subprocess.PIPE, stderr=log, env=dump_env)
+            load = subprocess.Popen(load_cmd, stdin=subprocess.PIPE, stderr=log, env=load_env)
+            try:
+                for chunk in iter(lambda: dump.stdout.read(CHUNK_SIZE), b''):
+                    load.stdin.write(chunk)
+                    total += len(chunk)
+                    if meter is not None:
+                        meter.add(len(chunk), rows=count_rows(chunk))
+                load.stdin.close()
+            except BrokenPipeError:
+                # mysql termino antes de tiempo: su codigo de salida indica el error
+                dump.kill()
+            finally:
+                dump.stdout.close()
+            dump_code = dump.wait()
+            load_code = load.wait()
+
+        if dump_code != 0:
+            self.log_error(f"Error al exportar la base de datos de {self.source} (código {dump_code})")
+            return False
+        if load_code != 0:
+            self.log_error(f"Error al cargar la base de datos en {self.target} (código {load_code})")
+            return False
+
+        self.log_success(f"Base de datos copiada ({total / 1048576:.1f} MB)")
+        return True
+
+    def clone_moodledata(self):
+        """Extrae en el volumen destino el tar del volumen origen mientras se lee"""
+        source_volume = f"moodledata_{self.source}"
+        target_volume = f"moodledata_{self.target}"
+        for volume in (source_volume, target_volume):
+            if not self._volume_exists(volume):
+                self.log_error(f"El volumen {volume} no existe")
+                return False
+
+        self.log_info(f"Copiando moodledata de {self.source} a {self.target}")
+        if self.excludes:
+            self.log_info(f"Directorios excluidos: {', '.join(self.excludes)}")
+
+        meter = self._progress_stage('moodledata')
+        counter = TarCounter()
+        observer = (lambda chunk: meter.add(len(chunk), files=counter.feed(chunk))) if meter else None
+        source = VolumeStream(source_volume)
+        target = VolumeStream(target_volume)
+        try:
+            target.clear()
+            export = source.export_process(self.excludes, self.log_file)
+            try:
+                target.import_tar(MeteredReader(export.stdout, observer))
+            except Exception:
+                export.kill()
+                raise
+            finally:
+                export.wait()
+                export.stdout.close()
+            if export.error is not None:
+                raise export.error
+            if self.excludes:
+                # Moodle espera encontrar cache, temp, ... aunque esten vacios
+                target.make_dirs(self.excludes)
+        except Exception as e:
+            self.log_error(f"Error al copiar moodledata: {e}")
+            return False
+
+        self.log_success("Moodledata copiado")
+        return True
+
+    def fix_urls(self):
+        """Apunta $CFG->wwwroot y las URLs guardadas en la base de datos al destino"""
+        source_url = self._url(self.source)
+        target_url = self._url(self.target)
+        if not target_url:
+            self.log_warning(f"{env_prefix(self.target)}_URL no está definida: no se corrigen las URLs")
+            return True
+
+        self.log_info(f"Ajustando URLs para {target_url}")
+        config = f"{MOODLE_ROOT}/config.php"
+        # Todas las asignaciones (config.php y el bloque SSL agregado al final) apuntan al destino
+        code = self._moodle('sed', '-i', '-E',
+                            f"s#^([[:space:]]*\\$CFG->wwwroot[[:space:]]*=).*#\\1 '{target_url}';#", config)
+        if code != 0:
+            self.log_error(f"No se pudo actualizar $CFG->wwwroot en {config}")
+            return False
+
+        if source_url and source_url != target_url:
+            code = self._moodle('php', f"{MOODLE_ROOT}/admin/tool/replace/cli/replace.php",
+                                f"--search={source_url}", f"--replace={target_url}", '--non-interactive')
+            if code != 0:
+                self.log_error(f"Error al reemplazar {source_url} por {target_url} en la base de datos")
+                return False
+
+        if self._moodle('php', f"{MOODLE_ROOT}/admin/cli/purge_caches.php") != 0:
+            self.log_warning("No se pudieron purgar las caches de Moodle")
+        self.log_success(f"URLs actualizadas: {source_url or '?'} -> {target_url}")
+        return True
+
+    def run_concurrent(self):
+        """
+        Copia base de datos y moodledata al mismo tiempo
+
+        Returns:
+            Tupla (resultado base de datos, resultado moodledata)
+        """
+        legs = {
+            'database': lambda: self._tracked('database', self.clone_database),
+            'moodledata': lambda: self._tracked('moodledata', self.clone_moodledata),
+        }
+        results = {}
+
+        def run_leg(name, function):
+            try:
+                results[name] = function()
+            except Exception as e:
+                self.log_error(f"Error inesperado en la etapa {name}: {e}")
+                results[name] = False
+
+        threads = [threading.Thread(target=run_leg, args=item, name=item[0]) for item in legs.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results['database'], results['moodledata']
+
+    def run(self):
+        """
+        Ejecuta el clonado completo
+
+        El contenedor web del destino se detiene mientras se copian los datos
+        y se vuelve a iniciar para corregir las URLs con el CLI de Moodle.
+
+        Returns:
+            True si todas las etapas terminaron correctamente
+        """
+        os.makedirs(os.path.dirname(self.log_file), exist_ok=True)
+        start = time.time()
+        web = f"moodle_{self.target}"
+        self.log_info("==========================================")
+        self.log_info(f"Clonado de {self.source} en {self.target}")
+        self.log_info("==========================================")
+
+        if subprocess.run(['docker', 'stop', web], capture_output=True).returncode == 0:
+            self.log_info(f"Contenedor {web} detenido")
+        else:
+            self.log_warning(f"No se pudo detener {web} (puede que no esté corriendo)")
+
+        db_ok, md_ok = self.run_concurrent()
+
+        if subprocess.run(['docker', 'start', web], capture_output=True).returncode != 0:
+            self.log_error(f"Error al iniciar el contenedor {web}")
+            return False
+
+        ok = db_ok and md_ok and self.fix_urls()
+        elapsed = int(time.time() - start)
+        if ok:
+            self.log_success(f"CLONADO COMPLETADO en {elapsed // 60}m {elapsed % 60}s")
+        else:
+            self.log_error(f"CLONADO CON ERRORES: {self.target} puede haber quedado incompleto "
+                           f"(restaure un backup o repita el clonado). Log: {self.log_file}")
+        return ok
+
+
+def main(argv):
+    usage = "Uso: clone.py [origen] [destino]    (por defecto production testing)"
+    if len(argv) > 3 or any(arg.startswith('-') for arg in argv[1:]):
+        print(usage, file=sys.stderr)
+        return 1
+
+    from backup.backup_manager import BackupManager
+    from config.settings import Settings
+
+    settings = Settings()
+    settings.load_env_file()
+    source = argv[1] if len(argv) > 1 else 'production'
+    target = argv[2] if len(argv) > 2 else 'testing'
+    try:
+        return 0 if BackupManager(settings).clone_environment(source, target) else 1
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,125 @@
+"""
+Compression Module
+Codecs de compresion usados por el motor de respaldos
+"""
+
+import os
+import shutil
+
+
+# Firmas (magic bytes) de cada formato
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+class Codec:
+    """Describe un compresor externo que trabaja sobre stdin/stdout"""
+
+    def __init__(self, name, extension, binary, default_level, thread_flag=None):
+        self.name = name
+        self.extension = extension
+        self.binary = binary
+        self.default_level = default_level
+        self.thread_flag = thread_flag
+
+    @property
+    def multithreaded(self):
+        return self.thread_flag is not None
+
+    def is_available(self):
+        """Indica si el binario del codec existe en el sistema"""
+        return shutil.which(self.binary) is not None
+
+    def compress_command(self, level=None, threads=None):
+        """
+        Comando que comprime stdin hacia stdout
+
+        Args:
+            level: Nivel de compresion (None usa el nivel por defecto del codec)
+            threads: Hilos a usar (0/None = todos los nucleos, ignorado por gzip)
+        """
+        level = level or self.default_level
+        return [self.binary, '-c', f'-{level}'] + self._thread_args(threads)
+
+    def decompress_command(self, threads=None):
+        """Comando que descomprime stdin hacia stdout"""
+        return [self.binary, '-d', '-c'] + self._thread_args(threads)
+
+    def _thread_args(self, threads):
+        """Argumentos de hilos ('--threads=N' va unido, '-p N' separado)"""
+        if not self.multithreaded:
+            return []
+        count = str(resolve_threads(threads))
+        if self.thread_flag.endswith('='):
+            return [self.thread_flag + count]
+        return [self.thread_flag, count]
+
+    def test_command(self):
+        """Comando que comprueba la integridad del stream leido de stdin"""
+        return [self.binary, '-t', '-q'] if self.name == 'zstd' else [self.binary, '-t']
+
+
+CODECS = {
+    'gzip': Codec('gzip', '.gz', 'gzip', 6),
+    'pigz': Codec('pigz', '.gz', 'pigz', 6, thread_flag='-p'),
+    'zstd': Codec('zstd', '.zst', 'zstd', 3, thread_flag='--threads='),
+}
+
+
+def resolve_threads(threads):
+    """Convierte 0/None en el numero de nucleos disponibles"""
+    try:
+        threads = int(threads or 0)
+    except (TypeError, ValueError):
+        threads = 0
+    if threads <= 0:
+        threads = os.cpu_count() or 1
+    return threads
+
+
+def get_codec(name):
+    """
+    Obtiene un codec por nombre
+
+    Args:
+        name: 'gzip', 'pigz' o 'zstd'
+
+    Returns:
+        Instancia de Codec
+    """
+    codec = CODECS.get((name or 'gzip').strip().lower())
+    if codec is None:
+        raise ValueError(f"Codec de compresion no soportado: {name}")
+    return codec
+
+
+def resolve_codec(name):
+    """
+    Obtiene el codec configurado, usando gzip si su binario no esta instalado
+    pigz produce archivos .gz compatibles, por lo que el fallback es transparente
+    """
+    codec = get_codec(name)
+    if not codec.is_available():
+        print(f"Advertencia: '{codec.binary}' no está instalado, se usará gzip")
+        return CODECS['gzip']
+    return codec
+
+
+def detect_codec(path):
+    """
+    Detecta el formato de compresion de un archivo por sus magic bytes
+
+    Args:
+        path: Ruta del archivo
+
+    Returns:
+        Codec para descomprimir (pigz si esta disponible para .gz) o None si no esta comprimido
+    """
+    with open(path, 'rb') as f:
+        header = f.read(4)
+
+    if header.startswith(ZSTD_MAGIC):
+        return CODECS['zstd']
+    if header.startswith(GZIP_MAGIC):
+        return CODECS['pigz'] if CODECS['pigz'].is_available() else CODECS['gzip']
+    return None
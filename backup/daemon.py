@@ -0,0 +1,532 @@
+#!/usr/bin/env python3
+"""
+Scheduler Daemon Module
+Servicio de respaldos programados, alternativa al crontab (BACKUP_SCHEDULER='daemon')
+
+Con cron cada ambiente tiene su propia linea y nada impide que los respaldos
+de testing y production, o un respaldo lento y el del siguiente horario,
+compitan por el mismo disco. El servicio guarda los horarios y una cola de
+trabajos en SQLite (BACKUPS_PATH/scheduler.db) y al ejecutarlos aplica:
+
+- un lock por ambiente (BACKUPS_PATH/.locks/<ambiente>.lock), que tambien
+  toma BackupManager.create_backup en los respaldos manuales;
+- un limite global de trabajos pesados simultaneos (BACKUP_SCHEDULER_MAX_JOBS);
+- un retraso aleatorio sobre el horario (BACKUP_SCHEDULER_JITTER segundos);
+- si el trabajo anterior de un horario sigue en cola o en curso, la nueva
+  ejecucion se registra como omitida en lugar de encolarse otra vez.
+
+El archivado de binlogs es un trabajo liviano: no cuenta para el limite ni
+toma el lock del ambiente (binlog.py tiene su propio lock). El paso al
+almacenamiento frio (tiering) corre con prioridad idle, por lo que tampoco
+cuenta para el limite, pero si toma el lock del ambiente.
+Solo usa la biblioteca estandar.
+"""
+
+import fcntl
+import os
+import random
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+SCHEDULER_FILE = 'scheduler.db'
+LOCK_DIR = '.locks'
+DAEMON_LOCK = 'scheduler.lock'
+SERVICE_NAME = 'moodle-backup-scheduler'
+
+# Segundos entre cada revision de horarios y trabajos
+POLL_INTERVAL = 15
+
+# Trabajos terminados que se conservan en el historial
+HISTORY_LIMIT = 500
+
+HEAVY_KINDS = ('backup',)
+ACTIVE_STATUS = ('queued', 'running')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS schedules (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    environment TEXT NOT NULL,
+    expression TEXT NOT NULL,
+    next_run REAL,
+    last_run REAL,
+    last_status TEXT,
+    last_duration REAL,
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    environment TEXT NOT NULL,
+    status TEXT NOT NULL,
+    scheduled_for REAL,
+    queued_at REAL,
+    started_at REAL,
+    finished_at REAL,
+    pid INTEGER,
+    returncode INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+"""
+
+# Rangos de los campos de una expresion cron: minuto hora dia mes dia_semana
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _parse_cron_field(field, low, high):
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+            if step < 1:
+                raise ValueError(f"Paso invalido en '{field}'")
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(value) for value in part.split('-', 1))
+        else:
+            start = int(part)
+            # '5/10' equivale a '5-max/10'
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"Valor fuera de rango en '{field}' ({low}-{high})")
+        values.update(range(start, end + 1, step))
+    return sorted(values)
+
+
+class CronExpression:
+    """Expresion cron de 5 campos (listas, rangos y pasos) con el calculo de la siguiente ejecucion"""
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"La expresion cron debe tener 5 campos: '{expression}'")
+        self.expression = expression
+        parsed = [_parse_cron_field(field, low, high) for field, (low, high) in zip(fields, CRON_FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        # En cron 0 y 7 son domingo; datetime.weekday() usa lunes=0
+        self.weekdays = sorted({(day - 1) % 7 for day in weekdays})
+        # Si dia y dia_semana estan restringidos basta con que coincida uno (como cron)
+        self.restrict_days = not fields[2].startswith('*')
+        self.restrict_weekdays = not fields[4].startswith('*')
+        self.any_day = self.restrict_days and self.restrict_weekdays
+
+    def _day_matches(self, day):
+        if day.month not in self.months:
+            return False
+        in_days = day.day in self.days
+        in_weekdays = day.weekday() in self.weekdays
+        if self.any_day:
+            return in_days or in_weekdays
+        return (in_days or not self.restrict_days) and (in_weekdays or not self.restrict_weekdays)
+
+    def next_after(self, after):
+        """
+        Primera ejecucion estrictamente posterior a 'after' (datetime local)
+
+        Returns:
+            datetime sin segundos
+        """
+        start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.date()
+        # Cuatro años cubren expresiones como '0 0 29 2 *'
+        for _ in range(4 * 366 + 1):
+            if self._day_matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = datetime(day.year, day.month, day.day, hour, minute)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"La expresion cron no tiene ejecuciones: '{self.expression}'")
+
+
+class EnvironmentLock:
+    """
+    Lock exclusivo (flock) de un ambiente para que dos respaldos no se solapen
+
+    El lock se libera solo si el proceso muere, asi que no quedan locks
+    huerfanos despues de una caida.
+    """
+
+    def __init__(self, backups_path, environment):
+        self.path = os.path.join(backups_path, LOCK_DIR, f"{environment}.lock")
+        self.handle = None
+
+    def acquire(self):
+        """
+        Intenta tomar el lock sin esperar
+
+        Returns:
+            True si se obtuvo el lock
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        handle = open(self.path, 'a+')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            handle.close()
+            return False
+        handle.seek(0)
+        handle.truncate()
+        handle.write(f"{os.getpid()}\n")
+        handle.flush()
+        self.handle = handle
+        return True
+
+    def release(self):
+        if self.handle is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+            self.handle.close()
+            self.handle = None
+
+    def is_locked(self):
+        """True si otro proceso tiene el lock"""
+        if self.handle is not None:
+            return True
+        if not self.acquire():
+            return True
+        self.release()
+        return False
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class JobQueue:
+    """Horarios y cola persistente de trabajos del servicio (SQLite)"""
+
+    def __init__(self, backups_path):
+        self.path = os.path.join(backups_path, SCHEDULER_FILE)
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.executescript(SCHEMA)
+        return conn
+
+    def set_schedule(self, job_id, kind, environment, expression, next_run):
+        """Crea o reemplaza un horario (conserva su ultima ejecucion)"""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO schedules (job_id, kind, environment, expression, next_run, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(job_id) DO UPDATE SET kind = excluded.kind, environment = excluded.environment, "
+                "expression = excluded.expression, next_run = excluded.next_run",
+                (job_id, kind, environment, expression, next_run, datetime.now().isoformat(timespec='seconds')))
+
+    def remove_schedules(self, environment):
+        """
+        Elimina los horarios de un ambiente y sus trabajos en cola
+
+        Returns:
+            Cantidad de horarios eliminados
+        """
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE environment = ? AND status = 'queued'", (environment,))
+            return conn.execute("DELETE FROM schedules WHERE environment = ?", (environment,)).rowcount
+
+    def list_schedules(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM schedules ORDER BY environment, kind").fetchall()
+        return [dict(row) for row in rows]
+
+    def set_next_run(self, job_id, next_run):
+        with self._connect() as conn:
+            conn.execute("UPDATE schedules SET next_run = ? WHERE job_id = ?", (next_run, job_id))
+
+    def enqueue(self, schedule, scheduled_for, status='queued'):
+        """Agrega un trabajo a la cola (o lo registra como omitido)"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (job_id, kind, environment, status, scheduled_for, queued_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (schedule['job_id'], schedule['kind'], schedule['environment'], status,
+                 scheduled_for, time.time()))
+            return cursor.lastrowid
+
+    def is_active(self, job_id):
+        """True si el horario tiene un trabajo en cola o en curso"""
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT 1 FROM jobs WHERE job_id = ? AND status IN ({','.join('?' * len(ACTIVE_STATUS))})",
+                (job_id, *ACTIVE_STATUS)).fetchone()
+        return row is not None
+
+    def jobs(self, status=None, limit=None):
+        """Trabajos en orden de llegada (los mas recientes al final)"""
+        query = "SELECT * FROM jobs"
+        params = []
+        if status:
+            statuses = (status,) if isinstance(status, str) else tuple(status)
+            query += f" WHERE status IN ({','.join('?' * len(statuses))})"
+            params.extend(statuses)
+        query += " ORDER BY id DESC"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        with self._connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def mark_running(self, job, pid):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'running', started_at = ?, pid = ? WHERE id = ?",
+                         (time.time(), pid, job['id']))
+
+    def mark_finished(self, job, status, returncode=None):
+        """Cierra un trabajo y actualiza la ultima ejecucion de su horario"""
+        finished = time.time()
+        started = job.get('started_at') or finished
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, finished_at = ?, returncode = ? WHERE id = ?",
+                         (status, finished, returncode, job['id']))
+            conn.execute("UPDATE schedules SET last_run = ?, last_status = ?, last_duration = ? WHERE job_id = ?",
+                         (started, status, round(finished - started, 1), job['job_id']))
+            conn.execute(
+                "DELETE FROM jobs WHERE status NOT IN ('queued', 'running') AND id NOT IN "
+                "(SELECT id FROM jobs ORDER BY id DESC LIMIT ?)", (HISTORY_LIMIT,))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SchedulerDaemon:
+    """
+    Bucle del servicio: encola los horarios vencidos y lanza los trabajos
+
+    Cada trabajo corre en un proceso hijo ('daemon.py run <tipo> <ambiente>'),
+    de modo que un respaldo en curso sigue aunque el servicio se reinicie.
+    """
+
+    def __init__(self, queue, backups_path, max_jobs=1, jitter=0, command=None, log_dir=None):
+        self.queue = queue
+        self.backups_path = backups_path
+        self.max_jobs = max(int(max_jobs), 1)
+        self.jitter = max(int(jitter), 0)
+        self.command = command or self.default_command
+        self.log_dir = log_dir
+        self.children = {}
+        self.running = False
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(JobQueue(settings.BACKUPS_PATH), settings.BACKUPS_PATH,
+                   max_jobs=settings.BACKUP_SCHEDULER_MAX_JOBS,
+                   jitter=settings.BACKUP_SCHEDULER_JITTER,
+                   log_dir=settings.LOGS_PATH)
+
+    @staticmethod
+    def default_command(job):
+        return [sys.executable, str(Path(__file__).resolve()), 'run', job['kind'], job['environment']]
+
+    def next_run(self, expression, after=None, kind='backup'):
+        """Proxima ejecucion (epoch) con el retraso aleatorio de los trabajos pesados"""
+        moment = CronExpression(expression).next_after(after or datetime.now()).timestamp()
+        if kind in HEAVY_KINDS and self.jitter:
+            moment += random.uniform(0, self.jitter)
+        return moment
+
+    def recover(self):
+        """Cierra los trabajos 'running' de una ejecucion anterior cuyo proceso ya no existe"""
+        for job in self.queue.jobs(status='running'):
+            if job['id'] in self.children:
+                continue
+            if not job['pid'] or not _pid_alive(job['pid']):
+                self.queue.mark_finished(job, 'interrupted')
+                print(f"Trabajo {job['job_id']} #{job['id']} interrumpido (el proceso ya no existe)")
+
+    def enqueue_due(self, now=None):
+        """
+        Encola los horarios vencidos; si el anterior sigue activo se omite
+
+        Returns:
+            Lista de (job_id, estado) encolados u omitidos
+        """
+        now = now or time.time()
+        events = []
+        for schedule in self.queue.list_schedules():
+            if schedule['next_run'] is None:
+                self.queue.set_next_run(schedule['job_id'],
+                                        self.next_run(schedule['expression'], kind=schedule['kind']))
+                continue
+            if schedule['next_run'] > now:
+                continue
+            status = 'skipped' if self.queue.is_active(schedule['job_id']) else 'queued'
+            self.queue.enqueue(schedule, schedule['next_run'], status)
+            if status == 'skipped':
+                print(f"{schedule['job_id']}: la ejecucion anterior sigue activa, se omite esta")
+            # Tras una caida larga se salta a la siguiente ejecucion futura, sin recuperar las perdidas
+            after = datetime.fromtimestamp(max(now, schedule['next_run']))
+            self.queue.set_next_run(schedule['job_id'],
+                                    self.next_run(schedule['expression'], after, schedule['kind']))
+            events.append((schedule['job_id'], status))
+        return events
+
+    def _spawn(self, job):
+        log = subprocess.DEVNULL
+        if self.log_dir:
+            os.makedirs(self.log_dir, exist_ok=True)
+            log = open(os.path.join(self.log_dir, f"scheduler_{job['environment']}.log"), 'a')
+        try:
+            process = subprocess.Popen(self.command(job), stdout=log, stderr=subprocess.STDOUT,
+                                       stdin=subprocess.DEVNULL, start_new_session=True)
+        finally:
+            if log is not subprocess.DEVNULL:
+                log.close()
+        self.children[job['id']] = (process, job)
+        self.queue.mark_running(job, process.pid)
+        job['started_at'] = time.time()
+        print(f"Iniciado {job['job_id']} #{job['id']} (pid {process.pid})")
+
+    def start_queued(self):
+        """
+        Lanza los trabajos en cola respetando el limite global y los locks por ambiente
+
+        Returns:
+            Lista de trabajos iniciados
+        """
+        heavy_running = sum(1 for job in self.queue.jobs(status='running') if job['kind'] in HEAVY_KINDS)
+        started = []
+        for job in self.queue.jobs(status='queued'):
+            if job['kind'] in HEAVY_KINDS:
+                if heavy_running >= self.max_jobs:
+                    continue
+                # Un respaldo manual del mismo ambiente tiene el lock: el trabajo espera
+                if EnvironmentLock(self.backups_path, job['environment']).is_locked():
+                    continue
+                heavy_running += 1
+            self._spawn(job)
+            started.append(job)
+        return started
+
+    def reap(self):
+        """Registra los trabajos hijos que terminaron"""
+        finished = []
+        for job_id, (process, job) in list(self.children.items()):
+            code = process.poll()
+            if code is None:
+                continue
+            del self.children[job_id]
+            self.queue.mark_finished(job, 'done' if code == 0 else 'failed', code)
+            print(f"Terminado {job['job_id']} #{job_id}: código {code}")
+            finished.append(job)
+        return finished
+
+    def tick(self, now=None):
+        self.reap()
+        self.recover()
+        self.enqueue_due(now)
+        self.start_queued()
+
+    def stop(self, *args):
+        self.running = False
+
+    def run(self, poll_interval=POLL_INTERVAL):
+        """
+        Ejecuta el servicio hasta recibir SIGTERM/SIGINT
+
+        Returns:
+            False si ya hay otra instancia del servicio en ejecucion
+        """
+        os.makedirs(os.path.join(self.backups_path, LOCK_DIR), exist_ok=True)
+        with open(os.path.join(self.backups_path, LOCK_DIR, DAEMON_LOCK), 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                print("Ya hay otra instancia del servicio de respaldos en ejecucion")
+                return False
+
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+            self.running = True
+            print(f"Servicio de respaldos iniciado (max. {self.max_jobs} trabajos pesados, "
+                  f"jitter {self.jitter}s)")
+            while self.running:
+                try:
+                    self.tick()
+                except sqlite3.Error as e:
+                    print(f"Error de la cola de trabajos: {e}")
+                deadline = time.monotonic() + poll_interval
+                while self.running and time.monotonic() < deadline:
+                    time.sleep(min(1, poll_interval))
+            # Los respaldos en curso continuan; se registran al reiniciar (recover)
+            print(f"Servicio detenido ({len(self.children)} trabajos en curso continúan)")
+        return True
+
+
+def run_job(settings, kind, environment):
+    """Ejecuta un trabajo del servicio (en el proceso hijo)"""
+    if kind == 'backup':
+        from backup.backup_manager import BackupManager
+        return BackupManager(settings).create_backup(environment)
+    if kind == 'binlog':
+        from backup.binlog import BinlogArchiver
+        archiver = BinlogArchiver.from_settings(settings, environment)
+        archived = archiver.archive()
+        if archived is None:
+            print("Otro archivado de binlogs está en curso")
+            return True
+        removed = archiver.prune()
+        print(f"Binlogs archivados: {len(archived)}, depurados: {len(removed)}")
+        return True
+    if kind == 'tiering':
+        from backup.backup_manager import BackupManager
+        return BackupManager(settings).tier_backups(environment) is not None
+    raise ValueError(f"Tipo de trabajo desconocido: {kind}")
+
+
+def main(argv):
+    usage = (
+        "Uso:\n"
+        "  daemon.py start                    (servicio en primer plano; usado por systemd)\n"
+        "  daemon.py status\n"
+        "  daemon.py run <backup|binlog|tiering> <ambiente>\n"
+        "La configuracion se lee del .env de BASE_PATH"
+    )
+    command = argv[1] if len(argv) > 1 else None
+    if command not in ('start', 'status', 'run') or (command == 'run' and len(argv) < 4):
+        print(usage, file=sys.stderr)
+        return 1
+
+    from config.settings import Settings
+    settings = Settings()
+    settings.load_env_file()
+
+    if command == 'run':
+        try:
+            return 0 if run_job(settings, argv[2], argv[3]) else 1
+        except Exception as e:
+            print(f"ERROR: {e}", file=sys.stderr)
+            return 1
+    if command == 'status':
+        from backup.scheduler import BackupScheduler
+        BackupScheduler(settings).list_scheduled_backups()
+        return 0
+    return 0 if SchedulerDaemon.from_settings(settings).run() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+Differential Restore Module
+Restauracion diferencial de moodledata sobre el volumen existente
+
+En lugar de borrar el volumen y extraer el respaldo completo, compara cada
+entrada del respaldo (tar o manifiesto incremental) con el volumen vivo:
+- Mismo tamaño y mtime: el archivo se deja como esta
+- Mismo tamaño y distinto mtime: se compara el contenido (hash) antes de escribir
+- Distinto tamaño o tipo: se reescribe
+Al final se eliminan los archivos que no existen en el respaldo, salvo los
+directorios excluidos del respaldo (cache, temp, ...), que se conservan.
+Las comparaciones y escrituras se reparten en un pool de workers.
+
+Solo usa la biblioteca estandar para poder ejecutarse desde restore.sh.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import stat
+import sys
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Permite ejecutar el modulo directamente desde restore.sh
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backup.exclusions import excludes_from_env, is_excluded
+from backup.incremental import BlobStore, CHUNK_SIZE, read_manifest, sha1_file
+
+
+# Los miembros del tar mas pequeños que esto se leen a memoria y se escriben
+# desde el pool; los mayores se procesan directamente desde el stream
+MEMORY_MEMBER_SIZE = 8 * 1024 * 1024
+
+
+def _safe_path(relative):
+    """Valida que la ruta del respaldo no salga del volumen destino"""
+    while relative.startswith('./'):
+        relative = relative[2:]
+    relative = relative.rstrip('/')
+    if not relative or relative == '.':
+        return None
+    if os.path.isabs(relative) or '..' in relative.split('/'):
+        raise ValueError(f"Ruta no permitida en el respaldo: {relative}")
+    return relative
+
+
+class DifferentialRestore:
+    """Sincroniza un volumen de moodledata con el contenido de un respaldo"""
+
+    def __init__(self, target_dir, workers=4, verify_hash=False, exclude=()):
+        """
+        Args:
+            target_dir: Raiz del volumen (punto de montaje en el host)
+            workers: Hilos para comparar y escribir archivos
+            verify_hash: Compara contenido aunque coincidan tamaño y mtime
+            exclude: Rutas relativas que no estan en el respaldo y no se eliminan
+        """
+        self.target_dir = target_dir
+        self.workers = max(1, int(workers))
+        self.verify_hash = verify_hash
+        self.exclude = list(exclude)
+        self.set_owner = hasattr(os, 'geteuid') and os.geteuid() == 0
+        self.stats = {
+            'checked': 0,
+            'unchanged': 0,
+            'written': 0,
+            'removed': 0,
+            'bytes_written': 0,
+        }
+        self._lock = threading.Lock()
+        self._expected = set()
+
+    # ------------------------------------------------------------------
+    # Funciones auxiliares
+    # ------------------------------------------------------------------
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _target(self, relative):
+        return os.path.join(self.target_dir, relative)
+
+    def _apply_metadata(self, path, entry):
+        """Aplica dueño, permisos y mtime de la entrada"""
+        if self.set_owner:
+            os.lchown(path, entry['uid'], entry['gid'])
+        if entry['type'] == 'symlink':
+            return
+        os.chmod(path, entry['mode'])
+        os.utime(path, (entry['mtime'], entry['mtime']))
+
+    def _live_stat(self, path):
+        try:
+            return os.lstat(path)
+        except FileNotFoundError:
+            return None
+
+    def _clear(self, path, st):
+        """Elimina lo que haya en path (archivo, enlace o directorio)"""
+        if st is None:
+            return
+        if stat.S_ISDIR(st.st_mode):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+    def _write_stream(self, path, stream, entry, prefix=b''):
+        """Escribe el archivo de forma atomica desde un stream"""
+        partial = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        written = 0
+        try:
+            with open(partial, 'wb') as output:
+                if prefix:
+                    output.write(prefix)
+                    written += len(prefix)
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    output.write(chunk)
+                    written += len(chunk)
+            self._apply_metadata(partial, entry)
+            os.replace(partial, path)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        self._count('written')
+        self._count('bytes_written', written)
+
+    def _sync_file(self, relative, entry, open_source, source_sha1=None):
+        """
+        Compara un archivo con el volumen y lo reescribe solo si difiere
+
+        Args:
+            relative: Ruta relativa dentro del volumen
+            entry: Metadatos (size, mtime, mode, uid, gid)
+            open_source: Funcion que abre el contenido del respaldo (binario)
+            source_sha1: SHA1 del contenido del respaldo si se conoce
+        """
+        path = self._target(relative)
+        st = self._live_stat(path)
+        self._count('checked')
+
+        if st is not None and stat.S_ISREG(st.st_mode) and st.st_size == entry['size']:
+            same_mtime = int(st.st_mtime) == entry['mtime']
+            if same_mtime and not self.verify_hash:
+                self._count('unchanged')
+                return
+            if source_sha1 is not None:
+                identical = sha1_file(path) == source_sha1
+            else:
+                with open_source() as source:
+                    identical = self._same_content(path, source)
+            if identical:
+                if not same_mtime:
+                    self._apply_metadata(path, entry)
+                self._count('unchanged')
+                return
+
+        if st is not None and not stat.S_ISREG(st.st_mode):
+            self._clear(path, st)
+        with open_source() as source:
+            self._write_stream(path, source, entry)
+
+    def _same_content(self, path, source):
+        digest_live = hashlib.sha1()
+        digest_source = hashlib.sha1()
+        with open(path, 'rb') as live:
+            for chunk in iter(lambda: live.read(CHUNK_SIZE), b''):
+                digest_live.update(chunk)
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            digest_source.update(chunk)
+        return digest_live.digest() == digest_source.digest()
+
+    def _sync_dir(self, relative):
+        path = self._target(relative)
+        st = self._live_stat(path)
+        if st is not None and not stat.S_ISDIR(st.st_mode):
+            os.remove(path)
+            st = None
+        if st is None:
+            os.makedirs(path, exist_ok=True)
+
+    def _sync_symlink(self, relative, entry):
+        path = self._target(relative)
+        st = self._live_stat(path)
+        self._count('checked')
+        if st is not None and stat.S_ISLNK(st.st_mode) and os.readlink(path) == entry['target']:
+            self._count('unchanged')
+            return
+        self._clear(path, st)
+        os.symlink(entry['target'], path)
+        self._apply_metadata(path, entry)
+        self._count('written')
+
+    def _finish_dirs(self, directories):
+        """Permisos y mtime de los directorios (los mas profundos primero)"""
+        for relative, entry in sorted(directories, key=lambda d: d[0].count('/'), reverse=True):
+            self._apply_metadata(self._target(relative), entry)
+
+    def remove_extra(self):
+        """Elimina del volumen lo que no existe en el respaldo"""
+        for root, dirs, files in os.walk(self.target_dir, topdown=True):
+            relative_root = os.path.relpath(root, self.target_dir)
+            relative_root = '' if relative_root == '.' else relative_root
+
+            for name in list(dirs):
+                relative = f"{relative_root}/{name}" if relative_root else name
+                if is_excluded(relative, self.exclude):
+                    dirs.remove(name)
+                    continue
+                if relative not in self._expected:
+                    path = os.path.join(root, name)
+                    if os.path.islink(path):
+                        os.remove(path)
+                    else:
+                        shutil.rmtree(path)
+                    dirs.remove(name)
+                    self._count('removed')
+
+            for name in files:
+                relative = f"{relative_root}/{name}" if relative_root else name
+                if relative not in self._expected and not is_excluded(relative, self.exclude):
+                    os.remove(os.path.join(root, name))
+                    self._count('removed')
+
+    # ------------------------------------------------------------------
+    # Fuentes de respaldo
+    # ------------------------------------------------------------------
+
+    def restore_manifest(self, manifest_path, store_root):
+        """
+        Sincroniza el volumen con un manifiesto incremental
+
+        Los blobs se leen directamente del almacen, por lo que todas las
+        comparaciones y copias se reparten entre los workers.
+
+        Returns:
+            Dict con estadisticas
+        """
+        started = time.monotonic()
+        _, entries = read_manifest(manifest_path)
+        store = BlobStore(store_root)
+
+        missing = store.missing_blobs(entries)
+        if missing:
+            raise FileNotFoundError(f"Faltan {len(missing)} blobs en el almacen (ej. {missing[0]})")
+
+        directories = []
+        files = []
+        symlinks = []
+        for entry in entries:
+            relative = _safe_path(entry['path'])
+            if relative is None:
+                continue
+            self._expected.add(relative)
+            if entry['type'] == 'dir':
+                directories.append((relative, entry))
+            elif entry['type'] == 'symlink':
+                symlinks.append((relative, entry))
+            else:
+                files.append((relative, entry))
+
+        # Los directorios se crean primero (el manifiesto ya viene ordenado por nivel)
+        for relative, _ in sorted(directories, key=lambda d: d[0].count('/')):
+            self._sync_dir(relative)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [
+                pool.submit(self._sync_file, relative, entry,
+                            lambda blob=store.blob_path(entry['sha1']): open(blob, 'rb'),
+                            entry['sha1'])
+                for relative, entry in files
+            ]
+            for future in futures:
+                future.result()
+
+        for relative, entry in symlinks:
+            self._sync_symlink(relative, entry)
+
+        self.remove_extra()
+        self._finish_dirs(directories)
+        self.stats['seconds'] = round(time.monotonic() - started, 3)
+        return self.stats
+
+    def restore_archive(self, fileobj):
+        """
+        Sincroniza el volumen con un stream tar (ya descomprimido)
+
+        El stream se lee en orden; los archivos pequeños se pasan al pool en
+        memoria y los grandes se comparan/escriben directamente desde el stream.
+
+        Returns:
+            Dict con estadisticas
+        """
+        started = time.monotonic()
+        directories = []
+        symlinks = []
+        hardlinks = []
+        # Limita la memoria usada por los archivos pendientes en el pool
+        pending = threading.BoundedSemaphore(self.workers * 2)
+        futures = []
+
+        def release(_):
+            pending.release()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool, \
+                tarfile.open(fileobj=fileobj, mode='r|') as tar:
+            for member in tar:
+                relative = _safe_path(member.name)
+                entry = {
+                    'mode': stat.S_IMODE(member.mode),
+                    'uid': member.uid,
+                    'gid': member.gid,
+                    'mtime': int(member.mtime),
+                }
+                if relative is None:
+                    if member.isdir():
+                        entry['type'] = 'dir'
+                        directories.append(('', entry))
+                    continue
+                self._expected.add(relative)
+
+                if member.isdir():
+                    entry['type'] = 'dir'
+                    self._sync_dir(relative)
+                    directories.append((relative, entry))
+                elif member.issym():
+                    entry.update({'type': 'symlink', 'target': member.linkname})
+                    symlinks.append((relative, entry))
+                elif member.islnk():
+                    hardlinks.append((relative, _safe_path(member.linkname)))
+                elif member.isfile():
+                    entry.update({'type': 'file', 'size': member.size})
+                    source = tar.extractfile(member)
+                    if member.size <= MEMORY_MEMBER_SIZE:
+                        data = source.read()
+                        pending.acquire()
+                        future = pool.submit(self._sync_file, relative, entry,
+                                             lambda data=data: _BytesSource(data))
+                        future.add_done_callback(release)
+                        futures.append(future)
+                    else:
+                        self._sync_large_member(relative, entry, source)
+                # Dispositivos y FIFOs no forman parte de moodledata
+
+            for future in futures:
+                future.result()
+
+        for relative, entry in symlinks:
+            self._sync_symlink(relative, entry)
+        for relative, link_target in hardlinks:
+            self._sync_hardlink(relative, link_target)
+
+        self.remove_extra()
+        self._finish_dirs(directories)
+        self.stats['seconds'] = round(time.monotonic() - started, 3)
+        return self.stats
+
+    def _sync_large_member(self, relative, entry, source):
+        """
+        Miembro grande del tar: el stream solo se puede leer una vez, asi que
+        la comparacion de contenido se hace bloque a bloque y, si difiere, se
+        reescribe reutilizando la parte ya leida
+        """
+        path = self._target(relative)
+        st = self._live_stat(path)
+        self._count('checked')
+
+        if st is not None and stat.S_ISREG(st.st_mode) and st.st_size == entry['size']:
+            same_mtime = int(st.st_mtime) == entry['mtime']
+            if same_mtime and not self.verify_hash:
+                self._count('unchanged')
+                return
+            read = []
+            with open(path, 'rb') as live:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    read.append(chunk)
+                    if live.read(len(chunk)) != chunk:
+                        break
+                else:
+                    if not same_mtime:
+                        self._apply_metadata(path, entry)
+                    self._count('unchanged')
+                    return
+            # Difiere: el archivo se reescribe con lo ya leido mas el resto del stream
+            self._write_stream(path, source, entry, prefix=b''.join(read))
+            return
+
+        if st is not None and not stat.S_ISREG(st.st_mode):
+            self._clear(path, st)
+        self._write_stream(path, source, entry)
+
+    def _sync_hardlink(self, relative, link_target):
+        path = self._target(relative)
+        source = self._target(link_target)
+        st = self._live_stat(path)
+        self._count('checked')
+        if st is not None and os.path.exists(source) and os.path.samefile(path, source):
+            self._count('unchanged')
+            return
+        self._clear(path, st)
+        os.link(source, path)
+        self._count('written')
+
+
+class _BytesSource:
+    """Contenido en memoria con la interfaz de archivo usada por _sync_file"""
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self.data) - self.offset
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += len(chunk)
+        return chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def main(argv):
+    usage = (
+        "Uso:\n"
+        "  differential.py manifest <manifiesto> <almacen> <volumen>\n"
+        "  differential.py archive <tar|-> <volumen>      (tar sin comprimir, - = stdin)\n"
+        "Variables: BACKUP_PARALLEL_WORKERS (workers), BACKUP_RESTORE_VERIFY_HASH=true,\n"
+        "  BACKUP_MOODLEDATA_EXCLUDE (directorios que se conservan)"
+    )
+    command = argv[1] if len(argv) > 1 else None
+    if len(argv) < (5 if command == 'manifest' else 4):
+        print(usage, file=sys.stderr)
+        return 1
+
+    restore = DifferentialRestore(
+        argv[-1],
+        workers=int(os.environ.get('BACKUP_PARALLEL_WORKERS') or 4),
+        verify_hash=os.environ.get('BACKUP_RESTORE_VERIFY_HASH', '').lower() == 'true',
+        exclude=excludes_from_env()
+    )
+
+    try:
+        if command == 'manifest':
+            stats = restore.restore_manifest(argv[2], argv[3])
+        elif command == 'archive':
+            if argv[2] == '-':
+                stats = restore.restore_archive(sys.stdin.buffer)
+            else:
+                with open(argv[2], 'rb') as f:
+                    stats = restore.restore_archive(f)
+        else:
+            print(usage, file=sys.stderr)
+            return 1
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
+    print(json.dumps(stats))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,1255 @@
+"""
+Backup Engine Module
+Motor nativo de respaldos de Moodle
+Transmite mysqldump y tar directamente al compresor, sin archivos intermedios
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from backup.adaptive import SAMPLE_SIZE, STORE_MIN_SIZE, classify
+from backup.archive_index import ARCHIVE_INDEX_SUFFIX, ArchiveIndexWriter
+from backup.catalog import BackupCatalog
+from backup.compression import resolve_codec
+from backup.incremental import BlobStore, BLOB_STORE_DIR, MANIFEST_SUFFIX
+from backup.integrity import HashingWriter, add_checksums
+from backup.parallel_dump import ParallelDumper, PARALLEL_DIR
+from backup.physical import ARCHIVE_PREFIX as PHYSICAL_PREFIX, METADATA_FILE as PHYSICAL_METADATA, CloneSource
+from backup.progress import count_rows
+from backup.remote import RemoteReplicator
+from backup.retention import RetentionManager
+from backup.sharded import SHARD_DIR, ShardedArchiver
+from backup.seekable import FrameWriter, INDEX_SUFFIX, SectionSplitter, write_index
+from backup.throttle import Throttle
+from backup.volume import TarCounter, TarEntryReader, VolumeStream
+
+
+# Tamaño de bloque para leer/escribir los streams
+CHUNK_SIZE = 1024 * 1024
+
+# Segundos entre cada linea de progreso cuando ambas etapas corren a la vez
+PROGRESS_INTERVAL = 10
+
+# Tipos tar de archivos regulares (los unicos que se clasifican)
+REGULAR_TYPES = (b'0', b'\0', b'7')
+
+
+def format_bytes(num_bytes):
+    """Convierte bytes a formato legible (similar a du -h)"""
+    value = float(num_bytes)
+    for unit in ['B', 'K', 'M', 'G', 'T']:
+        if value < 1024 or unit == 'T':
+            if unit == 'B':
+                return f"{int(value)}{unit}"
+            return f"{value:.1f}{unit}"
+        value /= 1024
+    return f"{value:.1f}T"
+
+
+class StageStats:
+    """Contadores de bytes y tiempo de una etapa del pipeline"""
+
+    def __init__(self, name):
+        self.name = name
+        self.bytes = 0
+        self.started = None
+        self.finished = None
+
+    def start(self):
+        self.started = time.monotonic()
+
+    def add(self, count):
+        self.bytes += count
+
+    def stop(self):
+        self.finished = time.monotonic()
+
+    @property
+    def elapsed(self):
+        """Segundos transcurridos en la etapa"""
+        if self.started is None:
+            return 0.0
+        end = self.finished if self.finished is not None else time.monotonic()
+        return max(end - self.started, 0.0)
+
+    @property
+    def throughput(self):
+        """Bytes por segundo procesados en la etapa"""
+        elapsed = self.elapsed
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self):
+        return {
+            'stage': self.name,
+            'bytes': self.bytes,
+            'seconds': round(self.elapsed, 3),
+            'bytes_per_second': round(self.throughput, 1),
+        }
+
+
+class StreamPipeline:
+    """
+    Conecta la salida de un proceso productor con un compresor externo
+    y escribe el resultado directamente en el archivo final
+    El SHA-256 del archivo se calcula mientras se escribe (atributo sha256)
+    Con un Throttle el compresor corre con nice/ionice y la escritura
+    respeta su limite de bytes por segundo. observer recibe cada bloque del
+    productor sin comprimir (ej. para leer las cabeceras de un binlog).
+    source_cmd puede ser un comando o una funcion que devuelve un objeto con
+    stdout, wait() y kill() (ej. VolumeStream.export_process)
+    """
+
+    def __init__(self, source_cmd, codec, output_file, level=None, threads=None,
+                 log_file=None, env=None, throttle=None, observer=None):
+        self.source_cmd = source_cmd
+        self.codec = codec
+        self.output_file = output_file
+        self.level = level
+        self.threads = threads
+        self.log_file = log_file
+        self.env = env
+        self.throttle = throttle
+        self.observer = observer
+        self.sha256 = None
+        self.stats = {
+            'source': StageStats('source'),
+            'compress': StageStats('compress'),
+        }
+
+    @contextmanager
+    def _cleanup_on_failure(self, partial_file):
+        """
+        Limpieza comun de run() ante un error de escritura (ej. disco lleno),
+        un proceso que no arranca o una interrupcion: mata y espera los
+        procesos registrados, espera los hilos, aborta los escritores (marcos,
+        indice) y borra el archivo parcial antes de relanzar la excepcion
+
+        Produce la funcion con la que run() registra cada recurso al crearlo
+        """
+        resources = []
+        try:
+            yield resources.append
+        except BaseException:
+            processes = [r for r in resources if hasattr(r, 'kill')]
+            for process in processes:
+                process.kill()
+            for process in processes:
+                process.wait()
+            for resource in resources:
+                if isinstance(resource, threading.Thread):
+                    resource.join()
+                elif hasattr(resource, 'abort'):
+                    resource.abort()
+            if os.path.exists(partial_file):
+                os.remove(partial_file)
+            raise
+
+    def run(self):
+        """
+        Ejecuta el pipeline productor -> compresor -> archivo
+
+        Returns:
+            Dict con las estadisticas de cada etapa
+
+        Raises:
+            RuntimeError si alguno de los procesos falla
+        """
+        partial_file = self.output_file + '.part'
+        stderr = open(self.log_file, 'ab') if self.log_file else subprocess.DEVNULL
+        pump_errors = []
+
+        try:
+            with self._cleanup_on_failure(partial_file) as register:
+                self.stats['source'].start()
+                if callable(self.source_cmd):
+                    source = self.source_cmd()
+                else:
+                    source = subprocess.Popen(
+                        self.source_cmd,
+                        stdout=subprocess.PIPE,
+                        stderr=stderr,
+                        env=self.env
+                    )
+                register(source)
+                self.stats['compress'].start()
+                compress_command = self.codec.compress_command(self.level, self.threads)
+                if self.throttle is not None:
+                    compress_command = self.throttle.command(compress_command)
+                compressor = subprocess.Popen(
+                    compress_command,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=stderr
+                )
+                register(compressor)
+
+                def pump():
+                    # Copia el stream del productor hacia el compresor
+                    try:
+                        for chunk in iter(lambda: source.stdout.read(CHUNK_SIZE), b''):
+                            self.stats['source'].add(len(chunk))
+                            if self.observer is not None:
+                                self.observer(chunk)
+                            compressor.stdin.write(chunk)
+                    except Exception as e:
+                        pump_errors.append(e)
+                        source.kill()
+                    finally:
+                        self.stats['source'].stop()
+                        try:
+                            compressor.stdin.close()
+                        except Exception:
+                            pass
+
+                pump_thread = threading.Thread(target=pump, daemon=True)
+                register(pump_thread)
+                pump_thread.start()
+
+                with open(partial_file, 'wb') as output:
+                    writer = HashingWriter(output)
+                    for chunk in iter(lambda: compressor.stdout.read(CHUNK_SIZE), b''):
+                        self.stats['compress'].add(len(chunk))
+                        if self.throttle is not None:
+                            self.throttle.consume(len(chunk))
+                        writer.write(chunk)
+                self.stats['compress'].stop()
+
+                pump_thread.join()
+                source_code = source.wait()
+                compressor_code = compressor.wait()
+        finally:
+            if stderr is not subprocess.DEVNULL:
+                stderr.close()
+
+        if pump_errors or source_code != 0 or compressor_code != 0 or self.stats['source'].bytes == 0:
+            if os.path.exists(partial_file):
+                os.remove(partial_file)
+            reason = pump_errors[0] if pump_errors else (
+                f"productor={source_code}, compresor={compressor_code}, "
+                f"bytes={self.stats['source'].bytes}")
+            raise RuntimeError(f"Pipeline fallido ({reason})")
+
+        os.replace(partial_file, self.output_file)
+        self.sha256 = writer.hexdigest()
+        return {name: stage.to_dict() for name, stage in self.stats.items()}
+
+
+class FramedDumpPipeline(StreamPipeline):
+    """
+    Variante de StreamPipeline para mysqldump que comprime cada tabla en un
+    marco independiente (ver seekable.py) y guarda el indice de marcos en
+    <archivo>.index.json (SHA-256 en el atributo index_sha256)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.index_file = self.output_file + INDEX_SUFFIX
+        self.index_sha256 = None
+
+    def run(self):
+        """
+        Ejecuta el pipeline mysqldump -> marcos comprimidos -> archivo
+
+        Returns:
+            Dict con las estadisticas de cada etapa
+
+        Raises:
+            RuntimeError si mysqldump o algun compresor falla
+        """
+        partial_file = self.output_file + '.part'
+        stderr = open(self.log_file, 'ab') if self.log_file else subprocess.DEVNULL
+        errors = []
+
+        try:
+            with self._cleanup_on_failure(partial_file) as register:
+                self.stats['source'].start()
+                source = subprocess.Popen(self.source_cmd, stdout=subprocess.PIPE, stderr=stderr, env=self.env)
+                register(source)
+                self.stats['compress'].start()
+                with open(partial_file, 'wb') as output:
+                    writer = HashingWriter(output)
+                    frames = FrameWriter(writer, self.codec, self.level, self.threads, stderr=stderr,
+                                         throttle=self.throttle, on_output=self.stats['compress'].add)
+                    register(frames)
+                    splitter = SectionSplitter()
+
+                    def apply(items):
+                        for item in items:
+                            if item[0] == 'section':
+                                frames.begin(item[1], item[2])
+                            else:
+                                frames.write(item[1])
+
+                    try:
+                        for chunk in iter(lambda: source.stdout.read(CHUNK_SIZE), b''):
+                            self.stats['source'].add(len(chunk))
+                            if self.observer is not None:
+                                self.observer(chunk)
+                            apply(splitter.feed(chunk))
+                        apply(splitter.finish())
+                        frames.end()
+                    except Exception as e:
+                        errors.append(e)
+                        frames.abort()
+                        source.kill()
+                self.stats['source'].stop()
+                self.stats['compress'].stop()
+                source_code = source.wait()
+        finally:
+            if stderr is not subprocess.DEVNULL:
+                stderr.close()
+
+        if errors or source_code != 0 or self.stats['source'].bytes == 0:
+            if os.path.exists(partial_file):
+                os.remove(partial_file)
+            reason = errors[0] if errors else f"productor={source_code}, bytes={self.stats['source'].bytes}"
+            raise RuntimeError(f"Pipeline fallido ({reason})")
+
+        os.replace(partial_file, self.output_file)
+        self.sha256 = writer.hexdigest()
+        data = write_index(self.index_file, frames.index(file=os.path.basename(self.output_file)))
+        self.index_sha256 = hashlib.sha256(data).hexdigest()
+        return {name: stage.to_dict() for name, stage in self.stats.items()}
+
+
+class AdaptiveTarPipeline(StreamPipeline):
+    """
+    Variante de StreamPipeline para el tar de moodledata que no comprime el
+    contenido que ya viene comprimido (ver adaptive.py)
+
+    Los archivos de al menos min_size bytes se clasifican por su inicio; los
+    incompresibles van a marcos sin comprimir y el resto al compresor
+    (min_size=None comprime todo). El tar se copia byte a byte, solo cambia
+    como se reparte entre marcos. Las cifras de la clasificacion quedan en
+    el atributo adaptive.
+
+    Con frame_size los marcos se cortan al superar ese tamaño sin comprimir
+    y con index=True se escribe <archivo>.index.json.gz con el marco y la
+    posicion de cada entrada (ver archive_index.py; SHA-256 en index_sha256).
+    """
+
+    def __init__(self, *args, min_size=STORE_MIN_SIZE, frame_size=None, index=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+        self.frame_size = frame_size
+        self.index_file = self.output_file + ARCHIVE_INDEX_SUFFIX if index else None
+        self.index_sha256 = None
+        self.adaptive = None
+
+    def run(self):
+        """
+        Ejecuta el pipeline tar -> marcos comprimidos o guardados -> archivo
+
+        Returns:
+            Dict con las estadisticas de cada etapa
+
+        Raises:
+            RuntimeError si el productor o algun compresor falla
+        """
+        partial_file = self.output_file + '.part'
+        stderr = open(self.log_file, 'ab') if self.log_file else subprocess.DEVNULL
+        errors = []
+        adaptive = {'compressed_files': 0, 'compressed_bytes': 0, 'stored_files': 0, 'stored_bytes': 0,
+                    'stored_frames': 0, 'formats': {}}
+
+        index = None
+        try:
+            with self._cleanup_on_failure(partial_file) as register:
+                self.stats['source'].start()
+                if callable(self.source_cmd):
+                    source = self.source_cmd()
+                else:
+                    source = subprocess.Popen(self.source_cmd, stdout=subprocess.PIPE, stderr=stderr, env=self.env)
+                register(source)
+                self.stats['compress'].start()
+                if self.index_file:
+                    index = ArchiveIndexWriter(self.index_file)
+                    register(index)
+                with open(partial_file, 'wb') as output:
+                    writer = HashingWriter(output)
+                    frames = FrameWriter(writer, self.codec, self.level, self.threads, stderr=stderr,
+                                         throttle=self.throttle, on_output=self.stats['compress'].add)
+                    register(frames)
+                    reader = TarEntryReader(source.stdout)
+                    current = None
+                    # Bytes sin comprimir del marco en curso (posicion de la siguiente entrada)
+                    position = 0
+
+                    def feed(data):
+                        nonlocal position
+                        if data:
+                            self.stats['source'].add(len(data))
+                            if self.observer is not None:
+                                self.observer(data)
+                            frames.write(data)
+                            position += len(data)
+
+                    try:
+                        for entry in reader.entries():
+                            head = b''
+                            compress = True
+                            if (self.min_size is not None and entry['type'] in REGULAR_TYPES
+                                    and entry['size'] >= self.min_size):
+                                while len(head) < SAMPLE_SIZE:
+                                    chunk = reader.read(SAMPLE_SIZE - len(head))
+                                    if not chunk:
+                                        break
+                                    head += chunk
+                                compress, reason = classify(head[:entry['size']])
+                                if not compress:
+                                    adaptive['formats'][reason] = adaptive['formats'].get(reason, 0) + entry['size']
+
+                            kind = 'tar' if compress else 'stored'
+                            if kind != current or (self.frame_size and position >= self.frame_size):
+                                frames.begin(kind, store=not compress)
+                                current = kind
+                                position = 0
+                                if not compress:
+                                    adaptive['stored_frames'] += 1
+                            adaptive[f"{'compressed' if compress else 'stored'}_files"] += 1
+                            adaptive[f"{'compressed' if compress else 'stored'}_bytes"] += entry['size']
+                            if index is not None:
+                                index.add(entry, len(frames.frames), position)
+
+                            feed(entry['header'])
+                            feed(head)
+                            for chunk in iter(reader.read, b''):
+                                feed(chunk)
+
+                        # El fin de archivo (y el relleno del bloque tar) se copia tal cual
+                        if current is None:
+                            frames.begin('tar')
+                        feed(reader.trailer)
+                        for chunk in iter(lambda: source.stdout.read(CHUNK_SIZE), b''):
+                            feed(chunk)
+                        frames.end()
+                    except Exception as e:
+                        errors.append(e)
+                        frames.abort()
+                        source.kill()
+                self.stats['source'].stop()
+                self.stats['compress'].stop()
+                source_code = source.wait()
+        finally:
+            if stderr is not subprocess.DEVNULL:
+                stderr.close()
+
+        if errors or source_code != 0 or self.stats['source'].bytes == 0:
+            if index is not None:
+                index.abort()
+            if os.path.exists(partial_file):
+                os.remove(partial_file)
+            reason = errors[0] if errors else f"productor={source_code}, bytes={self.stats['source'].bytes}"
+            raise RuntimeError(f"Pipeline fallido ({reason})")
+
+        os.replace(partial_file, self.output_file)
+        self.sha256 = writer.hexdigest()
+        if index is not None:
+            self.index_sha256 = index.finish({'codec': self.codec.name, 'file': os.path.basename(self.output_file),
+                                              'frames': frames.frames})
+
+        # CPU evitado: los bytes guardados al ritmo medido de los compresores
+        compressed_input = sum(f['bytes'] for f in frames.frames if f['kind'] != 'stored')
+        cpu_per_byte = frames.cpu_seconds / compressed_input if compressed_input else 0.0
+        adaptive.update({
+            'frames': len(frames.frames),
+            'compressor_cpu_seconds': round(frames.cpu_seconds, 3),
+            'cpu_seconds_avoided': round(adaptive['stored_bytes'] * cpu_per_byte, 3),
+            'bytes_saved': self.stats['source'].bytes - self.stats['compress'].bytes,
+        })
+        self.adaptive = adaptive
+        return {name: stage.to_dict() for name, stage in self.stats.items()}
+
+
+class BackupEngine:
+    """Ejecuta un respaldo completo de un ambiente sin pasar por backup.sh"""
+
+    # Colores para output
+    RED = '\033[0;31m'
+    GREEN = '\033[0;32m'
+    YELLOW = '\033[1;33m'
+    NC = '\033[0m'
+
+    def __init__(self, settings, environment, codec=None, level=None, threads=None, progress=None,
+                 db_mode=None):
+        self.settings = settings
+        self.environment = environment
+        # 'single', 'parallel' o 'physical' (ver Settings.backup_db_mode)
+        self.db_mode = db_mode or settings.backup_db_mode(environment)
+        self.codec = resolve_codec(codec or settings.BACKUP_COMPRESSION)
+        self.level = level or settings.BACKUP_COMPRESSION_LEVEL
+        self.threads = threads if threads is not None else settings.BACKUP_COMPRESSION_THREADS
+        self.timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        self.base_dir = settings.BACKUPS_PATH
+        self.backup_dir = os.path.join(self.base_dir, environment, self.timestamp)
+        self.log_file = os.path.join(self.backup_dir, 'backup.log')
+        self.mysql_container = f"mysql_{environment}"
+        self.volume_name = f"moodledata_{environment}"
+        self.stats = {}
+        self.catalog = BackupCatalog(self.base_dir)
+        self.throttle = Throttle.from_settings(settings)
+        # ProgressReporter de la operacion (ver BackupManager.create_backup)
+        self.progress = progress
+
+    # ------------------------------------------------------------------
+    # Funciones auxiliares
+    # ------------------------------------------------------------------
+
+    def _log(self, message, tag='[INFO]', color=''):
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        reset = self.NC if color else ''
+        print(f"{timestamp} - {color}{tag}{reset} {message}")
+        try:
+            with open(self.log_file, 'a') as f:
+                f.write(f"{timestamp} - {tag} {message}\n")
+        except OSError:
+            pass
+
+    def log_info(self, message):
+        self._log(message)
+
+    def log_success(self, message):
+        self._log(message, '[OK]', self.GREEN)
+
+    def log_warning(self, message):
+        self._log(message, '[WARNING]', self.YELLOW)
+
+    def log_error(self, message):
+        self._log(message, '[ERROR]', self.RED)
+
+    def _db_credentials(self):
+        """Obtiene nombre, usuario y contraseña de la BD del ambiente"""
+        prefix = 'PROD' if self.environment == 'production' else 'TEST'
+        return (
+            self.settings.get_env_var(f'{prefix}_DB_NAME', 'moodle'),
+            self.settings.get_env_var(f'{prefix}_DB_USER', 'moodle'),
+            self.settings.get_env_var(f'{prefix}_DB_PASS', 'moodle'),
+        )
+
+    def _db_root_password(self):
+        prefix = 'PROD' if self.environment == 'production' else 'TEST'
+        return self.settings.get_env_var(f'{prefix}_DB_ROOT_PASS', '')
+
+    def _container_running(self, name):
+        result = subprocess.run(
+            ['docker', 'ps', '--format', '{{.Names}}'],
+            capture_output=True,
+            text=True
+        )
+        return result.returncode == 0 and name in result.stdout.split()
+
+    def _volume_exists(self, name):
+        result = subprocess.run(
+            ['docker', 'volume', 'inspect', name],
+            capture_output=True,
+            text=True
+        )
+        return result.returncode == 0
+
+    def _volume_mountpoint(self, name):
+        """Ruta del volumen en el host (requiere root)"""
+        result = subprocess.run(
+            ['docker', 'volume', 'inspect', '-f', '{{.Mountpoint}}', name],
+            capture_output=True,
+            text=True
+        )
+        if result.returncode != 0:
+            return None
+        return result.stdout.strip() or None
+
+    def _progress_stage(self, name):
+        """Medidor de progreso de la etapa (None sin ProgressReporter)"""
+        return self.progress.stage(name) if self.progress is not None else None
+
+    def _tracked(self, name, function):
+        """Ejecuta una etapa registrando su inicio y fin en el progreso"""
+        self._progress_stage(name)
+        ok = False
+        try:
+            ok = function()
+            return ok
+        finally:
+            if self.progress is not None:
+                self.progress.end_stage(name, ok)
+
+    def _log_stage_stats(self, stats):
+        for stage in stats.values():
+            self.log_info(
+                f"  {stage['stage']}: {format_bytes(stage['bytes'])} en {stage['seconds']}s "
+                f"({format_bytes(stage['bytes_per_second'])}/s)"
+            )
+
+    def _leg_size(self, prefixes):
+        """Bytes escritos en el respaldo por los archivos/directorios con esos prefijos"""
+        total = 0
+        try:
+            entries = list(os.scandir(self.backup_dir))
+        except OSError:
+            return 0
+        for entry in entries:
+            if not entry.name.startswith(prefixes):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                total += self._dir_size(entry.path)
+            else:
+                try:
+                    total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass
+        return total
+
+    def _dir_size(self, path):
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    # ------------------------------------------------------------------
+    # Etapas del respaldo
+    # ------------------------------------------------------------------
+
+    def backup_database(self):
+        """Transmite mysqldump directamente al archivo comprimido final"""
+        if self.db_mode == 'parallel':
+            return self.backup_database_parallel()
+        if self.db_mode == 'physical':
+            return self.backup_database_physical()
+
+        self.log_info("Iniciando respaldo de base de datos MySQL")
+
+        db_name, db_user, db_pass = self._db_credentials()
+        output_file = os.path.join(
+            self.backup_dir, f"{db_name}_{self.timestamp}.sql{self.codec.extension}")
+
+        if not self._container_running(self.mysql_container):
+            self.log_error(f"El contenedor MySQL ({self.mysql_container}) no está corriendo")
+            return False
+
+        self.log_info(f"Exportando base de datos: {db_name} ({self.codec.name} en streaming)")
+
+        binlog_args = []
+        if self.settings.BACKUP_BINLOG_ENABLED:
+            # Como root para registrar la posición del binlog (recuperación a un instante)
+            db_user, db_pass = 'root', self._db_root_password()
+            binlog_args = ['--source-data=2']
+
+        # MYSQL_PWD se hereda del entorno para no exponer la contraseña en argv
+        env = os.environ.copy()
+        env['MYSQL_PWD'] = db_pass
+        command = [
+            'docker', 'exec', '-e', 'MYSQL_PWD', self.mysql_container, 'mysqldump',
+            f'-u{db_user}',
+            '--single-transaction',
+            '--routines',
+            '--triggers',
+            '--events',
+            '--no-tablespaces'
+        ] + binlog_args + [db_name]
+
+        meter = self._progress_stage('database')
+        # Con indice cada tabla queda en su propio marco (restauracion selectiva)
+        pipeline_class = FramedDumpPipeline if self.settings.BACKUP_DB_INDEX else StreamPipeline
+        pipeline = pipeline_class(
+            command, self.codec, output_file,
+            level=self.level, threads=self.threads, log_file=self.log_file, env=env,
+            throttle=self.throttle,
+            observer=(lambda chunk: meter.add(len(chunk), rows=count_rows(chunk))) if meter else None
+        )
+        try:
+            stats = pipeline.run()
+        except Exception as e:
+            self.log_error(f"Error al exportar la base de datos: {e}")
+            return False
+
+        self.stats['database'] = stats
+        checksums = {os.path.basename(output_file): pipeline.sha256}
+        if isinstance(pipeline, FramedDumpPipeline):
+            checksums[os.path.basename(pipeline.index_file)] = pipeline.index_sha256
+        add_checksums(self.backup_dir, checksums)
+        file_size = format_bytes(os.path.getsize(output_file))
+        self.log_success(f"Base de datos comprimida: {output_file} ({file_size})")
+        self._log_stage_stats(stats)
+
+        with open(os.path.join(self.backup_dir, 'DB_INFO.txt'), 'w') as f:
+            f.write(f"{db_name}\n")
+            f.write(f"Tamaño: {file_size}\n")
+        with open(os.path.join(self.backup_dir, 'FIN_DUMP_DB.log'), 'w') as f:
+            f.write(f"{datetime.now()}\n")
+        return True
+
+    def backup_database_parallel(self):
+        """Vuelca la BD por tabla y por rangos desde una instantánea consistente"""
+        self.log_info("Iniciando respaldo paralelo de base de datos MySQL")
+
+        db_name = self._db_credentials()[0]
+        output_dir = os.path.join(self.backup_dir, PARALLEL_DIR)
+        workers = self.settings.BACKUP_PARALLEL_WORKERS
+
+        if not self._container_running(self.mysql_container):
+            self.log_error(f"El contenedor MySQL ({self.mysql_container}) no está corriendo")
+            return False
+
+        self.log_info(f"Exportando base de datos: {db_name} ({workers} workers, {self.codec.name})")
+
+        meter = self._progress_stage('database')
+        dumper = ParallelDumper(
+            self.mysql_container, db_name, self._db_root_password(), output_dir, self.codec,
+            level=self.level,
+            workers=workers,
+            chunk_bytes=self.settings.BACKUP_PARALLEL_CHUNK_MB * 1024 * 1024,
+            threads=self.threads,
+            log_file=self.log_file,
+            throttle=self.throttle,
+            progress=meter.add if meter else None
+        )
+        try:
+            index = dumper.dump()
+        except Exception as e:
+            self.log_error(f"Error al exportar la base de datos: {e}")
+            shutil.rmtree(output_dir, ignore_errors=True)
+            return False
+
+        add_checksums(self.backup_dir, {
+            f"{PARALLEL_DIR}/{name}": digest for name, digest in dumper.checksums.items()})
+
+        self.stats['database'] = {
+            'mode': 'parallel',
+            'tables': len({c['table'] for c in index['chunks']}),
+            'chunks': len(index['chunks']),
+            'rows': index['rows'],
+            'bytes': index['bytes'],
+            'compressed_bytes': index['compressed_bytes'],
+            'seconds': index['seconds'],
+        }
+        file_size = format_bytes(self._dir_size(output_dir))
+        self.log_success(
+            f"Base de datos exportada: {len(index['chunks'])} fragmentos, {index['rows']} filas ({file_size})")
+
+        with open(os.path.join(self.backup_dir, 'DB_INFO.txt'), 'w') as f:
+            f.write(f"{db_name}\n")
+            f.write(f"Tamaño: {file_size}\n")
+            f.write("Modo: parallel\n")
+        with open(os.path.join(self.backup_dir, 'FIN_DUMP_DB.log'), 'w') as f:
+            f.write(f"{datetime.now()}\n")
+        return True
+
+    def backup_database_physical(self):
+        """Clona el directorio de datos de MySQL y lo transmite comprimido como tar"""
+        self.log_info("Iniciando respaldo físico de MySQL (plugin clone)")
+
+        output_file = os.path.join(self.backup_dir, f"{PHYSICAL_PREFIX}{self.timestamp}.tar{self.codec.extension}")
+
+        if not self._container_running(self.mysql_container):
+            self.log_error(f"El contenedor MySQL ({self.mysql_container}) no está corriendo")
+            return False
+
+        source = CloneSource(self.mysql_container, self._db_root_password(), f"physical-{self.timestamp}")
+        try:
+            metadata = source.prepare()
+        except Exception as e:
+            self.log_error(f"Error al clonar la instancia MySQL: {e}")
+            return False
+        self.log_info(f"Instancia clonada (MySQL {metadata['mysql_version']}), comprimiendo con {self.codec.name}")
+
+        meter = self._progress_stage('database')
+        counter = TarCounter()
+        pipeline = StreamPipeline(
+            lambda: source.export_process(self.log_file), self.codec, output_file,
+            level=self.level, threads=self.threads, log_file=self.log_file,
+            throttle=self.throttle,
+            observer=(lambda chunk: meter.add(len(chunk), files=counter.feed(chunk))) if meter else None
+        )
+        try:
+            stats = pipeline.run()
+        except Exception as e:
+            self.log_error(f"Error al exportar el directorio de datos: {e}")
+            return False
+        finally:
+            try:
+                source.remove()
+            except Exception as e:
+                self.log_warning(f"No se pudo borrar la copia temporal {source.path}: {e}")
+
+        metadata['archive'] = os.path.basename(output_file)
+        metadata['codec'] = self.codec.name
+        metadata_file = os.path.join(self.backup_dir, PHYSICAL_METADATA)
+        with open(metadata_file, 'w') as f:
+            json.dump(metadata, f, indent=2)
+        with open(metadata_file, 'rb') as f:
+            metadata_sha256 = hashlib.sha256(f.read()).hexdigest()
+
+        stats['mode'] = 'physical'
+        self.stats['database'] = stats
+        add_checksums(self.backup_dir, {
+            os.path.basename(output_file): pipeline.sha256,
+            PHYSICAL_METADATA: metadata_sha256,
+        })
+        file_size = format_bytes(os.path.getsize(output_file))
+        self.log_success(f"Directorio de datos comprimido: {output_file} ({file_size})")
+        self._log_stage_stats(stats)
+
+        with open(os.path.join(self.backup_dir, 'DB_INFO.txt'), 'w') as f:
+            f.write(f"{self._db_credentials()[0]}\n")
+            f.write(f"Tamaño: {file_size}\n")
+            f.write(f"Modo: physical (MySQL {metadata['mysql_version']})\n")
+        with open(os.path.join(self.backup_dir, 'FIN_DUMP_DB.log'), 'w') as f:
+            f.write(f"{datetime.now()}\n")
+        return True
+
+    def _moodledata_pipeline(self, source_cmd, output_file, meter, threads=None):
+        """Pipeline tar -> archivo de moodledata con las opciones de compresion e indice"""
+        counter = TarCounter()
+
+        # Con BACKUP_MOODLEDATA_ADAPTIVE el contenido ya comprimido no pasa por el compresor
+        # y con BACKUP_MOODLEDATA_INDEX el tar se escribe en marcos con indice de archivos
+        options = {}
+        pipeline_class = StreamPipeline
+        if self.settings.BACKUP_MOODLEDATA_ADAPTIVE or self.settings.BACKUP_MOODLEDATA_INDEX:
+            pipeline_class = AdaptiveTarPipeline
+            options['min_size'] = (self.settings.BACKUP_MOODLEDATA_STORE_MIN_KB * 1024
+                                   if self.settings.BACKUP_MOODLEDATA_ADAPTIVE else None)
+        if self.settings.BACKUP_MOODLEDATA_INDEX:
+            options['frame_size'] = self.settings.BACKUP_MOODLEDATA_FRAME_MB * 1024 * 1024
+            options['index'] = True
+        return pipeline_class(
+            source_cmd, self.codec, output_file,
+            level=self.level, threads=threads or self.threads, log_file=self.log_file,
+            throttle=self.throttle,
+            observer=(lambda chunk: meter.add(len(chunk), files=counter.feed(chunk))) if meter else None,
+            **options
+        )
+
+    def backup_moodledata(self):
+        """Transmite el tar del volumen moodledata al archivo comprimido final"""
+        if self.settings.BACKUP_MOODLEDATA_MODE == 'incremental':
+            return self.backup_moodledata_incremental()
+        if self.settings.BACKUP_MOODLEDATA_MODE == 'sharded':
+            return self.backup_moodledata_sharded()
+
+        self.log_info("Iniciando respaldo de moodledata")
+
+        output_file = os.path.join(
+            self.backup_dir, f"moodledata_{self.timestamp}.tar{self.codec.extension}")
+
+        if not self._volume_exists(self.volume_name):
+            self.log_warning(f"El volumen {self.volume_name} no existe")
+            return False
+
+        self.log_info(f"Comprimiendo volumen: {self.volume_name}")
+
+        # El daemon emite el tar sin comprimir por su API; la compresión ocurre en el host
+        excludes = self.settings.BACKUP_MOODLEDATA_EXCLUDE
+        if excludes:
+            self.log_info(f"Directorios excluidos: {', '.join(excludes)}")
+        volume = VolumeStream(self.volume_name)
+        meter = self._progress_stage('moodledata')
+        pipeline = self._moodledata_pipeline(
+            lambda: volume.export_process(excludes, self.log_file), output_file, meter)
+        try:
+            stats = pipeline.run()
+        except Exception as e:
+            self.log_error(f"Error al respaldar moodledata: {e}")
+            return False
+
+        self.stats['moodledata'] = stats
+        add_checksums(self.backup_dir, {os.path.basename(output_file): pipeline.sha256})
+        if getattr(pipeline, 'index_sha256', None):
+            add_checksums(self.backup_dir, {os.path.basename(pipeline.index_file): pipeline.index_sha256})
+        file_size = format_bytes(os.path.getsize(output_file))
+        self.log_success(f"Moodledata respaldado: {output_file} ({file_size})")
+        self._log_stage_stats(stats)
+        adaptive = getattr(pipeline, 'adaptive', None)
+        if adaptive and pipeline.min_size is not None:
+            self.stats['moodledata_adaptive'] = adaptive
+            self.log_info(
+                f"  Sin comprimir: {adaptive['stored_files']} archivos ({format_bytes(adaptive['stored_bytes'])}), "
+                f"CPU evitado ~{adaptive['cpu_seconds_avoided']}s, ahorro total {format_bytes(adaptive['bytes_saved'])}")
+
+        with open(os.path.join(self.backup_dir, 'MOODLEDATA_INFO.txt'), 'w') as f:
+            f.write(f"Volumen: {self.volume_name}\n")
+            f.write(f"Tamaño: {file_size}\n")
+            if excludes:
+                f.write(f"Excluidos: {', '.join(excludes)}\n")
+            if adaptive and pipeline.min_size is not None:
+                f.write(f"Sin comprimir: {adaptive['stored_files']} archivos "
+                        f"({format_bytes(adaptive['stored_bytes'])})\n")
+        with open(os.path.join(self.backup_dir, 'FIN_DUMP_MOODLEDATA.log'), 'w') as f:
+            f.write(f"{datetime.now()}\n")
+        return True
+
+    def backup_moodledata_incremental(self):
+        """Copia al almacen de blobs solo el contenido nuevo y escribe el manifiesto"""
+        self.log_info("Iniciando respaldo incremental de moodledata")
+
+        if not self._volume_exists(self.volume_name):
+            self.log_warning(f"El volumen {self.volume_name} no existe")
+            return False
+
+        source_dir = self._volume_mountpoint(self.volume_name)
+        if not source_dir or not os.path.isdir(source_dir):
+            self.log_error(f"No se pudo acceder al punto de montaje de {self.volume_name}")
+            return False
+
+        manifest_file = os.path.join(self.backup_dir, f"moodledata_{self.timestamp}{MANIFEST_SUFFIX}")
+        store = BlobStore(os.path.join(self.base_dir, BLOB_STORE_DIR), self.throttle)
+        excludes = self.settings.BACKUP_MOODLEDATA_EXCLUDE
+        if excludes:
+            self.log_info(f"Directorios excluidos: {', '.join(excludes)}")
+
+        meter = self._progress_stage('moodledata')
+        try:
+            stats = store.snapshot(source_dir, manifest_file, {
+                'environment': self.environment,
+                'volume': self.volume_name,
+            }, exclude=excludes, progress=meter.add if meter else None)
+        except Exception as e:
+            self.log_error(f"Error al respaldar moodledata: {e}")
+            return False
+
+        self.stats['moodledata'] = stats
+        add_checksums(self.backup_dir, {os.path.basename(manifest_file): stats['sha256']})
+        self.log_success(
+            f"Moodledata respaldado: {stats['files']} archivos ({format_bytes(stats['bytes'])}), "
+            f"{stats['new_blobs']} blobs nuevos ({format_bytes(stats['copied_bytes'])} copiados), "
+            f"{stats['reused_blobs']} reutilizados")
+
+        with open(os.path.join(self.backup_dir, 'MOODLEDATA_INFO.txt'), 'w') as f:
+            f.write(f"Volumen: {self.volume_name}\n")
+            f.write("Modo: incremental\n")
+            if excludes:
+                f.write(f"Excluidos: {', '.join(excludes)}\n")
+            f.write(f"Tamaño: {format_bytes(stats['bytes'])}\n")
+            f.write(f"Copiado: {format_bytes(stats['copied_bytes'])}\n")
+        with open(os.path.join(self.backup_dir, 'FIN_DUMP_MOODLEDATA.log'), 'w') as f:
+            f.write(f"{datetime.now()}\n")
+        return True
+
+    def backup_moodledata_sharded(self):
+        """Respalda moodledata en fragmentos por prefijo de filedir con un pool de workers"""
+        self.log_info("Iniciando respaldo de moodledata en fragmentos")
+
+        if not self._volume_exists(self.volume_name):
+            self.log_warning(f"El volumen {self.volume_name} no existe")
+            return False
+
+        source_dir = self._volume_mountpoint(self.volume_name)
+        if not source_dir or not os.path.isdir(source_dir):
+            self.log_error(f"No se pudo acceder al punto de montaje de {self.volume_name}")
+            return False
+
+        output_dir = os.path.join(self.backup_dir, SHARD_DIR)
+        workers = self.settings.BACKUP_PARALLEL_WORKERS
+        excludes = self.settings.BACKUP_MOODLEDATA_EXCLUDE
+        if excludes:
+            self.log_info(f"Directorios excluidos: {', '.join(excludes)}")
+        self.log_info(f"Comprimiendo volumen: {self.volume_name} ({self.settings.BACKUP_MOODLEDATA_SHARDS} "
+                      f"fragmentos de filedir, {workers} workers, {self.codec.name})")
+
+        meter = self._progress_stage('moodledata')
+        # Los hilos del compresor se reparten entre los workers
+        threads = max(1, (int(self.threads or 0) or (os.cpu_count() or 1)) // workers)
+        archiver = ShardedArchiver(
+            source_dir, output_dir, self.codec,
+            lambda command, output_file: self._moodledata_pipeline(command, output_file, meter, threads),
+            shards=self.settings.BACKUP_MOODLEDATA_SHARDS,
+            workers=workers,
+            exclude=excludes
+        )
+        try:
+            manifest = archiver.archive()
+        except Exception as e:
+            self.log_error(f"Error al respaldar moodledata: {e}")
+            shutil.rmtree(output_dir, ignore_errors=True)
+            return False
+
+        add_checksums(self.backup_dir, {
+            f"{SHARD_DIR}/{name}": digest for name, digest in archiver.checksums.items()})
+
+        self.stats['moodledata'] = {
+            'mode': 'sharded',
+            'shards': len(manifest['shards']),
+            'workers': workers,
+            'bytes': manifest['bytes'],
+            'compressed_bytes': manifest['compressed_bytes'],
+            'seconds': manifest['seconds'],
+        }
+        # Compresion adaptativa sumada de todos los fragmentos
+        adaptive = None
+        for pipeline in archiver.pipelines.values():
+            if getattr(pipeline, 'adaptive', None) is None or pipeline.min_size is None:
+                continue
+            adaptive = adaptive or {'formats': {}}
+            for key, value in pipeline.adaptive.items():
+                if key == 'formats':
+                    for name, size in value.items():
+                        adaptive['formats'][name] = adaptive['formats'].get(name, 0) + size
+                else:
+                    adaptive[key] = round(adaptive.get(key, 0) + value, 3)
+
+        file_size = format_bytes(manifest['compressed_bytes'])
+        self.log_success(
+            f"Moodledata respaldado: {len(manifest['shards'])} fragmentos ({format_bytes(manifest['bytes'])} "
+            f"-> {file_size}) en {manifest['seconds']}s")
+        if adaptive:
+            self.stats['moodledata_adaptive'] = adaptive
+            self.log_info(
+                f"  Sin comprimir: {adaptive['stored_files']} archivos ({format_bytes(adaptive['stored_bytes'])}), "
+                f"CPU evitado ~{adaptive['cpu_seconds_avoided']}s, ahorro total {format_bytes(adaptive['bytes_saved'])}")
+
+        with open(os.path.join(self.backup_dir, 'MOODLEDATA_INFO.txt'), 'w') as f:
+            f.write(f"Volumen: {self.volume_name}\n")
+            f.write(f"Modo: sharded ({len(manifest['shards'])} fragmentos)\n")
+            if excludes:
+                f.write(f"Excluidos: {', '.join(excludes)}\n")
+            f.write(f"Tamaño: {file_size}\n")
+            if adaptive:
+                f.write(f"Sin comprimir: {adaptive['stored_files']} archivos "
+                        f"({format_bytes(adaptive['stored_bytes'])})\n")
+        with open(os.path.join(self.backup_dir, 'FIN_DUMP_MOODLEDATA.log'), 'w') as f:
+            f.write(f"{datetime.now()}\n")
+        return True
+
+    def run_concurrent(self):
+        """
+        Respalda base de datos y moodledata al mismo tiempo
+
+        El dump depende de CPU/MySQL y el archivo de moodledata del disco, por
+        lo que correr ambas etapas en paralelo acorta el respaldo completo.
+        Mientras ambas corren se muestra una linea de progreso combinada
+        (con ProgressReporter el avance se registra en su archivo de eventos).
+
+        Returns:
+            Tupla (resultado base de datos, resultado moodledata)
+        """
+        legs = {
+            'database': lambda: self._tracked('database', self.backup_database),
+            'moodledata': lambda: self._tracked('moodledata', self.backup_moodledata),
+        }
+        results = {}
+
+        def run_leg(name, function):
+            try:
+                results[name] = function()
+            except Exception as e:
+                self.log_error(f"Error inesperado en la etapa {name}: {e}")
+                results[name] = False
+
+        threads = [threading.Thread(target=run_leg, args=item, name=item[0]) for item in legs.items()]
+        for thread in threads:
+            thread.start()
+
+        db_prefixes = (f"{self._db_credentials()[0]}_", PARALLEL_DIR, PHYSICAL_PREFIX)
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(PROGRESS_INTERVAL / len(threads))
+            # Con ProgressReporter el progreso se muestra como barra (ver progress.py)
+            if not any(thread.is_alive() for thread in threads) or self.progress is not None:
+                continue
+            db_state = 'terminado' if 'database' in results else 'en curso'
+            md_state = 'terminado' if 'moodledata' in results else 'en curso'
+            print(f"  Progreso: base de datos {format_bytes(self._leg_size(db_prefixes))} ({db_state}) | "
+                  f"moodledata {format_bytes(self._leg_size(('moodledata_',)))} ({md_state})")
+
+        return results['database'], results['moodledata']
+
+    def cleanup_old_backups(self):
+        """Aplica la politica de retencion (diaria/semanal/mensual) del ambiente"""
+        retention = RetentionManager(
+            self.base_dir,
+            daily=self.settings.BACKUP_KEEP_DAILY,
+            weekly=self.settings.BACKUP_KEEP_WEEKLY,
+            monthly=self.settings.BACKUP_KEEP_MONTHLY
+        )
+        self.log_info(
+            f"Aplicando retención: {retention.daily} diarios, {retention.weekly} semanales, "
+            f"{retention.monthly} mensuales")
+
+        try:
+            # El respaldo en curso nunca se elimina
+            deleted = retention.apply(self.environment, protect=(self.timestamp,))
+        except OSError as e:
+            self.log_warning(f"Hubo problemas al eliminar respaldos antiguos: {e}")
+            return False
+
+        if deleted:
+            freed = format_bytes(sum(backup['size_bytes'] for backup in deleted))
+            self.log_success(
+                f"Respaldos antiguos eliminados: {len(deleted)} ({freed}, borrado en segundo plano)")
+        else:
+            self.log_success("No hay respaldos fuera de la política de retención")
+
+        self.collect_blob_garbage()
+        return True
+
+    def collect_blob_garbage(self):
+        """Libera los blobs que ya no referencia ningun manifiesto"""
+        store_dir = os.path.join(self.base_dir, BLOB_STORE_DIR)
+        if not os.path.isdir(store_dir):
+            return
+        try:
+            removed, freed = BlobStore(store_dir).collect_garbage(self.base_dir)
+            if removed:
+                self.log_info(f"Blobs sin referencias eliminados: {removed} ({format_bytes(freed)})")
+        except Exception as e:
+            self.log_warning(f"No se pudo limpiar el almacen de blobs: {e}")
+
+    def upload_remote(self):
+        """Replica el respaldo al almacenamiento S3 configurado"""
+        self.log_info(f"Replicando respaldo a {self.settings.BACKUP_REMOTE_ENDPOINT} "
+                      f"(bucket {self.settings.BACKUP_REMOTE_BUCKET})")
+        try:
+            stats = RemoteReplicator.from_settings(self.settings).upload_backup(self.environment, self.timestamp)
+        except Exception as e:
+            self.log_error(f"Error al replicar el respaldo (se reanuda en la próxima subida): {e}")
+            return False
+
+        self.stats['remote'] = stats
+        self.log_success(
+            f"Respaldo replicado: {stats['uploaded']} archivos subidos ({format_bytes(stats['bytes'])}), "
+            f"{stats['skipped']} sin cambios, {stats['blobs']} blobs, {stats['seconds']}s")
+        return True
+
+    def send_email_notification(self, status, details, attachment=None):
+        """
+        Envía la notificación usando send_mail.py
+
+        Con BACKUP_EMAIL_SPOOL definida (ver BackupManager.create_backups) la
+        notificación se encola para el correo de resumen.
+        """
+        email_to = self.settings.BACKUP_EMAIL_TO
+        email_script = Path(__file__).parent / 'send_mail.py'
+
+        if not email_script.exists():
+            self.log_warning(f"Script de email no encontrado: {email_script}")
+            return False
+        if not email_to:
+            self.log_warning("No se ha configurado BACKUP_EMAIL_TO")
+            return False
+
+        env = os.environ.copy()
+        env.update({k: str(v) for k, v in self.settings.env_vars.items() if k.startswith('SMTP_')})
+        subject = f"[Backup Moodle] {self.environment} - {status}"
+        message = (f"Respaldo de Moodle {self.environment}\nFecha: {self.timestamp}\n"
+                   f"Estado: {status}\n\nDetalles:\n{details}")
+
+        with open(self.log_file, 'a') as log:
+            result = subprocess.run(
+                ['python3', str(email_script), email_to, subject, message] + ([attachment] if attachment else []),
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                env=env
+            )
+
+        if result.returncode == 0:
+            if os.environ.get('BACKUP_EMAIL_SPOOL'):
+                self.log_success("Notificación agregada al correo de resumen")
+            else:
+                self.log_success("Notificación enviada por email")
+            return True
+        self.log_warning("No se pudo enviar la notificación por email")
+        return False
+
+    # ------------------------------------------------------------------
+    # Flujo principal
+    # ------------------------------------------------------------------
+
+    def run(self):
+        """
+        Ejecuta el respaldo completo (base de datos + moodledata)
+
+        Returns:
+            True si el respaldo fue exitoso, False en caso contrario
+        """
+        print(f"Creando directorio de respaldo: {self.backup_dir}")
+        try:
+            os.makedirs(self.backup_dir, exist_ok=True)
+        except OSError:
+            print("ERROR: No se pudo crear el directorio de respaldo")
+            return False
+
+        self.log_info("==========================================")
+        self.log_info(f"Iniciando respaldo de Moodle {self.environment}")
+        self.log_info("==========================================")
+
+        started = time.monotonic()
+        backup_status = "SUCCESS"
+        error_details = ""
+
+        self.log_success("Directorio de respaldo creado")
+        with open(os.path.join(self.backup_dir, 'INICIO.log'), 'w') as f:
+            f.write(f"INICIO RESPALDO MOODLE {self.environment}\n{datetime.now()}\n")
+        self.log_info(f"Prioridad y límites: {self.throttle.describe()}")
+
+        if self.settings.BACKUP_CONCURRENT:
+            self.log_info("Respaldando base de datos y moodledata en paralelo")
+            database_ok, moodledata_ok = self.run_concurrent()
+        else:
+            database_ok = self._tracked('database', self.backup_database)
+            moodledata_ok = self._tracked('moodledata', self.backup_moodledata)
+
+        if not database_ok:
+            backup_status = "FAILED"
+            error_details += "\n- Error al respaldar base de datos MySQL"
+
+        if not moodledata_ok:
+            backup_status = "FAILED"
+            error_details += "\n- Error al respaldar moodledata"
+
+        self.cleanup_old_backups()
+
+        with open(os.path.join(self.backup_dir, 'FIN_RESPALDO.log'), 'w') as f:
+            f.write(f"{datetime.now()}\n")
+
+        self.stats['status'] = backup_status
+        self.stats['codec'] = self.codec.name
+        self.stats['db_mode'] = self.db_mode
+        self.stats['seconds'] = round(time.monotonic() - started, 3)
+        self.stats['throttle'] = self.throttle.describe()
+        with open(os.path.join(self.backup_dir, 'STATS.json'), 'w') as f:
+            json.dump(self.stats, f, indent=2)
+
+        try:
+            self.catalog.record_backup(
+                self.environment, self.timestamp,
+                status=backup_status,
+                codec=self.codec.name,
+                duration_seconds=self.stats['seconds'],
+                stats=self.stats
+            )
+        except Exception as e:
+            self.log_warning(f"No se pudo registrar el respaldo en el catálogo: {e}")
+
+        remote_note = ""
+        if self.settings.BACKUP_REMOTE_ENABLED and backup_status == "SUCCESS":
+            remote_note = "\nCopia remota: " + ("OK" if self.upload_remote() else "FALLIDA")
+
+        backup_size = format_bytes(self._dir_size(self.backup_dir))
+        self.log_info("==========================================")
+        self.log_info(f"Respaldo completado con estado: {backup_status}")
+        self.log_info(f"Ubicación: {self.backup_dir}")
+        self.log_info(f"Tamaño total: {backup_size}")
+        self.log_info("==========================================")
+
+        if backup_status == "SUCCESS":
+            self.send_email_notification(
+                "EXITOSO",
+                f"Respaldo completado correctamente\nUbicación: {self.backup_dir}\nTamaño: {backup_size}{remote_note}")
+        else:
+            self.send_email_notification(
+                "FALLIDO",
+                f"Errores durante el respaldo:{error_details}\nUbicación: {self.backup_dir}",
+                attachment=self.log_file)
+
+        return backup_status == "SUCCESS"
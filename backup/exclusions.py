@@ -0,0 +1,58 @@
+"""
+Exclusions Module
+Perfil de exclusion de directorios de moodledata
+
+Moodle regenera por si mismo cache/, localcache/, temp/, sessions/ y trashdir/;
+en sitios grandes son buena parte de los archivos del volumen. Los respaldos
+(tar completo e incremental) los omiten y la restauracion los vuelve a crear
+vacios con el mismo dueño que la raiz de moodledata.
+
+Solo usa la biblioteca estandar para poder usarse desde los scripts de shell.
+"""
+
+import os
+
+
+# Rutas relativas a la raiz de moodledata
+DEFAULT_EXCLUDES = ('cache', 'localcache', 'temp', 'sessions', 'trashdir')
+
+
+def parse_excludes(value):
+    """
+    Normaliza un perfil de exclusion
+
+    Args:
+        value: 'cache,temp,...', una lista o None (perfil por defecto).
+               Una cadena vacia desactiva las exclusiones.
+
+    Returns:
+        Lista de rutas relativas sin duplicados
+    """
+    if value is None:
+        return list(DEFAULT_EXCLUDES)
+    items = value.split(',') if isinstance(value, str) else value
+    excludes = []
+    for item in items:
+        item = item.strip().strip('/')
+        while item.startswith('./'):
+            item = item[2:]
+        if not item or '..' in item.split('/'):
+            continue
+        if item not in excludes:
+            excludes.append(item)
+    return excludes
+
+
+def is_excluded(relative, excludes):
+    """True si la ruta (relativa a moodledata) es o esta dentro de un directorio excluido"""
+    return any(relative == item or relative.startswith(item + '/') for item in excludes)
+
+
+def tar_exclude_args(excludes):
+    """Opciones --exclude para `tar -C <moodledata> .` (GNU tar y busybox)"""
+    return [f'--exclude=./{item}' for item in excludes]
+
+
+def excludes_from_env():
+    """Perfil desde BACKUP_MOODLEDATA_EXCLUDE (sin definir = perfil por defecto)"""
+    return parse_excludes(os.environ.get('BACKUP_MOODLEDATA_EXCLUDE'))
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Incremental Backup Module
+Respaldos incrementales de moodledata basados en contenido (content-addressed)
+
+Moodle guarda los archivos de filedir bajo su hash SHA1
+(filedir/ab/cd/abcd...), por lo que un archivo con el mismo nombre tiene
+siempre el mismo contenido. El almacen de blobs aprovecha esto: solo copia
+los hashes que aun no existen y cada respaldo queda reducido a un manifiesto.
+
+El almacen es compartido entre testing y production.
+Solo usa la biblioteca estandar para poder ejecutarse desde restore.sh.
+"""
+
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import stat
+import sys
+import tarfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backup.exclusions import excludes_from_env, is_excluded
+from backup.integrity import HashingWriter
+from backup.progress import meter_from_env
+from backup.throttle import throttle_from_env
+
+
+CHUNK_SIZE = 1024 * 1024
+MANIFEST_FORMAT = 'moodledata-manifest'
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = '.manifest.json.gz'
+
+# Directorio del almacen dentro de BACKUPS_PATH
+BLOB_STORE_DIR = 'blobs'
+
+# filedir/ab/cd/<sha1 completo que empieza por abcd>
+FILEDIR_HASH = re.compile(r'^[0-9a-f]{40}$')
+
+
+def sha1_file(path):
+    """Calcula el SHA1 de un archivo"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def filedir_hash(relative_path):
+    """
+    Devuelve el contenthash si la ruta pertenece al filedir de Moodle
+
+    Args:
+        relative_path: Ruta relativa a la raiz de moodledata
+
+    Returns:
+        Hash SHA1 o None si no es un blob de filedir
+    """
+    parts = relative_path.split('/')
+    if len(parts) != 4 or parts[0] != 'filedir':
+        return None
+    name = parts[3]
+    if FILEDIR_HASH.match(name) and name[0:2] == parts[1] and name[2:4] == parts[2]:
+        return name
+    return None
+
+
+def read_manifest(path):
+    """
+    Lee un manifiesto
+
+    Returns:
+        Tupla (cabecera, lista de entradas)
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        if header.get('format') != MANIFEST_FORMAT:
+            raise ValueError(f"{path} no es un manifiesto de moodledata")
+        entries = [json.loads(line) for line in f if line.strip()]
+    return header, entries
+
+
+class BlobStore:
+    """Almacen de blobs direccionado por SHA1, compartido entre ambientes"""
+
+    def __init__(self, root, throttle=None):
+        self.root = root
+        self.lock_file = os.path.join(root, '.lock')
+        # Limite de ancho de banda opcional para las copias (ver throttle.py)
+        self.throttle = throttle
+
+    def blob_path(self, sha1):
+        """Ruta del blob con el mismo esquema que filedir (ab/cd/abcd...)"""
+        return os.path.join(self.root, sha1[0:2], sha1[2:4], sha1)
+
+    def has_blob(self, sha1):
+        return os.path.exists(self.blob_path(sha1))
+
+    @contextmanager
+    def locked(self, exclusive=False):
+        """
+        Bloqueo del almacen: los respaldos toman un bloqueo compartido y la
+        recoleccion de basura uno exclusivo, para no borrar blobs en uso
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.lock_file, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def put_file(self, source, sha1):
+        """
+        Copia un archivo al almacen si el blob no existe
+
+        Returns:
+            Bytes copiados o None si el blob ya existia
+        """
+        target = self.blob_path(sha1)
+        if os.path.exists(target):
+            return None
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        partial = f"{target}.{os.getpid()}.part"
+        if self.throttle is None:
+            shutil.copyfile(source, partial)
+        else:
+            with open(source, 'rb') as src, open(partial, 'wb') as dst:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                    self.throttle.consume(len(chunk))
+                    dst.write(chunk)
+        # Escritura atomica: otro ambiente puede estar guardando el mismo blob
+        os.replace(partial, target)
+        return os.path.getsize(target)
+
+    def snapshot(self, source_dir, manifest_path, metadata=None, exclude=(), progress=None):
+        """
+        Guarda el contenido de source_dir en el almacen y escribe el manifiesto
+
+        Args:
+            source_dir: Raiz de moodledata (punto de montaje del volumen)
+            manifest_path: Ruta del manifiesto a generar (.manifest.json.gz)
+            metadata: Dict con datos extra para la cabecera
+            exclude: Rutas relativas que no se respaldan (ver exclusions.py)
+            progress: Funcion progress(bytes, files=) llamada por cada archivo (opcional)
+
+        Returns:
+            Dict con estadisticas (archivos, bytes, blobs nuevos, bytes copiados
+            y SHA-256 del manifiesto)
+        """
+        stats = {
+            'files': 0,
+            'directories': 0,
+            'bytes': 0,
+            'new_blobs': 0,
+            'copied_bytes': 0,
+            'reused_blobs': 0,
+        }
+        started = time.monotonic()
+        header = {
+            'format': MANIFEST_FORMAT,
+            'version': MANIFEST_VERSION,
+            'created': datetime.now().isoformat(timespec='seconds'),
+        }
+        header.update(metadata or {})
+        if exclude:
+            header['excluded'] = list(exclude)
+
+        partial = manifest_path + '.part'
+        try:
+            with self.locked(), open(partial, 'wb') as raw:
+                # El SHA-256 del manifiesto se calcula sobre los bytes comprimidos al escribirlos
+                hashing = HashingWriter(raw)
+                with gzip.open(hashing, 'wt', encoding='utf-8') as manifest:
+                    manifest.write(json.dumps(header) + '\n')
+
+                    for root, dirs, files in os.walk(source_dir):
+                        relative_root = os.path.relpath(root, source_dir)
+                        relative_root = '' if relative_root == '.' else relative_root
+                        # Los directorios excluidos no se recorren
+                        dirs[:] = sorted(d for d in dirs if not is_excluded(
+                            f"{relative_root}/{d}" if relative_root else d, exclude))
+
+                        for name in dirs + sorted(files):
+                            path = os.path.join(root, name)
+                            relative = f"{relative_root}/{name}" if relative_root else name
+                            if is_excluded(relative, exclude):
+                                continue
+                            entry = self._snapshot_entry(path, relative, stats)
+                            if entry:
+                                manifest.write(json.dumps(entry) + '\n')
+                                if progress is not None and entry['type'] == 'file':
+                                    progress(entry['size'], files=1)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+
+        os.replace(partial, manifest_path)
+        stats['sha256'] = hashing.hexdigest()
+        stats['seconds'] = round(time.monotonic() - started, 3)
+        return stats
+
+    def _snapshot_entry(self, path, relative, stats):
+        st = os.lstat(path)
+        entry = {
+            'path': relative,
+            'mode': stat.S_IMODE(st.st_mode),
+            'uid': st.st_uid,
+            'gid': st.st_gid,
+            'mtime': int(st.st_mtime),
+        }
+
+        if stat.S_ISDIR(st.st_mode):
+            entry['type'] = 'dir'
+            stats['directories'] += 1
+        elif stat.S_ISLNK(st.st_mode):
+            entry['type'] = 'symlink'
+            entry['target'] = os.readlink(path)
+        elif stat.S_ISREG(st.st_mode):
+            # En filedir el nombre ya es el hash; el resto se hashea
+            sha1 = filedir_hash(relative) or sha1_file(path)
+            copied = self.put_file(path, sha1)
+            if copied is None:
+                stats['reused_blobs'] += 1
+            else:
+                stats['new_blobs'] += 1
+                stats['copied_bytes'] += copied
+            entry.update({'type': 'file', 'sha1': sha1, 'size': st.st_size})
+            stats['files'] += 1
+            stats['bytes'] += st.st_size
+        else:
+            # Sockets, FIFOs y dispositivos no se respaldan
+            return None
+        return entry
+
+    def missing_blobs(self, entries):
+        """Hashes del manifiesto que no existen en el almacen"""
+        return [e['sha1'] for e in entries if e['type'] == 'file' and not self.has_blob(e['sha1'])]
+
+    def write_tar(self, manifest_path, output):
+        """
+        Reconstruye el volumen completo como un stream tar
+
+        Args:
+            manifest_path: Manifiesto del respaldo
+            output: Objeto binario donde escribir el tar (ej. sys.stdout.buffer)
+        """
+        _, entries = read_manifest(manifest_path)
+
+        missing = self.missing_blobs(entries)
+        if missing:
+            raise FileNotFoundError(f"Faltan {len(missing)} blobs en el almacen (ej. {missing[0]})")
+
+        with tarfile.open(fileobj=output, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+            for entry in entries:
+                info = tarfile.TarInfo(entry['path'])
+                info.mode = entry['mode']
+                info.uid = entry['uid']
+                info.gid = entry['gid']
+                info.mtime = entry['mtime']
+
+                if entry['type'] == 'dir':
+                    info.type = tarfile.DIRTYPE
+                    tar.addfile(info)
+                elif entry['type'] == 'symlink':
+                    info.type = tarfile.SYMTYPE
+                    info.linkname = entry['target']
+                    tar.addfile(info)
+                else:
+                    info.size = entry['size']
+                    with open(self.blob_path(entry['sha1']), 'rb') as blob:
+                        tar.addfile(info, blob)
+
+    def referenced_blobs(self, backups_root):
+        """
+        Conjunto de hashes referenciados por todos los manifiestos
+
+        Sigue los enlaces de los respaldos en almacenamiento frio; si alguno
+        no se puede resolver (volumen frio sin montar) falla, ya que sus
+        manifiestos no se pueden leer.
+        """
+        referenced = set()
+        store = os.path.abspath(self.root)
+        for root, dirs, files in os.walk(backups_root, followlinks=True):
+            # Los directorios ocultos (ej. .trash) contienen respaldos ya eliminados
+            # y el propio almacen no tiene manifiestos
+            dirs[:] = [d for d in dirs
+                       if not d.startswith('.') and os.path.abspath(os.path.join(root, d)) != store]
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.islink(path) and not os.path.exists(path):
+                    raise RuntimeError(f"Respaldo en almacenamiento frío inaccesible: {path} -> "
+                                       f"{os.readlink(path)}; se omite la limpieza de blobs")
+                if name.endswith(MANIFEST_SUFFIX):
+                    _, entries = read_manifest(path)
+                    referenced.update(e['sha1'] for e in entries if e['type'] == 'file')
+        return referenced
+
+    def collect_garbage(self, backups_root):
+        """
+        Elimina los blobs que ya no referencia ningun manifiesto
+
+        Returns:
+            Tupla (blobs eliminados, bytes liberados)
+        """
+        removed = 0
+        freed = 0
+        with self.locked(exclusive=True):
+            referenced = self.referenced_blobs(backups_root)
+            for root, _, files in os.walk(self.root):
+                for name in files:
+                    if not FILEDIR_HASH.match(name) or name in referenced:
+                        continue
+                    path = os.path.join(root, name)
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+                    removed += 1
+        return removed, freed
+
+
+def main(argv):
+    usage = (
+        "Uso:\n"
+        "  incremental.py backup <origen> <almacen> <manifiesto>\n"
+        "  incremental.py check <manifiesto> <almacen>\n"
+        "  incremental.py tar <manifiesto> <almacen>      (tar del volumen a stdout)\n"
+        "  incremental.py gc <directorio_backups> <almacen>"
+    )
+    command = argv[1] if len(argv) > 1 else None
+    if len(argv) < (5 if command == 'backup' else 4):
+        print(usage, file=sys.stderr)
+        return 1
+
+    try:
+        if command == 'backup':
+            # Con BACKUP_PROGRESS_FILE (backup.sh) se registra el progreso de la etapa
+            reporter, meter = meter_from_env('moodledata')
+            ok = False
+            try:
+                stats = BlobStore(argv[3], throttle_from_env()).snapshot(
+                    argv[2], argv[4], exclude=excludes_from_env(), progress=meter.add if meter else None)
+                ok = True
+            finally:
+                if reporter is not None:
+                    reporter.close()
+                    reporter.end_stage('moodledata', ok)
+            print(json.dumps(stats))
+        elif command == 'check':
+            _, entries = read_manifest(argv[2])
+            missing = BlobStore(argv[3]).missing_blobs(entries)
+            if missing:
+                print(f"Faltan {len(missing)} blobs en el almacen (ej. {missing[0]})", file=sys.stderr)
+                return 1
+            print(f"Manifiesto completo: {len(entries)} entradas")
+        elif command == 'tar':
+            BlobStore(argv[3]).write_tar(argv[2], sys.stdout.buffer)
+        elif command == 'gc':
+            removed, freed = BlobStore(argv[3]).collect_garbage(argv[2])
+            print(f"Blobs eliminados: {removed} ({freed} bytes)")
+        else:
+            print(usage, file=sys.stderr)
+            return 1
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
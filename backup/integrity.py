@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Integrity Module
+Checksums SHA-256 de los artefactos de cada respaldo
+
+Los hashes se calculan mientras los archivos se escriben (sin una segunda
+lectura) y se guardan en SHA256SUMS, junto a DB_INFO.txt, en el mismo
+formato que sha256sum para poder comprobarlos tambien con `sha256sum -c`.
+La verificacion vuelve a leer los archivos con lecturas secuenciales grandes
+en un pool de hilos y, para los comprimidos, prueba el stream con gzip/zstd -t.
+
+Solo usa la biblioteca estandar para poder ejecutarse desde backup.sh.
+"""
+
+import hashlib
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backup.compression import detect_codec
+
+
+CHECKSUM_FILE = 'SHA256SUMS'
+
+# Lecturas secuenciales grandes para la verificacion
+VERIFY_BLOCK_SIZE = 8 * 1024 * 1024
+
+# Archivos de control del respaldo que no se verifican
+CONTROL_FILES = (CHECKSUM_FILE, 'backup.log', 'STATS.json')
+
+
+class HashingWriter:
+    """Envuelve un archivo binario y calcula el SHA-256 de lo que se escribe"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.digest = hashlib.sha256()
+        self.bytes = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.bytes += len(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+class HashingCopier(threading.Thread):
+    """
+    Copia la salida de un proceso a un archivo calculando su SHA-256
+
+    Se usa cuando el hilo principal esta ocupado alimentando al compresor
+    """
+
+    def __init__(self, source, output_file, chunk_size=1024 * 1024, throttle=None):
+        super().__init__(daemon=True)
+        self.source = source
+        self.output_file = output_file
+        self.chunk_size = chunk_size
+        self.throttle = throttle
+        self.sha256 = None
+        self.bytes = 0
+        self.error = None
+
+    def run(self):
+        try:
+            with open(self.output_file, 'wb') as output:
+                writer = HashingWriter(output)
+                for chunk in iter(lambda: self.source.read(self.chunk_size), b''):
+                    if self.throttle is not None:
+                        self.throttle.consume(len(chunk))
+                    writer.write(chunk)
+            self.sha256 = writer.hexdigest()
+            self.bytes = writer.bytes
+        except Exception as e:
+            self.error = e
+
+
+def read_checksums(backup_dir):
+    """
+    Lee SHA256SUMS de un respaldo
+
+    Returns:
+        Dict {ruta relativa: sha256} (vacio si no existe)
+    """
+    checksums = {}
+    try:
+        with open(os.path.join(backup_dir, CHECKSUM_FILE)) as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if not line:
+                    continue
+                digest, name = line.split('  ', 1)
+                checksums[name] = digest
+    except OSError:
+        pass
+    return checksums
+
+
+def add_checksums(backup_dir, checksums):
+    """
+    Agrega entradas a SHA256SUMS
+
+    Se escribe en modo append con una sola escritura, por lo que las etapas
+    concurrentes (hilos del motor o procesos de backup.sh) pueden agregar
+    sus checksums a la vez. Si un archivo aparece dos veces vale la ultima.
+
+    Args:
+        backup_dir: Directorio del respaldo
+        checksums: Dict {ruta relativa: sha256}
+    """
+    lines = ''.join(f"{digest}  {name}\n" for name, digest in sorted(checksums.items()))
+    with open(os.path.join(backup_dir, CHECKSUM_FILE), 'a') as f:
+        f.write(lines)
+
+
+def backup_artifacts(backup_dir):
+    """Archivos de datos de un respaldo (excluye logs y marcas de control)"""
+    artifacts = []
+    for root, _, files in os.walk(backup_dir):
+        for name in files:
+            relative = os.path.relpath(os.path.join(root, name), backup_dir)
+            if relative in CONTROL_FILES or name.endswith(('.log', '.txt', '.part')):
+                continue
+            artifacts.append(relative)
+    return sorted(artifacts)
+
+
+def verify_file(path, expected=None):
+    """
+    Relee un archivo calculando su SHA-256 y probando el stream comprimido
+
+    La misma lectura alimenta al hash y a `gzip -t`/`zstd -t`, por lo que
+    cada archivo se lee una sola vez.
+
+    Args:
+        path: Ruta del archivo
+        expected: SHA-256 esperado (None si el respaldo no tiene checksum)
+
+    Returns:
+        Dict con sha256, bytes, segundos, resultado del hash y del stream
+    """
+    started = time.monotonic()
+    digest = hashlib.sha256()
+    total = 0
+    codec = detect_codec(path)
+    tester = None
+    if codec is not None and codec.is_available():
+        tester = subprocess.Popen(codec.test_command(), stdin=subprocess.PIPE,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    stream_ok = True
+    with open(path, 'rb', buffering=0) as f:
+        for block in iter(lambda: f.read(VERIFY_BLOCK_SIZE), b''):
+            digest.update(block)
+            total += len(block)
+            if tester is not None and stream_ok:
+                try:
+                    tester.stdin.write(block)
+                except BrokenPipeError:
+                    # El probador termino antes: el stream esta dañado
+                    stream_ok = False
+
+    if tester is not None:
+        try:
+            tester.stdin.close()
+        except BrokenPipeError:
+            pass
+        stream_ok = tester.wait() == 0 and stream_ok
+
+    sha256 = digest.hexdigest()
+    seconds = time.monotonic() - started
+    return {
+        'sha256': sha256,
+        'bytes': total,
+        'seconds': round(seconds, 3),
+        'hash_ok': None if expected is None else sha256 == expected,
+        'stream_ok': None if tester is None else stream_ok,
+        'codec': codec.name if codec else None,
+    }
+
+
+def verify_backup_files(tasks, threads=4):
+    """
+    Verifica archivos de uno o varios respaldos en un pool de hilos
+
+    Args:
+        tasks: Lista de tuplas (clave, ruta, sha256 esperado o None)
+        threads: Hilos de verificacion
+
+    Returns:
+        Dict {clave: resultado de verify_file}
+    """
+    def run(task):
+        key, path, expected = task
+        try:
+            return key, verify_file(path, expected)
+        except OSError as e:
+            return key, {'error': str(e), 'bytes': 0, 'seconds': 0, 'hash_ok': False, 'stream_ok': None}
+
+    with ThreadPoolExecutor(max_workers=max(1, int(threads))) as pool:
+        return dict(pool.map(run, tasks))
+
+
+def result_ok(result):
+    """Un archivo es valido si ni el hash ni el stream fallaron"""
+    return 'error' not in result and result['hash_ok'] is not False and result['stream_ok'] is not False
+
+
+def main(argv):
+    usage = (
+        "Uso:\n"
+        "  integrity.py verify <directorio_backup> [hilos]"
+    )
+    if len(argv) >= 3 and argv[1] == 'verify':
+        backup_dir = argv[2]
+        checksums = read_checksums(backup_dir)
+        tasks = [(name, os.path.join(backup_dir, name), checksums.get(name))
+                 for name in backup_artifacts(backup_dir)]
+        results = verify_backup_files(tasks, int(argv[3]) if len(argv) > 3 else 4)
+        failed = 0
+        for name, result in sorted(results.items()):
+            ok = result_ok(result)
+            failed += 0 if ok else 1
+            print(f"{'OK' if ok else 'FALLO'}  {name}")
+        return 1 if failed else 0
+    print(usage, file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
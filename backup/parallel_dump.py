@@ -0,0 +1,569 @@
+#!/usr/bin/env python3
+"""
+Parallel Dump Module
+Respaldo logico de MySQL por tabla y en paralelo, con carga concurrente
+
+Todas las sesiones de trabajo abren su transaccion con
+START TRANSACTION WITH CONSISTENT SNAPSHOT mientras una sesion de control
+mantiene FLUSH TABLES WITH READ LOCK, por lo que todos los archivos
+corresponden al mismo instante. Las tablas grandes (ej.
+mdl_logstore_standard_log) se dividen en rangos de su clave primaria.
+
+Estructura generada:
+    mysql_parallel/
+        index.json          tablas, fragmentos, filas y posicion del binlog
+        schema.sql.gz       CREATE TABLE / vistas (sin triggers)
+        post.sql.gz         triggers, rutinas y eventos
+        data/<tabla>.<n>.sql.gz
+Cada archivo registra su SHA-256 (calculado al escribirlo) en index.json.
+"""
+
+import hashlib
+import json
+import math
+import os
+import queue
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backup.compression import detect_codec, resolve_codec
+from backup.integrity import HashingCopier, add_checksums
+from backup.progress import meter_from_env
+from backup.throttle import throttle_from_env
+
+
+PARALLEL_DIR = 'mysql_parallel'
+INDEX_FILE = 'index.json'
+
+# Tamaño maximo de cada sentencia INSERT generada
+MAX_STATEMENT_BYTES = 1024 * 1024
+
+# Tipos que se exportan en hexadecimal para no depender del charset
+BINARY_TYPES = {'binary', 'varbinary', 'tinyblob', 'blob', 'mediumblob', 'longblob', 'bit'}
+
+# Escapes que aplica el cliente mysql en modo --batch
+BATCH_ESCAPE = re.compile(rb'\\(.)')
+BATCH_UNESCAPE = {b'n': b'\n', b't': b'\t', b'0': b'\0', b'\\': b'\\'}
+
+CHUNK_HEADER = (
+    "/*!40101 SET NAMES utf8mb4 */;\n"
+    "SET time_zone='+00:00';\n"
+    "SET foreign_key_checks=0;\n"
+    "SET unique_checks=0;\n"
+    "SET sql_mode='NO_AUTO_VALUE_ON_ZERO';\n"
+    "START TRANSACTION;\n"
+)
+CHUNK_FOOTER = "COMMIT;\n"
+
+
+def quote_identifier(name):
+    return '`' + name.replace('`', '``') + '`'
+
+
+def unescape_batch_line(line):
+    """Revierte el escape de --batch (\\n, \\t, \\0, \\\\)"""
+    return BATCH_ESCAPE.sub(lambda m: BATCH_UNESCAPE.get(m.group(1), b'\\' + m.group(1)), line)
+
+
+class MySQLSession:
+    """
+    Sesion interactiva con el cliente mysql dentro del contenedor
+    Cada consulta termina con un SELECT centinela para saber donde acaba su salida
+    """
+
+    def __init__(self, container, user, password, database, log_file=None):
+        env = os.environ.copy()
+        env['MYSQL_PWD'] = password
+        self.log_file = log_file
+        self.stderr = open(log_file, 'ab') if log_file else subprocess.DEVNULL
+        self.process = subprocess.Popen(
+            ['docker', 'exec', '-i', '-e', 'MYSQL_PWD', container, 'mysql',
+             f'-u{user}', '--batch', '--skip-column-names',
+             '--default-character-set=utf8mb4', database],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self.stderr,
+            env=env
+        )
+        self.counter = 0
+
+    def stream(self, sql):
+        """
+        Ejecuta una sentencia y devuelve un generador con las filas (bytes sin escapar)
+
+        Raises:
+            RuntimeError si el cliente termina antes del centinela
+        """
+        self.counter += 1
+        sentinel = f"__moodle_backup_sync_{self.counter}__"
+        self.process.stdin.write(f"{sql};\nSELECT '{sentinel}';\n".encode('utf-8'))
+        self.process.stdin.flush()
+
+        marker = sentinel.encode('utf-8')
+        for line in self.process.stdout:
+            line = line.rstrip(b'\n')
+            if line == marker:
+                return
+            yield unescape_batch_line(line)
+        raise RuntimeError(f"La sesion MySQL terminó inesperadamente ejecutando: {sql[:120]}")
+
+    def execute(self, sql):
+        """Ejecuta una sentencia y devuelve todas sus filas como texto"""
+        return [line.decode('utf-8', 'replace').split('\t') for line in self.stream(sql)]
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except Exception:
+            pass
+        self.process.wait()
+        if self.stderr is not subprocess.DEVNULL:
+            self.stderr.close()
+
+
+class ParallelDumper:
+    """Exporta una base de datos en fragmentos comprimidos usando un pool de sesiones"""
+
+    def __init__(self, container, database, password, output_dir, codec, level=None,
+                 workers=4, chunk_bytes=256 * 1024 * 1024, threads=None, log_file=None,
+                 user='root', throttle=None, progress=None):
+        self.container = container
+        self.database = database
+        self.password = password
+        self.user = user
+        self.output_dir = output_dir
+        self.codec = codec
+        self.level = level
+        self.workers = max(1, int(workers))
+        self.chunk_bytes = max(1, int(chunk_bytes))
+        self.log_file = log_file
+        self.throttle = throttle
+        # progress(bytes, rows=) recibe cada sentencia escrita (ver progress.StageMeter.add)
+        self.progress = progress
+        # Los hilos del compresor se reparten entre los workers
+        total_threads = int(threads or 0) or (os.cpu_count() or 1)
+        self.compress_threads = max(1, total_threads // self.workers)
+        # SHA-256 de cada archivo generado, relativo a output_dir
+        self.checksums = {}
+        self.lock = threading.Lock()
+
+    def _session(self):
+        return MySQLSession(self.container, self.user, self.password, self.database, self.log_file)
+
+    def _compress_command(self):
+        command = self.codec.compress_command(self.level, self.compress_threads)
+        return self.throttle.command(command) if self.throttle else command
+
+    def _mysqldump(self, extra_args, output_file):
+        """Ejecuta mysqldump (sin datos) hacia un archivo comprimido"""
+        env = os.environ.copy()
+        env['MYSQL_PWD'] = self.password
+        command = ['docker', 'exec', '-e', 'MYSQL_PWD', self.container, 'mysqldump',
+                   f'-u{self.user}', '--no-data', '--single-transaction', '--no-tablespaces',
+                   '--skip-comments'] + extra_args + [self.database]
+        stderr = open(self.log_file, 'ab') if self.log_file else subprocess.DEVNULL
+        try:
+            dump = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, env=env)
+            compressor = subprocess.Popen(
+                self._compress_command(), stdin=dump.stdout, stdout=subprocess.PIPE, stderr=stderr)
+            dump.stdout.close()
+            copier = HashingCopier(compressor.stdout, output_file, throttle=self.throttle)
+            copier.start()
+            copier.join()
+            if dump.wait() != 0 or compressor.wait() != 0 or copier.error:
+                raise RuntimeError(f"mysqldump falló ({' '.join(extra_args)})")
+            self.checksums[os.path.basename(output_file)] = copier.sha256
+        finally:
+            if stderr is not subprocess.DEVNULL:
+                stderr.close()
+
+    def _table_plan(self, session):
+        """Lista tablas, columnas y fragmentos a exportar"""
+        db = self.database.replace("'", "''")
+        tables = session.execute(
+            "SELECT table_name, data_length FROM information_schema.tables "
+            f"WHERE table_schema = '{db}' AND table_type = 'BASE TABLE' ORDER BY table_name")
+        columns = session.execute(
+            "SELECT table_name, column_name, data_type, extra, column_key FROM information_schema.columns "
+            f"WHERE table_schema = '{db}' ORDER BY table_name, ordinal_position")
+        integer_types = {'tinyint', 'smallint', 'mediumint', 'int', 'bigint'}
+
+        table_columns = {}
+        primary_keys = {}
+        for table, column, data_type, extra, column_key in columns:
+            # Las columnas generadas se recalculan al cargar (DEFAULT_GENERATED si se exporta)
+            if extra.upper() in ('VIRTUAL GENERATED', 'STORED GENERATED'):
+                continue
+            table_columns.setdefault(table, []).append((column, data_type.lower()))
+            if column_key == 'PRI':
+                primary_keys.setdefault(table, []).append((column, data_type.lower()))
+
+        tasks = []
+        for table, data_length in tables:
+            data_length = int(data_length) if data_length.isdigit() else 0
+            pk = primary_keys.get(table, [])
+            ranges = [(None, None)]
+            key = None
+            if len(pk) == 1 and pk[0][1] in integer_types:
+                key = pk[0][0]
+                chunks = math.ceil(data_length / self.chunk_bytes)
+                if chunks > 1:
+                    ranges = self._key_ranges(session, table, key, chunks)
+            for number, (low, high) in enumerate(ranges):
+                tasks.append({
+                    'table': table,
+                    'chunk': number,
+                    'key': key,
+                    'low': low,
+                    'high': high,
+                    'columns': table_columns.get(table, []),
+                    'estimated_bytes': data_length // len(ranges),
+                })
+
+        # Los fragmentos mas grandes primero para equilibrar los workers
+        tasks.sort(key=lambda t: t['estimated_bytes'], reverse=True)
+        return tasks
+
+    def _key_ranges(self, session, table, key, chunks):
+        rows = session.execute(
+            f"SELECT MIN({quote_identifier(key)}), MAX({quote_identifier(key)}) FROM {quote_identifier(table)}")
+        if not rows or rows[0][0] == 'NULL':
+            return [(None, None)]
+        low, high = int(rows[0][0]), int(rows[0][1])
+        step = max(1, math.ceil((high - low + 1) / chunks))
+        bounds = list(range(low, high + 1, step))
+        ranges = []
+        for i, start in enumerate(bounds):
+            # El primer y el ultimo rango quedan abiertos
+            range_low = None if i == 0 else start
+            range_high = bounds[i + 1] if i + 1 < len(bounds) else None
+            ranges.append((range_low, range_high))
+        return ranges
+
+    def _select_sql(self, task):
+        expressions = []
+        for column, data_type in task['columns']:
+            ident = quote_identifier(column)
+            if data_type in BINARY_TYPES:
+                expressions.append(f"IF({ident} IS NULL, 'NULL', CONCAT('X''', HEX({ident}), ''''))")
+            else:
+                expressions.append(f"QUOTE({ident})")
+        values = ", ',', ".join(expressions)
+        select = f"SELECT CONCAT('(', {values}, ')') FROM {quote_identifier(task['table'])}"
+
+        conditions = []
+        if task['low'] is not None:
+            conditions.append(f"{quote_identifier(task['key'])} >= {task['low']}")
+        if task['high'] is not None:
+            conditions.append(f"{quote_identifier(task['key'])} < {task['high']}")
+        if conditions:
+            select += " WHERE " + " AND ".join(conditions)
+        return select
+
+    def _dump_task(self, session, task):
+        """Exporta un fragmento de tabla como sentencias INSERT comprimidas"""
+        file_name = f"{task['table']}.{task['chunk']:04d}.sql{self.codec.extension}"
+        output_file = os.path.join(self.output_dir, 'data', file_name)
+        column_list = ','.join(quote_identifier(c) for c, _ in task['columns'])
+        prefix = f"INSERT INTO {quote_identifier(task['table'])} ({column_list}) VALUES ".encode('utf-8')
+
+        stderr = open(self.log_file, 'ab') if self.log_file else subprocess.DEVNULL
+        rows = 0
+        raw_bytes = 0
+        compressor = subprocess.Popen(
+            self._compress_command(), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr)
+        # El archivo se escribe (y se hashea) en otro hilo mientras este alimenta al compresor
+        copier = HashingCopier(compressor.stdout, output_file, throttle=self.throttle)
+        copier.start()
+        try:
+            compressor.stdin.write(CHUNK_HEADER.encode('utf-8'))
+            batch = []
+            batch_bytes = 0
+            if task['columns']:
+                for row in session.stream(self._select_sql(task)):
+                    batch.append(row)
+                    batch_bytes += len(row) + 1
+                    rows += 1
+                    if batch_bytes >= MAX_STATEMENT_BYTES:
+                        statement = prefix + b','.join(batch) + b';\n'
+                        compressor.stdin.write(statement)
+                        raw_bytes += len(statement)
+                        if self.progress is not None:
+                            self.progress(len(statement), rows=len(batch))
+                        batch, batch_bytes = [], 0
+            if batch:
+                statement = prefix + b','.join(batch) + b';\n'
+                compressor.stdin.write(statement)
+                raw_bytes += len(statement)
+                if self.progress is not None:
+                    self.progress(len(statement), rows=len(batch))
+            compressor.stdin.write(CHUNK_FOOTER.encode('utf-8'))
+        finally:
+            compressor.stdin.close()
+            code = compressor.wait()
+            copier.join()
+            if stderr is not subprocess.DEVNULL:
+                stderr.close()
+        if code != 0 or copier.error:
+            raise RuntimeError(f"Error comprimiendo {file_name}")
+
+        relative = f"data/{file_name}"
+        with self.lock:
+            self.checksums[relative] = copier.sha256
+        return {
+            'table': task['table'],
+            'chunk': task['chunk'],
+            'file': relative,
+            'rows': rows,
+            'bytes': raw_bytes,
+            'compressed_bytes': copier.bytes,
+            'sha256': copier.sha256,
+        }
+
+    def dump(self):
+        """
+        Exporta la base de datos completa
+
+        Returns:
+            Dict del indice generado (tambien se guarda en index.json)
+        """
+        started = time.monotonic()
+        os.makedirs(os.path.join(self.output_dir, 'data'), exist_ok=True)
+
+        control = self._session()
+        sessions = []
+        try:
+            # Abrir todas las instantaneas mientras las escrituras estan bloqueadas
+            control.execute("FLUSH TABLES WITH READ LOCK")
+            binlog = control.execute("SHOW MASTER STATUS")
+            for _ in range(self.workers):
+                session = self._session()
+                sessions.append(session)
+                session.execute("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                session.execute("SET SESSION time_zone = '+00:00'")
+                session.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+
+            # El esquema y el plan de fragmentos se toman bajo el mismo bloqueo
+            self._mysqldump(['--skip-triggers'], os.path.join(self.output_dir, f"schema.sql{self.codec.extension}"))
+            self._mysqldump(['--no-create-info', '--skip-add-drop-table', '--triggers', '--routines', '--events'],
+                            os.path.join(self.output_dir, f"post.sql{self.codec.extension}"))
+            tasks = self._table_plan(control)
+            control.execute("UNLOCK TABLES")
+        except BaseException:
+            # Las sesiones de los workers no llegan a usarse
+            for session in sessions:
+                session.close()
+            raise
+        finally:
+            control.close()
+
+        pending = queue.Queue()
+        for task in tasks:
+            pending.put(task)
+        results = []
+        errors = []
+        lock = threading.Lock()
+
+        def worker(session):
+            try:
+                while not errors:
+                    try:
+                        task = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    result = self._dump_task(session, task)
+                    with lock:
+                        results.append(result)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                session.close()
+
+        threads = [threading.Thread(target=worker, args=(s,), daemon=True) for s in sessions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise RuntimeError(f"Error en el volcado paralelo: {errors[0]}")
+
+        results.sort(key=lambda r: (r['table'], r['chunk']))
+        index = {
+            'format': 'mysql-parallel',
+            'version': 1,
+            'database': self.database,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'codec': self.codec.name,
+            'workers': self.workers,
+            'binlog': {'file': binlog[0][0], 'position': int(binlog[0][1])} if binlog else None,
+            'schema': f"schema.sql{self.codec.extension}",
+            'post': f"post.sql{self.codec.extension}",
+            'chunks': results,
+            'rows': sum(r['rows'] for r in results),
+            'bytes': sum(r['bytes'] for r in results),
+            'compressed_bytes': sum(r['compressed_bytes'] for r in results),
+            'seconds': round(time.monotonic() - started, 3),
+        }
+        index['checksums'] = {name: self.checksums[name] for name in (index['schema'], index['post'])}
+        data = json.dumps(index, indent=2).encode('utf-8')
+        with open(os.path.join(self.output_dir, INDEX_FILE), 'wb') as f:
+            f.write(data)
+        self.checksums[INDEX_FILE] = hashlib.sha256(data).hexdigest()
+        return index
+
+
+class ParallelLoader:
+    """Carga un respaldo paralelo ejecutando varios clientes mysql a la vez"""
+
+    def __init__(self, container, database, password, input_dir, workers=4, log_file=None, user='root',
+                 progress=None):
+        self.container = container
+        self.database = database
+        self.password = password
+        self.user = user
+        self.input_dir = input_dir
+        self.workers = max(1, int(workers))
+        self.log_file = log_file
+        # progress(bytes, rows=) recibe cada fragmento cargado (bytes sin comprimir del indice)
+        self.progress = progress
+
+    def _load_file(self, relative_path):
+        """Descomprime un archivo y lo envía a un cliente mysql"""
+        path = os.path.join(self.input_dir, relative_path)
+        codec = detect_codec(path)
+        env = os.environ.copy()
+        env['MYSQL_PWD'] = self.password
+        stderr = open(self.log_file, 'ab') if self.log_file else subprocess.DEVNULL
+
+        try:
+            with open(path, 'rb') as source:
+                if codec:
+                    decompressor = subprocess.Popen(
+                        codec.decompress_command(1), stdin=source, stdout=subprocess.PIPE, stderr=stderr)
+                    mysql_input = decompressor.stdout
+                else:
+                    decompressor = None
+                    mysql_input = source
+                client = subprocess.Popen(
+                    ['docker', 'exec', '-i', '-e', 'MYSQL_PWD', self.container, 'mysql',
+                     f'-u{self.user}', '--default-character-set=utf8mb4', self.database],
+                    stdin=mysql_input, stderr=stderr, env=env)
+                if decompressor:
+                    decompressor.stdout.close()
+                client_code = client.wait()
+                decompress_code = decompressor.wait() if decompressor else 0
+        finally:
+            if stderr is not subprocess.DEVNULL:
+                stderr.close()
+
+        if client_code != 0 or decompress_code != 0:
+            raise RuntimeError(f"Error cargando {relative_path}")
+        return os.path.getsize(path)
+
+    def load(self):
+        """
+        Restaura esquema, datos en paralelo y objetos finales
+
+        Returns:
+            Dict con estadisticas de la carga
+        """
+        started = time.monotonic()
+        with open(os.path.join(self.input_dir, INDEX_FILE)) as f:
+            index = json.load(f)
+
+        self._load_file(index['schema'])
+
+        # Los fragmentos mas grandes primero
+        chunks = sorted(index['chunks'], key=lambda c: c['compressed_bytes'], reverse=True)
+        loaded = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self._load_file, chunk['file']): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                try:
+                    loaded += future.result()
+                except Exception:
+                    # Los fragmentos que aun no empezaron no se cargan
+                    for other in futures:
+                        other.cancel()
+                    raise
+                if self.progress is not None:
+                    self.progress(futures[future]['bytes'], rows=futures[future]['rows'])
+
+        self._load_file(index['post'])
+        return {
+            'chunks': len(chunks),
+            'rows': index.get('rows', 0),
+            'compressed_bytes': loaded,
+            'seconds': round(time.monotonic() - started, 3),
+        }
+
+
+def main(argv):
+    usage = (
+        "Uso (contraseña de root en MYSQL_PWD):\n"
+        "  parallel_dump.py dump <contenedor> <base_de_datos> <directorio>\n"
+        "  parallel_dump.py load <contenedor> <base_de_datos> <directorio>\n"
+        "Variables opcionales: BACKUP_PARALLEL_WORKERS, BACKUP_PARALLEL_CHUNK_MB,\n"
+        "  BACKUP_COMPRESSION, BACKUP_COMPRESSION_LEVEL, BACKUP_COMPRESSION_THREADS,\n"
+        "  BACKUP_RATE_LIMIT_MB"
+    )
+    if len(argv) < 5 or argv[1] not in ('dump', 'load'):
+        print(usage, file=sys.stderr)
+        return 1
+
+    command, container, database, directory = argv[1:5]
+    password = os.environ.get('MYSQL_PWD', '')
+    workers = int(os.environ.get('BACKUP_PARALLEL_WORKERS') or 4)
+    log_file = os.environ.get('LOG_FILE')
+
+    # Con BACKUP_PROGRESS_FILE (backup.sh/restore.sh) se registra el progreso de la etapa
+    reporter, meter = meter_from_env('database')
+    ok = False
+    try:
+        if command == 'dump':
+            level = os.environ.get('BACKUP_COMPRESSION_LEVEL') or None
+            dumper = ParallelDumper(
+                container, database, password, directory,
+                resolve_codec(os.environ.get('BACKUP_COMPRESSION', 'gzip')),
+                level=int(level) if level else None,
+                workers=workers,
+                chunk_bytes=int(os.environ.get('BACKUP_PARALLEL_CHUNK_MB') or 256) * 1024 * 1024,
+                threads=os.environ.get('BACKUP_COMPRESSION_THREADS'),
+                log_file=log_file,
+                throttle=throttle_from_env(),
+                progress=meter.add if meter else None
+            )
+            index = dumper.dump()
+            # Los checksums se agregan al SHA256SUMS del directorio del respaldo
+            directory = os.path.normpath(directory)
+            add_checksums(os.path.dirname(directory), {
+                f"{os.path.basename(directory)}/{name}": digest for name, digest in dumper.checksums.items()})
+            print(f"Fragmentos: {len(index['chunks'])}, filas: {index['rows']}, "
+                  f"comprimido: {index['compressed_bytes']} bytes, {index['seconds']}s")
+        else:
+            stats = ParallelLoader(container, database, password, directory, workers, log_file,
+                                   progress=meter.add if meter else None).load()
+            print(f"Fragmentos cargados: {stats['chunks']}, {stats['seconds']}s")
+        ok = True
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if reporter is not None:
+            reporter.close()
+            reporter.end_stage('database', ok)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+Physical Backup Module
+Respaldo fisico (archivos de InnoDB) de MySQL con el plugin clone
+
+mysqldump + mysql reconstruye cada indice fila por fila al restaurar, lo que
+en una base de datos grande lleva horas. En modo fisico el servidor copia su
+propio directorio de datos con CLONE LOCAL DATA DIRECTORY (instantanea
+consistente sin bloquear las escrituras) dentro del contenedor, y ese
+directorio se transmite como tar por la API de Docker hacia el compresor.
+
+Al restaurar los archivos se extraen primero en un directorio de la propia
+instancia con MySQL corriendo; despues se detiene el contenedor, se
+intercambian los directorios (renombres en el mismo volumen) y se vuelve a
+arrancar. Si MySQL no arranca con los datos restaurados se vuelven a poner
+los anteriores.
+
+Estructura generada:
+    mysql_physical.json             version de MySQL, directorio y posicion del binlog
+    mysql_physical_<fecha>.tar.gz   directorio de datos clonado (o .tar.zst)
+
+El respaldo solo se restaura en la misma serie de MySQL (ej. 8.0.x) y en una
+version igual o posterior. Solo usa la biblioteca estandar.
+"""
+
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backup.clone import MeteredReader
+from backup.progress import meter_from_env
+from backup.volume import DockerClient, DockerAPIError, TarFilter, VolumeExport
+
+
+METADATA_FILE = 'mysql_physical.json'
+ARCHIVE_PREFIX = 'mysql_physical_'
+
+# Directorio de datos de la imagen mysql y directorio donde mysqld puede escribir (secure_file_priv)
+DATADIR = '/var/lib/mysql'
+CLONE_ROOT = '/var/lib/mysql-files'
+
+# Datos anteriores mientras se verifica que MySQL arranca con los restaurados
+PREVIOUS_DIR = '.pre-restore'
+
+# Segundos que se espera a que MySQL responda tras el intercambio
+START_TIMEOUT = 300
+
+# Argumentos: $0 directorio de datos, $1 directorio restaurado, $2 directorio de los datos anteriores
+SWAP_SCRIPT = r'''
+cd "$0" || exit 1
+[ -d "$1" ] || exit 4
+if [ -e "$2" ]; then echo "Ya existe $0/$2 (restauracion anterior sin terminar)" >&2; exit 3; fi
+mkdir "$2" || exit 1
+for entry in * .[!.]* ..?*; do
+    [ -e "$entry" ] || [ -L "$entry" ] || continue
+    [ "$entry" = "$1" ] || [ "$entry" = "$2" ] || mv -- "$entry" "$2"/ || exit 1
+done
+for entry in "$1"/* "$1"/.[!.]* "$1"/..?*; do
+    [ -e "$entry" ] || [ -L "$entry" ] || continue
+    mv -- "$entry" . || exit 1
+done
+rmdir "$1"
+'''
+
+ROLLBACK_SCRIPT = r'''
+cd "$0" || exit 1
+[ -d "$2" ] || exit 4
+for entry in * .[!.]* ..?*; do
+    [ -e "$entry" ] || [ -L "$entry" ] || continue
+    [ "$entry" = "$2" ] || rm -rf -- "$entry" || exit 1
+done
+for entry in "$2"/* "$2"/.[!.]* "$2"/..?*; do
+    [ -e "$entry" ] || [ -L "$entry" ] || continue
+    mv -- "$entry" . || exit 1
+done
+rmdir "$2"
+'''
+
+VERSION_PATTERN = re.compile(r'(\d+)\.(\d+)\.(\d+)')
+
+
+def parse_version(text):
+    """'8.0.36-log' -> (8, 0, 36)"""
+    match = VERSION_PATTERN.search(text or '')
+    if not match:
+        raise ValueError(f"Versión de MySQL no reconocida: {text!r}")
+    return tuple(int(part) for part in match.groups())
+
+
+def compatible(backup_version, server_version):
+    """
+    True si un respaldo fisico de backup_version arranca en server_version
+
+    Misma serie (mayor.menor) y un servidor igual o posterior: mysqld
+    actualiza el diccionario de datos hacia adelante, nunca hacia atras.
+    """
+    backup, server = parse_version(backup_version), parse_version(server_version)
+    return backup[:2] == server[:2] and server >= backup
+
+
+def read_metadata(backup_dir):
+    """Metadatos del respaldo fisico o None si el respaldo es logico"""
+    path = os.path.join(backup_dir, METADATA_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def find_archive(backup_dir):
+    """Archivo tar (comprimido) del directorio de datos o None"""
+    for name in sorted(os.listdir(backup_dir)):
+        if name.startswith(ARCHIVE_PREFIX) and '.tar' in name and not name.endswith(('.part', '.sha256')):
+            return os.path.join(backup_dir, name)
+    return None
+
+
+def mysql_query(container, password, sql):
+    """
+    Ejecuta una consulta como root y devuelve las filas como listas de texto
+
+    Raises:
+        RuntimeError si el cliente mysql falla
+    """
+    env = os.environ.copy()
+    env['MYSQL_PWD'] = password
+    result = subprocess.run(
+        ['docker', 'exec', '-e', 'MYSQL_PWD', container, 'mysql', '-uroot',
+         '--batch', '--skip-column-names', '-e', sql],
+        capture_output=True, text=True, env=env
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Error en MySQL ({container}): {result.stderr.strip() or result.returncode}")
+    return [line.split('\t') for line in result.stdout.splitlines() if line]
+
+
+class CloneSource:
+    """
+    Directorio de datos clonado dentro del contenedor MySQL, como stream tar
+
+    Tiene la interfaz de VolumeStream que usa VolumeExport (export y volume),
+    por lo que StreamPipeline lo comprime igual que un volumen.
+    """
+
+    def __init__(self, container, password, name, client=None):
+        self.container = container
+        self.password = password
+        self.name = name
+        self.path = f"{CLONE_ROOT}/{name}"
+        self.volume = f"{container}:{self.path}"
+        self.client = client or DockerClient()
+
+    def _query(self, sql):
+        return mysql_query(self.container, self.password, sql)
+
+    def prepare(self):
+        """
+        Clona la instancia en CLONE_ROOT/<name>
+
+        Returns:
+            Metadatos del respaldo (version, directorio y posicion del binlog)
+        """
+        installed = self._query(
+            "SELECT PLUGIN_STATUS FROM information_schema.PLUGINS WHERE PLUGIN_NAME = 'clone'")
+        if not installed:
+            self._query("INSTALL PLUGIN clone SONAME 'mysql_clone.so'")
+        elif installed[0][0] != 'ACTIVE':
+            raise RuntimeError(f"El plugin clone está en estado {installed[0][0]}")
+
+        version = self._query("SELECT @@version")[0][0]
+        self.remove()
+        self._query(f"CLONE LOCAL DATA DIRECTORY = '{self.path}'")
+
+        binlog = None
+        status = self._query("SELECT BINLOG_FILE, BINLOG_POSITION FROM performance_schema.clone_status")
+        if status and status[0][0] not in ('', 'NULL'):
+            binlog = {'file': status[0][0], 'position': int(status[0][1])}
+
+        return {
+            'format': 'physical',
+            'method': 'clone',
+            'mysql_version': version,
+            'directory': self.name,
+            'binlog': binlog,
+            'created': datetime.now().isoformat(timespec='seconds'),
+        }
+
+    def export(self, output, exclude=()):
+        """Escribe en output el tar del directorio clonado (entradas <name>/...)"""
+        response = self.client.get_archive(self.container, self.path)
+        try:
+            return TarFilter(exclude).copy(response, output)
+        finally:
+            response.close()
+
+    def export_process(self, log_file=None):
+        """Exportacion en segundo plano con la interfaz de un proceso (para StreamPipeline)"""
+        return VolumeExport(self, log_file=log_file)
+
+    def remove(self):
+        """Borra el directorio clonado del contenedor"""
+        code = self.client.exec_run(self.container, ['rm', '-rf', '--', self.path])
+        if code != 0:
+            raise RuntimeError(f"No se pudo borrar {self.path} en {self.container} (código {code})")
+
+
+class PhysicalRestore:
+    """Reemplaza el directorio de datos de un contenedor MySQL por uno respaldado"""
+
+    def __init__(self, container, metadata, password, client=None, log_file=None,
+                 timeout=START_TIMEOUT, progress=None):
+        self.container = container
+        self.metadata = metadata
+        self.password = password
+        self.client = client or DockerClient()
+        self.log_file = log_file
+        self.timeout = timeout
+        self.progress = progress
+        self.staging = metadata['directory']
+
+    def log(self, message):
+        print(message)
+        if self.log_file:
+            with open(self.log_file, 'a') as f:
+                f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - {message}\n")
+
+    def _datadir_volume(self):
+        """Volumen montado en el directorio de datos y la imagen del contenedor"""
+        info = self.client.inspect(self.container)
+        for mount in info.get('Mounts', []):
+            if mount.get('Destination') == DATADIR and mount.get('Name'):
+                return mount['Name'], info['Config']['Image']
+        raise RuntimeError(f"{self.container} no monta un volumen en {DATADIR}")
+
+    def check(self):
+        """Verifica que la version del servidor pueda arrancar con el respaldo"""
+        server_version = mysql_query(self.container, self.password, "SELECT @@version")[0][0]
+        backup_version = self.metadata['mysql_version']
+        if not compatible(backup_version, server_version):
+            raise RuntimeError(f"El respaldo es de MySQL {backup_version} y el servidor es {server_version}: "
+                               f"restaure con un logical dump o use la misma versión")
+        return server_version
+
+    def stage(self, source):
+        """Extrae el tar de source en DATADIR/<directorio> con MySQL corriendo"""
+        self._remove(f"{DATADIR}/{self.staging}")
+        observer = (lambda chunk: self.progress(len(chunk))) if self.progress is not None else None
+        try:
+            self.client.put_archive(self.container, DATADIR, MeteredReader(source, observer))
+        except Exception:
+            self._remove(f"{DATADIR}/{self.staging}")
+            raise
+
+    def _remove(self, path):
+        code = self.client.exec_run(self.container, ['rm', '-rf', '--', path])
+        if code != 0:
+            raise RuntimeError(f"No se pudo borrar {path} en {self.container} (código {code})")
+
+    def _run_script(self, script):
+        volume, image = self._datadir_volume()
+        return self.client.run_helper(image, volume, DATADIR,
+                                      ['sh', '-c', script, DATADIR, self.staging, PREVIOUS_DIR])
+
+    def wait_ready(self):
+        """True cuando mysqld responde; False si el contenedor termina o se agota el tiempo"""
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            state = self.client.inspect(self.container)['State']
+            if state.get('Running') and not state.get('Restarting'):
+                try:
+                    # mysqladmin ping devuelve 0 con el servidor arriba aunque rechace el usuario
+                    if self.client.exec_run(self.container, ['mysqladmin', 'ping', '--silent']) == 0:
+                        return True
+                except DockerAPIError:
+                    pass
+            elif state.get('Status') in ('exited', 'dead') and not state.get('Restarting'):
+                return False
+            time.sleep(2)
+        return False
+
+    def swap(self):
+        """Detiene MySQL, intercambia los directorios y lo arranca (vuelve atras si no arranca)"""
+        self.log(f"Deteniendo {self.container}...")
+        self.client.stop(self.container)
+        code = self._run_script(SWAP_SCRIPT)
+        if code != 0:
+            self.client.start(self.container)
+            raise RuntimeError(f"No se pudo intercambiar el directorio de datos (código {code})")
+
+        self.log(f"Arrancando {self.container} con los datos restaurados...")
+        self.client.start(self.container)
+        if self.wait_ready():
+            self._remove(f"{DATADIR}/{PREVIOUS_DIR}")
+            return
+
+        self.log("MySQL no arrancó con los datos restaurados: se vuelven a poner los anteriores")
+        self.client.stop(self.container)
+        code = self._run_script(ROLLBACK_SCRIPT)
+        self.client.start(self.container)
+        if code != 0 or not self.wait_ready():
+            raise RuntimeError(f"MySQL no arrancó y no se pudieron recuperar los datos anteriores "
+                               f"(revise {DATADIR}/{PREVIOUS_DIR} en el volumen)")
+        raise RuntimeError("MySQL no arrancó con los datos restaurados (se conservaron los anteriores)")
+
+    def run(self, source):
+        """
+        Restaura el directorio de datos leyendo el tar de source
+
+        Returns:
+            Segundos de la restauracion
+        """
+        started = time.monotonic()
+        server_version = self.check()
+        self.log(f"Extrayendo directorio de datos (MySQL {self.metadata['mysql_version']} -> {server_version})...")
+        self.stage(source)
+        self.swap()
+        return round(time.monotonic() - started, 3)
+
+
+def main(argv):
+    usage = (
+        "Uso (contraseña de root en MYSQL_PWD):\n"
+        "  physical.py restore <contenedor> <mysql_physical.json>   (tar del directorio de datos por stdin)\n"
+        "  physical.py info <directorio_backup>"
+    )
+    command = argv[1] if len(argv) > 1 else None
+    if command == 'info' and len(argv) >= 3:
+        metadata = read_metadata(argv[2])
+        if metadata is None:
+            print(f"{argv[2]} no es un respaldo físico", file=sys.stderr)
+            return 1
+        print(json.dumps(metadata, indent=2))
+        return 0
+    if command != 'restore' or len(argv) < 4:
+        print(usage, file=sys.stderr)
+        return 1
+
+    with open(argv[3]) as f:
+        metadata = json.load(f)
+    # Con BACKUP_PROGRESS_FILE (restore.sh) se registra el progreso de la etapa
+    reporter, meter = meter_from_env('database')
+    ok = False
+    try:
+        seconds = PhysicalRestore(
+            argv[2], metadata, os.environ.get('MYSQL_PWD', ''),
+            log_file=os.environ.get('LOG_FILE'),
+            progress=meter.add if meter else None
+        ).run(sys.stdin.buffer)
+        print(f"Directorio de datos restaurado en {seconds}s")
+        ok = True
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if reporter is not None:
+            reporter.close()
+            reporter.end_stage('database', ok)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
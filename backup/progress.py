@@ -0,0 +1,596 @@
+#!/usr/bin/env python3
+"""
+Progress Module
+Progreso en vivo (bytes, filas, archivos, velocidad y ETA) de respaldos y restauraciones
+
+Cada operacion escribe eventos JSON, uno por linea, en
+BACKUPS_PATH/.progress/<operacion>_<ambiente>.jsonl:
+
+    {"event": "start", "operation": "backup", "environment": "testing",
+     "expected": {"database": 123, "moodledata": 456}, ...}
+    {"event": "progress", "stage": "database", "bytes": 12, "rows": 3, "files": 0,
+     "bytes_per_second": 4.0, "expected_bytes": 123, "percent": 9.8, "eta_seconds": 27.8, ...}
+    {"event": "stage_end", "stage": "database", "status": "SUCCESS", ...}
+    {"event": "end", "status": "SUCCESS", "seconds": 31.2, ...}
+
+El motor nativo reporta desde el proceso; backup.sh y restore.sh intercalan
+`progress.py meter` en sus pipes (igual que throttle.py). El tamaño esperado
+de cada etapa sale de la ultima ejecucion exitosa (history.json), asi que la
+ETA no requiere recorrer los datos antes de empezar.
+Solo usa la biblioteca estandar para poder ejecutarse desde los scripts de shell.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backup.volume import TarCounter
+
+
+PROGRESS_DIR = '.progress'
+HISTORY_FILE = 'history.json'
+CHUNK_SIZE = 1024 * 1024
+
+# Segundos entre eventos de progreso y ventana para calcular la velocidad actual
+EVENT_INTERVAL = 1.0
+RATE_WINDOW = 10.0
+
+STAGES = ('database', 'moodledata')
+
+
+def progress_file(backups_path, operation, environment):
+    """Ruta del archivo de eventos de una operacion ('backup', 'restore' o 'clone')"""
+    return os.path.join(backups_path, PROGRESS_DIR, f"{operation}_{environment}.jsonl")
+
+
+def count_rows(data):
+    """
+    Filas aproximadas en un bloque de un dump SQL
+
+    mysqldump agrupa las filas en INSERT extendidos '(...),(...)': cada
+    sentencia aporta una fila mas que separadores. Las filas partidas entre
+    bloques o un '),(' dentro de un texto desvian apenas el conteo.
+    """
+    return data.count(b'),(') + data.count(b'INSERT INTO ')
+
+
+def format_duration(seconds):
+    """Segundos como H:MM:SS"""
+    seconds = int(max(seconds, 0))
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def _format_bytes(num_bytes):
+    value = float(num_bytes)
+    for unit in ['B', 'K', 'M', 'G']:
+        if value < 1024:
+            return f"{int(value)}{unit}" if unit == 'B' else f"{value:.1f}{unit}"
+        value /= 1024
+    return f"{value:.1f}T"
+
+
+class StageMeter:
+    """Contadores de una etapa con velocidad sobre una ventana y ETA"""
+
+    def __init__(self, name, expected_bytes=None):
+        self.name = name
+        self.expected_bytes = expected_bytes or None
+        self.bytes = 0
+        self.rows = 0
+        self.files = 0
+        self.started = time.monotonic()
+        self.finished = None
+        self.status = None
+        self._samples = [(self.started, 0)]
+        self._lock = threading.Lock()
+
+    def add(self, count=0, rows=0, files=0):
+        with self._lock:
+            self.bytes += count
+            self.rows += rows
+            self.files += files
+
+    def finish(self, ok=True):
+        self.finished = time.monotonic()
+        self.status = 'SUCCESS' if ok else 'FAILED'
+
+    def snapshot(self):
+        """Estado actual de la etapa (campos de un evento 'progress')"""
+        now = self.finished or time.monotonic()
+        with self._lock:
+            done, rows, files = self.bytes, self.rows, self.files
+        if self.finished is None:
+            self._samples.append((now, done))
+            while len(self._samples) > 2 and now - self._samples[1][0] >= RATE_WINDOW:
+                self._samples.pop(0)
+            since, base = self._samples[0]
+        else:
+            since, base = self.started, 0
+        elapsed = now - since
+        rate = (done - base) / elapsed if elapsed > 0 else 0.0
+
+        percent = eta = None
+        if self.finished is not None:
+            percent, eta = 100.0, 0.0
+        elif self.expected_bytes:
+            # Si se supera lo esperado la etapa sigue abierta: se muestra 99.9% sin ETA
+            percent = min(100.0 * done / self.expected_bytes, 99.9)
+            if done < self.expected_bytes and rate > 0:
+                eta = (self.expected_bytes - done) / rate
+
+        return {
+            'stage': self.name,
+            'bytes': done,
+            'rows': rows,
+            'files': files,
+            'seconds': round(now - self.started, 1),
+            'bytes_per_second': round(rate, 1),
+            'expected_bytes': self.expected_bytes,
+            'percent': round(percent, 1) if percent is not None else None,
+            'eta_seconds': round(eta, 1) if eta is not None else None,
+        }
+
+
+class ProgressReporter:
+    """
+    Escribe los eventos de progreso de una operacion
+
+    Un hilo emite cada EVENT_INTERVAL segundos el estado de las etapas en
+    curso. Varios procesos pueden escribir en el mismo archivo (ej. los dos
+    medidores de backup.sh): cada evento es una sola escritura en modo append.
+    """
+
+    def __init__(self, path, interval=EVENT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.expected = {}
+        self.stages = {}
+        self.started = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def attach(cls, path):
+        """Reporter de una operacion ya iniciada (toma el tamaño esperado del evento 'start')"""
+        reporter = cls(path)
+        for event in read_events(path):
+            if event.get('event') == 'start':
+                reporter.expected = event.get('expected') or {}
+        reporter._start_ticker()
+        return reporter
+
+    def emit(self, event, **fields):
+        record = {'event': event, 'time': round(time.time(), 3), **fields}
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            try:
+                with open(self.path, 'a') as f:
+                    f.write(line)
+            except OSError:
+                # El progreso nunca hace fallar la operacion
+                pass
+
+    def start(self, operation, environment, expected=None, **fields):
+        """Reinicia el archivo y registra el inicio de la operacion"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w'):
+            pass
+        self.expected = {k: v for k, v in (expected or {}).items() if v}
+        self.started = time.monotonic()
+        self.emit('start', operation=operation, environment=environment, expected=self.expected,
+                  pid=os.getpid(), **fields)
+        self._start_ticker()
+        return self
+
+    def _start_ticker(self):
+        self._thread = threading.Thread(target=self._tick, daemon=True)
+        self._thread.start()
+
+    def _tick(self):
+        while not self._stop.wait(self.interval):
+            for meter in list(self.stages.values()):
+                if meter.finished is None:
+                    self.emit('progress', **meter.snapshot())
+
+    def stage(self, name):
+        """Medidor de una etapa (lo crea y registra su inicio la primera vez)"""
+        with self._lock:
+            meter = self.stages.get(name)
+            if meter is None:
+                meter = self.stages[name] = StageMeter(name, self.expected.get(name))
+            else:
+                return meter
+        self.emit('stage_start', stage=name, expected_bytes=meter.expected_bytes)
+        return meter
+
+    def end_stage(self, name, ok=True):
+        meter = self.stages.get(name)
+        if meter is None or meter.finished is not None:
+            return
+        meter.finish(ok)
+        self.emit('stage_end', status=meter.status, **meter.snapshot())
+
+    def close(self):
+        """Detiene el hilo de eventos"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def finish(self, status):
+        """Cierra las etapas abiertas y registra el fin de la operacion"""
+        self.close()
+        for name in list(self.stages):
+            self.end_stage(name, status == 'SUCCESS')
+        seconds = time.monotonic() - self.started if self.started is not None else None
+        self.emit('end', status=status, seconds=round(seconds, 1) if seconds is not None else None)
+
+
+class ProgressView:
+    """Estado agregado de una operacion a partir de sus eventos (para mostrarlo)"""
+
+    def __init__(self):
+        self.operation = None
+        self.environment = None
+        self.expected = {}
+        self.stages = {}
+        self.status = None
+        self.started = None
+        self.pid = None
+        self.seconds = None
+
+    def apply(self, event):
+        kind = event.get('event')
+        if kind == 'start':
+            self.__init__()
+            self.operation = event.get('operation')
+            self.environment = event.get('environment')
+            self.expected = event.get('expected') or {}
+            self.started = event.get('time')
+            self.pid = event.get('pid')
+        elif kind in ('stage_start', 'progress', 'stage_end'):
+            stage = self.stages.setdefault(event['stage'], {})
+            stage.update({k: v for k, v in event.items() if k not in ('event', 'time')})
+            if kind == 'stage_end':
+                stage['bytes_per_second'] = 0
+        elif kind == 'end':
+            self.status = event.get('status')
+            self.seconds = event.get('seconds')
+
+    @property
+    def finished(self):
+        return self.status is not None
+
+    def summary(self):
+        """
+        Totales de la operacion
+
+        Returns:
+            Dict con bytes, filas, archivos, velocidad, esperado, porcentaje y ETA
+        """
+        stages = self.stages.values()
+        done = sum(s.get('bytes', 0) for s in stages)
+        expected = sum(self.expected.values()) or None
+        running = [s for s in stages if not s.get('status')]
+        # Las etapas corren en paralelo: termina cuando termina la mas lenta
+        etas = [s.get('eta_seconds') for s in running]
+        eta = max(etas) if etas and None not in etas else (0.0 if not running and self.finished else None)
+        percent = None
+        if self.finished:
+            percent = 100.0
+        elif expected:
+            percent = min(100.0 * done / expected, 99.9)
+        return {
+            'bytes': done,
+            'rows': sum(s.get('rows', 0) for s in stages),
+            'files': sum(s.get('files', 0) for s in stages),
+            'bytes_per_second': sum(s.get('bytes_per_second') or 0 for s in running),
+            'expected_bytes': expected,
+            'percent': percent,
+            'eta_seconds': eta,
+        }
+
+    def render(self, width=30):
+        """Barra de progreso en una linea"""
+        summary = self.summary()
+        if summary['percent'] is not None:
+            filled = int(width * summary['percent'] / 100)
+            bar = f"[{'#' * filled}{'-' * (width - filled)}] {summary['percent']:5.1f}%"
+        else:
+            bar = f"[{'?' * width}]   ?  "
+        parts = [bar, _format_bytes(summary['bytes'])]
+        if summary['expected_bytes'] and not self.finished:
+            parts[-1] += f"/{_format_bytes(summary['expected_bytes'])}"
+        if self.finished:
+            parts.append(f"{self.status} en {format_duration(self.seconds or 0)}")
+        else:
+            parts.append(f"{_format_bytes(summary['bytes_per_second'])}/s")
+            parts.append(f"ETA {format_duration(summary['eta_seconds'])}"
+                         if summary['eta_seconds'] is not None else "ETA --:--:--")
+        if summary['rows']:
+            parts.append(f"{summary['rows']} filas")
+        if summary['files']:
+            parts.append(f"{summary['files']} archivos")
+        return ' | '.join(parts)
+
+
+def read_events(path, offset=0):
+    """
+    Eventos del archivo a partir de offset
+
+    Returns:
+        Lista de eventos (la ultima linea se ignora si esta incompleta)
+    """
+    try:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except OSError:
+        return []
+    events = []
+    for line in data.split(b'\n')[:-1]:
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            continue
+    return events
+
+
+def load_view(path):
+    view = ProgressView()
+    for event in read_events(path):
+        view.apply(event)
+    return view
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def active_operations(backups_path):
+    """
+    Operaciones en curso (su archivo no tiene evento 'end' y el proceso sigue vivo)
+
+    Returns:
+        Lista de tuplas (ruta, ProgressView)
+    """
+    directory = os.path.join(backups_path, PROGRESS_DIR)
+    if not os.path.isdir(directory):
+        return []
+    active = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.jsonl'):
+            continue
+        path = os.path.join(directory, name)
+        view = load_view(path)
+        if view.operation and not view.finished and (not view.pid or _pid_alive(view.pid)):
+            active.append((path, view))
+    return active
+
+
+class ProgressWatcher:
+    """
+    Muestra la barra de progreso de un archivo de eventos mientras corre la operacion
+
+    En una terminal la barra se redibuja en su linea; si no, se imprime una
+    linea cada 'interval' segundos. Con only_new se ignoran los eventos
+    anteriores al inicio del watcher (de una ejecucion previa).
+    """
+
+    def __init__(self, path, interval=1.0, stream=None, only_new=True):
+        self.path = path
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self.view = ProgressView()
+        self._stop = threading.Event()
+        self._thread = None
+        self._offset = 0
+        self._since = time.time() - 1 if only_new else 0
+
+    def _poll(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size < self._offset:
+            # El archivo se reinicio (nueva operacion)
+            self._offset = 0
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        complete = data.rfind(b'\n') + 1
+        self._offset += complete
+        for line in data[:complete].split(b'\n')[:-1]:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event.get('event') == 'start' and event.get('time', 0) < self._since:
+                continue
+            if self.view.operation is None and event.get('event') != 'start':
+                continue
+            self.view.apply(event)
+
+    def _draw(self, final=False):
+        if self.view.operation is None:
+            return
+        line = f"  Progreso: {self.view.render()}"
+        if self.stream.isatty():
+            # Al volver al inicio de la linea el siguiente mensaje del log la sobrescribe
+            self.stream.write(f"\r\033[K{line}" + ("\n" if final else "\r"))
+        else:
+            self.stream.write(line + "\n")
+        self.stream.flush()
+
+    def _run(self):
+        last_line = 0
+        while not self._stop.wait(self.interval):
+            self._poll()
+            if self.stream.isatty() or time.monotonic() - last_line >= 10:
+                self._draw()
+                last_line = time.monotonic()
+            if self.view.finished:
+                break
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._poll()
+        self._draw(final=True)
+
+    def wait(self):
+        """Muestra el progreso hasta que la operacion termina (Ctrl+C para salir)"""
+        self.start()
+        try:
+            while self._thread.is_alive():
+                self._thread.join(0.5)
+        except KeyboardInterrupt:
+            pass
+        self.stop()
+
+
+def stage_bytes(stats):
+    """
+    Bytes sin comprimir de cada etapa segun el STATS.json del motor
+
+    Returns:
+        Dict {etapa: bytes} (sin las etapas que no se pueden determinar)
+    """
+    result = {}
+    database = stats.get('database') or {}
+    moodledata = stats.get('moodledata') or {}
+    if isinstance(database.get('source'), dict):
+        result['database'] = database['source'].get('bytes')
+    elif database.get('bytes'):
+        result['database'] = database['bytes']
+    if isinstance(moodledata.get('source'), dict):
+        result['moodledata'] = moodledata['source'].get('bytes')
+    elif moodledata.get('bytes'):
+        result['moodledata'] = moodledata['bytes']
+    return {k: v for k, v in result.items() if v}
+
+
+def load_history(backups_path):
+    try:
+        with open(os.path.join(backups_path, PROGRESS_DIR, HISTORY_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def expected_from_history(backups_path, operation, environment):
+    """Bytes de cada etapa en la ultima ejecucion exitosa de la operacion"""
+    entry = load_history(backups_path).get(f"{operation}/{environment}") or {}
+    return {stage: entry[stage] for stage in STAGES if entry.get(stage)}
+
+
+def record_history(backups_path, path):
+    """
+    Guarda los bytes de cada etapa de una operacion exitosa (base de la proxima ETA)
+
+    Returns:
+        True si se actualizo el historial
+    """
+    view = load_view(path)
+    if view.status != 'SUCCESS' or not view.operation:
+        return False
+    entry = {name: stage['bytes'] for name, stage in view.stages.items()
+             if stage.get('status') == 'SUCCESS' and stage.get('bytes')}
+    if not entry:
+        return False
+    entry['seconds'] = view.seconds
+    entry['recorded'] = time.strftime('%Y-%m-%d %H:%M:%S')
+
+    history = load_history(backups_path)
+    history[f"{view.operation}/{view.environment}"] = entry
+    history_path = os.path.join(backups_path, PROGRESS_DIR, HISTORY_FILE)
+    partial = history_path + '.part'
+    with open(partial, 'w') as f:
+        json.dump(history, f, indent=2)
+    os.replace(partial, history_path)
+    return True
+
+
+def meter_from_env(stage):
+    """
+    Medidor de una etapa para los scripts invocados por backup.sh/restore.sh
+
+    Returns:
+        Tupla (ProgressReporter, StageMeter) o (None, None) sin BACKUP_PROGRESS_FILE
+    """
+    path = os.environ.get('BACKUP_PROGRESS_FILE')
+    if not path:
+        return None, None
+    reporter = ProgressReporter.attach(path)
+    return reporter, reporter.stage(stage)
+
+
+def copy_metered(source, target, stage, content=None):
+    """
+    Copia source -> target contando bytes (y filas o archivos) de la etapa
+
+    Args:
+        content: 'sql' para contar filas, 'tar' para contar archivos
+    """
+    reporter, meter = meter_from_env(stage)
+    counter = TarCounter() if content == 'tar' else None
+    ok = False
+    try:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            target.write(chunk)
+            if meter is not None:
+                if content == 'sql':
+                    meter.add(len(chunk), rows=count_rows(chunk))
+                elif counter is not None:
+                    meter.add(len(chunk), files=counter.feed(chunk))
+                else:
+                    meter.add(len(chunk))
+        target.flush()
+        ok = True
+    finally:
+        if reporter is not None:
+            reporter.close()
+            reporter.end_stage(stage, ok)
+
+
+def main(argv):
+    usage = (
+        "Uso:\n"
+        "  progress.py meter <etapa> [sql|tar]    (copia stdin a stdout registrando el progreso\n"
+        "                                          en BACKUP_PROGRESS_FILE)\n"
+        "  progress.py watch <archivo.jsonl>      (muestra la barra de progreso)"
+    )
+    command = argv[1] if len(argv) > 1 else None
+    if command == 'meter' and len(argv) >= 3:
+        try:
+            copy_metered(sys.stdin.buffer, sys.stdout.buffer, argv[2], argv[3] if len(argv) > 3 else None)
+        except BrokenPipeError:
+            return 1
+        return 0
+    if command == 'watch' and len(argv) >= 3:
+        ProgressWatcher(argv[2], only_new=False).wait()
+        return 0
+    print(usage, file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
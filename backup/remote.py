@@ -0,0 +1,696 @@
+#!/usr/bin/env python3
+"""
+Remote Module
+Replicacion de respaldos a almacenamiento compatible con S3 (AWS, MinIO...)
+
+Cada archivo del respaldo se sube a <prefijo>/<ambiente>/<timestamp>/<archivo>:
+- Los archivos mayores que una parte se suben en multipart, con varias partes
+  en paralelo. El upload_id queda en BACKUPS_PATH/.uploads y una nueva
+  ejecucion continua con las partes que faltan en lugar de empezar de cero
+- Los objetos que ya existen con el mismo SHA-256 (metadato x-amz-meta-sha256)
+  no se vuelven a subir
+- El ancho de banda se limita con BACKUP_REMOTE_RATE_LIMIT_MB (ver throttle.py)
+
+Los blobs de los respaldos incrementales se suben una sola vez a <prefijo>/blobs.
+La restauracion lee los objetos en streaming (comando cat) sin copiarlos al disco.
+
+Solo usa la biblioteca estandar (firma AWS Signature V4 sobre http.client)
+para poder ejecutarse desde backup.sh y restore.sh.
+"""
+
+import hashlib
+import hmac
+import http.client
+import json
+import math
+import os
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import quote, urlsplit
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backup.incremental import BLOB_STORE_DIR, MANIFEST_SUFFIX, BlobStore, read_manifest
+from backup.integrity import read_checksums
+from backup.throttle import Throttle
+
+
+CHUNK_SIZE = 1024 * 1024
+
+# Directorio (dentro de BACKUPS_PATH) con el estado de los multipart en curso
+UPLOAD_STATE_DIR = '.uploads'
+
+EMPTY_SHA256 = hashlib.sha256(b'').hexdigest()
+# El cuerpo se envia en streaming desde el disco; la integridad se comprueba con el ETag (MD5)
+# salvo en buckets con SSE-KMS o SSE-C, donde el ETag no es el MD5
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+
+RETRIES = 4
+
+
+class S3Error(Exception):
+    """Error devuelto por el servicio S3"""
+
+    def __init__(self, status, code, message=''):
+        super().__init__(f"S3 {status} {code}: {message}".strip())
+        self.status = status
+        self.code = code
+
+    @property
+    def retriable(self):
+        return self.status >= 500 or self.status == 429 or self.code == 'BadDigest'
+
+
+def _local_name(element):
+    return element.tag.rsplit('}', 1)[-1]
+
+
+def _xml_text(element, name):
+    for child in element:
+        if _local_name(child) == name:
+            return child.text or ''
+    return None
+
+
+def _xml_children(element, name):
+    return [child for child in element if _local_name(child) == name]
+
+
+def _parse_error(status, data):
+    try:
+        root = ET.fromstring(data)
+        return S3Error(status, _xml_text(root, 'Code') or 'Error', _xml_text(root, 'Message') or '')
+    except ET.ParseError:
+        return S3Error(status, 'NotFound' if status == 404 else 'Error', data[:200].decode(errors='replace'))
+
+
+def _with_retries(function):
+    """Reintenta errores de red y errores 5xx con espera exponencial"""
+    for attempt in range(RETRIES):
+        try:
+            return function()
+        except (OSError, http.client.HTTPException, S3Error) as e:
+            if isinstance(e, S3Error) and not e.retriable or attempt == RETRIES - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+
+class FileSlice:
+    """
+    Rango de un archivo usado como cuerpo de una peticion
+
+    Calcula el MD5 de lo enviado (para comparar con el ETag) y aplica
+    el limite de ancho de banda en cada lectura.
+    """
+
+    def __init__(self, path, offset, length, throttle=None):
+        self.file = open(path, 'rb')
+        self.file.seek(offset)
+        self.remaining = length
+        self.throttle = throttle
+        self.md5 = hashlib.md5()
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        if not data:
+            raise OSError("El archivo cambió de tamaño durante la subida")
+        self.remaining -= len(data)
+        self.md5.update(data)
+        if self.throttle is not None:
+            self.throttle.consume(len(data))
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def slice_md5(path, offset, length):
+    """MD5 de un rango de un archivo (para validar partes ya subidas)"""
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while length > 0:
+            data = f.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            digest.update(data)
+            length -= len(data)
+    return digest.hexdigest()
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class S3Client:
+    """Cliente S3 minimo (estilo path: endpoint/bucket/clave) con firma V4"""
+
+    def __init__(self, endpoint, bucket, access_key, secret_key, region='us-east-1', timeout=120):
+        parts = urlsplit(endpoint if '://' in endpoint else f'https://{endpoint}')
+        self.secure = parts.scheme == 'https'
+        self.host = parts.netloc
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region or 'us-east-1'
+        self.timeout = timeout
+        # Una conexion persistente por hilo
+        self.local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            factory = http.client.HTTPSConnection if self.secure else http.client.HTTPConnection
+            connection = factory(self.host, timeout=self.timeout, blocksize=CHUNK_SIZE)
+            self.local.connection = connection
+        return connection
+
+    def _discard_connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            connection.close()
+        self.local.connection = None
+
+    def _sign(self, method, path, query, headers, payload_hash):
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        scope = f"{now.strftime('%Y%m%d')}/{self.region}/s3/aws4_request"
+
+        headers['host'] = self.host
+        headers['x-amz-date'] = amz_date
+        headers['x-amz-content-sha256'] = payload_hash
+        signed_headers = ';'.join(sorted(headers))
+        canonical_headers = ''.join(f"{name}:{' '.join(str(headers[name]).split())}\n"
+                                    for name in sorted(headers))
+        canonical_query = '&'.join(f"{quote(str(k), safe='-_.~')}={quote(str(v), safe='-_.~')}"
+                                   for k, v in sorted(query.items()))
+        canonical_request = '\n'.join(
+            [method, path, canonical_query, canonical_headers, signed_headers, payload_hash])
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest()])
+
+        key = ('AWS4' + self.secret_key).encode()
+        for part in scope.split('/'):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+        headers['authorization'] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}")
+        return canonical_query
+
+    def request(self, method, key='', query=None, headers=None, body=None, length=None, stream=False):
+        """
+        Envia una peticion firmada
+
+        Args:
+            body: bytes, un objeto con read() (se envia en streaming) o None
+            length: Content-Length cuando body es un objeto con read()
+            stream: Devuelve la respuesta sin leer el cuerpo (para descargas)
+
+        Returns:
+            Tupla (respuesta, cuerpo) o la respuesta si stream es True
+
+        Raises:
+            S3Error si el servicio responde con un error
+        """
+        query = query or {}
+        headers = {name.lower(): value for name, value in (headers or {}).items()}
+        path = '/' + quote(self.bucket) + ('/' + quote(key, safe='/-_.~') if key else '')
+
+        if body is None:
+            payload_hash = EMPTY_SHA256
+        elif isinstance(body, bytes):
+            payload_hash = hashlib.sha256(body).hexdigest()
+        else:
+            payload_hash = UNSIGNED_PAYLOAD
+        canonical_query = self._sign(method, path, query, headers, payload_hash)
+        if body is not None:
+            headers['content-length'] = str(len(body) if isinstance(body, bytes) else length)
+
+        connection = self._connection()
+        try:
+            connection.request(method, path + ('?' + canonical_query if canonical_query else ''),
+                               body=body, headers=headers)
+            response = connection.getresponse()
+            if response.status >= 300:
+                raise _parse_error(response.status, response.read())
+            if stream:
+                # La respuesta queda asociada a quien la lee; el hilo usara otra conexion
+                self.local.connection = None
+                return response
+            return response, response.read()
+        except (OSError, http.client.HTTPException):
+            self._discard_connection()
+            raise
+
+    # ------------------------------------------------------------------
+    # Operaciones
+    # ------------------------------------------------------------------
+
+    def head_object(self, key):
+        """Cabeceras del objeto (en minusculas) o None si no existe"""
+        try:
+            response, _ = self.request('HEAD', key)
+        except S3Error as e:
+            if e.status == 404:
+                return None
+            raise
+        return {name.lower(): value for name, value in response.getheaders()}
+
+    def put_object(self, key, body, length, metadata=None):
+        """Sube un objeto; devuelve (ETag, si el ETag es el MD5)"""
+        response, _ = self.request('PUT', key, headers=_metadata_headers(metadata), body=body, length=length)
+        return _upload_etag(response)
+
+    def create_multipart_upload(self, key, metadata=None):
+        _, data = self.request('POST', key, query={'uploads': ''}, headers=_metadata_headers(metadata))
+        return _xml_text(ET.fromstring(data), 'UploadId')
+
+    def upload_part(self, key, upload_id, number, body, length):
+        """Sube una parte; devuelve (ETag, si el ETag es el MD5)"""
+        response, _ = self.request('PUT', key, query={'partNumber': number, 'uploadId': upload_id},
+                                   body=body, length=length)
+        return _upload_etag(response)
+
+    def list_parts(self, key, upload_id):
+        """Partes ya subidas: {numero: {'etag', 'size'}}"""
+        parts = {}
+        marker = None
+        while True:
+            query = {'uploadId': upload_id}
+            if marker:
+                query['part-number-marker'] = marker
+            _, data = self.request('GET', key, query=query)
+            root = ET.fromstring(data)
+            for part in _xml_children(root, 'Part'):
+                parts[int(_xml_text(part, 'PartNumber'))] = {
+                    'etag': _xml_text(part, 'ETag').strip('"'),
+                    'size': int(_xml_text(part, 'Size')),
+                }
+            if _xml_text(root, 'IsTruncated') != 'true':
+                return parts
+            marker = _xml_text(root, 'NextPartNumberMarker')
+
+    def complete_multipart_upload(self, key, upload_id, etags):
+        body = '<CompleteMultipartUpload>' + ''.join(
+            f'<Part><PartNumber>{number}</PartNumber><ETag>"{etag}"</ETag></Part>'
+            for number, etag in sorted(etags.items())) + '</CompleteMultipartUpload>'
+        _, data = self.request('POST', key, query={'uploadId': upload_id}, body=body.encode())
+        # S3 puede responder 200 con el error en el cuerpo
+        if _local_name(ET.fromstring(data)) == 'Error':
+            raise _parse_error(500, data)
+
+    def list_objects(self, prefix):
+        """Objetos bajo un prefijo: {clave: tamaño}"""
+        objects = {}
+        token = None
+        while True:
+            query = {'list-type': '2', 'prefix': prefix}
+            if token:
+                query['continuation-token'] = token
+            _, data = self.request('GET', query=query)
+            root = ET.fromstring(data)
+            for item in _xml_children(root, 'Contents'):
+                objects[_xml_text(item, 'Key')] = int(_xml_text(item, 'Size'))
+            if _xml_text(root, 'IsTruncated') != 'true':
+                return objects
+            token = _xml_text(root, 'NextContinuationToken')
+
+    def get_object(self, key):
+        """Respuesta HTTP del objeto para leerlo en streaming"""
+        return self.request('GET', key, stream=True)
+
+
+def _upload_etag(response):
+    """
+    ETag de una subida y si corresponde al MD5 del contenido
+
+    Con SSE-KMS o SSE-C el servicio devuelve un ETag que no es el MD5, por
+    lo que en esos buckets no se puede comparar.
+    """
+    etag = (response.getheader('ETag') or '').strip('"')
+    encryption = (response.getheader('x-amz-server-side-encryption') or '').lower()
+    is_md5 = (not encryption.startswith('aws:kms')
+              and not response.getheader('x-amz-server-side-encryption-customer-algorithm'))
+    return etag, is_md5
+
+
+def _metadata_headers(metadata):
+    return {f'x-amz-meta-{name}': value for name, value in (metadata or {}).items()}
+
+
+class RemoteReplicator:
+    """Sube y descarga respaldos completos de un almacenamiento S3"""
+
+    def __init__(self, client, backups_path, prefix='moodle-backups', workers=4,
+                 part_size=64 * 1024 * 1024, throttle=None):
+        self.client = client
+        self.backups_path = backups_path
+        self.prefix = prefix.strip('/')
+        self.workers = max(1, int(workers))
+        # S3 exige partes de al menos 5 MB (salvo la ultima)
+        self.part_size = max(5 * 1024 * 1024, int(part_size))
+        self.throttle = throttle
+        self.state_dir = os.path.join(backups_path, UPLOAD_STATE_DIR)
+
+    @classmethod
+    def from_settings(cls, settings):
+        client = S3Client(
+            settings.BACKUP_REMOTE_ENDPOINT, settings.BACKUP_REMOTE_BUCKET,
+            settings.BACKUP_REMOTE_ACCESS_KEY, settings.BACKUP_REMOTE_SECRET_KEY,
+            settings.BACKUP_REMOTE_REGION)
+        return cls(
+            client, settings.BACKUPS_PATH,
+            prefix=settings.BACKUP_REMOTE_PREFIX,
+            workers=settings.BACKUP_REMOTE_WORKERS,
+            part_size=settings.BACKUP_REMOTE_PART_MB * 1024 * 1024,
+            throttle=Throttle(rate_limit_mb=settings.BACKUP_REMOTE_RATE_LIMIT_MB)
+        )
+
+    def _key(self, *parts):
+        return '/'.join(part for part in (self.prefix,) + parts if part)
+
+    def backup_key(self, environment, timestamp, name=''):
+        return self._key(environment, timestamp, name)
+
+    def blob_key(self, sha1):
+        return self._key(BLOB_STORE_DIR, sha1[0:2], sha1[2:4], sha1)
+
+    # ------------------------------------------------------------------
+    # Subida
+    # ------------------------------------------------------------------
+
+    def upload_backup(self, environment, timestamp):
+        """
+        Replica un respaldo (y sus blobs, si es incremental)
+
+        Se puede volver a ejecutar tras una interrupcion: los archivos
+        completos se omiten por checksum y los multipart continuan.
+
+        Returns:
+            Dict con archivos subidos/omitidos, blobs y bytes enviados
+        """
+        started = time.monotonic()
+        backup_dir = os.path.join(self.backups_path, environment, timestamp)
+        if not os.path.isdir(backup_dir):
+            raise FileNotFoundError(f"No existe el respaldo {backup_dir}")
+
+        checksums = read_checksums(backup_dir)
+        remote = self.client.list_objects(self.backup_key(environment, timestamp) + '/')
+        stats = {'files': 0, 'uploaded': 0, 'skipped': 0, 'blobs': 0, 'bytes': 0}
+        uploads = []
+        manifests = []
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = []
+            for name in self._local_files(backup_dir):
+                path = os.path.join(backup_dir, name)
+                key = self.backup_key(environment, timestamp, name)
+                size = os.path.getsize(path)
+                sha256 = checksums.get(name) or sha256_file(path)
+                stats['files'] += 1
+                if name.endswith(MANIFEST_SUFFIX):
+                    manifests.append(path)
+
+                if key in remote and remote[key] == size:
+                    head = self.client.head_object(key)
+                    if head and head.get('x-amz-meta-sha256') == sha256:
+                        stats['skipped'] += 1
+                        continue
+
+                stats['uploaded'] += 1
+                if size <= self.part_size:
+                    futures.append(pool.submit(self._put_file, key, path, size, {'sha256': sha256}))
+                else:
+                    upload, existing = self._start_multipart(key, path, size, sha256)
+                    uploads.append(upload)
+                    futures += [pool.submit(self._upload_part, upload, number, existing.get(number))
+                                for number in range(1, upload['parts'] + 1)]
+
+            if manifests:
+                blob_futures = self._upload_blobs(pool, manifests)
+                stats['blobs'] = len(blob_futures)
+                futures += blob_futures
+
+            # result() propaga el primer error de cualquier parte
+            stats['bytes'] = sum(future.result() for future in futures)
+
+        for upload in uploads:
+            _with_retries(lambda: self.client.complete_multipart_upload(
+                upload['key'], upload['upload_id'], upload['etags']))
+            os.remove(upload['state_file'])
+
+        stats['seconds'] = round(time.monotonic() - started, 3)
+        return stats
+
+    def _local_files(self, backup_dir):
+        names = []
+        for root, _, files in os.walk(backup_dir):
+            for name in files:
+                if not name.endswith('.part'):
+                    names.append(os.path.relpath(os.path.join(root, name), backup_dir))
+        return sorted(names)
+
+    def _put_file(self, key, path, size, metadata=None):
+        def send():
+            body = FileSlice(path, 0, size, self.throttle)
+            try:
+                etag, is_md5 = self.client.put_object(key, body, size, metadata)
+            finally:
+                body.close()
+            if is_md5 and etag != body.md5.hexdigest():
+                raise S3Error(0, 'BadDigest', f"ETag inesperado para {key}")
+        _with_retries(send)
+        return size
+
+    def _state_file(self, key):
+        return os.path.join(self.state_dir, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def _start_multipart(self, key, path, size, sha256):
+        """
+        Inicia un multipart o retoma el que quedo pendiente para el mismo archivo
+
+        Returns:
+            Tupla (upload, partes ya subidas {numero: {'etag', 'size'}})
+        """
+        state_file = self._state_file(key)
+        state = None
+        existing = {}
+        try:
+            with open(state_file) as f:
+                state = json.load(f)
+            if (state.get('sha256'), state.get('size'), state.get('part_size')) != (sha256, size, self.part_size):
+                state = None
+        except (OSError, ValueError):
+            state = None
+
+        if state is not None:
+            try:
+                existing = self.client.list_parts(key, state['upload_id'])
+            except S3Error as e:
+                if e.status != 404:
+                    raise
+                state = None
+
+        if state is None:
+            upload_id = self.client.create_multipart_upload(key, {'sha256': sha256})
+            state = {'key': key, 'upload_id': upload_id, 'sha256': sha256,
+                     'size': size, 'part_size': self.part_size}
+            os.makedirs(self.state_dir, exist_ok=True)
+            with open(state_file + '.part', 'w') as f:
+                json.dump(state, f)
+            os.replace(state_file + '.part', state_file)
+
+        upload = {
+            'key': key,
+            'path': path,
+            'size': size,
+            'upload_id': state['upload_id'],
+            'parts': max(1, math.ceil(size / self.part_size)),
+            'etags': {},
+            'state_file': state_file,
+        }
+        return upload, existing
+
+    def _upload_part(self, upload, number, existing=None):
+        """Sube una parte (o la reutiliza si ya esta subida y su MD5 coincide)"""
+        offset = (number - 1) * self.part_size
+        length = min(self.part_size, upload['size'] - offset)
+
+        if existing and existing['size'] == length and \
+                slice_md5(upload['path'], offset, length) == existing['etag']:
+            upload['etags'][number] = existing['etag']
+            return 0
+
+        def send():
+            body = FileSlice(upload['path'], offset, length, self.throttle)
+            try:
+                etag, is_md5 = self.client.upload_part(upload['key'], upload['upload_id'], number, body, length)
+            finally:
+                body.close()
+            if is_md5 and etag != body.md5.hexdigest():
+                raise S3Error(0, 'BadDigest', f"ETag inesperado en la parte {number} de {upload['key']}")
+            return etag
+
+        upload['etags'][number] = _with_retries(send)
+        return length
+
+    def _upload_blobs(self, pool, manifests):
+        """Encola los blobs referenciados que aun no existen en el almacenamiento remoto"""
+        referenced = set()
+        for manifest in manifests:
+            _, entries = read_manifest(manifest)
+            referenced.update(entry['sha1'] for entry in entries if entry['type'] == 'file')
+
+        remote = {key.rsplit('/', 1)[-1] for key in self.client.list_objects(self._key(BLOB_STORE_DIR) + '/')}
+        store = BlobStore(os.path.join(self.backups_path, BLOB_STORE_DIR))
+        futures = []
+        for sha1 in sorted(referenced - remote):
+            path = store.blob_path(sha1)
+            futures.append(pool.submit(self._put_file, self.blob_key(sha1), path, os.path.getsize(path)))
+        return futures
+
+    # ------------------------------------------------------------------
+    # Descarga
+    # ------------------------------------------------------------------
+
+    def list_backup(self, environment, timestamp):
+        """Archivos de un respaldo remoto (rutas relativas)"""
+        prefix = self.backup_key(environment, timestamp) + '/'
+        return sorted(key[len(prefix):] for key in self.client.list_objects(prefix))
+
+    def stream_file(self, environment, timestamp, name, output):
+        """Escribe un archivo del respaldo remoto en output (sin pasar por el disco)"""
+        response = self.client.get_object(self.backup_key(environment, timestamp, name))
+        try:
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                output.write(chunk)
+            output.flush()
+        finally:
+            response.close()
+
+    def _download(self, key, target):
+        def fetch():
+            partial = f"{target}.part"
+            response = self.client.get_object(key)
+            try:
+                with open(partial, 'wb') as f:
+                    for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                        f.write(chunk)
+            finally:
+                response.close()
+            os.replace(partial, target)
+            return os.path.getsize(target)
+        return _with_retries(fetch)
+
+    def download_backup(self, environment, timestamp):
+        """
+        Descarga un respaldo remoto a BACKUPS_PATH y los blobs que falten
+
+        Se usa para los formatos que no se pueden restaurar en streaming
+        (volcado paralelo y manifiestos incrementales).
+
+        Returns:
+            Bytes descargados
+        """
+        backup_dir = os.path.join(self.backups_path, environment, timestamp)
+        names = self.list_backup(environment, timestamp)
+        if not names:
+            raise FileNotFoundError(f"No existe el respaldo remoto {environment}/{timestamp}")
+
+        total = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = []
+            for name in names:
+                target = os.path.join(backup_dir, name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                futures.append(pool.submit(self._download, self.backup_key(environment, timestamp, name), target))
+            total += sum(future.result() for future in futures)
+
+            store = BlobStore(os.path.join(self.backups_path, BLOB_STORE_DIR))
+            missing = set()
+            for name in names:
+                if name.endswith(MANIFEST_SUFFIX):
+                    _, entries = read_manifest(os.path.join(backup_dir, name))
+                    missing.update(store.missing_blobs(entries))
+            futures = []
+            for sha1 in sorted(missing):
+                target = store.blob_path(sha1)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                futures.append(pool.submit(self._download, self.blob_key(sha1), target))
+            total += sum(future.result() for future in futures)
+        return total
+
+
+def replicator_from_env(backups_path):
+    """Replicador configurado con las variables BACKUP_REMOTE_* (para backup.sh y restore.sh)"""
+    client = S3Client(
+        os.environ.get('BACKUP_REMOTE_ENDPOINT', ''),
+        os.environ.get('BACKUP_REMOTE_BUCKET', ''),
+        os.environ.get('BACKUP_REMOTE_ACCESS_KEY', ''),
+        os.environ.get('BACKUP_REMOTE_SECRET_KEY', ''),
+        os.environ.get('BACKUP_REMOTE_REGION') or 'us-east-1')
+    return RemoteReplicator(
+        client, backups_path,
+        prefix=os.environ.get('BACKUP_REMOTE_PREFIX') or 'moodle-backups',
+        workers=int(os.environ.get('BACKUP_REMOTE_WORKERS') or 4),
+        part_size=int(os.environ.get('BACKUP_REMOTE_PART_MB') or 64) * 1024 * 1024,
+        throttle=Throttle(rate_limit_mb=os.environ.get('BACKUP_REMOTE_RATE_LIMIT_MB') or 0)
+    )
+
+
+def main(argv):
+    usage = (
+        "Uso:\n"
+        "  remote.py upload <directorio_backups> <ambiente> <timestamp>\n"
+        "  remote.py list <directorio_backups> <ambiente> <timestamp>\n"
+        "  remote.py cat <directorio_backups> <ambiente> <timestamp> <archivo>   (a stdout)\n"
+        "  remote.py download <directorio_backups> <ambiente> <timestamp>\n"
+        "Configuración: BACKUP_REMOTE_ENDPOINT, BACKUP_REMOTE_BUCKET, BACKUP_REMOTE_ACCESS_KEY,\n"
+        "  BACKUP_REMOTE_SECRET_KEY, BACKUP_REMOTE_REGION, BACKUP_REMOTE_PREFIX,\n"
+        "  BACKUP_REMOTE_WORKERS, BACKUP_REMOTE_PART_MB, BACKUP_REMOTE_RATE_LIMIT_MB"
+    )
+    command = argv[1] if len(argv) > 1 else None
+    if command not in ('upload', 'list', 'cat', 'download') or len(argv) < (6 if command == 'cat' else 5):
+        print(usage, file=sys.stderr)
+        return 1
+
+    replicator = replicator_from_env(argv[2])
+    environment, timestamp = argv[3], argv[4]
+    try:
+        if command == 'upload':
+            stats = replicator.upload_backup(environment, timestamp)
+            print(f"{stats['uploaded']} archivos subidos, {stats['skipped']} sin cambios, "
+                  f"{stats['blobs']} blobs, {stats['bytes']} bytes en {stats['seconds']}s")
+        elif command == 'list':
+            for name in replicator.list_backup(environment, timestamp):
+                print(name)
+        elif command == 'cat':
+            replicator.stream_file(environment, timestamp, argv[5], sys.stdout.buffer)
+        else:
+            total = replicator.download_backup(environment, timestamp)
+            print(f"Respaldo descargado: {total} bytes")
+    except BrokenPipeError:
+        return 1
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
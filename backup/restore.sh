@@ -3,7 +3,8 @@
 ###############################################################################
 # Script de Restauración de Respaldos para Moodle en Docker
 # Restaura: Base de datos MySQL + moodledata
-# Formatos soportados: .sql.gz (comprimido) y .sql (sin comprimir)
+# Formatos soportados: .sql.gz / .sql.zst (comprimido) y .sql (sin comprimir)
+# El formato de compresión se detecta automáticamente por su firma
 # Autor: Eduardo Valdés
 ###############################################################################
 
@@ -49,6 +50,27 @@ MOODLE_CONTAINER="moodle_$ENVIRONMENT"
 # Archivo de log
 LOG_FILE="/tmp/restore_${ENVIRONMENT}_${BACKUP_TIMESTAMP}.log"
 
+# Hilos de descompresión (0 = todos los núcleos)
+COMPRESSION_THREADS="${BACKUP_COMPRESSION_THREADS:-0}"
+
+# Almacén de blobs de los respaldos incrementales
+BLOB_STORE="$BASE_BACKUP_DIR/blobs"
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+
+# Restaurar base de datos y moodledata al mismo tiempo (true/false)
+CONCURRENT="${BACKUP_CONCURRENT:-true}"
+
+# Modo de restauración de moodledata: full (borrar y extraer) o differential
+RESTORE_MODE="${BACKUP_RESTORE_MODE:-full}"
+
+# Directorios excluidos del respaldo; se recrean vacíos al restaurar
+export BACKUP_MOODLEDATA_EXCLUDE="${BACKUP_MOODLEDATA_EXCLUDE-cache,localcache,temp,sessions,trashdir}"
+
+# Si el backup no está en disco se busca en el almacenamiento remoto (BACKUP_REMOTE_*)
+REMOTE_ENABLED="${BACKUP_REMOTE_ENABLED:-false}"
+REMOTE_SOURCE="false"
+REMOTE_FILES=""
+
 # Colores para output
 RED='\033[0;31m'
 GREEN='\033[0;32m'
@@ -82,6 +104,127 @@ log_info() {
     log_message "${BLUE}[INFO]${NC} $1"
 }
 
+###############################################################################
+# Detección de compresión
+###############################################################################
+
+# Detecta el codec de un archivo por sus magic bytes: gzip, zstd o none
+# (por la extensión si el archivo está en el almacenamiento remoto)
+detect_codec() {
+    if [ "$REMOTE_SOURCE" = "true" ]; then
+        case "$1" in
+            *.gz)  echo "gzip" ;;
+            *.zst) echo "zstd" ;;
+            *)     echo "none" ;;
+        esac
+        return
+    fi
+
+    local magic=$(head -c 4 "$1" | od -An -tx1 | tr -d ' \n')
+
+    case "$magic" in
+        1f8b*)    echo "gzip" ;;
+        28b52ffd) echo "zstd" ;;
+        *)        echo "none" ;;
+    esac
+}
+
+# Configura PROGRESS_DB_CMD / PROGRESS_MD_CMD: con BACKUP_PROGRESS_FILE progress.py
+# registra el avance de cada etapa, si no los pipes usan cat
+setup_progress() {
+    PROGRESS_DB_CMD=(cat)
+    PROGRESS_MD_CMD=(cat)
+    if [ -n "$BACKUP_PROGRESS_FILE" ]; then
+        PROGRESS_DB_CMD=(python3 "$SCRIPT_DIR/progress.py" meter database sql)
+        PROGRESS_MD_CMD=(python3 "$SCRIPT_DIR/progress.py" meter moodledata tar)
+    fi
+}
+
+# Configura DECOMPRESS_CMD para el codec indicado
+setup_decompression() {
+    local codec="$1"
+    local threads="$COMPRESSION_THREADS"
+    if [ -z "$threads" ] || [ "$threads" -le 0 ] 2>/dev/null; then
+        threads=$(nproc 2>/dev/null || echo 1)
+    fi
+
+    case "$codec" in
+        gzip)
+            if command -v pigz > /dev/null 2>&1; then
+                DECOMPRESS_CMD=(pigz -dc -p "$threads")
+            else
+                DECOMPRESS_CMD=(gzip -dc)
+            fi
+            ;;
+        zstd)
+            if ! command -v zstd > /dev/null 2>&1; then
+                log_error "El backup está comprimido con zstd pero 'zstd' no está instalado"
+                return 1
+            fi
+            DECOMPRESS_CMD=(zstd -dc -q)
+            ;;
+        *)
+            DECOMPRESS_CMD=(cat)
+            ;;
+    esac
+    return 0
+}
+
+# Descomprime un archivo del respaldo hacia stdout (en streaming si es remoto)
+decompress_backup_file() {
+    if [ "$REMOTE_SOURCE" = "true" ]; then
+        python3 "$SCRIPT_DIR/remote.py" cat "$BASE_BACKUP_DIR" "$ENVIRONMENT" "$BACKUP_TIMESTAMP" "$1" \
+            2>> "$LOG_FILE" | "${DECOMPRESS_CMD[@]}"
+        return $(( PIPESTATUS[0] | PIPESTATUS[1] ))
+    fi
+    "${DECOMPRESS_CMD[@]}" < "$1"
+}
+
+# Busca el primer archivo del respaldo (local o remoto) que coincide con alguno de los patrones
+find_backup_file() {
+    local pattern name
+    for pattern in "$@"; do
+        if [ "$REMOTE_SOURCE" = "true" ]; then
+            while IFS= read -r name; do
+                if [[ "$name" != */* && "$name" == $pattern ]]; then
+                    echo "$name"
+                    return 0
+                fi
+            done <<< "$REMOTE_FILES"
+        else
+            name=$(find "$BACKUP_DIR" -maxdepth 1 -type f -name "$pattern" | head -n 1)
+            if [ -n "$name" ]; then
+                echo "$name"
+                return 0
+            fi
+        fi
+    done
+    return 1
+}
+
+###############################################################################
+# Backup en el almacenamiento remoto
+###############################################################################
+find_remote_backup() {
+    REMOTE_FILES=$(python3 "$SCRIPT_DIR/remote.py" list "$BASE_BACKUP_DIR" "$ENVIRONMENT" "$BACKUP_TIMESTAMP" 2>> "$LOG_FILE")
+    if [ -z "$REMOTE_FILES" ]; then
+        return 1
+    fi
+
+    # El volcado paralelo, el respaldo físico, los manifiestos incrementales y los fragmentos
+    # de moodledata necesitan sus archivos (y blobs) en disco
+    if echo "$REMOTE_FILES" | grep -q -e '^mysql_parallel/' -e '^mysql_physical\.json$' -e '\.manifest\.json\.gz$' \
+            -e '^moodledata_shards/'; then
+        log_info "Descargando backup desde el almacenamiento remoto..."
+        python3 "$SCRIPT_DIR/remote.py" download "$BASE_BACKUP_DIR" "$ENVIRONMENT" "$BACKUP_TIMESTAMP" >> "$LOG_FILE" 2>&1
+        return $?
+    fi
+
+    REMOTE_SOURCE="true"
+    log_info "Backup no disponible localmente: se restaurará en streaming desde el almacenamiento remoto"
+    return 0
+}
+
 ###############################################################################
 # Validaciones iniciales
 ###############################################################################
@@ -102,7 +245,7 @@ validate_parameters() {
         exit 1
     fi
 
-    if [ ! -d "$BACKUP_DIR" ]; then
+    if [ ! -d "$BACKUP_DIR" ] && { [ "$REMOTE_ENABLED" != "true" ] || ! find_remote_backup; }; then
         log_error "No existe el directorio de backup: $BACKUP_DIR"
         echo ""
         echo "Backups disponibles para $ENVIRONMENT:"
@@ -192,27 +335,37 @@ start_services() {
 # Restaurar base de datos MySQL
 ###############################################################################
 restore_mysql_database() {
-    log_info "Restaurando base de datos MySQL..."
-
-    # Buscar archivo SQL (primero comprimido, luego sin comprimir)
-    local sql_file=$(find "$BACKUP_DIR" -name "*.sql.gz" | head -n 1)
-    local is_compressed=true
+    # Respaldo paralelo: cargar los fragmentos de forma concurrente
+    if [ -f "$BACKUP_DIR/mysql_parallel/index.json" ]; then
+        restore_mysql_database_parallel
+        return $?
+    fi
 
-    if [ -z "$sql_file" ]; then
-        # Si no hay archivo comprimido, buscar archivo .sql sin comprimir
-        sql_file=$(find "$BACKUP_DIR" -name "*.sql" | head -n 1)
-        is_compressed=false
+    # Respaldo físico: reemplazar el directorio de datos en lugar de cargar SQL
+    if [ -f "$BACKUP_DIR/mysql_physical.json" ]; then
+        restore_mysql_database_physical
+        return $?
     fi
 
+    log_info "Restaurando base de datos MySQL..."
+
+    # Buscar archivo SQL (comprimido o, si no hay, sin comprimir)
+    local sql_file=$(find_backup_file "*.sql.gz" "*.sql.zst" "*.sql")
+
     if [ -z "$sql_file" ]; then
-        log_error "No se encontró archivo SQL en el backup (buscado: *.sql.gz, *.sql)"
+        log_error "No se encontró archivo SQL en el backup (buscado: *.sql.gz, *.sql.zst, *.sql)"
         return 1
     fi
 
-    if [ "$is_compressed" = true ]; then
-        log_info "Archivo encontrado (comprimido): $(basename $sql_file)"
-    else
+    local codec=$(detect_codec "$sql_file")
+    if [ "$codec" = "none" ]; then
         log_info "Archivo encontrado (sin comprimir): $(basename $sql_file)"
+    else
+        log_info "Archivo encontrado (comprimido con $codec): $(basename $sql_file)"
+    fi
+
+    if ! setup_decompression "$codec"; then
+        return 1
     fi
 
     # Verificar que el contenedor MySQL esté corriendo
@@ -225,24 +378,83 @@ restore_mysql_database() {
     local db_user="root"
     local db_pass="${DB_ROOT_PASS}"
 
-    # Restaurar según el formato
-    if [ "$is_compressed" = true ]; then
-        # Descomprimir, filtrar warnings y restaurar
-        log_info "Descomprimiendo y restaurando base de datos..."
-        gunzip -c "$sql_file" | grep -v "^mysqldump:" | grep -v "^mysql:" | docker exec -i "$MYSQL_CONTAINER" mysql \
-            -u"$db_user" \
-            -p"$db_pass" \
-            "$db_name" 2>> "$LOG_FILE"
+    # Descomprimir, filtrar warnings de mysqldump que puedan estar en el archivo y restaurar
+    log_info "Descomprimiendo y restaurando base de datos..."
+    decompress_backup_file "$sql_file" 2>> "$LOG_FILE" | "${PROGRESS_DB_CMD[@]}" 2>> "$LOG_FILE" | \
+        grep -v "^mysqldump:" | grep -v "^mysql:" | docker exec -i "$MYSQL_CONTAINER" mysql \
+        -u"$db_user" \
+        -p"$db_pass" \
+        "$db_name" 2>> "$LOG_FILE"
+
+    local pipe_status=("${PIPESTATUS[@]}")
+
+    if [ "${pipe_status[0]}" -eq 0 ] && [ "${pipe_status[1]}" -eq 0 ] && [ "${pipe_status[4]}" -eq 0 ]; then
+        log_success "Base de datos restaurada correctamente"
+        return 0
     else
-        # Filtrar warnings de mysqldump que puedan estar en el archivo y restaurar
-        log_info "Restaurando base de datos..."
-        grep -v "^mysqldump:" "$sql_file" | grep -v "^mysql:" | docker exec -i "$MYSQL_CONTAINER" mysql \
-            -u"$db_user" \
-            -p"$db_pass" \
-            "$db_name" 2>> "$LOG_FILE"
+        log_error "Error al restaurar la base de datos"
+        return 1
     fi
+}
 
-    if [ $? -eq 0 ]; then
+###############################################################################
+# Restaurar base de datos MySQL desde un respaldo paralelo
+###############################################################################
+restore_mysql_database_parallel() {
+    log_info "Restaurando base de datos MySQL (carga paralela)..."
+
+    if ! docker ps | grep -q "$MYSQL_CONTAINER"; then
+        log_error "El contenedor MySQL ($MYSQL_CONTAINER) no está corriendo"
+        return 1
+    fi
+
+    local db_name="${DB_NAME:-moodle}"
+
+    MYSQL_PWD="$DB_ROOT_PASS" LOG_FILE="$LOG_FILE" \
+        python3 "$SCRIPT_DIR/parallel_dump.py" load "$MYSQL_CONTAINER" "$db_name" "$BACKUP_DIR/mysql_parallel" 2>> "$LOG_FILE" | tee -a "$LOG_FILE"
+
+    if [ "${PIPESTATUS[0]}" -eq 0 ]; then
+        log_success "Base de datos restaurada correctamente"
+        return 0
+    else
+        log_error "Error al restaurar la base de datos"
+        return 1
+    fi
+}
+
+###############################################################################
+# Restaurar base de datos MySQL desde un respaldo físico (plugin clone)
+###############################################################################
+restore_mysql_database_physical() {
+    log_info "Restaurando base de datos MySQL (respaldo físico)..."
+
+    local archive_file=$(find_backup_file "mysql_physical_*.tar.gz" "mysql_physical_*.tar.zst" "mysql_physical_*.tar")
+    if [ -z "$archive_file" ]; then
+        log_error "No se encontró el directorio de datos del respaldo físico (mysql_physical_*.tar*)"
+        return 1
+    fi
+
+    local codec=$(detect_codec "$archive_file")
+    log_info "Archivo encontrado: $(basename $archive_file) (compresión: $codec)"
+
+    if ! setup_decompression "$codec"; then
+        return 1
+    fi
+
+    if ! docker ps | grep -q "$MYSQL_CONTAINER"; then
+        log_error "El contenedor MySQL ($MYSQL_CONTAINER) no está corriendo"
+        return 1
+    fi
+
+    # physical.py verifica la versión, extrae los archivos, reinicia MySQL y vuelve atrás si no arranca
+    decompress_backup_file "$archive_file" 2>> "$LOG_FILE" | \
+        MYSQL_PWD="$DB_ROOT_PASS" LOG_FILE="$LOG_FILE" \
+        python3 "$SCRIPT_DIR/physical.py" restore "$MYSQL_CONTAINER" "$BACKUP_DIR/mysql_physical.json" 2>> "$LOG_FILE" | \
+        tee -a "$LOG_FILE"
+
+    local pipe_status=("${PIPESTATUS[@]}")
+
+    if [ "${pipe_status[0]}" -eq 0 ] && [ "${pipe_status[1]}" -eq 0 ]; then
         log_success "Base de datos restaurada correctamente"
         return 0
     else
@@ -257,15 +469,46 @@ restore_mysql_database() {
 restore_moodledata() {
     log_info "Restaurando moodledata..."
 
-    # Buscar archivo de moodledata
-    local moodledata_file=$(find "$BACKUP_DIR" -name "moodledata_*.tar.gz" | head -n 1)
+    # Respaldo en fragmentos: se extraen en paralelo (ver sharded.py)
+    if [ -f "$BACKUP_DIR/moodledata_shards/manifest.json" ]; then
+        if [ "$RESTORE_MODE" = "differential" ]; then
+            restore_moodledata_differential "$BACKUP_DIR/moodledata_shards"
+            return $?
+        fi
+        restore_moodledata_sharded
+        return $?
+    fi
+
+    # Buscar archivo de moodledata (.tar.gz, .tar.zst o .tar)
+    local moodledata_file=$(find_backup_file "moodledata_*.tar.gz" "moodledata_*.tar.zst" "moodledata_*.tar")
 
     if [ -z "$moodledata_file" ]; then
+        # Respaldo incremental: reconstruir el volumen desde el manifiesto
+        local manifest_file=$(find_backup_file "moodledata_*.manifest.json.gz")
+        if [ -n "$manifest_file" ]; then
+            if [ "$RESTORE_MODE" = "differential" ]; then
+                restore_moodledata_differential "$manifest_file"
+                return $?
+            fi
+            restore_moodledata_from_manifest "$manifest_file"
+            return $?
+        fi
+
         log_error "No se encontró archivo de moodledata en el backup"
         return 1
     fi
 
-    log_info "Archivo encontrado: $(basename $moodledata_file)"
+    local codec=$(detect_codec "$moodledata_file")
+    log_info "Archivo encontrado: $(basename $moodledata_file) (compresión: $codec)"
+
+    if ! setup_decompression "$codec"; then
+        return 1
+    fi
+
+    if [ "$RESTORE_MODE" = "differential" ]; then
+        restore_moodledata_differential "$moodledata_file"
+        return $?
+    fi
 
     local volume_name="moodledata_${ENVIRONMENT}"
 
@@ -277,18 +520,20 @@ restore_moodledata() {
 
     # Limpiar volumen actual
     log_warning "Eliminando contenido actual de moodledata..."
-    docker run --rm \
-        -v "$volume_name":/target \
-        alpine sh -c "rm -rf /target/*" 2>> "$LOG_FILE"
+    if ! python3 "$SCRIPT_DIR/volume.py" clear "$volume_name" 2>> "$LOG_FILE"; then
+        log_error "No se pudo vaciar el volumen $volume_name"
+        return 1
+    fi
 
-    # Restaurar desde backup
+    # Restaurar desde backup: se descomprime en el host y el daemon extrae el tar por su API
     log_info "Restaurando contenido de moodledata..."
-    docker run --rm \
-        -v "$volume_name":/target \
-        -v "$BACKUP_DIR":/backup:ro \
-        alpine tar xzf "/backup/$(basename $moodledata_file)" -C /target 2>> "$LOG_FILE"
+    decompress_backup_file "$moodledata_file" 2>> "$LOG_FILE" | "${PROGRESS_MD_CMD[@]}" 2>> "$LOG_FILE" | \
+        python3 "$SCRIPT_DIR/volume.py" import "$volume_name" 2>> "$LOG_FILE"
 
-    if [ $? -eq 0 ]; then
+    local pipe_status=("${PIPESTATUS[@]}")
+
+    if [ "${pipe_status[0]}" -eq 0 ] && [ "${pipe_status[1]}" -eq 0 ] && [ "${pipe_status[2]}" -eq 0 ]; then
+        recreate_excluded_dirs "$volume_name"
         log_success "Moodledata restaurado correctamente"
         return 0
     else
@@ -297,6 +542,189 @@ restore_moodledata() {
     fi
 }
 
+###############################################################################
+# Recrear vacíos los directorios excluidos del respaldo (cache, temp, ...)
+# con el mismo dueño y permisos que la raíz de moodledata
+###############################################################################
+recreate_excluded_dirs() {
+    local volume_name="$1"
+    local dirs=() targets=() dir
+    IFS=',' read -ra dirs <<< "$BACKUP_MOODLEDATA_EXCLUDE"
+    for dir in "${dirs[@]}"; do
+        dir="${dir// /}"
+        dir="${dir#./}"
+        dir="${dir%/}"
+        [ -n "$dir" ] && targets+=("$dir")
+    done
+
+    if [ ${#targets[@]} -eq 0 ]; then
+        return 0
+    fi
+
+    if python3 "$SCRIPT_DIR/volume.py" mkdirs "$volume_name" "${targets[@]}" 2>> "$LOG_FILE"; then
+        log_info "Directorios excluidos recreados: ${targets[*]}"
+    else
+        log_warning "No se pudieron recrear los directorios excluidos (Moodle los creará al usarlos)"
+    fi
+}
+
+###############################################################################
+# Restaurar moodledata de forma diferencial (solo los archivos que difieren)
+# Recibe un tar (usa DECOMPRESS_CMD), un manifiesto incremental o el directorio de fragmentos
+###############################################################################
+restore_moodledata_differential() {
+    local source_file="$1"
+    local volume_name="moodledata_${ENVIRONMENT}"
+
+    log_info "Restauración diferencial de moodledata (${BACKUP_PARALLEL_WORKERS:-4} workers)"
+
+    if ! docker volume ls | grep -q "$volume_name"; then
+        log_error "El volumen $volume_name no existe"
+        return 1
+    fi
+
+    # Se trabaja sobre el volumen en el host para comparar con el contenido actual
+    local mountpoint=$(docker volume inspect -f '{{.Mountpoint}}' "$volume_name" 2>> "$LOG_FILE")
+    if [ -z "$mountpoint" ] || [ ! -d "$mountpoint" ]; then
+        log_error "No se pudo acceder al punto de montaje de $volume_name"
+        return 1
+    fi
+
+    local stats status
+    if [[ "$source_file" == *.manifest.json.gz ]]; then
+        stats=$(python3 "$SCRIPT_DIR/differential.py" manifest "$source_file" "$BLOB_STORE" "$mountpoint" 2>> "$LOG_FILE")
+        status=$?
+    elif [ -d "$source_file" ]; then
+        # Los fragmentos se unen en un solo tar para comparar el volumen completo
+        stats=$(BACKUP_COMPRESSION_THREADS="$COMPRESSION_THREADS" python3 "$SCRIPT_DIR/sharded.py" tar "$source_file" 2>> "$LOG_FILE" | \
+            python3 "$SCRIPT_DIR/differential.py" archive - "$mountpoint" 2>> "$LOG_FILE"; \
+            exit $(( PIPESTATUS[0] | PIPESTATUS[1] )))
+        status=$?
+    else
+        stats=$(decompress_backup_file "$source_file" 2>> "$LOG_FILE" | \
+            python3 "$SCRIPT_DIR/differential.py" archive - "$mountpoint" 2>> "$LOG_FILE"; \
+            exit $(( PIPESTATUS[0] | PIPESTATUS[1] )))
+        status=$?
+    fi
+
+    if [ $status -eq 0 ]; then
+        recreate_excluded_dirs "$volume_name"
+        log_success "Moodledata restaurado (diferencial): $stats"
+        return 0
+    else
+        log_error "Error en la restauración diferencial de moodledata"
+        return 1
+    fi
+}
+
+###############################################################################
+# Restaurar moodledata desde un respaldo en fragmentos
+# El fragmento con el resto del volumen va primero y los de filedir en paralelo
+###############################################################################
+restore_moodledata_sharded() {
+    local shard_dir="$BACKUP_DIR/moodledata_shards"
+    local volume_name="moodledata_${ENVIRONMENT}"
+
+    log_info "Respaldo en fragmentos encontrado (${BACKUP_PARALLEL_WORKERS:-4} workers)"
+
+    if ! docker volume ls | grep -q "$volume_name"; then
+        log_error "El volumen $volume_name no existe"
+        return 1
+    fi
+
+    # Limpiar volumen actual
+    log_warning "Eliminando contenido actual de moodledata..."
+    if ! python3 "$SCRIPT_DIR/volume.py" clear "$volume_name" 2>> "$LOG_FILE"; then
+        log_error "No se pudo vaciar el volumen $volume_name"
+        return 1
+    fi
+
+    log_info "Restaurando fragmentos de moodledata..."
+    LOG_FILE="$LOG_FILE" BACKUP_COMPRESSION_THREADS="$COMPRESSION_THREADS" \
+        python3 "$SCRIPT_DIR/sharded.py" restore "$shard_dir" "$volume_name" 2>> "$LOG_FILE" | tee -a "$LOG_FILE"
+
+    if [ "${PIPESTATUS[0]}" -eq 0 ]; then
+        recreate_excluded_dirs "$volume_name"
+        log_success "Moodledata restaurado correctamente"
+        return 0
+    else
+        log_error "Error al restaurar moodledata desde los fragmentos"
+        return 1
+    fi
+}
+
+###############################################################################
+# Restaurar moodledata desde un manifiesto incremental
+###############################################################################
+restore_moodledata_from_manifest() {
+    local manifest_file="$1"
+    local volume_name="moodledata_${ENVIRONMENT}"
+
+    log_info "Manifiesto incremental encontrado: $(basename $manifest_file)"
+    log_info "Almacén de blobs: $BLOB_STORE"
+
+    if ! docker volume ls | grep -q "$volume_name"; then
+        log_error "El volumen $volume_name no existe"
+        return 1
+    fi
+
+    # Verificar que todos los blobs existen antes de tocar el volumen
+    if ! python3 "$SCRIPT_DIR/incremental.py" check "$manifest_file" "$BLOB_STORE" >> "$LOG_FILE" 2>&1; then
+        log_error "El almacén de blobs no contiene todos los archivos del manifiesto"
+        return 1
+    fi
+
+    # Limpiar volumen actual
+    log_warning "Eliminando contenido actual de moodledata..."
+    if ! python3 "$SCRIPT_DIR/volume.py" clear "$volume_name" 2>> "$LOG_FILE"; then
+        log_error "No se pudo vaciar el volumen $volume_name"
+        return 1
+    fi
+
+    # El manifiesto y los blobs se convierten en un stream tar del volumen completo
+    log_info "Reconstruyendo moodledata desde el almacén de blobs..."
+    python3 "$SCRIPT_DIR/incremental.py" tar "$manifest_file" "$BLOB_STORE" 2>> "$LOG_FILE" | \
+        "${PROGRESS_MD_CMD[@]}" 2>> "$LOG_FILE" | \
+        python3 "$SCRIPT_DIR/volume.py" import "$volume_name" 2>> "$LOG_FILE"
+
+    local pipe_status=("${PIPESTATUS[@]}")
+
+    if [ "${pipe_status[0]}" -eq 0 ] && [ "${pipe_status[1]}" -eq 0 ] && [ "${pipe_status[2]}" -eq 0 ]; then
+        recreate_excluded_dirs "$volume_name"
+        log_success "Moodledata restaurado correctamente"
+        return 0
+    else
+        log_error "Error al restaurar moodledata desde el manifiesto"
+        return 1
+    fi
+}
+
+###############################################################################
+# Restaurar base de datos y moodledata al mismo tiempo
+# Retorna 0 solo si ambas etapas terminan correctamente
+###############################################################################
+restore_concurrent() {
+    log_info "Restaurando base de datos y moodledata en paralelo"
+
+    restore_mysql_database &
+    local db_pid=$!
+    restore_moodledata &
+    local moodledata_pid=$!
+
+    # Progreso combinado mientras ambas etapas corren
+    local elapsed=0
+    while kill -0 "$db_pid" 2>/dev/null && kill -0 "$moodledata_pid" 2>/dev/null; do
+        sleep 10
+        elapsed=$((elapsed + 10))
+        echo "  Progreso: base de datos y moodledata en curso (${elapsed}s)"
+    done
+
+    local status=0
+    wait "$db_pid" || status=1
+    wait "$moodledata_pid" || status=1
+    return $status
+}
+
 ###############################################################################
 # Verificar restauración
 ###############################################################################
@@ -331,6 +759,7 @@ main() {
 
     # Confirmar con el usuario
     confirm_restore
+    setup_progress
 
     local restore_status="SUCCESS"
 
@@ -340,29 +769,42 @@ main() {
         restore_status="FAILED"
     fi
 
-    # Restaurar base de datos
-    if [ "$restore_status" = "SUCCESS" ]; then
-        if ! restore_mysql_database; then
+    # Restaurar base de datos y moodledata
+    if [ "$restore_status" = "SUCCESS" ] && [ "$CONCURRENT" = "true" ]; then
+        if ! restore_concurrent; then
             restore_status="FAILED"
         fi
+    else
+        # Restaurar base de datos
+        if [ "$restore_status" = "SUCCESS" ]; then
+            if ! restore_mysql_database; then
+                restore_status="FAILED"
+            fi
+        fi
+
+        # Restaurar moodledata
+        if [ "$restore_status" = "SUCCESS" ]; then
+            if ! restore_moodledata; then
+                restore_status="FAILED"
+            fi
+        fi
     fi
 
-    # Restaurar moodledata
-    if [ "$restore_status" = "SUCCESS" ]; then
-        if ! restore_moodledata; then
+    # Con SKIP_START=yes Moodle queda detenido (backup_manager.py aplica los
+    # binlogs de la recuperación a un instante y luego lo inicia)
+    if [ "${SKIP_START}" = "yes" ]; then
+        log_info "Contenedor Moodle detenido hasta completar la recuperación a un instante"
+    else
+        # Iniciar servicios
+        if ! start_services; then
+            log_error "Error al iniciar servicios"
             restore_status="FAILED"
         fi
-    fi
 
-    # Iniciar servicios
-    if ! start_services; then
-        log_error "Error al iniciar servicios"
-        restore_status="FAILED"
+        # Verificar restauración
+        verify_restore
     fi
 
-    # Verificar restauración
-    verify_restore
-
     # Resultado final
     log_info "=========================================="
     if [ "$restore_status" = "SUCCESS" ]; then
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Retention Module
+Politica de retencion abuelo-padre-hijo (GFS) para los respaldos
+
+Se conservan los respaldos mas recientes de cada uno de los ultimos N dias,
+N semanas y N meses que tengan respaldos. El plan se calcula con los datos
+del catalogo (fecha y estado de cada respaldo), sin recorrer los directorios.
+
+Los respaldos a eliminar se mueven primero a BACKUPS_PATH/.trash (un rename,
+instantaneo) y un proceso independiente los borra en segundo plano, de modo
+que un rm de cientos de GB no bloquea el siguiente respaldo.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backup.catalog import BackupCatalog
+
+
+TRASH_DIR = '.trash'
+TIMESTAMP_FORMAT = "%Y-%m-%d_%H-%M-%S"
+
+# Estados que no cuentan como punto de restauracion
+UNUSABLE_STATUS = ('FAILED', 'INCOMPLETE')
+
+PERIODS = (
+    ('daily', 'diario', lambda d: d.date()),
+    ('weekly', 'semanal', lambda d: tuple(d.isocalendar()[:2])),
+    ('monthly', 'mensual', lambda d: (d.year, d.month)),
+)
+
+
+def plan_retention(backups, daily, weekly, monthly, protect=()):
+    """
+    Calcula que respaldos conservar y cuales eliminar
+
+    Args:
+        backups: Lista de dicts con 'timestamp', 'status' y 'size_bytes' (catalogo)
+        daily: Dias distintos a conservar
+        weekly: Semanas distintas a conservar
+        monthly: Meses distintos a conservar
+        protect: Timestamps que nunca se eliminan (ej. el respaldo en curso)
+
+    Returns:
+        Tupla (conservar, eliminar): conservar es una lista de
+        (respaldo, [motivos]) y eliminar una lista de respaldos
+    """
+    limits = {'daily': daily, 'weekly': weekly, 'monthly': monthly}
+    dated = []
+    for backup in backups:
+        try:
+            dated.append((datetime.strptime(backup['timestamp'], TIMESTAMP_FORMAT), backup))
+        except ValueError:
+            continue
+    dated.sort(key=lambda item: item[0], reverse=True)
+
+    usable = [(date, backup) for date, backup in dated if backup['status'] not in UNUSABLE_STATUS]
+    newest_usable = usable[0][0] if usable else None
+
+    reasons = {}
+    for key, label, period_of in PERIODS:
+        seen = []
+        for date, backup in usable:
+            period = period_of(date)
+            if period in seen:
+                continue
+            if len(seen) >= limits[key]:
+                break
+            seen.append(period)
+            reasons.setdefault(backup['timestamp'], []).append(label)
+
+    if usable and usable[0][1]['timestamp'] not in reasons:
+        # El respaldo valido mas reciente siempre se conserva
+        reasons[usable[0][1]['timestamp']] = ['mas reciente']
+
+    keep = []
+    delete = []
+    for date, backup in dated:
+        timestamp = backup['timestamp']
+        if timestamp in reasons:
+            keep.append((backup, reasons[timestamp]))
+        elif timestamp in protect:
+            keep.append((backup, ['protegido']))
+        elif backup['status'] in UNUSABLE_STATUS and (newest_usable is None or date > newest_usable):
+            # Un respaldo fallido o en curso posterior al ultimo valido se conserva para revisarlo
+            keep.append((backup, ['posterior al ultimo valido']))
+        else:
+            delete.append(backup)
+    return keep, delete
+
+
+class RetentionManager:
+    """Aplica la politica de retencion de un directorio de respaldos"""
+
+    def __init__(self, backups_path, daily=7, weekly=4, monthly=3):
+        self.backups_path = backups_path
+        self.daily = max(0, int(daily))
+        self.weekly = max(0, int(weekly))
+        self.monthly = max(0, int(monthly))
+        self.catalog = BackupCatalog(backups_path)
+        self.trash_dir = os.path.join(backups_path, TRASH_DIR)
+
+    def plan(self, environment, protect=()):
+        """Plan de retencion de un ambiente (ver plan_retention)"""
+        return plan_retention(self.catalog.list_backups(environment),
+                              self.daily, self.weekly, self.monthly, protect)
+
+    def apply(self, environment, protect=(), background=True):
+        """
+        Elimina los respaldos que no cubre la politica
+
+        Los directorios se mueven a .trash y se quitan del catalogo de
+        inmediato; el borrado fisico corre en un proceso aparte.
+
+        Returns:
+            Lista de respaldos eliminados
+        """
+        _, delete = self.plan(environment, protect)
+        if not delete:
+            return []
+
+        os.makedirs(self.trash_dir, exist_ok=True)
+        trash_dirs = {self.trash_dir}
+        for backup in delete:
+            source = os.path.join(self.backups_path, environment, backup['timestamp'])
+            trash_name = f"{environment}_{backup['timestamp']}_{os.getpid()}"
+            if os.path.islink(source):
+                # Respaldo en almacenamiento frio: el directorio real va al .trash de su disco
+                real = os.path.realpath(source)
+                trash_dir = os.path.join(os.path.dirname(os.path.dirname(real)), TRASH_DIR)
+                os.makedirs(trash_dir, exist_ok=True)
+                os.rename(real, os.path.join(trash_dir, trash_name))
+                os.remove(source)
+                trash_dirs.add(trash_dir)
+            else:
+                os.rename(source, os.path.join(self.trash_dir, trash_name))
+            self.catalog.remove_backup(environment, backup['timestamp'])
+
+        for trash_dir in sorted(trash_dirs):
+            if background:
+                self.purge_in_background(trash_dir)
+            else:
+                purge_trash(trash_dir)
+        return delete
+
+    def purge_in_background(self, trash_dir=None):
+        """Lanza un proceso independiente que vacia .trash"""
+        with open(os.devnull, 'wb') as devnull:
+            subprocess.Popen(
+                [sys.executable, str(Path(__file__).resolve()), 'purge', trash_dir or self.trash_dir],
+                stdin=subprocess.DEVNULL,
+                stdout=devnull,
+                stderr=devnull,
+                start_new_session=True,
+                cwd=str(Path(__file__).resolve().parent.parent)
+            )
+
+
+def purge_trash(trash_dir):
+    """Borra el contenido de .trash (usado por el proceso en segundo plano)"""
+    if not os.path.isdir(trash_dir):
+        return 0
+    removed = 0
+    for entry in os.scandir(trash_dir):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            os.remove(entry.path)
+        removed += 1
+    return removed
+
+
+def policy_from_env():
+    """Politica desde BACKUP_KEEP_* (BACKUP_RETENTION_DAYS si no hay diaria)"""
+    daily = os.environ.get('BACKUP_KEEP_DAILY') or os.environ.get('BACKUP_RETENTION_DAYS') or 7
+    return {
+        'daily': int(daily),
+        'weekly': int(os.environ.get('BACKUP_KEEP_WEEKLY') or 4),
+        'monthly': int(os.environ.get('BACKUP_KEEP_MONTHLY') or 3),
+    }
+
+
+def main(argv):
+    usage = (
+        "Uso:\n"
+        "  retention.py plan <directorio_backups> <ambiente> [timestamp_protegido]\n"
+        "  retention.py apply <directorio_backups> <ambiente> [timestamp_protegido]\n"
+        "  retention.py purge <directorio_trash>\n"
+        "Politica: BACKUP_KEEP_DAILY, BACKUP_KEEP_WEEKLY, BACKUP_KEEP_MONTHLY"
+    )
+    command = argv[1] if len(argv) > 1 else None
+    if command == 'purge' and len(argv) >= 3:
+        purge_trash(argv[2])
+        return 0
+    if command not in ('plan', 'apply') or len(argv) < 4:
+        print(usage, file=sys.stderr)
+        return 1
+
+    manager = RetentionManager(argv[2], **policy_from_env())
+    protect = tuple(argv[4:5])
+    try:
+        if command == 'plan':
+            keep, delete = manager.plan(argv[3], protect)
+            for backup, reasons in keep:
+                print(f"CONSERVAR  {backup['timestamp']}  ({', '.join(reasons)})")
+            for backup in delete:
+                print(f"ELIMINAR   {backup['timestamp']}")
+        else:
+            deleted = manager.apply(argv[3], protect)
+            print(f"Respaldos eliminados: {len(deleted)} "
+                  f"({sum(b['size_bytes'] for b in deleted)} bytes, borrado en segundo plano)")
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
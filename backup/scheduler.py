@@ -1,21 +1,36 @@
 """
 Scheduler Module
-Gestion de tareas programadas para backups usando cron
+Gestion de tareas programadas para backups usando cron o el servicio
+de respaldos (BACKUP_SCHEDULER='daemon', ver backup/daemon.py)
 """
 
 import os
+import shutil
 import subprocess
+import sys
+from datetime import datetime
 from pathlib import Path
 import tempfile
 
+from backup.daemon import CronExpression, JobQueue, SchedulerDaemon, SERVICE_NAME
+
+SERVICE_FILE = f"/etc/systemd/system/{SERVICE_NAME}.service"
+
 
 class BackupScheduler:
-    """Gestiona tareas programadas de backups usando crontab"""
+    """Gestiona tareas programadas de backups usando crontab o el servicio de respaldos"""
 
     def __init__(self, settings):
         self.settings = settings
         self.script_dir = Path(__file__).parent
         self.backup_script = self.script_dir / 'backup.sh'
+        self.binlog_script = self.script_dir / 'binlog.py'
+        self.daemon_script = self.script_dir / 'daemon.py'
+        self.queue = JobQueue(settings.BACKUPS_PATH)
+
+    @property
+    def uses_daemon(self):
+        return self.settings.BACKUP_SCHEDULER == 'daemon'
 
     def _get_current_crontab(self):
         """Obtiene el contenido actual del crontab"""
@@ -36,7 +51,6 @@ class BackupScheduler:
         """Escribe el contenido al crontab"""
         try:
             # Verificar que crontab esté disponible
-            import shutil
             if not shutil.which('crontab'):
                 print("Error: El comando 'crontab' no está disponible")
                 print("Instala cron/cronie según tu distribución:")
@@ -96,6 +110,9 @@ class BackupScheduler:
         print(f"\nConfigurando backup automatico para {environment}")
         print(f"Horario: {schedule}")
 
+        if self.uses_daemon:
+            return self.setup_daemon_job(environment, 'backup', schedule)
+
         if not self.backup_script.exists():
             print(f"Error: Script de backup no encontrado: {self.backup_script}")
             return False
@@ -130,6 +147,74 @@ class BackupScheduler:
             print("Error configurando crontab")
             return False
 
+    def setup_binlog_cron(self, environment, interval=5):
+        """
+        Configura el archivado periodico de binlogs (recuperacion a un instante)
+
+        Args:
+            environment: 'testing' o 'production'
+            interval: Minutos entre cada archivado
+
+        Returns:
+            True si se configuró correctamente
+        """
+        if self.uses_daemon:
+            if self.setup_daemon_job(environment, 'binlog', f"*/{interval} * * * *"):
+                print(f"Archivado de binlogs configurado para {environment} (cada {interval} minutos)")
+                return True
+            return False
+
+        job_id = f"moodle-backup-binlog-{environment}"
+        current_crontab = self._get_current_crontab()
+        lines = current_crontab.split('\n') if current_crontab else []
+        new_lines = [line for line in lines if line.strip() and job_id not in line]
+
+        # binlog.py lee la configuracion del .env de BASE_PATH
+        command = f"python3 {self.binlog_script} archive {environment} >> {self.settings.LOGS_PATH}/binlog_{environment}.log 2>&1"
+        new_entry = f"*/{interval} * * * * {command} # {job_id}"
+        new_lines.append(new_entry)
+
+        if self._write_crontab('\n'.join(new_lines) + '\n'):
+            print(f"Archivado de binlogs configurado para {environment} (cada {interval} minutos)")
+            return True
+        else:
+            print("Error configurando el archivado de binlogs")
+            return False
+
+    def setup_tiering_cron(self, environment, schedule='30 4 * * *'):
+        """
+        Configura el paso diario de los backups antiguos al almacenamiento frio
+
+        Args:
+            environment: 'testing' o 'production'
+            schedule: Expresión cron (por defecto diario a las 4:30 AM)
+
+        Returns:
+            True si se configuró correctamente
+        """
+        if self.uses_daemon:
+            if self.setup_daemon_job(environment, 'tiering', schedule):
+                print(f"Almacenamiento frío configurado para {environment} ({schedule})")
+                return True
+            return False
+
+        job_id = f"moodle-backup-tiering-{environment}"
+        current_crontab = self._get_current_crontab()
+        lines = current_crontab.split('\n') if current_crontab else []
+        new_lines = [line for line in lines if line.strip() and job_id not in line]
+
+        # daemon.py run toma el lock del ambiente igual que el servicio
+        command = (f"python3 {self.daemon_script} run tiering {environment} "
+                   f">> {self.settings.LOGS_PATH}/tiering_{environment}.log 2>&1")
+        new_lines.append(f"{schedule} {command} # {job_id}")
+
+        if self._write_crontab('\n'.join(new_lines) + '\n'):
+            print(f"Almacenamiento frío configurado para {environment} ({schedule})")
+            return True
+        else:
+            print("Error configurando el almacenamiento frío")
+            return False
+
     def remove_cron(self, environment):
         """
         Elimina tarea cron de backups
@@ -142,6 +227,11 @@ class BackupScheduler:
         """
         print(f"\nEliminando backup automatico de {environment}")
 
+        if os.path.exists(self.queue.path):
+            removed = self.queue.remove_schedules(environment)
+            if removed:
+                print(f"Eliminados {removed} horarios del servicio de respaldos")
+
         # Obtener crontab actual
         current_crontab = self._get_current_crontab()
 
@@ -149,15 +239,16 @@ class BackupScheduler:
             print("No hay tareas cron configuradas")
             return True
 
-        # Identificador único para esta tarea
-        job_id = f"moodle-backup-{environment}"
+        # Identificadores de las tareas del ambiente (backup, archivado de binlogs y almacenamiento frio)
+        job_ids = (f"moodle-backup-{environment}", f"moodle-backup-binlog-{environment}",
+                   f"moodle-backup-tiering-{environment}")
 
         # Filtrar líneas que no contengan el job_id y líneas vacías
         lines = current_crontab.split('\n')
-        new_lines = [line for line in lines if line.strip() and job_id not in line]
+        new_lines = [line for line in lines if line.strip() and not any(job_id in line for job_id in job_ids)]
 
         # Verificar si se eliminó algo
-        original_jobs = [line for line in lines if job_id in line]
+        original_jobs = [line for line in lines if any(job_id in line for job_id in job_ids)]
         if not original_jobs:
             print(f"No hay backup automatico configurado para {environment}")
             return True
@@ -172,6 +263,143 @@ class BackupScheduler:
             print("Error eliminando entrada de crontab")
             return False
 
+    def setup_daemon_job(self, environment, kind, schedule):
+        """
+        Registra un horario en el servicio de respaldos en lugar del crontab
+
+        Quita la linea de crontab equivalente (para no ejecutar dos veces) e
+        instala el servicio si todavia no existe.
+
+        Args:
+            environment: 'testing' o 'production'
+            kind: 'backup', 'binlog' o 'tiering'
+            schedule: Expresión cron
+
+        Returns:
+            True si se configuró correctamente
+        """
+        try:
+            CronExpression(schedule)
+        except ValueError as e:
+            print(f"Error: {str(e)}")
+            return False
+
+        job_id = f"moodle-backup-{environment}" if kind == 'backup' else f"moodle-backup-{kind}-{environment}"
+        daemon = SchedulerDaemon.from_settings(self.settings)
+        next_run = daemon.next_run(schedule, kind=kind)
+        try:
+            self.queue.set_schedule(job_id, kind, environment, schedule, next_run)
+        except Exception as e:
+            print(f"Error registrando el horario: {str(e)}")
+            return False
+
+        current_crontab = self._get_current_crontab()
+        if job_id in current_crontab:
+            lines = [line for line in current_crontab.split('\n') if line.strip() and job_id not in line]
+            self._write_crontab('\n'.join(lines) + '\n' if lines else '')
+            print(f"Entrada de crontab {job_id} reemplazada por el servicio")
+
+        print(f"Horario registrado en el servicio de respaldos: {job_id}")
+        print(f"Próxima ejecución: {datetime.fromtimestamp(next_run).strftime('%Y-%m-%d %H:%M:%S')}")
+        if not self.is_service_active():
+            self.install_service()
+        return True
+
+    def is_service_active(self):
+        """True si el servicio de respaldos esta corriendo (systemd)"""
+        if not shutil.which('systemctl'):
+            return False
+        result = subprocess.run(['systemctl', 'is-active', '--quiet', SERVICE_NAME], capture_output=True)
+        return result.returncode == 0
+
+    def install_service(self):
+        """
+        Instala y arranca el servicio systemd del programador de respaldos
+
+        Returns:
+            True si el servicio quedó activo
+        """
+        manual = f"{sys.executable} {self.daemon_script} start"
+        if not shutil.which('systemctl'):
+            print("systemd no está disponible; inicia el servicio manualmente:")
+            print(f"  {manual}")
+            return False
+
+        unit = (
+            "[Unit]\n"
+            "Description=Moodle backup scheduler\n"
+            "After=docker.service\n"
+            "Requires=docker.service\n"
+            "\n"
+            "[Service]\n"
+            "Type=simple\n"
+            f"ExecStart={manual}\n"
+            f"WorkingDirectory={self.script_dir.parent}\n"
+            # Los respaldos en curso siguen aunque el servicio se reinicie
+            "KillMode=process\n"
+            "Restart=on-failure\n"
+            "RestartSec=30\n"
+            "\n"
+            "[Install]\n"
+            "WantedBy=multi-user.target\n"
+        )
+        try:
+            with open(SERVICE_FILE, 'w') as f:
+                f.write(unit)
+        except OSError as e:
+            print(f"Error escribiendo {SERVICE_FILE}: {str(e)}")
+            print(f"Inicia el servicio manualmente: {manual}")
+            return False
+
+        subprocess.run(['systemctl', 'daemon-reload'], capture_output=True)
+        result = subprocess.run(['systemctl', 'enable', '--now', SERVICE_NAME], capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"Error iniciando {SERVICE_NAME}: {result.stderr.strip()}")
+            return False
+        print(f"Servicio {SERVICE_NAME} instalado e iniciado")
+        return True
+
+    def _list_daemon_jobs(self):
+        """Muestra los horarios, la cola y las ultimas ejecuciones del servicio"""
+        def fmt(epoch):
+            return datetime.fromtimestamp(epoch).strftime('%Y-%m-%d %H:%M:%S') if epoch else '-'
+
+        schedules = self.queue.list_schedules()
+        if not schedules:
+            return False
+
+        state = 'activo' if self.is_service_active() else 'detenido'
+        print(f"\nServicio de respaldos ({SERVICE_NAME}): {state}")
+        print(f"Máximo de respaldos simultáneos: {self.settings.BACKUP_SCHEDULER_MAX_JOBS}, "
+              f"jitter: {self.settings.BACKUP_SCHEDULER_JITTER}s")
+        print("-" * 80)
+        print(f"  {'Tarea':32s} {'Horario':14s} {'Última ejecución':28s} Próxima")
+        for schedule in schedules:
+            last = fmt(schedule['last_run'])
+            if schedule['last_status']:
+                last += f" ({schedule['last_status']})"
+            print(f"  {schedule['job_id']:32s} {schedule['expression']:14s} {last:28s} "
+                  f"{fmt(schedule['next_run'])}")
+        print("-" * 80)
+
+        active = self.queue.jobs(status=('running', 'queued'))
+        print("\nCola de trabajos:" if active else "\nCola de trabajos: vacía")
+        for job in active:
+            since = job['started_at'] if job['status'] == 'running' else job['queued_at']
+            pid = f" pid {job['pid']}" if job['pid'] else ''
+            print(f"  #{job['id']:<5} {job['job_id']:32s} {job['status']:8s} desde {fmt(since)}{pid}")
+
+        history = [job for job in self.queue.jobs(limit=20) if job['status'] not in ('running', 'queued')][-5:]
+        if history:
+            print("\nÚltimas ejecuciones:")
+            for job in history:
+                duration = ''
+                if job['started_at'] and job['finished_at']:
+                    duration = f" ({job['finished_at'] - job['started_at']:.0f}s)"
+                when = job['started_at'] or job['queued_at']
+                print(f"  #{job['id']:<5} {job['job_id']:32s} {job['status']:11s} {fmt(when)}{duration}")
+        return True
+
     def list_scheduled_backups(self):
         """
         Lista las tareas programadas de backups
@@ -180,6 +408,9 @@ class BackupScheduler:
             True si se listaron correctamente
         """
         try:
+            if os.path.exists(self.queue.path):
+                self._list_daemon_jobs()
+
             current_crontab = self._get_current_crontab()
 
             if not current_crontab:
@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+"""
+Seekable SQL Module
+Volcado SQL en marcos comprimidos por tabla, con indice para restauraciones selectivas
+
+Para recuperar una tabla (ej. los intentos de cuestionario borrados de un
+curso) habia que descomprimir y recorrer el dump completo. El motor escribe
+el dump como una concatenacion de marcos independientes (miembros gzip o
+frames zstd): la cabecera de mysqldump, un marco por tabla, las vistas,
+rutinas y eventos, y el pie. Una secuencia de marcos sigue siendo un stream
+valido, por lo que restore.sh, la verificacion y binlog.py leen el archivo
+igual que antes. Junto al dump se guarda <dump>.index.json:
+
+    {"format": "seekable-sql", "version": 1, "codec": "zstd", "frames": [
+        {"kind": "header", "name": null, "offset": 0, "length": 412, "bytes": 1180, "rows": 0},
+        {"kind": "table", "name": "mdl_quiz_attempts", "offset": 412, ...}, ...]}
+
+Para extraer tablas solo se leen y descomprimen sus marcos (mas cabecera y
+pie). Los dumps sin indice (backup.sh o respaldos anteriores) y los volcados
+paralelos se leen con el mismo separador de secciones, recorriendo el stream.
+Solo usa la biblioteca estandar.
+"""
+
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backup.adaptive import stored_encoder
+from backup.compression import detect_codec
+from backup.parallel_dump import INDEX_FILE as PARALLEL_INDEX, PARALLEL_DIR
+from backup.progress import count_rows
+
+CHUNK_SIZE = 1024 * 1024
+
+FORMAT = 'seekable-sql'
+INDEX_SUFFIX = '.index.json'
+
+# Lineas con las que mysqldump abre cada seccion del volcado
+SECTION_PATTERN = re.compile(
+    rb'^(?:-- (Table structure for table|Dumping data for table|'
+    rb'Temporary view structure for view|Final view structure for view) `((?:[^`\n]|``)+)`'
+    rb'|-- Dumping (events|routines) for database'
+    rb'|/\*!40103 SET TIME_ZONE=@OLD_TIME_ZONE \*/;)',
+    re.MULTILINE)
+
+# Secciones que acompañan a cualquier extraccion (SET iniciales y su restauracion)
+FRAMING_KINDS = ('header', 'footer')
+
+
+class SectionSplitter:
+    """
+    Divide un stream de mysqldump en secciones
+
+    feed() devuelve una lista de ('section', tipo, nombre) y ('data', bytes)
+    en el orden del stream; los cortes caen siempre en un inicio de linea.
+    Tipos: header, table, view, events, routines y footer.
+    """
+
+    def __init__(self):
+        self.current = ('header', None)
+        self._tail = b''
+
+    def feed(self, data):
+        buffer = self._tail + data
+        end = buffer.rfind(b'\n') + 1
+        if self._opens_comment(buffer, end):
+            # Un '--' final puede ser la primera linea del bloque de la siguiente seccion
+            end -= 3
+        self._tail = buffer[end:]
+        return self._split(buffer[:end]) if end else []
+
+    @staticmethod
+    def _opens_comment(data, end):
+        """Indica si la linea que termina en end es '--'"""
+        return end >= 3 and data[end - 3:end] == b'--\n' and (end == 3 or data[end - 4:end - 3] == b'\n')
+
+    def finish(self):
+        tail, self._tail = self._tail, b''
+        return self._split(tail) if tail else []
+
+    def _split(self, data):
+        items = []
+        start = 0
+        for match in SECTION_PATTERN.finditer(data):
+            section = self._section(match)
+            if section == self.current:
+                # "Dumping data for table" continua la seccion de su CREATE TABLE
+                continue
+            begin = match.start()
+            if section[0] != 'footer' and self._opens_comment(data, begin) and begin - 3 >= start:
+                # La seccion empieza en el '--' que abre su comentario
+                begin -= 3
+            if begin > start:
+                items.append(('data', data[start:begin]))
+            items.append(('section',) + section)
+            self.current = section
+            start = begin
+        if start < len(data):
+            items.append(('data', data[start:]))
+        return items
+
+    @staticmethod
+    def _section(match):
+        label, name, objects = match.group(1), match.group(2), match.group(3)
+        if label:
+            name = name.replace(b'``', b'`').decode('utf-8', 'replace')
+            return ('view' if b'view' in label else 'table', name)
+        if objects:
+            return (objects.decode(), None)
+        return ('footer', None)
+
+
+class FrameWriter:
+    """
+    Escribe en output un marco comprimido independiente por seccion
+
+    Cada marco usa su propio proceso compresor; la salida comprimida la copia
+    un hilo mientras el llamador sigue alimentando la seccion en curso. Los
+    marcos abiertos con store=True se escriben sin comprimir en el formato
+    del codec (ver adaptive.py). cpu_seconds acumula el CPU de los compresores.
+    """
+
+    def __init__(self, output, codec, level=None, threads=None, stderr=None, throttle=None, on_output=None):
+        self.output = output
+        self.codec = codec
+        self.level = level
+        self.threads = threads
+        self.stderr = stderr if stderr is not None else subprocess.DEVNULL
+        self.throttle = throttle
+        # on_output(bytes) recibe el tamaño de cada bloque comprimido escrito
+        self.on_output = on_output
+        self.offset = 0
+        self.frames = []
+        self.cpu_seconds = 0.0
+        self._frame = None
+        self._process = None
+        self._encoder = None
+        self._thread = None
+        self._error = None
+
+    def begin(self, kind, name=None, store=False):
+        """Cierra el marco en curso y abre uno nuevo"""
+        self.end()
+        self._frame = {'kind': kind, 'name': name, 'offset': self.offset, 'length': 0, 'bytes': 0, 'rows': 0}
+        if store:
+            self._encoder = stored_encoder(self.codec)
+            return
+        command = self.codec.compress_command(self.level, self.threads)
+        if self.throttle is not None:
+            command = self.throttle.command(command)
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self.stderr)
+        self._thread = threading.Thread(target=self._drain, args=(self._process, self._frame), daemon=True)
+        self._thread.start()
+
+    def _emit(self, frame, chunk):
+        if self.throttle is not None:
+            self.throttle.consume(len(chunk))
+        self.output.write(chunk)
+        frame['length'] += len(chunk)
+        if self.on_output is not None:
+            self.on_output(len(chunk))
+
+    def _drain(self, process, frame):
+        try:
+            for chunk in iter(lambda: process.stdout.read(CHUNK_SIZE), b''):
+                self._emit(frame, chunk)
+        except Exception as e:
+            self._error = e
+            process.kill()
+
+    def write(self, data):
+        if self._frame is None:
+            self.begin('header')
+        if self._encoder is not None:
+            self._emit(self._frame, self._encoder.compress(data))
+        else:
+            self._process.stdin.write(data)
+        self._frame['bytes'] += len(data)
+        if self._frame['kind'] == 'table':
+            self._frame['rows'] += count_rows(data)
+
+    def end(self):
+        """Cierra el marco en curso (si hay uno)"""
+        if self._frame is None:
+            return
+        if self._encoder is not None:
+            frame, encoder = self._frame, self._encoder
+            self._frame = self._encoder = None
+            self._emit(frame, encoder.flush())
+            self.offset += frame['length']
+            self.frames.append(frame)
+            return
+        frame, process = self._frame, self._process
+        self._frame = self._process = None
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._thread.join()
+        code = self._wait(process)
+        if self._error is not None:
+            raise self._error
+        if code != 0:
+            raise RuntimeError(f"El compresor terminó con código {code} (marco {frame['kind']} {frame['name'] or ''})")
+        self.offset += frame['length']
+        self.frames.append(frame)
+
+    def _wait(self, process):
+        """Espera al compresor sumando su tiempo de CPU (usuario + sistema)"""
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+        except ChildProcessError:
+            return process.wait()
+        self.cpu_seconds += usage.ru_utime + usage.ru_stime
+        process.returncode = os.waitstatus_to_exitcode(status)
+        return process.returncode
+
+    def abort(self):
+        """Detiene el compresor en curso tras un error"""
+        if self._process is not None:
+            self._process.kill()
+            self._thread.join()
+            self._process.wait()
+        self._frame = self._process = self._encoder = None
+
+    def index(self, **fields):
+        """Indice de los marcos escritos"""
+        return {'format': FORMAT, 'version': 1, 'codec': self.codec.name, **fields, 'frames': self.frames}
+
+
+def write_index(path, index):
+    """
+    Guarda el indice junto al dump
+
+    Returns:
+        Contenido escrito (para calcular su SHA-256)
+    """
+    data = json.dumps(index, indent=2).encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(data)
+    return data
+
+
+def is_index_file(name):
+    return name.endswith(INDEX_SUFFIX)
+
+
+def find_dump(backup_dir):
+    """
+    Volcado de la base de datos de un respaldo
+
+    Returns:
+        Ruta del .sql(.gz/.zst), del directorio mysql_parallel o None
+    """
+    parallel = os.path.join(backup_dir, PARALLEL_DIR)
+    if os.path.exists(os.path.join(parallel, PARALLEL_INDEX)):
+        return parallel
+    for name in sorted(os.listdir(backup_dir)):
+        if name.endswith(('.sql', '.sql.gz', '.sql.zst')):
+            return os.path.join(backup_dir, name)
+    return None
+
+
+def _pump(source, target, length=None):
+    """Copia length bytes (o hasta el final) de source a target y cierra target"""
+    try:
+        remaining = length
+        while remaining is None or remaining > 0:
+            data = source.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            target.write(data)
+            if remaining is not None:
+                remaining -= len(data)
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            target.close()
+        except BrokenPipeError:
+            pass
+
+
+def _decompressed(path, offset=0, length=None):
+    """
+    Itera los bloques descomprimidos de un rango del archivo
+
+    Raises:
+        RuntimeError si el descompresor falla
+    """
+    codec = detect_codec(path)
+    with open(path, 'rb') as source:
+        source.seek(offset)
+        if codec is None:
+            remaining = length
+            while remaining is None or remaining > 0:
+                data = source.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+                if not data:
+                    return
+                if remaining is not None:
+                    remaining -= len(data)
+                yield data
+            return
+
+        process = subprocess.Popen(codec.decompress_command(1), stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        feeder = threading.Thread(target=_pump, args=(source, process.stdin, length), daemon=True)
+        feeder.start()
+        try:
+            yield from iter(lambda: process.stdout.read(CHUNK_SIZE), b'')
+        finally:
+            process.stdout.close()
+            feeder.join()
+            code = process.wait()
+        if code != 0:
+            raise RuntimeError(f"Error al descomprimir {os.path.basename(path)} (código {code})")
+
+
+class DumpReader:
+    """
+    Lista y extrae tablas de un volcado de respaldo
+
+    Con indice se leen solo los marcos de las tablas pedidas; un dump sin
+    indice se recorre completo; en un volcado paralelo se toma la seccion de
+    cada tabla de schema.sql y sus fragmentos de datos.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = None
+        if os.path.isdir(path):
+            self.mode = 'parallel'
+            with open(os.path.join(path, PARALLEL_INDEX)) as f:
+                self.index = json.load(f)
+        elif os.path.exists(path + INDEX_SUFFIX):
+            self.mode = 'indexed'
+            with open(path + INDEX_SUFFIX) as f:
+                self.index = json.load(f)
+        else:
+            self.mode = 'plain'
+
+    def tables(self):
+        """
+        Tablas del volcado
+
+        Returns:
+            Lista de dicts con name, rows, bytes (SQL sin comprimir) y compressed_bytes
+        """
+        totals = {}
+
+        def add(name, rows, size, compressed):
+            entry = totals.setdefault(name, {'name': name, 'rows': 0, 'bytes': 0, 'compressed_bytes': 0})
+            entry['rows'] += rows
+            entry['bytes'] += size
+            if compressed is not None:
+                entry['compressed_bytes'] += compressed
+
+        if self.mode == 'indexed':
+            for frame in self.index['frames']:
+                if frame['kind'] == 'table':
+                    add(frame['name'], frame['rows'], frame['bytes'], frame['length'])
+        elif self.mode == 'parallel':
+            for chunk in self.index['chunks']:
+                add(chunk['table'], chunk['rows'], chunk['bytes'], chunk['compressed_bytes'])
+        else:
+            for kind, name, data in self._sections(self.path):
+                if kind == 'table':
+                    add(name, count_rows(data), len(data), None)
+            for entry in totals.values():
+                entry['compressed_bytes'] = None
+        return sorted(totals.values(), key=lambda t: t['name'])
+
+    def _sections(self, path):
+        """Recorre un dump completo devolviendo (tipo, nombre, datos)"""
+        splitter = SectionSplitter()
+        section = splitter.current
+        for chunk in _decompressed(path):
+            for item in splitter.feed(chunk):
+                if item[0] == 'section':
+                    section = item[1:]
+                else:
+                    yield section + (item[1],)
+        for item in splitter.finish():
+            if item[0] == 'section':
+                section = item[1:]
+            else:
+                yield section + (item[1],)
+
+    def _check(self, tables):
+        known = {t['name'] for t in self.tables()}
+        missing = [t for t in tables if t not in known]
+        if missing:
+            raise ValueError(f"Tablas no encontradas en el respaldo: {', '.join(missing)}")
+
+    def extract(self, tables, output):
+        """
+        Escribe en output el SQL que recrea las tablas indicadas
+
+        Returns:
+            Dict con las tablas extraidas y los bytes escritos
+        """
+        wanted = set(tables)
+        if not wanted:
+            raise ValueError("No se indicó ninguna tabla")
+        if self.mode != 'plain':
+            self._check(wanted)
+        written = 0
+
+        if self.mode == 'indexed':
+            frames = [f for f in self.index['frames']
+                      if f['kind'] in FRAMING_KINDS or (f['kind'] in ('table', 'view') and f['name'] in wanted)]
+            # Los marcos contiguos se leen con un solo descompresor
+            ranges = []
+            for frame in frames:
+                if ranges and ranges[-1][0] + ranges[-1][1] == frame['offset']:
+                    ranges[-1][1] += frame['length']
+                else:
+                    ranges.append([frame['offset'], frame['length']])
+            for offset, length in ranges:
+                for data in _decompressed(self.path, offset, length):
+                    output.write(data)
+                    written += len(data)
+            found = {f['name'] for f in frames if f['kind'] == 'table'}
+
+        else:
+            schema = os.path.join(self.path, self.index['schema']) if self.mode == 'parallel' else self.path
+            found = set()
+            footer = []
+            for kind, name, data in self._sections(schema):
+                if kind == 'footer':
+                    # En un volcado paralelo los datos van antes del pie
+                    footer.append(data)
+                elif kind == 'header' or (kind in ('table', 'view') and name in wanted):
+                    output.write(data)
+                    written += len(data)
+                    if kind == 'table':
+                        found.add(name)
+            if self.mode == 'plain':
+                missing = wanted - found
+                if missing:
+                    raise ValueError(f"Tablas no encontradas en el respaldo: {', '.join(sorted(missing))}")
+            else:
+                for chunk in self.index['chunks']:
+                    if chunk['table'] in wanted:
+                        for data in _decompressed(os.path.join(self.path, chunk['file'])):
+                            output.write(data)
+                            written += len(data)
+            for data in footer:
+                output.write(data)
+                written += len(data)
+
+        return {'tables': sorted(found), 'bytes': written}
+
+
+def main(argv):
+    usage = (
+        "Uso:\n"
+        "  seekable.py tables <dump|directorio del respaldo>\n"
+        "  seekable.py extract <dump|directorio del respaldo> <tabla>[,<tabla>...]   (SQL a stdout)"
+    )
+    command = argv[1] if len(argv) > 1 else None
+    if command not in ('tables', 'extract') or len(argv) < 3 or (command == 'extract' and len(argv) < 4):
+        print(usage, file=sys.stderr)
+        return 1
+
+    path = argv[2]
+    if os.path.isdir(path) and not os.path.exists(os.path.join(path, PARALLEL_INDEX)):
+        path = find_dump(path)
+        if path is None:
+            print(f"ERROR: El respaldo no tiene volcado de base de datos: {argv[2]}", file=sys.stderr)
+            return 1
+
+    reader = DumpReader(path)
+    try:
+        if command == 'tables':
+            for table in reader.tables():
+                print(f"{table['name']}\t{table['rows']}\t{table['bytes']}")
+        else:
+            tables = [t.strip() for t in argv[3].split(',') if t.strip()]
+            reader.extract(tables, sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+    except BrokenPipeError:
+        return 1
+    except (ValueError, RuntimeError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -2,77 +2,286 @@
 """
 Script de envío de correos para notificaciones de backup
 Integrado con el sistema de backup de Moodle Docker
+
+Los adjuntos se codifican en base64 por bloques mientras se envían, por lo
+que el uso de memoria no depende de su tamaño; los que superan
+SMTP_MAX_ATTACHMENT_MB se reemplazan por un resumen (tamaño y, en los logs,
+las últimas líneas). Varias notificaciones se envían por una sola sesión SMTP
+autenticada.
+
+Con BACKUP_EMAIL_SPOOL definida las notificaciones se encolan en ese
+directorio en lugar de enviarse; `send_mail.py flush <directorio>` las envía
+después como un solo correo de resumen por destinatario (ej. los respaldos de
+varios ambientes de una misma ejecución).
 """
+import base64
+import glob
+import json
+import os
 import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email.mime.text import MIMEText
-from email import encoders
 import sys
-import os
+import time
+import uuid
+from email.header import Header
+from email.utils import formataddr, formatdate, make_msgid
+
+# Directorio (dentro de BACKUPS_PATH) con las colas de los correos de resumen
+SPOOL_DIR = '.notifications'
+
+# Bytes leidos por bloque: multiplo de 57 para que cada linea base64 tenga 76 caracteres
+ENCODE_CHUNK = 57 * 16 * 1024
+TAIL_BYTES = 8 * 1024
+TAIL_LINES = 30
+TEXT_EXTENSIONS = ('.log', '.txt', '.json')
+
+
+def formatear_tamano(num_bytes):
+    """Convierte bytes a formato legible (similar a du -h)"""
+    value = float(num_bytes)
+    for unit in ['B', 'K', 'M', 'G']:
+        if value < 1024:
+            return f"{int(value)}{unit}" if unit == 'B' else f"{value:.1f}{unit}"
+        value /= 1024
+    return f"{value:.1f}T"
+
+
+def resumen_adjunto(ruta, tamano, limite):
+    """Texto que reemplaza a un adjunto demasiado grande"""
+    lineas = [f"Adjunto omitido: {os.path.basename(ruta)} ({formatear_tamano(tamano)}, "
+              f"límite {formatear_tamano(limite)})",
+              f"  Ruta en el servidor: {ruta}"]
+    if ruta.endswith(TEXT_EXTENSIONS):
+        # Solo se lee el final del archivo
+        with open(ruta, 'rb') as f:
+            f.seek(max(tamano - TAIL_BYTES, 0))
+            final = f.read().decode('utf-8', 'replace').splitlines()[-TAIL_LINES:]
+        lineas.append(f"  Últimas {len(final)} líneas:")
+        lineas.extend(f"    {linea}" for linea in final)
+    return '\n'.join(lineas)
+
+
+class MensajeStreaming:
+    """
+    Mensaje MIME generado por bloques
+
+    El cuerpo y los adjuntos van en base64 (líneas CRLF de 76 caracteres),
+    así que ninguna línea empieza con un punto y no hace falta escaparlas.
+    """
+
+    def __init__(self, remitente, destinatarios, asunto, mensaje, archivos=(), limite_adjuntos=0):
+        self.remitente = remitente
+        self.destinatarios = list(destinatarios)
+        self.asunto = asunto
+        self.archivos = []
+        self.resumenes = []
+        disponible = limite_adjuntos
+        for ruta in archivos:
+            if not ruta or not os.path.isfile(ruta):
+                if ruta:
+                    print(f"Advertencia: No se encontró el archivo {ruta}")
+                continue
+            tamano = os.path.getsize(ruta)
+            if limite_adjuntos and tamano > disponible:
+                self.resumenes.append(resumen_adjunto(ruta, tamano, limite_adjuntos))
+                continue
+            disponible -= tamano
+            self.archivos.append(ruta)
+        self.mensaje = mensaje
+        if self.resumenes:
+            self.mensaje += '\n\n' + '\n\n'.join(self.resumenes)
+        self.boundary = f"=_{uuid.uuid4().hex}"
+
+    def _cabeceras(self, nombre_remitente):
+        cabeceras = [
+            ('From', formataddr((str(Header(nombre_remitente, 'utf-8')), self.remitente))),
+            ('To', ', '.join(self.destinatarios)),
+            ('Subject', Header(self.asunto, 'utf-8').encode()),
+            ('Date', formatdate(localtime=True)),
+            ('Message-ID', make_msgid()),
+            ('MIME-Version', '1.0'),
+            ('Content-Type', f'multipart/mixed; boundary="{self.boundary}"'),
+        ]
+        return ''.join(f"{nombre}: {valor}\r\n" for nombre, valor in cabeceras).encode('utf-8') + b'\r\n'
+
+    def _base64(self, datos):
+        return base64.encodebytes(datos).replace(b'\n', b'\r\n')
+
+    def bloques(self, nombre_remitente='Moodle Backup System'):
+        """Genera el mensaje completo en bloques de bytes (terminado en CRLF)"""
+        yield self._cabeceras(nombre_remitente)
+        yield (f"--{self.boundary}\r\n"
+               "Content-Type: text/plain; charset=utf-8\r\n"
+               "Content-Transfer-Encoding: base64\r\n\r\n").encode('ascii')
+        yield self._base64(self.mensaje.encode('utf-8'))
+        for ruta in self.archivos:
+            nombre = os.path.basename(ruta).replace('"', '')
+            yield (f"--{self.boundary}\r\n"
+                   "Content-Type: application/octet-stream\r\n"
+                   "Content-Transfer-Encoding: base64\r\n"
+                   f'Content-Disposition: attachment; filename="{nombre}"\r\n\r\n').encode('utf-8')
+            with open(ruta, 'rb') as f:
+                for bloque in iter(lambda: f.read(ENCODE_CHUNK), b''):
+                    yield self._base64(bloque)
+        yield f"--{self.boundary}--\r\n".encode('ascii')
+
+
+class SesionSMTP:
+    """Conexión SMTP_SSL autenticada que se reutiliza para varios correos"""
+
+    def __init__(self, servidor, puerto, usuario, contrasena, nombre_remitente, timeout=60):
+        self.servidor = servidor
+        self.puerto = puerto
+        self.usuario = usuario
+        self.contrasena = contrasena
+        self.nombre_remitente = nombre_remitente
+        self.timeout = timeout
+        self.smtp = None
+
+    @classmethod
+    def desde_entorno(cls):
+        """
+        Sesión configurada con las variables SMTP_*
+
+        Returns:
+            SesionSMTP o None si faltan las credenciales
+        """
+        usuario = os.getenv('SMTP_USER', 'CORREO')
+        contrasena = os.getenv('SMTP_PASSWORD', 'CONTRASEÑA')
+        if not usuario or not contrasena or usuario == 'CORREO' or contrasena == 'CONTRASEÑA':
+            print("ERROR: Las credenciales SMTP no están configuradas correctamente")
+            print("Configure las variables de entorno SMTP_USER y SMTP_PASSWORD")
+            return None
+        return cls(
+            os.getenv('SMTP_SERVER', 'smtp.gmail.com'),
+            int(os.getenv('SMTP_PORT', '465')),  # Puerto para SSL
+            usuario,
+            contrasena,
+            os.getenv('SMTP_FROM_NAME', 'Moodle Backup System')
+        )
+
+    def __enter__(self):
+        self.conectar()
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def conectar(self):
+        self.cerrar()
+        self.smtp = smtplib.SMTP_SSL(self.servidor, self.puerto, timeout=self.timeout)
+        self.smtp.login(self.usuario, self.contrasena)
+
+    def cerrar(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.smtp = None
+
+    def enviar(self, mensaje):
+        """Envía un MensajeStreaming; reconecta una vez si el servidor cerró la sesión"""
+        for intento in (1, 2):
+            try:
+                if self.smtp is None:
+                    self.conectar()
+                return self._enviar(mensaje)
+            except smtplib.SMTPServerDisconnected:
+                self.smtp = None
+                if intento == 2:
+                    raise
+
+    def _enviar(self, mensaje):
+        smtp = self.smtp
+        code, resp = smtp.mail(self.usuario)
+        if code != 250:
+            smtp.rset()
+            raise smtplib.SMTPSenderRefused(code, resp, self.usuario)
+        aceptados = 0
+        for destinatario in mensaje.destinatarios:
+            code, resp = smtp.rcpt(destinatario)
+            if code in (250, 251):
+                aceptados += 1
+            else:
+                print(f"Advertencia: Destinatario rechazado {destinatario}: {code} {resp!r}")
+        if not aceptados:
+            smtp.rset()
+            raise smtplib.SMTPRecipientsRefused({d: (code, resp) for d in mensaje.destinatarios})
+        code, resp = smtp.docmd('DATA')
+        if code != 354:
+            smtp.rset()
+            raise smtplib.SMTPDataError(code, resp)
+        # El mensaje se escribe en el socket bloque a bloque (no se arma en memoria)
+        for bloque in mensaje.bloques(self.nombre_remitente):
+            smtp.send(bloque)
+        smtp.send(b'.\r\n')
+        code, resp = smtp.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, resp)
+
+
+def _destinatarios(destinatarios):
+    return [dest.strip() for dest in destinatarios.split(',') if dest.strip()]
+
+
+def _limite_adjuntos():
+    return int(float(os.getenv('SMTP_MAX_ATTACHMENT_MB', '5') or 0) * 1024 * 1024)
 
-def enviar_correo(destinatarios, asunto, mensaje, archivo=None):
+
+def encolar_correo(directorio, destinatarios, asunto, mensaje, archivos=()):
+    """Guarda una notificación en el directorio de cola para el correo de resumen"""
+    os.makedirs(directorio, exist_ok=True)
+    aviso = {
+        'to': destinatarios,
+        'subject': asunto,
+        'body': mensaje,
+        'attachments': [os.path.abspath(a) for a in archivos if a],
+        'created': time.time(),
+    }
+    nombre = f"{time.time_ns()}_{os.getpid()}.json"
+    temporal = os.path.join(directorio, nombre + '.tmp')
+    with open(temporal, 'w') as f:
+        json.dump(aviso, f)
+    os.replace(temporal, os.path.join(directorio, nombre))
+    print(f"Notificación encolada para el resumen: {asunto}")
+    return True
+
+
+def enviar_correo(destinatarios, asunto, mensaje, archivo=None, sesion=None):
     """
-    Envía un correo electrónico con opción de adjuntar archivo
+    Envía un correo electrónico con opción de adjuntar archivos
 
     Args:
         destinatarios: String con emails separados por comas
         asunto: Asunto del correo
         mensaje: Cuerpo del mensaje
-        archivo: Ruta del archivo a adjuntar (opcional)
+        archivo: Ruta (o lista de rutas) de archivos a adjuntar (opcional)
+        sesion: SesionSMTP abierta para reutilizar (opcional)
 
     Returns:
         True si el envío fue exitoso, False en caso contrario
     """
-    # Obtener configuración desde variables de entorno
-    smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
-    port = int(os.getenv('SMTP_PORT', '465'))  # Puerto para SSL
-    sender_email = os.getenv('SMTP_USER', 'CORREO')
-    password = os.getenv('SMTP_PASSWORD', 'CONTRASEÑA')
-    from_name = os.getenv('SMTP_FROM_NAME', 'Moodle Backup System')
-
-    # Validar configuración
-    if sender_email == 'CORREO' or password == 'CONTRASEÑA':
-        print("ERROR: Las credenciales SMTP no están configuradas correctamente")
-        print("Configure las variables de entorno SMTP_USER y SMTP_PASSWORD")
-        return False
+    archivos = [archivo] if isinstance(archivo, str) else list(archivo or [])
 
-    # Procesar lista de destinatarios
-    lista_destinatarios = [dest.strip() for dest in destinatarios.split(',')]
+    spool = os.getenv('BACKUP_EMAIL_SPOOL')
+    if spool and sesion is None:
+        return encolar_correo(spool, destinatarios, asunto, mensaje, archivos)
 
-    # Crear mensaje
-    msg = MIMEMultipart()
-    msg['From'] = f"{from_name} <{sender_email}>"
-    msg['To'] = ', '.join(lista_destinatarios)
-    msg['Subject'] = asunto
-    msg.attach(MIMEText(mensaje, 'plain'))
+    propia = sesion is None
+    if propia:
+        sesion = SesionSMTP.desde_entorno()
+        if sesion is None:
+            return False
 
-    # Adjuntar archivo si se proporciona
-    if archivo and os.path.exists(archivo):
-        try:
-            part = MIMEBase('application', "octet-stream")
-            with open(archivo, 'rb') as file:
-                part.set_payload(file.read())
-            encoders.encode_base64(part)
-            part.add_header('Content-Disposition', f'attachment; filename="{os.path.basename(archivo)}"')
-            msg.attach(part)
-            print(f"Archivo adjunto: {os.path.basename(archivo)}")
-        except Exception as e:
-            print(f"Advertencia: No se pudo adjuntar el archivo {archivo}: {e}")
+    lista_destinatarios = _destinatarios(destinatarios)
+    correo = MensajeStreaming(sesion.usuario, lista_destinatarios, asunto, mensaje, archivos, _limite_adjuntos())
+    for ruta in correo.archivos:
+        print(f"Archivo adjunto: {os.path.basename(ruta)}")
 
     try:
-        # Iniciar servidor usando SSL
-        server = smtplib.SMTP_SSL(smtp_server, port)
-
-        # Login
-        server.login(sender_email, password)
-
-        # Enviar correo
-        text = msg.as_string()
-        server.sendmail(sender_email, lista_destinatarios, text)
+        sesion.enviar(correo)
         print(f"Correo enviado correctamente a {', '.join(lista_destinatarios)}")
         print(f"Asunto: {asunto}")
-        server.quit()
         return True
     except smtplib.SMTPAuthenticationError:
         print("ERROR: Falló la autenticación SMTP. Verifique las credenciales.")
@@ -83,27 +292,106 @@ def enviar_correo(destinatarios, asunto, mensaje, archivo=None):
     except Exception as e:
         print(f"ERROR al enviar correo: {e}")
         return False
+    finally:
+        if propia:
+            sesion.cerrar()
+
+
+def armar_resumen(avisos):
+    """
+    Combina varias notificaciones en un solo correo
+
+    Returns:
+        Tupla (asunto, mensaje, adjuntos)
+    """
+    if len(avisos) == 1:
+        aviso = avisos[0]
+        return aviso['subject'], aviso['body'], aviso['attachments']
+
+    fallidos = sum(1 for aviso in avisos if 'FALLIDO' in aviso['subject'])
+    estado = f"{fallidos} con errores" if fallidos else "todos exitosos"
+    asunto = f"[Backup Moodle] Resumen: {len(avisos)} notificaciones ({estado})"
+    secciones = [f"Resumen de {len(avisos)} notificaciones:"]
+    secciones.extend(f"  - {aviso['subject']}" for aviso in avisos)
+    for aviso in avisos:
+        secciones.append(f"{'=' * 60}\n{aviso['subject']}\n{'=' * 60}\n{aviso['body']}")
+    adjuntos = [ruta for aviso in avisos for ruta in aviso['attachments']]
+    return asunto, '\n\n'.join(secciones), adjuntos
+
+
+def enviar_resumen(directorio):
+    """
+    Envía las notificaciones encoladas: un correo por grupo de destinatarios,
+    todos por la misma sesión SMTP. Los avisos se borran solo si se enviaron.
+
+    Returns:
+        True si no quedaron avisos pendientes
+    """
+    rutas = sorted(glob.glob(os.path.join(directorio, '*.json')))
+    if not rutas:
+        print("No hay notificaciones pendientes")
+        return True
+
+    grupos = {}
+    for ruta in rutas:
+        with open(ruta) as f:
+            aviso = json.load(f)
+        grupos.setdefault(aviso['to'], []).append((ruta, aviso))
+
+    sesion = SesionSMTP.desde_entorno()
+    if sesion is None:
+        return False
+
+    exito = True
+    try:
+        sesion.conectar()
+        for destinatarios, elementos in grupos.items():
+            asunto, mensaje, adjuntos = armar_resumen([aviso for _, aviso in elementos])
+            if enviar_correo(destinatarios, asunto, mensaje, adjuntos, sesion=sesion):
+                for ruta, _ in elementos:
+                    os.remove(ruta)
+            else:
+                exito = False
+    except smtplib.SMTPAuthenticationError:
+        print("ERROR: Falló la autenticación SMTP. Verifique las credenciales.")
+        return False
+    except (smtplib.SMTPException, OSError) as e:
+        print(f"ERROR SMTP: {e}")
+        return False
+    finally:
+        sesion.cerrar()
+
+    if exito:
+        try:
+            os.rmdir(directorio)
+        except OSError:
+            pass
+    return exito
+
 
 if __name__ == "__main__":
-    if len(sys.argv) >= 4:
+    if len(sys.argv) >= 3 and sys.argv[1] == 'flush':
+        sys.exit(0 if enviar_resumen(sys.argv[2]) else 1)
+    elif len(sys.argv) >= 4:
         destinatarios = sys.argv[1]
         asunto = sys.argv[2]
         mensaje = sys.argv[3]
-        archivo = sys.argv[4] if len(sys.argv) > 4 else None
+        archivos = sys.argv[4:]
 
         # Ejecutar envío
-        exito = enviar_correo(destinatarios, asunto, mensaje, archivo)
+        exito = enviar_correo(destinatarios, asunto, mensaje, archivos)
 
         # Retornar código de salida apropiado
         sys.exit(0 if exito else 1)
     else:
-        print("Uso: python3 send_mail.py destinatarios asunto mensaje [archivo]")
+        print("Uso: python3 send_mail.py destinatarios asunto mensaje [archivo...]")
+        print("     python3 send_mail.py flush directorio_cola")
         print("")
         print("Argumentos:")
         print("  destinatarios  - Lista de correos separados por comas")
         print("  asunto        - Asunto del correo")
         print("  mensaje       - Cuerpo del mensaje")
-        print("  archivo       - Ruta del archivo a adjuntar (opcional)")
+        print("  archivo       - Rutas de archivos a adjuntar (opcional)")
         print("")
         print("Variables de entorno requeridas:")
         print("  SMTP_SERVER      - Servidor SMTP (default: smtp.gmail.com)")
@@ -111,4 +399,6 @@ if __name__ == "__main__":
         print("  SMTP_USER        - Usuario SMTP")
         print("  SMTP_PASSWORD    - Contraseña SMTP")
         print("  SMTP_FROM_NAME   - Nombre del remitente (default: Moodle Backup System)")
-        sys.exit(1)
\ No newline at end of file
+        print("  SMTP_MAX_ATTACHMENT_MB - Tamaño máximo de los adjuntos (default: 5, 0 = sin límite)")
+        print("  BACKUP_EMAIL_SPOOL     - Encolar en este directorio en lugar de enviar")
+        sys.exit(1)
@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+"""
+Sharded Archive Module
+Respaldo de moodledata en fragmentos por prefijo de filedir, en paralelo
+
+filedir reparte los archivos en 256 directorios 00-ff segun su contenthash,
+pero el modo 'full' recorre todo el volumen con un solo tar, que en discos
+NVMe es el cuello de botella. Con BACKUP_MOODLEDATA_MODE='sharded' los
+directorios de filedir se dividen en BACKUP_MOODLEDATA_SHARDS rangos
+contiguos mas un fragmento con el resto de moodledata; un pool de
+BACKUP_PARALLEL_WORKERS genera y comprime cada fragmento en su propio
+archivo y la restauracion los extrae en paralelo.
+
+Estructura generada:
+    moodledata_shards/
+        manifest.json           fragmentos, prefijos, bytes y SHA-256
+        other.tar.gz            todo salvo filedir/00-ff (se restaura primero)
+        filedir-00-1f.tar.gz
+        ...
+Las entradas de todos los fragmentos son relativas a la raiz del volumen
+(./filedir/3f/...), como en el tar del modo 'full'. Como el modo
+incremental, lee el punto de montaje del volumen en el host.
+Solo usa la biblioteca estandar.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backup.clone import MeteredReader
+from backup.compression import detect_codec, resolve_codec
+from backup.exclusions import excludes_from_env, tar_exclude_args
+from backup.integrity import add_checksums
+from backup.progress import meter_from_env
+from backup.throttle import throttle_from_env
+from backup.volume import CHUNK_SIZE, ZERO_BLOCK, TarCounter, TarEntryReader, VolumeStream
+
+
+SHARD_DIR = 'moodledata_shards'
+MANIFEST_FILE = 'manifest.json'
+FORMAT = 'moodledata-shards'
+
+# Fragmento con todo lo que no esta en filedir/00-ff (incluye la raiz y filedir/)
+OTHER_SHARD = 'other'
+FILEDIR = 'filedir'
+PREFIX_PATTERN = re.compile(r'^[0-9a-f]{2}$')
+
+# GNU tar termina con 1 si un archivo cambio mientras se leia (Moodle sigue en linea)
+TAR_WRAPPER = 'tar "$@"; code=$?; [ "$code" -eq 1 ] && code=0; exit "$code"'
+
+
+def filedir_prefixes(source_dir):
+    """Directorios filedir/00-ff existentes en el volumen"""
+    try:
+        entries = list(os.scandir(os.path.join(source_dir, FILEDIR)))
+    except FileNotFoundError:
+        return []
+    return sorted(entry.name for entry in entries
+                  if entry.is_dir(follow_symlinks=False) and PREFIX_PATTERN.match(entry.name))
+
+
+def shard_plan(prefixes, shards):
+    """
+    Reparte los prefijos de filedir en rangos contiguos
+
+    Returns:
+        Lista de dicts (name, prefixes): primero el fragmento de resto y
+        luego uno por rango que tenga directorios
+    """
+    shards = max(1, min(256, int(shards)))
+    plan = [{'name': OTHER_SHARD, 'prefixes': []}]
+    for number in range(shards):
+        low, high = number * 256 // shards, (number + 1) * 256 // shards
+        selected = [prefix for prefix in prefixes if low <= int(prefix, 16) < high]
+        if selected:
+            plan.append({'name': f"{FILEDIR}-{low:02x}-{high - 1:02x}", 'prefixes': selected})
+    return plan
+
+
+def tar_command(source_dir, shard, exclude=()):
+    """Comando que escribe en stdout el tar de un fragmento (entradas ./ruta)"""
+    command = ['sh', '-c', TAR_WRAPPER, 'tar', '-C', source_dir, '-cf', '-', '--numeric-owner']
+    command += tar_exclude_args(exclude)
+    if shard['name'] == OTHER_SHARD:
+        return command + [f'--exclude=./{FILEDIR}/[0-9a-f][0-9a-f]', '.']
+    return command + ['--'] + [f'./{FILEDIR}/{prefix}' for prefix in shard['prefixes']]
+
+
+def read_manifest(shard_dir):
+    with open(os.path.join(shard_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != FORMAT:
+        raise ValueError(f"{shard_dir} no es un respaldo de moodledata en fragmentos")
+    return manifest
+
+
+def shard_archives(shard_dir):
+    """Rutas de los fragmentos en el orden del manifiesto (el de resto primero)"""
+    return [os.path.join(shard_dir, shard['file']) for shard in read_manifest(shard_dir)['shards']]
+
+
+@contextmanager
+def open_shard(path, threads=None, log_file=None):
+    """
+    Contenido sin comprimir de un fragmento como archivo de lectura
+
+    Raises:
+        RuntimeError si el descompresor falla
+    """
+    codec = detect_codec(path)
+    with open(path, 'rb') as source:
+        if codec is None:
+            yield source
+            return
+        stderr = open(log_file, 'ab') if log_file else subprocess.DEVNULL
+        process = subprocess.Popen(codec.decompress_command(threads), stdin=source,
+                                   stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            yield process.stdout
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            process.stdout.close()
+            code = process.wait()
+            if stderr is not subprocess.DEVNULL:
+                stderr.close()
+        if code != 0:
+            raise RuntimeError(f"No se pudo descomprimir {os.path.basename(path)}")
+
+
+def extract_tar(source, directory, log_file=None):
+    """Extrae con tar en directory el tar leido de source (conserva dueños y permisos)"""
+    stderr = open(log_file, 'ab') if log_file else subprocess.DEVNULL
+    process = subprocess.Popen(['tar', '-x', '-f', '-', '-C', directory, '--numeric-owner', '-p'],
+                               stdin=subprocess.PIPE, stderr=stderr)
+    try:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            process.stdin.write(chunk)
+        process.stdin.close()
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        code = process.wait()
+        if stderr is not subprocess.DEVNULL:
+            stderr.close()
+    if code != 0:
+        raise RuntimeError(f"tar terminó con código {code} extrayendo en {directory}")
+
+
+def write_tar(shard_dir, output, threads=None):
+    """
+    Escribe en output un solo tar con las entradas de todos los fragmentos
+    (para la restauracion diferencial y las herramientas que esperan un tar)
+
+    Returns:
+        Numero de entradas escritas
+    """
+    count = 0
+    for path in shard_archives(shard_dir):
+        with open_shard(path, threads) as stream:
+            reader = TarEntryReader(stream)
+            for entry in reader.entries():
+                output.write(entry['header'])
+                for chunk in iter(reader.read, b''):
+                    output.write(chunk)
+                count += 1
+            # El fin de archivo de cada fragmento se descarta
+            for _ in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                pass
+    output.write(ZERO_BLOCK * 2)
+    return count
+
+
+class ShardedArchiver:
+    """Genera los fragmentos de moodledata con un pool de workers"""
+
+    def __init__(self, source_dir, output_dir, codec, pipeline_factory, shards=8, workers=4, exclude=()):
+        """
+        Args:
+            source_dir: Punto de montaje del volumen en el host
+            output_dir: Directorio moodledata_shards del respaldo
+            pipeline_factory: pipeline_factory(comando, archivo) -> pipeline del motor
+                (StreamPipeline o AdaptiveTarPipeline) que comprime un fragmento
+            shards: Rangos en que se divide filedir
+            workers: Fragmentos que se generan a la vez
+            exclude: Rutas relativas que no se respaldan (BACKUP_MOODLEDATA_EXCLUDE)
+        """
+        self.source_dir = source_dir
+        self.output_dir = output_dir
+        self.codec = codec
+        self.pipeline_factory = pipeline_factory
+        self.shards = shards
+        self.workers = max(1, int(workers))
+        self.exclude = list(exclude)
+        # SHA-256 de cada archivo generado, relativo a output_dir
+        self.checksums = {}
+        # Pipeline de cada fragmento (el motor toma de aqui la compresion adaptativa)
+        self.pipelines = {}
+        self.lock = threading.Lock()
+
+    def _archive_shard(self, shard):
+        started = time.monotonic()
+        output_file = os.path.join(self.output_dir, f"{shard['name']}.tar{self.codec.extension}")
+        pipeline = self.pipeline_factory(tar_command(self.source_dir, shard, self.exclude), output_file)
+        stats = pipeline.run()
+
+        result = {
+            'name': shard['name'],
+            'file': os.path.basename(output_file),
+            'prefixes': shard['prefixes'],
+            'bytes': stats['source']['bytes'],
+            'compressed_bytes': os.path.getsize(output_file),
+            'seconds': round(time.monotonic() - started, 3),
+        }
+        checksums = {result['file']: pipeline.sha256}
+        if getattr(pipeline, 'index_sha256', None):
+            result['index'] = os.path.basename(pipeline.index_file)
+            checksums[result['index']] = pipeline.index_sha256
+        with self.lock:
+            self.checksums.update(checksums)
+            self.pipelines[shard['name']] = pipeline
+        return result
+
+    def archive(self):
+        """
+        Genera todos los fragmentos y el manifiesto
+
+        Returns:
+            Dict del manifiesto (tambien se guarda en manifest.json)
+
+        Raises:
+            RuntimeError si algun fragmento falla
+        """
+        started = time.monotonic()
+        os.makedirs(self.output_dir, exist_ok=True)
+        plan = shard_plan(filedir_prefixes(self.source_dir), self.shards)
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self._archive_shard, shard): shard for shard in plan}
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]['name']] = future.result()
+                except Exception as e:
+                    for other in futures:
+                        other.cancel()
+                    raise RuntimeError(f"Error en el fragmento {futures[future]['name']}: {e}")
+
+        shards = [results[shard['name']] for shard in plan]
+        manifest = {
+            'format': FORMAT,
+            'version': 1,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'codec': self.codec.name,
+            'workers': self.workers,
+            'exclude': self.exclude,
+            'shards': shards,
+            'files': len(shards),
+            'bytes': sum(shard['bytes'] for shard in shards),
+            'compressed_bytes': sum(shard['compressed_bytes'] for shard in shards),
+            'seconds': round(time.monotonic() - started, 3),
+        }
+        data = json.dumps(manifest, indent=2).encode('utf-8')
+        with open(os.path.join(self.output_dir, MANIFEST_FILE), 'wb') as f:
+            f.write(data)
+        self.checksums[MANIFEST_FILE] = hashlib.sha256(data).hexdigest()
+        return manifest
+
+
+class ShardedRestore:
+    """
+    Extrae los fragmentos en un volumen: el de resto primero y filedir en paralelo
+
+    Como el respaldo, los fragmentos se extraen con tar en el punto de montaje
+    del volumen en el host. Si no es accesible se usa put_archive, que el
+    daemon aplica de a uno por contenedor, por lo que los fragmentos se
+    extraen uno tras otro.
+    """
+
+    def __init__(self, shard_dir, volume, workers=4, threads=None, log_file=None, progress=None, client=None):
+        """
+        Args:
+            volume: Volumen Docker destino (ya vaciado)
+            progress: progress(bytes) recibe cada bloque descomprimido (ver progress.StageMeter.add)
+        """
+        self.shard_dir = shard_dir
+        self.volume = volume
+        self.workers = max(1, int(workers))
+        self.log_file = log_file
+        self.progress = progress
+        self.client = client
+        # Los hilos del descompresor se reparten entre los workers
+        total_threads = int(threads or 0) or (os.cpu_count() or 1)
+        self.decompress_threads = max(1, total_threads // self.workers)
+
+    def _import(self, shard, mountpoint):
+        path = os.path.join(self.shard_dir, shard['file'])
+        observer = (lambda data: self.progress(len(data))) if self.progress else None
+        with open_shard(path, self.decompress_threads, self.log_file) as stream:
+            if mountpoint is None:
+                VolumeStream(self.volume, self.client).import_tar(MeteredReader(stream, observer))
+            else:
+                extract_tar(MeteredReader(stream, observer), mountpoint, self.log_file)
+        return shard
+
+    def restore(self):
+        """
+        Returns:
+            Dict con fragmentos, bytes y segundos
+
+        Raises:
+            RuntimeError si falta un fragmento o alguno falla
+        """
+        started = time.monotonic()
+        manifest = read_manifest(self.shard_dir)
+        shards = manifest['shards']
+        missing = [shard['file'] for shard in shards
+                   if not os.path.exists(os.path.join(self.shard_dir, shard['file']))]
+        if missing:
+            raise RuntimeError(f"Faltan fragmentos: {', '.join(missing)}")
+        mountpoint = VolumeStream(self.volume, self.client).mountpoint()
+        workers = self.workers if mountpoint else 1
+
+        # La raiz y filedir/ vienen en el fragmento de resto, con su dueño y permisos
+        for shard in shards:
+            if shard['name'] == OTHER_SHARD:
+                self._import(shard, mountpoint)
+
+        # Los fragmentos mas grandes primero
+        pending = sorted((shard for shard in shards if shard['name'] != OTHER_SHARD),
+                         key=lambda shard: shard['compressed_bytes'], reverse=True)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(self._import, shard, mountpoint): shard for shard in pending}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    for other in futures:
+                        other.cancel()
+                    raise RuntimeError(f"Error restaurando {futures[future]['file']}: {e}")
+
+        return {
+            'shards': len(shards),
+            'workers': workers,
+            'bytes': manifest['bytes'],
+            'seconds': round(time.monotonic() - started, 3),
+        }
+
+
+def _tree_bytes(path, skip=None):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        if skip is not None:
+            dirs[:] = [name for name in dirs if not skip(os.path.join(root, name))]
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _backup_command(source_dir, output_dir, threads):
+    """Modo 'sharded' de backup.sh: fragmentos con los pipelines del motor"""
+    # engine.py importa este modulo
+    from backup.engine import StreamPipeline
+
+    codec = resolve_codec(os.environ.get('BACKUP_COMPRESSION', 'gzip'))
+    level = os.environ.get('BACKUP_COMPRESSION_LEVEL') or None
+    workers = int(os.environ.get('BACKUP_PARALLEL_WORKERS') or 4)
+    # Los hilos del compresor se reparten entre los workers
+    threads = max(1, (int(threads or 0) or (os.cpu_count() or 1)) // workers)
+    throttle = throttle_from_env()
+    log_file = os.environ.get('LOG_FILE')
+
+    # Con BACKUP_PROGRESS_FILE (backup.sh) se registra el progreso de la etapa
+    reporter, meter = meter_from_env('moodledata')
+
+    def pipeline(command, output_file):
+        counter = TarCounter()
+        return StreamPipeline(
+            command, codec, output_file, level=int(level) if level else None, threads=threads,
+            log_file=log_file, throttle=throttle,
+            observer=(lambda chunk: meter.add(len(chunk), files=counter.feed(chunk))) if meter else None)
+
+    archiver = ShardedArchiver(
+        source_dir, output_dir, codec, pipeline,
+        shards=os.environ.get('BACKUP_MOODLEDATA_SHARDS') or 8,
+        workers=workers,
+        exclude=excludes_from_env()
+    )
+    ok = False
+    try:
+        manifest = archiver.archive()
+        # Los checksums se agregan al SHA256SUMS del directorio del respaldo
+        output_dir = os.path.normpath(output_dir)
+        add_checksums(os.path.dirname(output_dir), {
+            f"{os.path.basename(output_dir)}/{name}": digest for name, digest in archiver.checksums.items()})
+        print(f"Fragmentos: {len(manifest['shards'])}, {manifest['bytes']} bytes, "
+              f"comprimido: {manifest['compressed_bytes']} bytes, {manifest['seconds']}s")
+        ok = True
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        shutil.rmtree(output_dir, ignore_errors=True)
+        return 1
+    finally:
+        if reporter is not None:
+            reporter.close()
+            reporter.end_stage('moodledata', ok)
+    return 0
+
+
+def main(argv):
+    usage = (
+        "Uso:\n"
+        "  sharded.py plan <moodledata> [fragmentos]            (reparto y tamaño de cada fragmento)\n"
+        "  sharded.py backup <moodledata> <directorio_fragmentos> (checksums en el SHA256SUMS del respaldo)\n"
+        "  sharded.py restore <directorio_fragmentos> <volumen>  (el volumen debe estar vacio)\n"
+        "  sharded.py tar <directorio_fragmentos>                (un solo tar a stdout)\n"
+        "Variables opcionales: BACKUP_MOODLEDATA_SHARDS, BACKUP_PARALLEL_WORKERS, BACKUP_COMPRESSION,\n"
+        "  BACKUP_COMPRESSION_LEVEL, BACKUP_COMPRESSION_THREADS, BACKUP_MOODLEDATA_EXCLUDE,\n"
+        "  BACKUP_RATE_LIMIT_MB"
+    )
+    command = argv[1] if len(argv) > 1 else None
+    if (command not in ('plan', 'backup', 'restore', 'tar')
+            or len(argv) < (4 if command in ('backup', 'restore') else 3)):
+        print(usage, file=sys.stderr)
+        return 1
+
+    threads = os.environ.get('BACKUP_COMPRESSION_THREADS')
+    if command == 'plan':
+        source_dir = argv[2]
+        shards = argv[3] if len(argv) > 3 else (os.environ.get('BACKUP_MOODLEDATA_SHARDS') or 8)
+        excluded = {os.path.join(source_dir, item) for item in excludes_from_env()}
+        filedir = os.path.join(source_dir, FILEDIR)
+        for shard in shard_plan(filedir_prefixes(source_dir), shards):
+            if shard['name'] == OTHER_SHARD:
+                size = _tree_bytes(source_dir, lambda path: path in excluded or (
+                    os.path.dirname(path) == filedir and PREFIX_PATTERN.match(os.path.basename(path))))
+            else:
+                size = sum(_tree_bytes(os.path.join(filedir, prefix)) for prefix in shard['prefixes'])
+            print(f"{shard['name']:<16} {len(shard['prefixes']):>4} prefijos {size:>16} bytes")
+        return 0
+
+    if command == 'backup':
+        return _backup_command(argv[2], argv[3], threads)
+
+    if command == 'tar':
+        try:
+            write_tar(argv[2], sys.stdout.buffer, threads)
+            sys.stdout.buffer.flush()
+        except BrokenPipeError:
+            return 1
+        except (ValueError, RuntimeError, OSError) as e:
+            print(f"ERROR: {e}", file=sys.stderr)
+            return 1
+        return 0
+
+    # Con BACKUP_PROGRESS_FILE (restore.sh) se registra el progreso de la etapa
+    reporter, meter = meter_from_env('moodledata')
+    ok = False
+    try:
+        stats = ShardedRestore(
+            argv[2], argv[3],
+            workers=int(os.environ.get('BACKUP_PARALLEL_WORKERS') or 4),
+            threads=threads,
+            log_file=os.environ.get('LOG_FILE'),
+            progress=meter.add if meter else None
+        ).restore()
+        print(f"Fragmentos restaurados: {stats['shards']} ({stats['bytes']} bytes), {stats['seconds']}s")
+        ok = True
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if reporter is not None:
+            reporter.close()
+            reporter.end_stage('moodledata', ok)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
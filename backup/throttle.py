@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Throttle Module
+Limites de CPU, E/S y ancho de banda para los respaldos
+
+Evita que el respaldo sature el disco del servidor mientras Moodle atiende
+usuarios: los procesos del host (compresores) corren con nice/ionice, los
+escritores del archivo respetan un limite de bytes por segundo. El tar de
+moodledata lo genera el daemon de Docker (volume.py), por lo que lo acota
+ese mismo limite.
+
+Solo usa la biblioteca estandar para poder ejecutarse desde backup.sh.
+"""
+
+import os
+import shutil
+import sys
+import threading
+import time
+
+
+# Clases de ionice: 1 = tiempo real, 2 = best-effort, 3 = idle
+IONICE_CLASSES = {'realtime': '1', 'best-effort': '2', 'idle': '3'}
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class RateLimiter:
+    """
+    Limitador de bytes por segundo (token bucket) compartido entre hilos
+
+    Todas las etapas concurrentes consumen del mismo limite, por lo que
+    el total escrito por el respaldo nunca supera la tasa configurada.
+    """
+
+    def __init__(self, bytes_per_second):
+        self.rate = float(bytes_per_second)
+        # Permite rafagas de hasta un segundo de datos
+        self.capacity = self.rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, count):
+        """Bloquea hasta que se puedan escribir count bytes"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                # Los bloques mayores que la capacidad se dejan pasar con deuda
+                if self.tokens >= min(count, self.capacity):
+                    self.tokens -= count
+                    return
+                wait = (min(count, self.capacity) - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Throttle:
+    """Configuracion de prioridad y limites de un respaldo"""
+
+    def __init__(self, nice=0, io_class='', rate_limit_mb=0):
+        """
+        Args:
+            nice: Incremento de nice para los procesos del host (0 = sin cambio)
+            io_class: 'idle', 'best-effort', 'realtime' o vacio
+            rate_limit_mb: MB/s maximos escritos por el respaldo (0 = sin limite)
+        """
+        self.nice = int(nice or 0)
+        self.io_class_name = (io_class or '').strip().lower()
+        self.io_class = IONICE_CLASSES.get(self.io_class_name)
+        self.rate_limit_mb = float(rate_limit_mb or 0)
+        self.rate_limit = int(self.rate_limit_mb * 1024 * 1024)
+        self.limiter = RateLimiter(self.rate_limit) if self.rate_limit > 0 else None
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            nice=settings.BACKUP_NICE,
+            io_class=settings.BACKUP_IONICE_CLASS,
+            rate_limit_mb=settings.BACKUP_RATE_LIMIT_MB
+        )
+
+    def command(self, command):
+        """Antepone nice/ionice a un comando que corre en el host"""
+        prefix = []
+        if self.io_class and shutil.which('ionice'):
+            prefix += ['ionice', '-c', self.io_class]
+        if self.nice and shutil.which('nice'):
+            prefix += ['nice', '-n', str(self.nice)]
+        return prefix + list(command)
+
+    def consume(self, count):
+        """Aplica el limite de ancho de banda (no hace nada si no hay limite)"""
+        if self.limiter is not None:
+            self.limiter.consume(count)
+
+    def describe(self):
+        """Resumen legible para el log"""
+        parts = []
+        if self.nice:
+            parts.append(f"nice +{self.nice}")
+        if self.io_class:
+            parts.append(f"ionice {self.io_class_name}")
+        if self.rate_limit:
+            parts.append(f"límite {self.rate_limit_mb:g} MB/s")
+        return ', '.join(parts) if parts else 'sin límites'
+
+
+def throttle_from_env():
+    """
+    Limite de ancho de banda desde BACKUP_RATE_LIMIT_MB
+
+    Los scripts invocados por backup.sh ya heredan nice/ionice del shell,
+    por lo que aqui solo se aplica el limite de bytes por segundo.
+    """
+    return Throttle(rate_limit_mb=os.environ.get('BACKUP_RATE_LIMIT_MB') or 0)
+
+
+def copy_limited(source, target, rate_limit_mb):
+    """Copia source -> target a un maximo de rate_limit_mb MB/s"""
+    throttle = Throttle(rate_limit_mb=rate_limit_mb)
+    for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+        throttle.consume(len(chunk))
+        target.write(chunk)
+    target.flush()
+
+
+def main(argv):
+    usage = (
+        "Uso:\n"
+        "  throttle.py limit <MB/s>      (copia stdin a stdout con limite de ancho de banda)"
+    )
+    if len(argv) >= 3 and argv[1] == 'limit':
+        try:
+            copy_limited(sys.stdin.buffer, sys.stdout.buffer, float(argv[2]))
+        except BrokenPipeError:
+            return 1
+        return 0
+    print(usage, file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
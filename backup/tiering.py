@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Tiering Module
+Almacenamiento por niveles: los respaldos antiguos pasan a un directorio frio
+
+Los respaldos recientes se escriben con un codec rapido (gzip/zstd de nivel
+bajo) en BACKUPS_PATH para que respaldar y restaurar sea rapido. Pasados
+BACKUP_COLD_AFTER_DAYS casi nunca se restauran, asi que se mueven a
+BACKUP_COLD_PATH (otro disco, un NAS, etc.) recomprimidos con un codec de
+alta compresion (por defecto zstd -19), con nice/ionice idle.
+
+En BACKUPS_PATH/<ambiente>/<fecha> queda un enlace simbolico al directorio
+frio, por lo que el catalogo, restore.sh, la verificacion y la retencion lo
+siguen encontrando en la misma ruta. El catalogo registra el nivel (hot/cold).
+
+Cada archivo recomprimido se verifica antes de reemplazar al original: su
+contenido descomprimido debe tener el mismo SHA-256. Los dumps con indice de
+tablas (seekable.py) se recomprimen marco por marco y se reescribe el indice.
+Los archivos que no son un stream comprimido (manifiestos, volcado paralelo,
+logs) se copian sin cambios. Solo usa la biblioteca estandar.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backup.archive_index import ARCHIVE_INDEX_SUFFIX, read_index_header, write_index_header
+from backup.catalog import BackupCatalog, scan_backup_dir
+from backup.compression import detect_codec, resolve_codec
+from backup.engine import AdaptiveTarPipeline, StreamPipeline
+from backup.integrity import CHECKSUM_FILE, HashingWriter, read_checksums
+from backup.physical import METADATA_FILE as PHYSICAL_METADATA
+from backup.retention import TIMESTAMP_FORMAT, UNUSABLE_STATUS
+from backup.seekable import INDEX_SUFFIX, FrameWriter, _decompressed, write_index
+from backup.throttle import Throttle
+
+
+TIER_HOT = 'hot'
+TIER_COLD = 'cold'
+
+# Directorio en construccion dentro del almacenamiento frio
+STAGING_SUFFIX = '.tiering'
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def cold_name(name, codec):
+    """Nombre del archivo con la extension del codec frio (moodle_x.sql.gz -> moodle_x.sql.zst)"""
+    for extension in ('.gz', '.zst'):
+        if name.endswith(extension):
+            return name[:-len(extension)] + codec.extension
+    return name
+
+
+def recompressible(name):
+    """True para los dumps y tar comprimidos del nivel superior del respaldo"""
+    return ('/' not in name and name.endswith(('.gz', '.zst')) and not name.endswith('.json.gz')
+            and ('.sql.' in name or '.tar.' in name))
+
+
+def backup_tier(backup_dir):
+    return TIER_COLD if os.path.islink(backup_dir) else TIER_HOT
+
+
+def _raw_digest(path, threads=None):
+    """SHA-256 del contenido descomprimido de un archivo"""
+    digest = hashlib.sha256()
+    codec = detect_codec(path)
+    with open(path, 'rb') as source:
+        process = subprocess.Popen(codec.decompress_command(threads), stdin=source,
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        for chunk in iter(lambda: process.stdout.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+        if process.wait() != 0:
+            raise RuntimeError(f"No se pudo descomprimir {os.path.basename(path)}")
+    return digest.hexdigest()
+
+
+class TieringManager:
+    """Mueve los respaldos antiguos al almacenamiento frio recomprimiendolos"""
+
+    def __init__(self, backups_path, cold_path, after_days=7, codec='zstd', level=19, threads=None,
+                 throttle=None, log_file=None):
+        if not cold_path:
+            raise ValueError("No se ha configurado BACKUP_COLD_PATH")
+        self.backups_path = backups_path
+        self.cold_path = cold_path
+        self.after_days = max(0, int(after_days))
+        self.codec = resolve_codec(codec)
+        self.level = level
+        self.threads = threads
+        self.throttle = throttle or Throttle(nice=19, io_class='idle')
+        self.log_file = log_file
+        self.catalog = BackupCatalog(backups_path)
+
+    @classmethod
+    def from_settings(cls, settings, log_file=None):
+        return cls(
+            settings.BACKUPS_PATH,
+            settings.BACKUP_COLD_PATH,
+            after_days=settings.BACKUP_COLD_AFTER_DAYS,
+            codec=settings.BACKUP_COLD_COMPRESSION,
+            level=settings.BACKUP_COLD_COMPRESSION_LEVEL,
+            threads=settings.BACKUP_COMPRESSION_THREADS,
+            # Recompresion en segundo plano: nunca compite con Moodle ni con los respaldos
+            throttle=Throttle(nice=19, io_class='idle', rate_limit_mb=settings.BACKUP_RATE_LIMIT_MB),
+            log_file=log_file
+        )
+
+    def log(self, message):
+        print(message)
+        if self.log_file:
+            with open(self.log_file, 'a') as f:
+                f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - {message}\n")
+
+    def plan(self, environment, now=None, protect=()):
+        """
+        Respaldos de un ambiente que pasan al almacenamiento frio
+
+        El respaldo exitoso mas reciente siempre queda en el nivel rapido.
+
+        Returns:
+            Lista de entradas del catalogo (mas antiguas primero)
+        """
+        now = now or time.time()
+        usable = [b for b in self.catalog.list_backups(environment) if b['status'] not in UNUSABLE_STATUS]
+        latest = usable[0]['timestamp'] if usable else None
+        candidates = []
+        for backup in reversed(usable):
+            timestamp = backup['timestamp']
+            age_days = (now - datetime.strptime(timestamp, TIMESTAMP_FORMAT).timestamp()) / 86400
+            path = os.path.join(self.backups_path, environment, timestamp)
+            if (age_days >= self.after_days and timestamp != latest and timestamp not in protect
+                    and backup_tier(path) == TIER_HOT):
+                candidates.append(backup)
+        return candidates
+
+    def run(self, environment, now=None, protect=()):
+        """
+        Mueve al almacenamiento frio los respaldos del plan
+
+        Un error en un respaldo no detiene a los demas (queda en el nivel rapido).
+
+        Returns:
+            Lista de dicts con las estadisticas de cada respaldo movido
+        """
+        moved = []
+        for backup in self.plan(environment, now, protect):
+            try:
+                moved.append(self.migrate(environment, backup['timestamp']))
+            except Exception as e:
+                self.log(f"Error moviendo {environment}/{backup['timestamp']} al almacenamiento frío: {e}")
+        return moved
+
+    def migrate(self, environment, timestamp):
+        """
+        Copia un respaldo al almacenamiento frio y deja un enlace en su lugar
+
+        Returns:
+            Dict con archivos, bytes antes/despues y segundos
+        """
+        source = os.path.join(self.backups_path, environment, timestamp)
+        target = os.path.join(self.cold_path, environment, timestamp)
+        staging = target + STAGING_SUFFIX
+        if backup_tier(source) != TIER_HOT:
+            raise RuntimeError(f"{source} ya está en el almacenamiento frío")
+        if os.path.exists(target):
+            raise RuntimeError(f"Ya existe {target}")
+
+        started = time.monotonic()
+        self.log(f"Moviendo {environment}/{timestamp} a {target} ({self.codec.name} nivel {self.level})")
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        try:
+            stats = self._copy_backup(source, staging)
+            stats['seconds'] = round(time.monotonic() - started, 3)
+            self._update_stats(staging, stats)
+            os.rename(staging, target)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        # El enlace reemplaza al directorio con dos renombres en el mismo directorio
+        env_dir = os.path.dirname(source)
+        link = os.path.join(env_dir, f".{timestamp}.link")
+        previous = os.path.join(env_dir, f".{timestamp}{STAGING_SUFFIX}")
+        os.symlink(os.path.abspath(target), link)
+        os.rename(source, previous)
+        os.rename(link, source)
+        shutil.rmtree(previous)
+
+        self.catalog.record_backup(environment, timestamp)
+        self.log(f"Respaldo {environment}/{timestamp} en almacenamiento frío: "
+                 f"{stats['bytes_before']} -> {stats['bytes_after']} bytes, "
+                 f"{stats['recompressed']} archivos recomprimidos, {stats['seconds']}s")
+        return dict(stats, environment=environment, timestamp=timestamp)
+
+    def _copy_backup(self, source, staging):
+        checksums = read_checksums(source)
+        new_checksums = {}
+        stats = {'files': 0, 'recompressed': 0, 'bytes_before': 0, 'bytes_after': 0, 'renamed': {}}
+
+        files = scan_backup_dir(source)
+        names = {name for name, _ in files}
+        for name, size in files:
+            if name == CHECKSUM_FILE or any(name.endswith(suffix) and name[:-len(suffix)] in names
+                                            and recompressible(name[:-len(suffix)])
+                                            for suffix in (INDEX_SUFFIX, ARCHIVE_INDEX_SUFFIX)):
+                # SHA256SUMS se reescribe y los indices se regeneran con su dump o tar
+                # (los de los fragmentos de moodledata_shards/ se copian con ellos)
+                continue
+            path = os.path.join(source, name)
+            stats['files'] += 1
+            stats['bytes_before'] += size
+            if recompressible(name) and detect_codec(path) is not None:
+                new_name = cold_name(name, self.codec)
+                output = os.path.join(staging, new_name)
+                suffix = next((suffix for suffix in (INDEX_SUFFIX, ARCHIVE_INDEX_SUFFIX)
+                               if os.path.exists(path + suffix)), None)
+                if suffix:
+                    stats['bytes_before'] += os.path.getsize(path + suffix)
+                    new_checksums[new_name], index_sha256 = self._recompress_framed(path, output, suffix)
+                    new_checksums[new_name + suffix] = index_sha256
+                    stats['bytes_after'] += os.path.getsize(output + suffix)
+                else:
+                    new_checksums[new_name] = self._recompress(path, output)
+                stats['recompressed'] += 1
+                if new_name != name:
+                    stats['renamed'][name] = new_name
+            else:
+                output = os.path.join(staging, name)
+                os.makedirs(os.path.dirname(output), exist_ok=True)
+                digest = self._copy(path, output)
+                if name in checksums:
+                    if checksums[name] != digest:
+                        raise RuntimeError(f"{name} no coincide con su SHA-256 registrado")
+                    new_checksums[name] = digest
+            stats['bytes_after'] += os.path.getsize(output)
+
+        self._update_physical_metadata(staging, stats['renamed'], new_checksums)
+        with open(os.path.join(staging, CHECKSUM_FILE), 'w') as f:
+            f.write(''.join(f"{digest}  {name}\n" for name, digest in sorted(new_checksums.items())))
+        return stats
+
+    def _copy(self, path, output):
+        """Copia un archivo con el limite de ancho de banda y devuelve su SHA-256"""
+        with open(path, 'rb') as source, open(output, 'wb') as target:
+            writer = HashingWriter(target)
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                self.throttle.consume(len(chunk))
+                writer.write(chunk)
+        shutil.copystat(path, output)
+        return writer.hexdigest()
+
+    def _recompress(self, path, output):
+        """
+        Descomprime y vuelve a comprimir con el codec frio, verificando el contenido
+
+        Los tar se recomprimen con AdaptiveTarPipeline: el contenido ya
+        comprimido de moodledata no pasa por el nivel alto del codec frio.
+
+        Returns:
+            SHA-256 del archivo nuevo
+        """
+        original = hashlib.sha256()
+        pipeline_class = AdaptiveTarPipeline if '.tar.' in os.path.basename(path) else StreamPipeline
+        pipeline = pipeline_class(
+            self.throttle.command(detect_codec(path).decompress_command(self.threads) + [path]),
+            self.codec, output, level=self.level, threads=self.threads, log_file=self.log_file,
+            throttle=self.throttle, observer=original.update
+        )
+        pipeline.run()
+        if _raw_digest(output, self.threads) != original.hexdigest():
+            raise RuntimeError(f"El contenido recomprimido de {os.path.basename(path)} no coincide")
+        return pipeline.sha256
+
+    def _recompress_framed(self, path, output, suffix=INDEX_SUFFIX):
+        """
+        Recomprime un dump o tar con indice marco por marco y reescribe el indice
+
+        Los marcos guardados sin comprimir (ver adaptive.py) siguen igual; las
+        entradas del indice de moodledata apuntan a marco y posicion sin
+        comprimir, por lo que solo cambia la cabecera.
+
+        Returns:
+            Tupla (SHA-256 del archivo, SHA-256 del indice)
+        """
+        if suffix == ARCHIVE_INDEX_SUFFIX:
+            index = read_index_header(path + suffix)
+        else:
+            with open(path + suffix) as f:
+                index = json.load(f)
+        stderr = open(self.log_file, 'ab') if self.log_file else subprocess.DEVNULL
+        try:
+            with open(output, 'wb') as target:
+                writer = HashingWriter(target)
+                frames = FrameWriter(writer, self.codec, self.level, self.threads, stderr=stderr,
+                                     throttle=self.throttle)
+                try:
+                    for frame in index['frames']:
+                        frames.begin(frame['kind'], frame['name'], store=frame['kind'] == 'stored')
+                        for chunk in _decompressed(path, frame['offset'], frame['length']):
+                            frames.write(chunk)
+                        frames.end()
+                except Exception:
+                    frames.abort()
+                    raise
+        finally:
+            if stderr is not subprocess.DEVNULL:
+                stderr.close()
+
+        for old, new in zip(index['frames'], frames.frames):
+            if old['bytes'] != new['bytes']:
+                raise RuntimeError(f"El marco {old['kind']} {old['name'] or ''} de "
+                                   f"{os.path.basename(path)} no coincide al recomprimir")
+        if suffix == ARCHIVE_INDEX_SUFFIX:
+            shutil.copyfile(path + suffix, output + suffix)
+            header = dict(index, codec=self.codec.name, file=os.path.basename(output), frames=frames.frames)
+            return writer.hexdigest(), write_index_header(output + suffix, header)
+        fields = {k: v for k, v in index.items() if k not in ('format', 'version', 'codec', 'frames')}
+        fields['file'] = os.path.basename(output)
+        data = write_index(output + INDEX_SUFFIX, frames.index(**fields))
+        return writer.hexdigest(), hashlib.sha256(data).hexdigest()
+
+    def _update_physical_metadata(self, staging, renamed, checksums):
+        """mysql_physical.json apunta al archivo con su nuevo nombre y codec"""
+        path = os.path.join(staging, PHYSICAL_METADATA)
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            metadata = json.load(f)
+        if metadata.get('archive') not in renamed:
+            return
+        metadata['archive'] = renamed[metadata['archive']]
+        metadata['codec'] = self.codec.name
+        data = json.dumps(metadata, indent=2).encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(data)
+        if PHYSICAL_METADATA in checksums:
+            checksums[PHYSICAL_METADATA] = hashlib.sha256(data).hexdigest()
+
+    def _update_stats(self, staging, stats):
+        """Registra el paso al nivel frio en STATS.json (el catalogo toma el codec de aqui)"""
+        path = os.path.join(staging, 'STATS.json')
+        try:
+            with open(path) as f:
+                backup_stats = json.load(f)
+        except (OSError, ValueError):
+            backup_stats = {}
+        backup_stats['tiering'] = {
+            'tier': TIER_COLD,
+            'moved_at': datetime.now().isoformat(timespec='seconds'),
+            'original_codec': backup_stats.get('codec'),
+            'codec': self.codec.name,
+            'level': self.level,
+            'bytes_before': stats['bytes_before'],
+            'bytes_after': stats['bytes_after'],
+            'recompressed': stats['recompressed'],
+            'seconds': stats['seconds'],
+        }
+        if stats['recompressed']:
+            backup_stats['codec'] = self.codec.name
+        with open(path, 'w') as f:
+            json.dump(backup_stats, f, indent=2)
+
+
+def main(argv):
+    usage = (
+        "Uso:\n"
+        "  tiering.py plan [ambiente]   (respaldos que pasarían al almacenamiento frío)\n"
+        "  tiering.py run [ambiente]\n"
+        "La configuracion (BACKUP_COLD_*) se lee del .env de BASE_PATH"
+    )
+    command = argv[1] if len(argv) > 1 else None
+    if command not in ('plan', 'run'):
+        print(usage, file=sys.stderr)
+        return 1
+
+    from config.settings import Settings
+    settings = Settings()
+    settings.load_env_file()
+    environments = [argv[2]] if len(argv) > 2 else ['testing', 'production']
+
+    try:
+        manager = TieringManager.from_settings(settings)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
+    for environment in environments:
+        if command == 'plan':
+            for backup in manager.plan(environment):
+                print(f"{environment}/{backup['timestamp']} ({backup['size_bytes']} bytes)")
+        else:
+            moved = manager.run(environment)
+            print(f"{environment}: {len(moved)} respaldos movidos al almacenamiento frío")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
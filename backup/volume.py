@@ -0,0 +1,662 @@
+#!/usr/bin/env python3
+"""
+Volume Module
+Lectura y escritura de volumenes Docker como streams tar por la API de Docker
+
+En lugar de arrancar un contenedor alpine para cada respaldo o restauracion,
+el tar del volumen se pide al daemon por el socket unix (endpoints
+/containers/{id}/archive, los mismos que usa `docker cp`) y se comprime en el
+host con el codec configurado. Se usa el contenedor que ya monta el volumen
+(ej. moodle_<ambiente>); si no hay ninguno se crea uno auxiliar sin
+arrancarlo, con cualquier imagen local, por lo que no hace falta descargar
+alpine.
+
+Las exclusiones se aplican filtrando el stream tar a nivel de cabeceras: los
+datos de los archivos se copian sin volver a empaquetarlos.
+
+Solo usa la biblioteca estandar para poder ejecutarse desde los scripts de shell.
+"""
+
+import http.client
+import io
+import json
+import os
+import shutil
+import socket
+import sys
+import tarfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import quote, urlencode
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backup.exclusions import excludes_from_env, is_excluded
+
+
+DOCKER_SOCKET = '/var/run/docker.sock'
+CHUNK_SIZE = 1024 * 1024
+
+BLOCK_SIZE = 512
+ZERO_BLOCK = b'\0' * BLOCK_SIZE
+
+# Cabeceras extendidas que describen la entrada siguiente (pax y GNU)
+EXTENDED_TYPES = (b'x', b'L', b'K')
+
+
+class DockerAPIError(Exception):
+    """Respuesta de error del daemon de Docker"""
+
+    def __init__(self, status, message):
+        super().__init__(f"Docker API {status}: {message}")
+        self.status = status
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection sobre el socket unix del daemon"""
+
+    def __init__(self, socket_path):
+        super().__init__('localhost')
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class DockerClient:
+    """Cliente minimo de la API de Docker Engine"""
+
+    def __init__(self, socket_path=None):
+        if socket_path is None:
+            host = os.environ.get('DOCKER_HOST', '')
+            socket_path = host[len('unix://'):] if host.startswith('unix://') else DOCKER_SOCKET
+        self.socket_path = socket_path
+
+    def available(self):
+        """True si el socket existe y se puede usar (root o grupo docker)"""
+        return os.path.exists(self.socket_path) and os.access(self.socket_path, os.R_OK | os.W_OK)
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Envia una peticion y devuelve la respuesta sin leer (para streams)
+
+        Raises:
+            DockerAPIError si el daemon responde con un error
+        """
+        conn = UnixHTTPConnection(self.socket_path)
+        headers = dict(headers or {})
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        if response.status >= 400:
+            data = response.read()
+            conn.close()
+            try:
+                message = json.loads(data).get('message', '')
+            except ValueError:
+                message = data.decode('utf-8', 'replace')
+            raise DockerAPIError(response.status, message.strip())
+        return response
+
+    def json(self, method, path, body=None):
+        response = self.request(method, path, body)
+        try:
+            data = response.read()
+        finally:
+            response.close()
+        return json.loads(data) if data else None
+
+    def volume_containers(self, volume):
+        """
+        Contenedores que montan un volumen (los que estan corriendo primero)
+
+        Returns:
+            Lista de tuplas (id, punto de montaje, corriendo)
+        """
+        filters = quote(json.dumps({'volume': [volume]}))
+        found = []
+        for container in self.json('GET', f"/containers/json?all=1&filters={filters}") or []:
+            for mount in container.get('Mounts', []):
+                if mount.get('Name') == volume:
+                    found.append((container['Id'], mount['Destination'], container.get('State') == 'running'))
+        return sorted(found, key=lambda c: not c[2])
+
+    def create_helper(self, volume, destination):
+        """
+        Crea (sin arrancar) un contenedor que monta el volumen
+
+        El endpoint archive funciona con contenedores detenidos, asi que sirve
+        cualquier imagen que ya este en el host.
+        """
+        images = [image for image in self.json('GET', '/images/json') or [] if image.get('RepoTags')]
+        if not images:
+            raise RuntimeError(f"No hay imágenes locales para montar el volumen {volume}")
+        name = f"volume-helper-{volume}-{os.getpid()}"
+        created = self.json('POST', f"/containers/create?{urlencode({'name': name})}", {
+            'Image': images[0]['RepoTags'][0],
+            'Cmd': ['true'],
+            'NetworkDisabled': True,
+            'HostConfig': {'Binds': [f"{volume}:{destination}"]},
+        })
+        return created['Id']
+
+    def remove_container(self, container):
+        self.json('DELETE', f"/containers/{container}?force=1")
+
+    def inspect(self, container):
+        return self.json('GET', f"/containers/{container}/json")
+
+    def start(self, container):
+        self.json('POST', f"/containers/{container}/start")
+
+    def stop(self, container, timeout=60):
+        """Detiene un contenedor (sin error si ya estaba detenido)"""
+        self.json('POST', f"/containers/{container}/stop?{urlencode({'t': timeout})}")
+
+    def run_helper(self, image, volume, destination, command):
+        """
+        Ejecuta un comando en un contenedor temporal que monta el volumen
+
+        A diferencia de create_helper el contenedor se arranca, por lo que la
+        imagen debe tener los programas del comando (ej. la del servicio).
+
+        Returns:
+            Codigo de salida del comando
+        """
+        name = f"volume-helper-{volume}-{os.getpid()}"
+        created = self.json('POST', f"/containers/create?{urlencode({'name': name})}", {
+            'Image': image,
+            'Entrypoint': command[:1],
+            'Cmd': command[1:],
+            'NetworkDisabled': True,
+            'HostConfig': {'Binds': [f"{volume}:{destination}"]},
+        })
+        try:
+            self.start(created['Id'])
+            return self.json('POST', f"/containers/{created['Id']}/wait")['StatusCode']
+        finally:
+            self.remove_container(created['Id'])
+
+    def get_archive(self, container, path):
+        """Stream tar de una ruta del contenedor"""
+        return self.request('GET', f"/containers/{container}/archive?{urlencode({'path': path})}")
+
+    def put_archive(self, container, path, source):
+        """Extrae en una ruta del contenedor el tar leido de source (transferencia chunked)"""
+        body = iter(lambda: source.read(CHUNK_SIZE), b'')
+        self._drain(self.request('PUT', f"/containers/{container}/archive?{urlencode({'path': path})}",
+                                 body=body, headers={'Content-Type': 'application/x-tar'}))
+
+    def _drain(self, response):
+        try:
+            response.read()
+        finally:
+            response.close()
+
+    def exec_run(self, container, command):
+        """Ejecuta un comando en un contenedor corriendo y devuelve su codigo de salida"""
+        created = self.json('POST', f"/containers/{container}/exec", {
+            'Cmd': command, 'AttachStdout': True, 'AttachStderr': True})
+        self._drain(self.request('POST', f"/exec/{created['Id']}/start", {'Detach': False, 'Tty': False}))
+        return self.json('GET', f"/exec/{created['Id']}/json")['ExitCode']
+
+
+def _header_size(header):
+    field = header[124:136]
+    if field[0] & 0x80:
+        # Codificacion base-256 de GNU para archivos de mas de 8 GB
+        return int.from_bytes(field[1:], 'big')
+    return int(field.strip(b'\0 ') or b'0', 8)
+
+
+def _header_name(header):
+    name = header[0:100].split(b'\0', 1)[0]
+    if header[257:262] == b'ustar':
+        prefix = header[345:500].split(b'\0', 1)[0]
+        if prefix:
+            name = prefix + b'/' + name
+    return name.decode('utf-8', 'surrogateescape')
+
+
+def _parse_pax(data):
+    """Registros 'longitud clave=valor\\n' de una cabecera pax"""
+    records = {}
+    while data:
+        length, _, rest = data.partition(b' ')
+        if not length.isdigit():
+            break
+        record = data[:int(length)]
+        key, _, value = record[len(length) + 1:].rstrip(b'\n').partition(b'=')
+        records[key.decode('utf-8', 'replace')] = value.decode('utf-8', 'surrogateescape')
+        data = data[int(length):]
+    return records
+
+
+def _padded(size):
+    return (size + BLOCK_SIZE - 1) // BLOCK_SIZE * BLOCK_SIZE
+
+
+class TarFilter:
+    """Copia un stream tar omitiendo las entradas excluidas sin reempaquetarlo"""
+
+    def __init__(self, exclude=()):
+        self.exclude = list(exclude)
+        self.skipped = 0
+        self.bytes = 0
+
+    def _read(self, source, size):
+        data = b''
+        while len(data) < size:
+            chunk = source.read(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def _copy(self, source, output, size):
+        while size > 0:
+            chunk = source.read(min(size, CHUNK_SIZE))
+            if not chunk:
+                raise EOFError("Stream tar truncado")
+            if output is not None:
+                output.write(chunk)
+                self.bytes += len(chunk)
+            size -= len(chunk)
+
+    def _write(self, output, data):
+        output.write(data)
+        self.bytes += len(data)
+
+    def copy(self, source, output):
+        """
+        Returns:
+            Bytes escritos en output
+        """
+        if not self.exclude:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                self._write(output, chunk)
+            return self.bytes
+
+        pending = []
+        pax = {}
+        long_name = None
+        while True:
+            header = self._read(source, BLOCK_SIZE)
+            if len(header) < BLOCK_SIZE or header == ZERO_BLOCK:
+                # Fin del archivo: se copia tal cual
+                self._write(output, b''.join(pending) + header)
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    self._write(output, chunk)
+                return self.bytes
+
+            typeflag = header[156:157]
+            size = _header_size(header)
+            if typeflag in EXTENDED_TYPES:
+                data = self._read(source, _padded(size))
+                pending.append(header + data)
+                if typeflag == b'x':
+                    pax.update(_parse_pax(data[:size]))
+                elif typeflag == b'L':
+                    long_name = data[:size].rstrip(b'\0').decode('utf-8', 'surrogateescape')
+                continue
+
+            name = pax.get('path') or long_name or _header_name(header)
+            if 'size' in pax:
+                size = int(pax['size'])
+            relative = name.strip('/')
+            while relative.startswith('./'):
+                relative = relative[2:]
+            relative = '' if relative == '.' else relative
+
+            if relative and is_excluded(relative, self.exclude):
+                self._copy(source, None, _padded(size))
+                self.skipped += 1
+            else:
+                self._write(output, b''.join(pending) + header)
+                self._copy(source, output, _padded(size))
+            pending = []
+            pax = {}
+            long_name = None
+
+
+class TarCounter:
+    """
+    Cuenta los archivos de un stream tar mientras se transmite (progreso)
+
+    Solo conserva la cabecera incompleta (y los datos pax) entre bloques,
+    como BinlogScanner con los eventos de un binlog.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.pending = b''
+        self.skip = 0
+        self.pax = None
+        self.pax_size = None
+
+    def feed(self, data):
+        """
+        Returns:
+            Archivos nuevos encontrados en el bloque
+        """
+        found = 0
+        position = 0
+        while position < len(data):
+            if self.skip:
+                take = min(self.skip, len(data) - position)
+                if self.pax is not None:
+                    self.pax += data[position:position + take]
+                position += take
+                self.skip -= take
+                if not self.skip and self.pax is not None:
+                    self.pax_size = _parse_pax(self.pax).get('size')
+                    self.pax = None
+                continue
+
+            take = min(BLOCK_SIZE - len(self.pending), len(data) - position)
+            self.pending += data[position:position + take]
+            position += take
+            if len(self.pending) < BLOCK_SIZE:
+                break
+            header, self.pending = self.pending, b''
+            if header == ZERO_BLOCK:
+                continue
+
+            typeflag = header[156:157]
+            size = _header_size(header)
+            if typeflag == b'x':
+                self.pax = b''
+            elif typeflag not in EXTENDED_TYPES and typeflag != b'g':
+                if self.pax_size is not None:
+                    size = int(self.pax_size)
+                    self.pax_size = None
+                if typeflag in (b'0', b'\0', b'7'):
+                    found += 1
+            self.skip = _padded(size)
+
+        self.files += found
+        return found
+
+
+class TarEntryReader:
+    """
+    Recorre las entradas de un stream tar sin reempaquetarlo
+
+    entries() devuelve un dict por entrada con el nombre relativo (sin ./),
+    tipo, tamaño y los bloques de cabecera tal cual (incluidas las cabeceras
+    extendidas pax/GNU que la preceden). Los datos (con su relleno hasta el
+    bloque) se leen con read() antes de pedir la siguiente entrada; lo que no
+    se lea se descarta. Al terminar, trailer guarda el bloque de fin de archivo.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.remaining = 0
+        self.trailer = b''
+
+    def _read_exact(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.source.read(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def read(self, size=CHUNK_SIZE):
+        """Lee hasta size bytes de los datos de la entrada en curso"""
+        if self.remaining <= 0:
+            return b''
+        chunk = self.source.read(min(size, self.remaining))
+        if not chunk:
+            raise EOFError("Stream tar truncado")
+        self.remaining -= len(chunk)
+        return chunk
+
+    def entries(self):
+        pending = []
+        pax = {}
+        long_name = None
+        while True:
+            while self.remaining > 0:
+                self.read()
+            header = self._read_exact(BLOCK_SIZE)
+            if len(header) < BLOCK_SIZE or header == ZERO_BLOCK:
+                self.trailer = b''.join(pending) + header
+                return
+
+            typeflag = header[156:157]
+            size = _header_size(header)
+            if typeflag in EXTENDED_TYPES:
+                data = self._read_exact(_padded(size))
+                pending.append(header + data)
+                if typeflag == b'x':
+                    pax.update(_parse_pax(data[:size]))
+                elif typeflag == b'L':
+                    long_name = data[:size].rstrip(b'\0').decode('utf-8', 'surrogateescape')
+                continue
+
+            name = pax.get('path') or long_name or _header_name(header)
+            if 'size' in pax:
+                size = int(pax['size'])
+            relative = name.strip('/')
+            while relative.startswith('./'):
+                relative = relative[2:]
+            self.remaining = _padded(size)
+            yield {
+                'name': '' if relative == '.' else relative,
+                'type': typeflag,
+                'size': size,
+                'header': b''.join(pending) + header,
+            }
+            pending = []
+            pax = {}
+            long_name = None
+
+
+class VolumeStream:
+    """Contenido de un volumen Docker como stream tar"""
+
+    def __init__(self, volume, client=None):
+        self.volume = volume
+        self.client = client or DockerClient()
+
+    @contextmanager
+    def attached(self):
+        """
+        Contenedor que monta el volumen
+
+        Yields:
+            Tupla (id del contenedor, ruta del volumen dentro del contenedor)
+        """
+        if not self.client.available():
+            raise RuntimeError(f"No se puede usar el socket de Docker ({self.client.socket_path}): "
+                               f"ejecute como root o con un usuario del grupo docker")
+        containers = self.client.volume_containers(self.volume)
+        if containers:
+            yield containers[0][0], containers[0][1]
+            return
+
+        destination = '/volume'
+        helper = self.client.create_helper(self.volume, destination)
+        try:
+            yield helper, destination
+        finally:
+            self.client.remove_container(helper)
+
+    def export(self, output, exclude=()):
+        """
+        Escribe en output el tar del volumen (entradas ./ruta, como `tar -C vol .`)
+
+        Returns:
+            Bytes escritos
+        """
+        with self.attached() as (container, path):
+            response = self.client.get_archive(container, path.rstrip('/') + '/.')
+            try:
+                return TarFilter(exclude).copy(response, output)
+            finally:
+                response.close()
+
+    def export_process(self, exclude=(), log_file=None):
+        """Exportacion en segundo plano con la interfaz de un proceso (para StreamPipeline)"""
+        return VolumeExport(self, exclude, log_file)
+
+    def import_tar(self, source):
+        """Extrae en el volumen un tar leido de source (conserva dueños y permisos)"""
+        with self.attached() as (container, path):
+            self.client.put_archive(container, path, source)
+
+    def owner(self):
+        """uid, gid y permisos de la raiz del volumen (de la primera entrada del tar)"""
+        with self.attached() as (container, path):
+            response = self.client.get_archive(container, path.rstrip('/') + '/.')
+            try:
+                with tarfile.open(fileobj=response, mode='r|') as tar:
+                    root = tar.next()
+            finally:
+                response.close()
+        if root is None:
+            raise RuntimeError(f"No se pudo leer la raíz de {self.volume}")
+        return root.uid, root.gid, root.mode & 0o7777
+
+    def make_dirs(self, directories):
+        """Crea directorios vacios con el dueño y permisos de la raiz del volumen"""
+        uid, gid, mode = self.owner()
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode='w') as tar:
+            for directory in directories:
+                info = tarfile.TarInfo(directory)
+                info.type = tarfile.DIRTYPE
+                info.mode = mode
+                info.uid = uid
+                info.gid = gid
+                info.mtime = time.time()
+                tar.addfile(info)
+        data.seek(0)
+        self.import_tar(data)
+
+    def mountpoint(self):
+        """Punto de montaje del volumen en el host, o None si no se puede escribir en el (driver local, root)"""
+        mountpoint = (self.client.json('GET', f"/volumes/{quote(self.volume)}") or {}).get('Mountpoint')
+        if mountpoint and os.path.isdir(mountpoint) and os.access(mountpoint, os.W_OK):
+            return mountpoint
+        return None
+
+    def clear(self):
+        """
+        Vacia el volumen
+
+        Se borra desde el punto de montaje en el host (driver local, root);
+        si no es accesible se ejecuta rm en un contenedor temporal con la
+        imagen del servicio que lo monta (funciona con el servicio detenido,
+        como en restore.sh y clone.py).
+        """
+        mountpoint = self.mountpoint()
+        if mountpoint:
+            for entry in os.scandir(mountpoint):
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.remove(entry.path)
+            return
+
+        if not self.client.available():
+            raise RuntimeError(f"No se puede usar el socket de Docker ({self.client.socket_path}): "
+                               f"ejecute como root o con un usuario del grupo docker")
+        containers = self.client.volume_containers(self.volume)
+        if not containers:
+            raise RuntimeError(f"Ningún contenedor monta {self.volume}")
+        image = self.client.inspect(containers[0][0])['Config']['Image']
+        destination = '/volume'
+        code = self.client.run_helper(image, self.volume, destination, [
+            'sh', '-c', 'rm -rf -- "$0"/* "$0"/.[!.]* "$0"/..?*', destination])
+        if code != 0:
+            raise RuntimeError(f"No se pudo vaciar {self.volume} (código {code})")
+
+
+class VolumeExport:
+    """
+    Ejecuta VolumeStream.export en un hilo que escribe en un pipe
+
+    Expone stdout, wait() y kill() como subprocess.Popen, por lo que
+    StreamPipeline lo usa igual que a un productor externo.
+    """
+
+    def __init__(self, stream, exclude=(), log_file=None):
+        read_fd, write_fd = os.pipe()
+        self.stdout = os.fdopen(read_fd, 'rb')
+        self._writer = os.fdopen(write_fd, 'wb')
+        self.stream = stream
+        self.exclude = exclude
+        self.log_file = log_file
+        self.error = None
+        self.returncode = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self.stream.export(self._writer, self.exclude)
+        except Exception as e:
+            self.error = e
+            if self.log_file:
+                with open(self.log_file, 'a') as log:
+                    log.write(f"Error exportando {self.stream.volume}: {e}\n")
+        finally:
+            try:
+                self._writer.close()
+            except OSError:
+                pass
+
+    def wait(self):
+        self._thread.join()
+        self.returncode = 0 if self.error is None else 1
+        return self.returncode
+
+    def kill(self):
+        # El hilo recibe BrokenPipeError en su siguiente escritura
+        self.stdout.close()
+
+
+def main(argv):
+    usage = (
+        "Uso:\n"
+        "  volume.py export <volumen>            (tar a stdout, excluye BACKUP_MOODLEDATA_EXCLUDE)\n"
+        "  volume.py import <volumen>            (extrae el tar de stdin)\n"
+        "  volume.py clear <volumen>\n"
+        "  volume.py mkdirs <volumen> <dir>...   (con el dueño de la raiz del volumen)"
+    )
+    command = argv[1] if len(argv) > 1 else None
+    if command not in ('export', 'import', 'clear', 'mkdirs') or len(argv) < 3:
+        print(usage, file=sys.stderr)
+        return 1
+
+    stream = VolumeStream(argv[2])
+    try:
+        if command == 'export':
+            stream.export(sys.stdout.buffer, excludes_from_env())
+            sys.stdout.buffer.flush()
+        elif command == 'import':
+            stream.import_tar(sys.stdin.buffer)
+        elif command == 'clear':
+            stream.clear()
+        elif argv[3:]:
+            stream.make_dirs(argv[3:])
+    except BrokenPipeError:
+        return 1
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
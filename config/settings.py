@@ -92,6 +92,50 @@ class Settings:
             # Backup Configuration
             'BACKUP_RETENTION_DAYS': '7',
             'BACKUP_EMAIL_TO': '',
+            'BACKUP_ENGINE': 'python',
+            'BACKUP_COMPRESSION': 'gzip',
+            'BACKUP_COMPRESSION_LEVEL': '',
+            'BACKUP_COMPRESSION_THREADS': '0',
+            'BACKUP_MOODLEDATA_MODE': 'full',
+            'BACKUP_MOODLEDATA_SHARDS': '8',
+            'BACKUP_MOODLEDATA_EXCLUDE': 'cache,localcache,temp,sessions,trashdir',
+            'BACKUP_MOODLEDATA_ADAPTIVE': 'true',
+            'BACKUP_MOODLEDATA_STORE_MIN_KB': '256',
+            'BACKUP_MOODLEDATA_INDEX': 'true',
+            'BACKUP_MOODLEDATA_FRAME_MB': '64',
+            'BACKUP_DB_MODE': 'single',
+            'BACKUP_DB_INDEX': 'true',
+            'BACKUP_PARALLEL_WORKERS': '4',
+            'BACKUP_PARALLEL_CHUNK_MB': '256',
+            'BACKUP_CONCURRENT': 'true',
+            'BACKUP_RESTORE_MODE': 'full',
+            'BACKUP_KEEP_DAILY': '',
+            'BACKUP_KEEP_WEEKLY': '4',
+            'BACKUP_KEEP_MONTHLY': '3',
+            'BACKUP_COLD_PATH': '',
+            'BACKUP_COLD_AFTER_DAYS': '7',
+            'BACKUP_COLD_COMPRESSION': 'zstd',
+            'BACKUP_COLD_COMPRESSION_LEVEL': '19',
+            'BACKUP_NICE': '10',
+            'BACKUP_IONICE_CLASS': 'idle',
+            'BACKUP_RATE_LIMIT_MB': '0',
+            'BACKUP_REMOTE_ENABLED': 'false',
+            'BACKUP_REMOTE_ENDPOINT': '',
+            'BACKUP_REMOTE_BUCKET': '',
+            'BACKUP_REMOTE_ACCESS_KEY': '',
+            'BACKUP_REMOTE_SECRET_KEY': '',
+            'BACKUP_REMOTE_REGION': 'us-east-1',
+            'BACKUP_REMOTE_PREFIX': 'moodle-backups',
+            'BACKUP_REMOTE_WORKERS': '4',
+            'BACKUP_REMOTE_PART_MB': '64',
+            'BACKUP_REMOTE_RATE_LIMIT_MB': '0',
+            'BACKUP_BINLOG_ENABLED': 'false',
+            'BACKUP_BINLOG_INTERVAL': '5',
+            'BACKUP_BINLOG_EXPIRE_DAYS': '7',
+            'BACKUP_BINLOG_MAX_SIZE_MB': '100',
+            'BACKUP_SCHEDULER': 'cron',
+            'BACKUP_SCHEDULER_MAX_JOBS': '1',
+            'BACKUP_SCHEDULER_JITTER': '300',
 
             # SMTP Configuration
             'SMTP_SERVER': 'smtp.gmail.com',
@@ -99,6 +143,7 @@ class Settings:
             'SMTP_USER': '',
             'SMTP_PASSWORD': '',
             'SMTP_FROM_NAME': 'Moodle Backup System',
+            'SMTP_MAX_ATTACHMENT_MB': '5',
 
             # Auto-start Configuration
             'AUTO_START_ON_BOOT': 'false',
@@ -154,6 +199,370 @@ class Settings:
         """Email de destino para notificaciones de backup"""
         return self.env_vars.get('BACKUP_EMAIL_TO', '')
 
+    @property
+    def BACKUP_ENGINE(self):
+        """Motor de respaldos: 'python' (streaming nativo) o 'shell' (backup.sh)"""
+        value = self.env_vars.get('BACKUP_ENGINE', 'python')
+        if isinstance(value, str):
+            value = value.strip("'\"").lower()
+        return value
+
+    @property
+    def BACKUP_COMPRESSION(self):
+        """Codec de compresion de respaldos: gzip, pigz o zstd"""
+        value = self.env_vars.get('BACKUP_COMPRESSION', 'gzip')
+        if isinstance(value, str):
+            value = value.strip("'\"").lower()
+        return value or 'gzip'
+
+    @property
+    def BACKUP_COMPRESSION_LEVEL(self):
+        """Nivel de compresion (None usa el nivel por defecto del codec)"""
+        value = self.env_vars.get('BACKUP_COMPRESSION_LEVEL', '')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return int(value) if value else None
+
+    @property
+    def BACKUP_COMPRESSION_THREADS(self):
+        """Hilos de compresion (0 = todos los nucleos)"""
+        value = self.env_vars.get('BACKUP_COMPRESSION_THREADS', '0')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return int(value or 0)
+
+    @property
+    def BACKUP_MOODLEDATA_MODE(self):
+        """Modo de respaldo de moodledata: 'full' (tar), 'incremental' (almacen de blobs) o 'sharded'"""
+        value = self.env_vars.get('BACKUP_MOODLEDATA_MODE', 'full')
+        if isinstance(value, str):
+            value = value.strip("'\"").lower()
+        return value or 'full'
+
+    @property
+    def BACKUP_MOODLEDATA_SHARDS(self):
+        """Fragmentos de filedir del modo 'sharded' (mas uno con el resto de moodledata)"""
+        value = self.env_vars.get('BACKUP_MOODLEDATA_SHARDS', '8')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return min(256, max(1, int(value or 8)))
+
+    @property
+    def BACKUP_MOODLEDATA_EXCLUDE(self):
+        """Directorios de moodledata que no se respaldan (vacio = ninguno)"""
+        value = self.env_vars.get('BACKUP_MOODLEDATA_EXCLUDE', 'cache,localcache,temp,sessions,trashdir')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return [item.strip().strip('/') for item in (value or '').split(',') if item.strip().strip('/')]
+
+    @property
+    def BACKUP_MOODLEDATA_ADAPTIVE(self):
+        """No comprimir el contenido de moodledata que ya viene comprimido (imagenes, video, ZIP)"""
+        value = self.env_vars.get('BACKUP_MOODLEDATA_ADAPTIVE', 'true')
+        if isinstance(value, str):
+            value = value.strip("'\"").lower()
+        return value == 'true'
+
+    @property
+    def BACKUP_MOODLEDATA_STORE_MIN_KB(self):
+        """Tamaño minimo (KB) de los archivos que se guardan sin comprimir"""
+        value = self.env_vars.get('BACKUP_MOODLEDATA_STORE_MIN_KB', '256')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return max(1, int(value or 256))
+
+    @property
+    def BACKUP_MOODLEDATA_INDEX(self):
+        """Tar de moodledata en marcos con indice de archivos (recuperar archivos sueltos)"""
+        value = self.env_vars.get('BACKUP_MOODLEDATA_INDEX', 'true')
+        if isinstance(value, str):
+            value = value.strip("'\"").lower()
+        return value == 'true'
+
+    @property
+    def BACKUP_MOODLEDATA_FRAME_MB(self):
+        """Tamaño (MB sin comprimir) de cada marco del tar de moodledata con indice"""
+        value = self.env_vars.get('BACKUP_MOODLEDATA_FRAME_MB', '64')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return max(1, int(value or 64))
+
+    @property
+    def BACKUP_DB_MODE(self):
+        """Modo de respaldo de la BD: 'single' (un mysqldump), 'parallel' (por tabla) o 'physical'"""
+        value = self.env_vars.get('BACKUP_DB_MODE', 'single')
+        if isinstance(value, str):
+            value = value.strip("'\"").lower()
+        return value or 'single'
+
+    def backup_db_mode(self, environment):
+        """
+        Modo de respaldo de la BD de un ambiente: 'single', 'parallel' o 'physical'
+
+        PROD_BACKUP_DB_MODE / TEST_BACKUP_DB_MODE reemplazan a BACKUP_DB_MODE
+        """
+        prefix = 'PROD' if environment == 'production' else 'TEST'
+        value = self.env_vars.get(f'{prefix}_BACKUP_DB_MODE', '')
+        if isinstance(value, str):
+            value = value.strip("'\"").lower()
+        return value or self.BACKUP_DB_MODE
+
+    @property
+    def BACKUP_DB_INDEX(self):
+        """Dump con un marco comprimido por tabla e indice (restauracion de tablas sueltas)"""
+        value = self.env_vars.get('BACKUP_DB_INDEX', 'true')
+        if isinstance(value, str):
+            value = value.strip("'\"").lower()
+        return value == 'true'
+
+    @property
+    def BACKUP_PARALLEL_WORKERS(self):
+        """Sesiones concurrentes del volcado/carga paralela"""
+        value = self.env_vars.get('BACKUP_PARALLEL_WORKERS', '4')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return max(1, int(value or 4))
+
+    @property
+    def BACKUP_PARALLEL_CHUNK_MB(self):
+        """Tamaño aproximado (MB) de cada fragmento de tabla"""
+        value = self.env_vars.get('BACKUP_PARALLEL_CHUNK_MB', '256')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return max(1, int(value or 256))
+
+    @property
+    def BACKUP_CONCURRENT(self):
+        """Respaldar base de datos y moodledata al mismo tiempo"""
+        value = self.env_vars.get('BACKUP_CONCURRENT', 'true')
+        if isinstance(value, str):
+            value = value.strip("'\"").lower()
+        return value == 'true'
+
+    @property
+    def BACKUP_RESTORE_MODE(self):
+        """Modo de restauracion de moodledata: full o differential"""
+        value = self.env_vars.get('BACKUP_RESTORE_MODE', 'full')
+        if isinstance(value, str):
+            value = value.strip("'\"").lower()
+        return value or 'full'
+
+    @property
+    def BACKUP_KEEP_DAILY(self):
+        """Dias distintos a conservar (vacio usa BACKUP_RETENTION_DAYS)"""
+        value = self.env_vars.get('BACKUP_KEEP_DAILY', '')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return int(value) if value else self.BACKUP_RETENTION_DAYS
+
+    @property
+    def BACKUP_KEEP_WEEKLY(self):
+        """Semanas distintas a conservar"""
+        value = self.env_vars.get('BACKUP_KEEP_WEEKLY', '4')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return int(value or 0)
+
+    @property
+    def BACKUP_KEEP_MONTHLY(self):
+        """Meses distintos a conservar"""
+        value = self.env_vars.get('BACKUP_KEEP_MONTHLY', '3')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return int(value or 0)
+
+    @property
+    def BACKUP_COLD_PATH(self):
+        """Directorio del almacenamiento frio (vacio = sin niveles)"""
+        value = self.env_vars.get('BACKUP_COLD_PATH', '')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return value or ''
+
+    @property
+    def BACKUP_COLD_AFTER_DAYS(self):
+        """Dias de antiguedad a partir de los que un respaldo pasa al almacenamiento frio"""
+        value = self.env_vars.get('BACKUP_COLD_AFTER_DAYS', '7')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return int(value or 7)
+
+    @property
+    def BACKUP_COLD_COMPRESSION(self):
+        """Codec de los respaldos en almacenamiento frio"""
+        value = self.env_vars.get('BACKUP_COLD_COMPRESSION', 'zstd')
+        if isinstance(value, str):
+            value = value.strip("'\"").lower()
+        return value or 'zstd'
+
+    @property
+    def BACKUP_COLD_COMPRESSION_LEVEL(self):
+        """Nivel de compresion del almacenamiento frio (None usa el del codec)"""
+        value = self.env_vars.get('BACKUP_COLD_COMPRESSION_LEVEL', '19')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return int(value) if value else None
+
+    @property
+    def BACKUP_NICE(self):
+        """Incremento de nice de los procesos del respaldo (0 = sin cambio)"""
+        value = self.env_vars.get('BACKUP_NICE', '10')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return min(19, max(0, int(value or 0)))
+
+    @property
+    def BACKUP_IONICE_CLASS(self):
+        """Clase de ionice: idle, best-effort, realtime o vacio"""
+        value = self.env_vars.get('BACKUP_IONICE_CLASS', 'idle')
+        if isinstance(value, str):
+            value = value.strip("'\"").lower()
+        return value or ''
+
+    @property
+    def BACKUP_RATE_LIMIT_MB(self):
+        """MB/s maximos escritos por el respaldo (0 = sin limite)"""
+        value = self.env_vars.get('BACKUP_RATE_LIMIT_MB', '0')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return max(0.0, float(value or 0))
+
+    @property
+    def BACKUP_REMOTE_ENABLED(self):
+        """Replicar cada respaldo al almacenamiento S3 configurado"""
+        value = self.env_vars.get('BACKUP_REMOTE_ENABLED', 'false')
+        if isinstance(value, str):
+            value = value.strip("'\"").lower()
+        return value == 'true'
+
+    @property
+    def BACKUP_REMOTE_ENDPOINT(self):
+        """URL del servicio S3 (ej. https://s3.amazonaws.com o http://minio:9000)"""
+        value = self.env_vars.get('BACKUP_REMOTE_ENDPOINT', '')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return value
+
+    @property
+    def BACKUP_REMOTE_BUCKET(self):
+        """Bucket de destino"""
+        value = self.env_vars.get('BACKUP_REMOTE_BUCKET', '')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return value
+
+    @property
+    def BACKUP_REMOTE_ACCESS_KEY(self):
+        """Access key del almacenamiento remoto"""
+        value = self.env_vars.get('BACKUP_REMOTE_ACCESS_KEY', '')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return value
+
+    @property
+    def BACKUP_REMOTE_SECRET_KEY(self):
+        """Secret key del almacenamiento remoto"""
+        value = self.env_vars.get('BACKUP_REMOTE_SECRET_KEY', '')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return value
+
+    @property
+    def BACKUP_REMOTE_REGION(self):
+        """Region usada en la firma (MinIO acepta us-east-1)"""
+        value = self.env_vars.get('BACKUP_REMOTE_REGION', 'us-east-1')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return value or 'us-east-1'
+
+    @property
+    def BACKUP_REMOTE_PREFIX(self):
+        """Prefijo de las claves dentro del bucket"""
+        value = self.env_vars.get('BACKUP_REMOTE_PREFIX', 'moodle-backups')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return value.strip('/')
+
+    @property
+    def BACKUP_REMOTE_WORKERS(self):
+        """Partes/archivos que se suben en paralelo"""
+        value = self.env_vars.get('BACKUP_REMOTE_WORKERS', '4')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return max(1, int(value or 4))
+
+    @property
+    def BACKUP_REMOTE_PART_MB(self):
+        """Tamaño de cada parte del multipart (minimo 5 MB)"""
+        value = self.env_vars.get('BACKUP_REMOTE_PART_MB', '64')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return max(5, int(value or 64))
+
+    @property
+    def BACKUP_REMOTE_RATE_LIMIT_MB(self):
+        """MB/s maximos de subida (0 = sin limite)"""
+        value = self.env_vars.get('BACKUP_REMOTE_RATE_LIMIT_MB', '0')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return max(0.0, float(value or 0))
+
+    @property
+    def BACKUP_BINLOG_ENABLED(self):
+        """Binlogs en MySQL y archivado continuo para recuperacion a un instante"""
+        value = self.env_vars.get('BACKUP_BINLOG_ENABLED', 'false')
+        if isinstance(value, str):
+            value = value.strip("'\"").lower()
+        return value == 'true'
+
+    @property
+    def BACKUP_BINLOG_INTERVAL(self):
+        """Minutos entre cada archivado de binlogs (perdida maxima de datos)"""
+        value = self.env_vars.get('BACKUP_BINLOG_INTERVAL', '5')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return min(59, max(1, int(value or 5)))
+
+    @property
+    def BACKUP_BINLOG_EXPIRE_DAYS(self):
+        """Dias que MySQL conserva sus binlogs antes de purgarlos"""
+        value = self.env_vars.get('BACKUP_BINLOG_EXPIRE_DAYS', '7')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return max(1, int(value or 7))
+
+    @property
+    def BACKUP_BINLOG_MAX_SIZE_MB(self):
+        """Tamaño maximo de cada binlog antes de rotar (MB)"""
+        value = self.env_vars.get('BACKUP_BINLOG_MAX_SIZE_MB', '100')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return max(4, int(value or 100))
+
+    @property
+    def BACKUP_SCHEDULER(self):
+        """Programador de los respaldos automaticos: cron o daemon (backup/daemon.py)"""
+        value = self.env_vars.get('BACKUP_SCHEDULER', 'cron')
+        if isinstance(value, str):
+            value = value.strip("'\"").lower()
+        return 'daemon' if value == 'daemon' else 'cron'
+
+    @property
+    def BACKUP_SCHEDULER_MAX_JOBS(self):
+        """Respaldos programados que pueden correr al mismo tiempo (todos los ambientes)"""
+        value = self.env_vars.get('BACKUP_SCHEDULER_MAX_JOBS', '1')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return max(1, int(value or 1))
+
+    @property
+    def BACKUP_SCHEDULER_JITTER(self):
+        """Retraso aleatorio maximo (segundos) sobre el horario de cada respaldo"""
+        value = self.env_vars.get('BACKUP_SCHEDULER_JITTER', '300')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        return max(0, int(value or 0))
+
     @property
     def SMTP_SERVER(self):
         """Servidor SMTP"""
@@ -183,6 +592,17 @@ class Settings:
         """Nombre del remitente en emails"""
         return self.env_vars.get('SMTP_FROM_NAME', 'Moodle Backup System')
 
+    @property
+    def SMTP_MAX_ATTACHMENT_MB(self):
+        """Tamaño máximo de los adjuntos (los mayores se reemplazan por un resumen, 0 = sin límite)"""
+        value = self.env_vars.get('SMTP_MAX_ATTACHMENT_MB', '5')
+        if isinstance(value, str):
+            value = value.strip("'\"")
+        try:
+            return max(float(value or 0), 0.0)
+        except ValueError:
+            return 5.0
+
     @property
     def SSL_CERT_TYPE(self):
         """Tipo de certificado SSL"""
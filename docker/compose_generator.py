@@ -77,7 +77,7 @@ class ComposeGenerator:
         """Construye configuracion de MySQL para un ambiente"""
         env_prefix = 'TEST' if env == 'testing' else 'PROD'
         
-        return {
+        service = {
             'image': 'mysql:8.0',
             'container_name': f'mysql_{env}',
             'environment': [
@@ -101,6 +101,19 @@ class ComposeGenerator:
                 'retries': 5
             }
         }
+
+        if self.settings.BACKUP_BINLOG_ENABLED:
+            # Binlogs para recuperacion a un instante (los archiva backup/binlog.py)
+            service['command'] = [
+                '--server-id=1',
+                '--log-bin=mysql-bin',
+                '--binlog-format=ROW',
+                '--sync-binlog=1',
+                f'--binlog-expire-logs-seconds={self.settings.BACKUP_BINLOG_EXPIRE_DAYS * 86400}',
+                f'--max-binlog-size={self.settings.BACKUP_BINLOG_MAX_SIZE_MB * 1024 * 1024}'
+            ]
+
+        return service
     
     def _build_moodle_service(self, env):
         """Construye configuracion de Moodle para un ambiente"""
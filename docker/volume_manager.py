@@ -3,13 +3,21 @@ Volume Manager Module
 Gestiona los volumenes Docker
 """
 
+import os
 import subprocess
 
+from backup.compression import resolve_codec
+from backup.engine import StreamPipeline
+from backup.sharded import open_shard
+from backup.volume import VolumeStream
+from config.settings import Settings
+
 
 class VolumeManager:
     """Gestiona volumenes Docker"""
     
-    def __init__(self):
+    def __init__(self, settings=None):
+        self.settings = settings or Settings()
         self.volumes = [
             'mysql_data_testing',
             'mysql_data_production',
@@ -75,29 +83,30 @@ class VolumeManager:
             return False
     
     def backup_volume(self, volume_name, backup_path):
-        """Crea un backup de un volumen"""
+        """
+        Crea un backup de un volumen (el tar se lee por la API de Docker y se
+        comprime aqui con BACKUP_COMPRESSION)
+        """
+        codec = resolve_codec(self.settings.BACKUP_COMPRESSION)
+        output_file = os.path.join(backup_path, f"{volume_name}.tar{codec.extension}")
         try:
-            cmd = f"""docker run --rm \\
-                -v {volume_name}:/source \\
-                -v {backup_path}:/backup \\
-                alpine tar czf /backup/{volume_name}.tar.gz -C /source .
-            """
-            subprocess.run(cmd, shell=True, check=True)
-            print(f"Backup creado: {backup_path}/{volume_name}.tar.gz")
+            # StreamPipeline escribe en <archivo>.part y lo borra si falla
+            StreamPipeline(
+                VolumeStream(volume_name).export_process, codec, output_file,
+                level=self.settings.BACKUP_COMPRESSION_LEVEL,
+                threads=self.settings.BACKUP_COMPRESSION_THREADS
+            ).run()
+            print(f"Backup creado: {output_file}")
             return True
         except Exception as e:
             print(f"Error creando backup de {volume_name}: {str(e)}")
             return False
     
     def restore_volume(self, volume_name, backup_file):
-        """Restaura un volumen desde un backup"""
+        """Restaura un volumen desde un backup (el codec se detecta del archivo)"""
         try:
-            cmd = f"""docker run --rm \\
-                -v {volume_name}:/target \\
-                -v {backup_file}:/backup.tar.gz \\
-                alpine sh -c "cd /target && tar xzf /backup.tar.gz"
-            """
-            subprocess.run(cmd, shell=True, check=True)
+            with open_shard(backup_file, self.settings.BACKUP_COMPRESSION_THREADS) as source:
+                VolumeStream(volume_name).import_tar(source)
             print(f"Volumen restaurado: {volume_name}")
             return True
         except Exception as e:
@@ -27,7 +27,9 @@ from utils.validator import Validator
 from utils.rollback import RollbackManager
 from utils.docker_compose_wrapper import DockerComposeWrapper
 from backup.backup_manager import BackupManager
+from backup.engine import format_bytes
 from backup.scheduler import BackupScheduler
+from backup.progress import ProgressWatcher, active_operations, format_duration, progress_file
 import time
 
 class MoodleDockerInstaller:
@@ -498,6 +500,7 @@ PROXIMOS PASOS:
   5. Ver estado de servicios
   6. Reiniciar Testing
   7. Reiniciar Produccion
+  8. Clonar Produccion en Testing (base de datos y moodledata)
   
   0. Volver al menu principal
 
@@ -522,6 +525,8 @@ PROXIMOS PASOS:
                 self._manage_environment_action('testing', 'restart')
             elif choice == '7':
                 self._manage_environment_action('production', 'restart')
+            elif choice == '8':
+                self._clone_environment('production', 'testing')
             else:
                 print("Opcion invalida")
     
@@ -563,6 +568,36 @@ PROXIMOS PASOS:
         except Exception as e:
             self.logger.error(f"Error: {str(e)}")
 
+    def _clone_environment(self, source, target):
+        """Copia la base de datos y moodledata de un ambiente a otro sin backup intermedio"""
+        self.settings.load_env_file()
+        backup_mgr = BackupManager(self.settings)
+
+        print(f"\n=== Clonar {source.upper()} en {target.upper()} ===")
+        print(f"La base de datos y moodledata de {source} se copian directamente a {target},")
+        print(f"sin escribir un backup en disco. Despues se ajustan las URLs para {target}.")
+        print("\n*** ADVERTENCIA ***")
+        print(f"Esta operacion ELIMINARA todos los datos actuales de {target}.")
+
+        confirm = input("\nEstas seguro? Escribe 'SI' para confirmar: ").strip()
+        if confirm != 'SI':
+            print("Clonado cancelado")
+            input("\nPresiona Enter para continuar...")
+            return
+
+        self.logger.info(f"Clonando {source} en {target}...")
+        watcher = ProgressWatcher(progress_file(backup_mgr.backup_path, 'clone', target)).start()
+        try:
+            ok = backup_mgr.clone_environment(source, target)
+        finally:
+            watcher.stop()
+        if ok:
+            self.logger.success(f"{target} clonado exitosamente desde {source}")
+        else:
+            self.logger.error(f"Error al clonar {source} en {target}")
+
+        input("\nPresiona Enter para continuar...")
+
     def _check_and_setup_ssl(self, environment):
         """
         DEPRECATED: SSL ahora se configura con Certbot en Apache (HOST)
@@ -670,6 +705,15 @@ PROXIMOS PASOS:
 
   10. Configurar notificaciones por email
   11. Ver informacion detallada de un backup
+  12. Reconstruir catalogo de backups
+  13. Verificar integridad de backups
+  14. Aplicar politica de retencion
+  15. Subir backup a almacenamiento remoto (S3)
+  16. Crear backup de ambos ambientes (un correo de resumen)
+  17. Ver progreso de operaciones en curso
+  18. Restaurar o exportar tablas de un backup
+  19. Mover backups antiguos al almacenamiento frio
+  20. Buscar o recuperar archivos de moodledata de un backup
 
   0. Volver al menu principal
 
@@ -702,6 +746,24 @@ PROXIMOS PASOS:
                 self._configure_email_notifications()
             elif choice == '11':
                 self._show_backup_info(backup_mgr)
+            elif choice == '12':
+                self._rebuild_backup_catalog(backup_mgr)
+            elif choice == '13':
+                self._verify_backups(backup_mgr)
+            elif choice == '14':
+                self._apply_retention(backup_mgr)
+            elif choice == '15':
+                self._upload_backup(backup_mgr)
+            elif choice == '16':
+                self._create_all_backups(backup_mgr)
+            elif choice == '17':
+                self._show_progress(backup_mgr)
+            elif choice == '18':
+                self._restore_tables(backup_mgr)
+            elif choice == '19':
+                self._tier_backups(backup_mgr)
+            elif choice == '20':
+                self._restore_moodledata_files(backup_mgr)
             else:
                 print("Opcion invalida")
 
@@ -716,13 +778,178 @@ PROXIMOS PASOS:
             return
 
         self.logger.info(f"Creando backup de {environment}...")
-        if backup_mgr.create_backup(environment):
+        watcher = ProgressWatcher(progress_file(backup_mgr.backup_path, 'backup', environment)).start()
+        try:
+            ok = backup_mgr.create_backup(environment)
+        finally:
+            watcher.stop()
+        if ok:
             self.logger.success(f"Backup de {environment} creado exitosamente")
         else:
             self.logger.error(f"Error al crear backup de {environment}")
 
         input("\nPresiona Enter para continuar...")
 
+    def _create_all_backups(self, backup_mgr):
+        """Crea los backups de testing y production con un solo correo de resumen"""
+        print("\n=== Crear Backup de Ambos Ambientes ===")
+        print("Las notificaciones de ambos respaldos se envían juntas en un correo de resumen.")
+
+        confirm = input("\nCrear backup de testing y production? (s/N): ").strip().lower()
+        if confirm != 's':
+            print("Backup cancelado")
+            return
+
+        results = backup_mgr.create_backups(['testing', 'production'])
+        for environment, ok in results.items():
+            if ok:
+                self.logger.success(f"Backup de {environment} creado exitosamente")
+            else:
+                self.logger.error(f"Error al crear backup de {environment}")
+
+        input("\nPresiona Enter para continuar...")
+
+    def _show_progress(self, backup_mgr):
+        """Muestra el progreso de los backups/restauraciones en curso (cron, daemon u otra sesion)"""
+        print("\n=== Operaciones en Curso ===\n")
+        operations = active_operations(backup_mgr.backup_path)
+        if not operations:
+            print("No hay backups ni restauraciones en curso")
+            input("\nPresiona Enter para continuar...")
+            return
+
+        for i, (path, view) in enumerate(operations, 1):
+            elapsed = format_duration(time.time() - view.started) if view.started else '?'
+            print(f"  {i}. {view.operation} de {view.environment} (hace {elapsed}): {view.render()}")
+
+        choice = input("\nSeguir cual? (numero, Enter = volver): ").strip()
+        if choice.isdigit() and 1 <= int(choice) <= len(operations):
+            print("Ctrl+C para dejar de seguir (la operacion continua)\n")
+            ProgressWatcher(operations[int(choice) - 1][0], only_new=False).wait()
+
+        input("\nPresiona Enter para continuar...")
+
+    def _restore_tables(self, backup_mgr):
+        """Restaura o exporta tablas sueltas de un backup sin restaurar el dump completo"""
+        print("\n=== Restaurar o Exportar Tablas ===")
+        env_choice = input("\nAmbiente (1=Testing, 2=Produccion): ").strip()
+        environment = 'production' if env_choice == '2' else 'testing'
+
+        print("\nIngresa el timestamp del backup (Ejemplo: 2024-01-15_10-30-00)")
+        timestamp = input("\nTimestamp: ").strip()
+        if not timestamp:
+            print("Timestamp invalido")
+            input("\nPresiona Enter para continuar...")
+            return
+
+        tables = backup_mgr.list_backup_tables(environment, timestamp)
+        if not tables:
+            input("\nPresiona Enter para continuar...")
+            return
+
+        pattern = input("\nFiltrar tablas por nombre (ej. quiz, Enter = todas): ").strip().lower()
+        shown = [t for t in tables if pattern in t['name'].lower()]
+        print(f"\n{'Tabla':<45} {'Filas':>12} {'Tamaño SQL':>12}")
+        for table in shown:
+            print(f"{table['name']:<45} {table['rows']:>12} {format_bytes(table['bytes']):>12}")
+        print(f"\n{len(shown)} de {len(tables)} tablas")
+
+        selected = [t.strip() for t in input("\nTablas a recuperar (separadas por coma): ").split(',') if t.strip()]
+        if not selected:
+            print("Operacion cancelada")
+            input("\nPresiona Enter para continuar...")
+            return
+
+        print("\nDestino:")
+        print("  1. Exportar a un archivo .sql")
+        print("  2. Cargar en otra base de datos (para copiar solo las filas necesarias)")
+        print("  3. Reemplazar las tablas en la base de datos del ambiente")
+        action = input("\nSelecciona una opcion [1]: ").strip() or '1'
+
+        if action == '2':
+            database = input("\nBase de datos destino [moodle_recuperacion]: ").strip() or 'moodle_recuperacion'
+            ok = backup_mgr.restore_tables(environment, timestamp, selected, database)
+        elif action == '3':
+            print("\n*** ADVERTENCIA ***")
+            print(f"Las tablas {', '.join(selected)} de {environment} se reemplazaran por las del backup.")
+            if input("\nEstas seguro? Escribe 'SI' para confirmar: ").strip() != 'SI':
+                print("Restauracion cancelada")
+                input("\nPresiona Enter para continuar...")
+                return
+            ok = backup_mgr.restore_tables(environment, timestamp, selected)
+        else:
+            default = os.path.join(backup_mgr.backup_path, 'exports', f"{environment}_{timestamp}_tablas.sql")
+            output = input(f"\nArchivo [{default}]: ").strip() or default
+            ok = backup_mgr.export_tables(environment, timestamp, selected, output)
+
+        if ok:
+            self.logger.success("Tablas recuperadas exitosamente")
+        else:
+            self.logger.error("Error al recuperar las tablas")
+        input("\nPresiona Enter para continuar...")
+
+    def _restore_moodledata_files(self, backup_mgr):
+        """Busca y recupera archivos sueltos del moodledata de un backup"""
+        print("\n=== Recuperar Archivos de Moodledata ===")
+        env_choice = input("\nAmbiente (1=Testing, 2=Produccion): ").strip()
+        environment = 'production' if env_choice == '2' else 'testing'
+
+        print("\nIngresa el timestamp del backup (Ejemplo: 2024-01-15_10-30-00)")
+        timestamp = input("\nTimestamp: ").strip()
+        if not timestamp:
+            print("Timestamp invalido")
+            input("\nPresiona Enter para continuar...")
+            return
+
+        term = input("\nContenthash (o su inicio) o parte de la ruta a buscar: ").strip()
+        if not term:
+            print("Operacion cancelada")
+            input("\nPresiona Enter para continuar...")
+            return
+        found = backup_mgr.search_moodledata_files(environment, timestamp, term)
+        if not found:
+            if found is not None:
+                print("No se encontraron archivos")
+            input("\nPresiona Enter para continuar...")
+            return
+
+        print(f"\n{'Tipo':<8} {'Tamaño':>10}  Ruta")
+        for item in found[:50]:
+            print(f"{item['type']:<8} {format_bytes(item['size']):>10}  {item['path']}")
+        if len(found) > 50:
+            print(f"... y {len(found) - 50} mas")
+
+        selected = [p.strip() for p in input("\nRutas o contenthash a recuperar (separados por coma): ").split(',')
+                    if p.strip()]
+        if not selected:
+            print("Operacion cancelada")
+            input("\nPresiona Enter para continuar...")
+            return
+
+        print("\nDestino:")
+        print("  1. Extraer en un directorio")
+        print("  2. Restaurar en el volumen moodledata del ambiente")
+        action = input("\nSelecciona una opcion [1]: ").strip() or '1'
+
+        if action == '2':
+            print("\n*** ADVERTENCIA ***")
+            print(f"Los archivos seleccionados se reemplazaran en moodledata_{environment}.")
+            if input("\nEstas seguro? Escribe 'SI' para confirmar: ").strip() != 'SI':
+                print("Restauracion cancelada")
+                input("\nPresiona Enter para continuar...")
+                return
+            ok = backup_mgr.extract_moodledata_files(environment, timestamp, selected)
+        else:
+            default = os.path.join(backup_mgr.backup_path, 'exports', f"{environment}_{timestamp}_moodledata")
+            target = input(f"\nDirectorio [{default}]: ").strip() or default
+            ok = backup_mgr.extract_moodledata_files(environment, timestamp, selected, target)
+
+        if ok:
+            self.logger.success("Archivos recuperados exitosamente")
+        else:
+            self.logger.error("Error al recuperar los archivos")
+        input("\nPresiona Enter para continuar...")
+
     def _list_backups(self, backup_mgr):
         """Lista todos los backups disponibles"""
         print("\n=== Backups Disponibles ===\n")
@@ -736,20 +963,37 @@ PROXIMOS PASOS:
         # Listar backups disponibles
         backups = backup_mgr.list_backups(environment)
 
-        if not backups:
+        # Con copia remota se puede restaurar un backup que ya no esta en disco
+        if not backups and not backup_mgr.settings.BACKUP_REMOTE_ENABLED:
             print(f"\nNo hay backups disponibles para {environment}")
             input("\nPresiona Enter para continuar...")
             return
 
+        # Recuperacion a un instante con los binlogs archivados
+        target_time = None
+        if backup_mgr.settings.BACKUP_BINLOG_ENABLED:
+            print("\nInstante a recuperar de la base de datos (binlogs)")
+            print("(Ejemplo: 2024-01-15 14:05:00, Enter = solo el backup)")
+            target_time = input("\nInstante: ").strip() or None
+
         print("\nIngresa el timestamp del backup a restaurar")
         print("(Ejemplo: 2024-01-15_10-30-00)")
+        if target_time:
+            print("(Enter = el backup anterior mas cercano al instante)")
         timestamp = input("\nTimestamp: ").strip()
 
-        if not timestamp:
+        if not timestamp and not target_time:
             print("Timestamp invalido")
             input("\nPresiona Enter para continuar...")
             return
 
+        print("\nModo de restauracion de moodledata:")
+        print("  1. Completo (borra el volumen y extrae todo el backup)")
+        print("  2. Diferencial (solo escribe los archivos que cambiaron)")
+        default_mode = '2' if backup_mgr.settings.BACKUP_RESTORE_MODE == 'differential' else '1'
+        mode_choice = input(f"\nSelecciona una opcion [{default_mode}]: ").strip() or default_mode
+        restore_mode = 'differential' if mode_choice == '2' else 'full'
+
         print("\n*** ADVERTENCIA ***")
         print("Esta operacion ELIMINARA todos los datos actuales")
         print("y los reemplazara con los del backup especificado.")
@@ -761,8 +1005,13 @@ PROXIMOS PASOS:
             input("\nPresiona Enter para continuar...")
             return
 
-        self.logger.info(f"Restaurando backup de {environment}: {timestamp}")
-        if backup_mgr.restore_backup(environment, timestamp):
+        self.logger.info(f"Restaurando backup de {environment}: {timestamp or target_time}")
+        watcher = ProgressWatcher(progress_file(backup_mgr.backup_path, 'restore', environment)).start()
+        try:
+            ok = backup_mgr.restore_backup(environment, timestamp or None, restore_mode, target_time)
+        finally:
+            watcher.stop()
+        if ok:
             self.logger.success(f"Backup restaurado exitosamente")
         else:
             self.logger.error(f"Error al restaurar backup")
@@ -773,9 +1022,9 @@ PROXIMOS PASOS:
         """Configura backup automatico"""
         print(f"\n=== Configurar Backup Automatico para {environment.upper()} ===")
 
-        # Verificar que crontab esté disponible
+        # Verificar que crontab esté disponible (el servicio de respaldos no lo usa)
         import shutil
-        if not shutil.which('crontab'):
+        if self.settings.BACKUP_SCHEDULER == 'cron' and not shutil.which('crontab'):
             self.logger.error("El comando 'crontab' no está disponible en el sistema")
             self.logger.info("Instala cron/cronie según tu distribución:")
             self.logger.info("  - Ubuntu/Debian: sudo apt install cron")
@@ -830,6 +1079,10 @@ PROXIMOS PASOS:
         if scheduler.setup_cron(environment, schedule):
             self.logger.success(f"Backup automatico configurado para {environment}")
             print(f"\nHorario: {description} ({schedule})")
+            if self.settings.BACKUP_BINLOG_ENABLED:
+                scheduler.setup_binlog_cron(environment, self.settings.BACKUP_BINLOG_INTERVAL)
+            if self.settings.BACKUP_COLD_PATH:
+                scheduler.setup_tiering_cron(environment)
         else:
             self.logger.error("Error al configurar backup automatico")
 
@@ -961,6 +1214,17 @@ PROXIMOS PASOS:
         print(f"Timestamp: {info['timestamp']}")
         print(f"Ruta: {info['path']}")
         print(f"Tamaño total: {info['size']}")
+        print(f"Estado: {info['status']}")
+        print(f"Compresion: {info['codec']}")
+        if info['duration'] is not None:
+            print(f"Duracion: {info['duration']:.1f}s")
+        if info['throughput']:
+            print(f"Velocidad de escritura: {info['throughput']}")
+        print(f"Verificacion: {info['verify_status']}")
+        if info['adaptive']:
+            adaptive = info['adaptive']
+            print(f"Moodledata sin comprimir: {adaptive['stored_files']} archivos "
+                  f"({format_bytes(adaptive['stored_bytes'])}), CPU evitado ~{adaptive['cpu_seconds_avoided']}s")
         print(f"\nArchivos del backup:")
         print(f"{'-'*60}")
         for file_info in info['files']:
@@ -969,6 +1233,157 @@ PROXIMOS PASOS:
 
         input("\nPresiona Enter para continuar...")
 
+    def _rebuild_backup_catalog(self, backup_mgr):
+        """Reconstruye el catalogo de backups"""
+        print("\n=== Reconstruir Catalogo de Backups ===")
+        print("Recorre todos los directorios de backups y regenera el indice.")
+
+        confirm = input("\nReconstruir catalogo? (s/N): ").strip().lower()
+        if confirm != 's':
+            print("Cancelado")
+            input("\nPresiona Enter para continuar...")
+            return
+
+        try:
+            backup_mgr.rebuild_catalog()
+            self.logger.success("Catalogo de backups reconstruido")
+        except Exception as e:
+            self.logger.error(f"Error al reconstruir catalogo: {str(e)}")
+
+        input("\nPresiona Enter para continuar...")
+
+    def _verify_backups(self, backup_mgr):
+        """Verifica la integridad de los backups"""
+        print("\n=== Verificar Integridad de Backups ===")
+
+        print("\n1. Testing")
+        print("2. Produccion")
+        print("3. Ambos")
+        env_choice = input("\nSelecciona el ambiente [3]: ").strip() or '3'
+
+        environments = {'1': 'testing', '2': 'production', '3': None}
+        if env_choice not in environments:
+            print("Opcion invalida")
+            input("\nPresiona Enter para continuar...")
+            return
+
+        results = backup_mgr.verify_backups(environments[env_choice])
+        failed = [name for name, ok in results.items() if not ok]
+        if failed:
+            self.logger.error(f"Backups con errores de integridad: {len(failed)}")
+        elif results:
+            self.logger.success("Todos los backups verificados correctamente")
+
+        input("\nPresiona Enter para continuar...")
+
+    def _apply_retention(self, backup_mgr):
+        """Muestra y aplica la politica de retencion"""
+        print("\n=== Politica de Retencion ===")
+
+        print("\n1. Testing")
+        print("2. Produccion")
+        env_choice = input("\nSelecciona el ambiente: ").strip()
+
+        if env_choice == '1':
+            env = 'testing'
+        elif env_choice == '2':
+            env = 'production'
+        else:
+            print("Opcion invalida")
+            input("\nPresiona Enter para continuar...")
+            return
+
+        # Vista previa sin eliminar nada
+        to_delete = backup_mgr.clean_old_backups(env, dry_run=True)
+        if not to_delete:
+            input("\nPresiona Enter para continuar...")
+            return
+
+        confirm = input(f"\nEliminar {len(to_delete)} backups? (s/N): ").strip().lower()
+        if confirm != 's':
+            print("Cancelado")
+            input("\nPresiona Enter para continuar...")
+            return
+
+        try:
+            backup_mgr.clean_old_backups(env)
+            self.logger.success("Politica de retencion aplicada")
+        except Exception as e:
+            self.logger.error(f"Error al aplicar la retencion: {str(e)}")
+
+        input("\nPresiona Enter para continuar...")
+
+    def _tier_backups(self, backup_mgr):
+        """Mueve los backups antiguos al almacenamiento frio"""
+        print("\n=== Almacenamiento Frio ===")
+
+        if not self.settings.BACKUP_COLD_PATH:
+            print("BACKUP_COLD_PATH no esta configurado")
+            input("\nPresiona Enter para continuar...")
+            return
+
+        print("\n1. Testing")
+        print("2. Produccion")
+        env_choice = input("\nSelecciona el ambiente: ").strip()
+
+        if env_choice == '1':
+            env = 'testing'
+        elif env_choice == '2':
+            env = 'production'
+        else:
+            print("Opcion invalida")
+            input("\nPresiona Enter para continuar...")
+            return
+
+        # Vista previa sin mover nada
+        candidates = backup_mgr.tier_backups(env, dry_run=True)
+        if not candidates:
+            input("\nPresiona Enter para continuar...")
+            return
+
+        confirm = input(f"\nMover {len(candidates)} backups al almacenamiento frio? (s/N): ").strip().lower()
+        if confirm != 's':
+            print("Cancelado")
+            input("\nPresiona Enter para continuar...")
+            return
+
+        if backup_mgr.tier_backups(env) is not None:
+            self.logger.success("Backups movidos al almacenamiento frio")
+        else:
+            self.logger.error("Error al mover los backups al almacenamiento frio")
+
+        input("\nPresiona Enter para continuar...")
+
+    def _upload_backup(self, backup_mgr):
+        """Sube (o reanuda la subida de) un backup al almacenamiento remoto"""
+        print("\n=== Subir Backup a Almacenamiento Remoto ===")
+
+        print("\n1. Testing")
+        print("2. Produccion")
+        env_choice = input("\nSelecciona el ambiente: ").strip()
+
+        if env_choice == '1':
+            env = 'testing'
+        elif env_choice == '2':
+            env = 'production'
+        else:
+            print("Opcion invalida")
+            input("\nPresiona Enter para continuar...")
+            return
+
+        timestamp = input("\nIngresa el timestamp del backup: ").strip()
+        if not timestamp:
+            print("Timestamp invalido")
+            input("\nPresiona Enter para continuar...")
+            return
+
+        if backup_mgr.upload_backup(env, timestamp):
+            self.logger.success("Backup replicado en el almacenamiento remoto")
+        else:
+            self.logger.error("Error al subir el backup (puede reintentarse: la subida se reanuda)")
+
+        input("\nPresiona Enter para continuar...")
+
     def _setup_automatic_backups(self):
         """Configura backups automaticos durante la instalacion"""
         print("\n" + "="*60)
@@ -1005,6 +1420,15 @@ PROXIMOS PASOS:
             else:
                 self.logger.warning("No se pudo configurar backup automatico para Produccion")
 
+            # Binlogs de produccion para recuperar a un instante entre respaldos
+            if self.settings.BACKUP_BINLOG_ENABLED:
+                scheduler.setup_binlog_cron('production', self.settings.BACKUP_BINLOG_INTERVAL)
+
+            # Backups antiguos al almacenamiento frio (si esta configurado)
+            if self.settings.BACKUP_COLD_PATH:
+                for environment in ('testing', 'production'):
+                    scheduler.setup_tiering_cron(environment)
+
             print("\nBackups automaticos configurados exitosamente")
             print("Testing: Diario a las 2:00 AM")
             print("Produccion: Diario a las 3:00 AM")
@@ -6,6 +6,7 @@ Pruebas basicas de funcionalidad
 
 import sys
 import os
+import time
 
 # Agregar directorio al path
 sys.path.insert(0, os.path.dirname(__file__))
@@ -14,6 +15,32 @@ from core.os_detector import OSDetector
 from utils.password_generator import PasswordGenerator
 from utils.validator import Validator
 from config.settings import Settings
+from backup.compression import get_codec, detect_codec
+from backup.adaptive import SAMPLE_SIZE, StoredZstd, classify
+from backup.engine import AdaptiveTarPipeline, FramedDumpPipeline, StreamPipeline
+from backup.incremental import BlobStore
+from backup.catalog import BackupCatalog, TIER_UNAVAILABLE
+from backup.differential import DifferentialRestore
+from backup.integrity import read_checksums, verify_file
+from backup.retention import RetentionManager, plan_retention
+from backup.throttle import Throttle
+from backup.remote import RemoteReplicator, S3Client
+from backup.exclusions import parse_excludes, tar_exclude_args
+from backup.volume import TarCounter, TarFilter, VolumeExport, VolumeStream
+from backup.parallel_dump import ParallelDumper, ParallelLoader, unescape_batch_line
+from backup.benchmark import SyntheticDatabase, SyntheticMoodledata, compare_runs, stage_times
+from backup.send_mail import MensajeStreaming, SesionSMTP, armar_resumen, encolar_correo
+from backup.backup_manager import BackupManager
+from backup.daemon import CronExpression, EnvironmentLock, JobQueue, SchedulerDaemon
+from backup.progress import (ProgressReporter, count_rows, copy_metered, expected_from_history,
+                             load_view, progress_file, record_history)
+from backup.clone import EnvironmentClone, MeteredReader
+from backup.seekable import DumpReader, SectionSplitter
+from backup.physical import CloneSource, PhysicalRestore, compatible, METADATA_FILE, PREVIOUS_DIR
+from backup.tiering import TieringManager, TIER_COLD, backup_tier
+from backup.archive_index import ArchiveReader, ArchiveSet, find_archive, open_archive, read_index_header
+from backup.sharded import SHARD_DIR, ShardedArchiver, ShardedRestore, read_manifest, shard_plan, write_tar
+from backup.binlog import BinlogScanner, BINLOG_MAGIC, EVENT_HEADER, dump_position, plan_replay
 
 
 def test_os_detection():
@@ -75,6 +102,1692 @@ def test_settings():
     return True
 
 
+def test_stream_pipeline():
+    """Prueba el pipeline de respaldo en streaming"""
+    print("\n=== Test: Pipeline de Respaldo ===")
+    import gzip
+    import subprocess
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, 'dump.sql.gz')
+        stats = StreamPipeline(['seq', '1', '100000'], get_codec('gzip'), output).run()
+        with gzip.open(output, 'rb') as f:
+            data = f.read()
+        print(f"Bytes entrada: {stats['source']['bytes']}")
+        print(f"Bytes salida: {stats['compress']['bytes']}")
+        assert len(data) == stats['source']['bytes']
+        assert os.path.getsize(output) == stats['compress']['bytes']
+        assert not os.path.exists(output + '.part')
+
+        # Un error al escribir (ej. disco lleno) termina ambos procesos y borra el parcial
+        class FullDisk:
+            def command(self, command):
+                return command
+
+            def consume(self, size):
+                raise OSError(28, 'No space left on device')
+
+        sources = []
+
+        def source_cmd():
+            sources.append(subprocess.Popen(['yes'], stdout=subprocess.PIPE))
+            return sources[0]
+        output = os.path.join(tmp, 'lleno.sql.gz')
+        try:
+            StreamPipeline(source_cmd, get_codec('gzip'), output, throttle=FullDisk()).run()
+            assert False, "El pipeline debio fallar"
+        except OSError as e:
+            print(f"Error de escritura: {e}")
+        assert sources[0].poll() is not None
+        assert not os.path.exists(output + '.part') and not os.path.exists(output)
+
+    print("OK")
+    return True
+
+
+def test_compression_codecs():
+    """Prueba comandos y deteccion de codecs"""
+    print("\n=== Test: Codecs de Compresion ===")
+    import tempfile
+
+    print(f"pigz: {' '.join(get_codec('pigz').compress_command(9, 4))}")
+    print(f"zstd: {' '.join(get_codec('zstd').compress_command(None, 2))}")
+    assert get_codec('pigz').compress_command(9, 4) == ['pigz', '-c', '-9', '-p', '4']
+    assert get_codec('gzip').compress_command(None, 8) == ['gzip', '-c', '-6']
+
+    with tempfile.TemporaryDirectory() as tmp:
+        samples = {
+            'a.gz': b'\x1f\x8b\x08\x00',
+            'a.zst': b'\x28\xb5\x2f\xfd',
+            'a.sql': b'-- MySQL dump',
+        }
+        for name, header in samples.items():
+            path = os.path.join(tmp, name)
+            with open(path, 'wb') as f:
+                f.write(header)
+            codec = detect_codec(path)
+            print(f"{name}: {codec.name if codec else 'sin comprimir'}")
+        assert detect_codec(os.path.join(tmp, 'a.zst')).name == 'zstd'
+        assert detect_codec(os.path.join(tmp, 'a.gz')).extension == '.gz'
+        assert detect_codec(os.path.join(tmp, 'a.sql')) is None
+
+    print("OK")
+    return True
+
+
+def test_incremental_blob_store():
+    """Prueba respaldo incremental y reconstruccion desde manifiesto"""
+    print("\n=== Test: Respaldo Incremental ===")
+    import hashlib
+    import io
+    import tarfile
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'moodledata')
+        content = b'contenido de prueba'
+        sha1 = hashlib.sha1(content).hexdigest()
+        blob_dir = os.path.join(source, 'filedir', sha1[0:2], sha1[2:4])
+        os.makedirs(blob_dir)
+        os.makedirs(os.path.join(source, 'lang'))
+        with open(os.path.join(blob_dir, sha1), 'wb') as f:
+            f.write(content)
+        with open(os.path.join(source, 'lang', 'es.txt'), 'w') as f:
+            f.write('hola')
+
+        store = BlobStore(os.path.join(tmp, 'blobs'))
+        first = store.snapshot(source, os.path.join(tmp, 'm1.manifest.json.gz'))
+        second = store.snapshot(source, os.path.join(tmp, 'm2.manifest.json.gz'))
+        print(f"Primer respaldo: {first['new_blobs']} blobs nuevos")
+        print(f"Segundo respaldo: {second['new_blobs']} blobs nuevos, {second['reused_blobs']} reutilizados")
+        assert first['new_blobs'] == 2 and second['new_blobs'] == 0
+        assert store.has_blob(sha1)
+
+        stream = io.BytesIO()
+        store.write_tar(os.path.join(tmp, 'm2.manifest.json.gz'), stream)
+        stream.seek(0)
+        with tarfile.open(fileobj=stream) as tar:
+            names = tar.getnames()
+            restored = tar.extractfile(f"filedir/{sha1[0:2]}/{sha1[2:4]}/{sha1}").read()
+        print(f"Entradas en el tar: {len(names)}")
+        assert restored == content
+
+    print("OK")
+    return True
+
+
+def test_parallel_dump():
+    """Prueba el escape de --batch y el reparto en fragmentos del volcado paralelo"""
+    print("\n=== Test: Volcado Paralelo ===")
+    import json
+    import tempfile
+
+    # mysql --batch escapa \\, NUL, salto de linea y tabulador
+    def escape(value):
+        return (value.replace(b'\\', b'\\\\').replace(b'\0', b'\\0')
+                .replace(b'\n', b'\\n').replace(b'\t', b'\\t'))
+
+    for value in (b"C:\\ruta\\nueva", b"a\0b", b"linea 1\nlinea 2", b"col\tcol", b"\\n literal\\\n\t\0",
+                  "ñandú \\t".encode('utf-8')):
+        assert unescape_batch_line(escape(value)) == value, value
+    assert unescape_batch_line(b'sin escape') == b'sin escape'
+
+    class FakeSession:
+        def __init__(self, rows=None, fail=None):
+            self.rows = rows
+            self.fail = fail
+            self.closed = False
+
+        def execute(self, sql):
+            if self.fail and self.fail in sql:
+                raise RuntimeError(f"Fallo en {self.fail}")
+            return self.rows
+
+        def close(self):
+            self.closed = True
+
+    dumper = ParallelDumper('mysql_testing', 'moodle', '', '/tmp/no-usado', get_codec('gzip'))
+    ranges = dumper._key_ranges(FakeSession([['1', '100']]), 'mdl_log', 'id', 4)
+    print(f"Rangos: {ranges}")
+    assert ranges == [(None, 26), (26, 51), (51, 76), (76, None)]
+    assert dumper._key_ranges(FakeSession([['NULL', 'NULL']]), 'mdl_log', 'id', 4) == [(None, None)]
+    assert dumper._key_ranges(FakeSession([['5', '5']]), 'mdl_log', 'id', 4) == [(None, None)]
+
+    task = {'table': 'mdl_log', 'key': 'id', 'columns': [('id', 'bigint'), ('data', 'blob')]}
+    assert dumper._select_sql(dict(task, low=None, high=None)) == (
+        "SELECT CONCAT('(', QUOTE(`id`), ',', IF(`data` IS NULL, 'NULL', CONCAT('X''', HEX(`data`), ''''))"
+        ", ')') FROM `mdl_log`")
+    assert dumper._select_sql(dict(task, low=None, high=26)).endswith(" WHERE `id` < 26")
+    assert dumper._select_sql(dict(task, low=26, high=51)).endswith(" WHERE `id` >= 26 AND `id` < 51")
+    assert dumper._select_sql(dict(task, low=76, high=None)).endswith(" WHERE `id` >= 76")
+
+    # Un error con el bloqueo tomado cierra las sesiones de los workers
+    with tempfile.TemporaryDirectory() as tmp:
+        sessions = []
+
+        class FailingDumper(ParallelDumper):
+            def _session(self):
+                sessions.append(FakeSession())
+                return sessions[-1]
+
+            def _mysqldump(self, extra_args, output_file):
+                raise RuntimeError("mysqldump falló")
+
+        try:
+            FailingDumper('mysql_testing', 'moodle', '', tmp, get_codec('gzip'), workers=3).dump()
+            assert False, "El volcado debio fallar"
+        except RuntimeError as e:
+            print(f"Volcado fallido: {e}")
+        assert len(sessions) == 4 and all(session.closed for session in sessions)
+
+    # El primer fragmento que falla cancela los pendientes y no se cargan los objetos finales
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'index.json'), 'w') as f:
+            json.dump({'schema': 'schema.sql.gz', 'post': 'post.sql.gz',
+                       'chunks': [{'file': f"data/{n}.sql.gz", 'compressed_bytes': 10 - n, 'bytes': 1, 'rows': 1}
+                                  for n in range(6)]}, f)
+        loaded = []
+
+        class FailingLoader(ParallelLoader):
+            def _load_file(self, relative_path):
+                loaded.append(relative_path)
+                if relative_path == 'data/0.sql.gz':
+                    raise RuntimeError(f"Error cargando {relative_path}")
+                return 1
+
+        try:
+            FailingLoader('mysql_testing', 'moodle', '', tmp, workers=1).load()
+            assert False, "La carga debio fallar"
+        except RuntimeError as e:
+            print(f"Carga fallida: {e}")
+        assert loaded == ['schema.sql.gz', 'data/0.sql.gz']
+
+    print("OK")
+    return True
+
+
+def test_backup_catalog():
+    """Prueba el registro y listado del catalogo de backups"""
+    print("\n=== Test: Catalogo de Backups ===")
+    import shutil
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for timestamp in ('2024-01-15_10-30-00', '2024-01-16_10-30-00'):
+            backup_dir = os.path.join(tmp, 'testing', timestamp)
+            os.makedirs(backup_dir)
+            with open(os.path.join(backup_dir, f'moodle_{timestamp}.sql.zst'), 'wb') as f:
+                f.write(b'x' * 100)
+
+        catalog = BackupCatalog(tmp)
+        backups = catalog.list_backups('testing')
+        print(f"Backups en catalogo: {len(backups)}")
+        assert [b['timestamp'] for b in backups] == ['2024-01-16_10-30-00', '2024-01-15_10-30-00']
+        assert backups[0]['codec'] == 'zstd' and backups[0]['size_bytes'] == 100
+
+        shutil.rmtree(os.path.join(tmp, 'testing', '2024-01-16_10-30-00'))
+        assert len(catalog.list_backups('testing')) == 1
+        assert catalog.get_backup('testing', '2024-01-15_10-30-00')['files'][0]['size_bytes'] == 100
+
+        # rebuild conserva la verificacion y los enlaces al almacenamiento frio sin montar
+        catalog.set_verification('testing', '2024-01-15_10-30-00', 'OK')
+        cold_dir = os.path.join(tmp, 'frio', '2024-01-10_10-30-00')
+        os.makedirs(cold_dir)
+        with open(os.path.join(cold_dir, 'moodle_2024-01-10_10-30-00.sql.gz'), 'wb') as f:
+            f.write(b'x' * 50)
+        os.symlink(cold_dir, os.path.join(tmp, 'testing', '2024-01-10_10-30-00'))
+        assert catalog.rebuild() == 2
+        assert catalog.get_backup('testing', '2024-01-10_10-30-00')['tier'] == 'cold'
+        shutil.rmtree(cold_dir)
+        assert catalog.rebuild() == 2
+        cold = catalog.get_backup('testing', '2024-01-10_10-30-00')
+        assert cold['tier'] == TIER_UNAVAILABLE and cold['size_bytes'] == 50
+        assert catalog.get_backup('testing', '2024-01-15_10-30-00')['verify_status'] == 'OK'
+        os.remove(os.path.join(tmp, 'testing', '2024-01-10_10-30-00'))
+        assert catalog.rebuild() == 1 and catalog.get_backup('testing', '2024-01-10_10-30-00') is None
+
+    print("OK")
+    return True
+
+
+def test_differential_restore():
+    """Prueba la restauracion diferencial desde un tar"""
+    print("\n=== Test: Restauracion Diferencial ===")
+    import io
+    import tarfile
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'source')
+        target = os.path.join(tmp, 'target')
+        for directory in (source, target):
+            os.makedirs(os.path.join(directory, 'lang'))
+            with open(os.path.join(directory, 'lang', 'es.txt'), 'w') as f:
+                f.write('hola')
+        with open(os.path.join(source, 'lang', 'en.txt'), 'w') as f:
+            f.write('hello')
+        with open(os.path.join(target, 'sobrante.txt'), 'w') as f:
+            f.write('x')
+        os.utime(os.path.join(target, 'lang', 'es.txt'), (0, 0))
+
+        stream = io.BytesIO()
+        with tarfile.open(fileobj=stream, mode='w') as tar:
+            tar.add(source, arcname='.')
+        stream.seek(0)
+
+        stats = DifferentialRestore(target, workers=2).restore_archive(stream)
+        print(f"Escritos: {stats['written']}, sin cambios: {stats['unchanged']}, eliminados: {stats['removed']}")
+        # es.txt solo difiere en mtime: se compara el contenido y no se reescribe
+        assert stats['written'] == 1 and stats['unchanged'] == 1 and stats['removed'] == 1
+        assert sorted(os.listdir(os.path.join(target, 'lang'))) == ['en.txt', 'es.txt']
+        assert not os.path.exists(os.path.join(target, 'sobrante.txt'))
+
+    print("OK")
+    return True
+
+
+def test_integrity_checksums():
+    """Prueba el SHA-256 calculado al escribir y la verificacion del stream"""
+    print("\n=== Test: Integridad de Backups ===")
+    import hashlib
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output_file = os.path.join(tmp, 'datos.gz')
+        pipeline = StreamPipeline(['printf', 'contenido de prueba\\n' * 200], get_codec('gzip'), output_file)
+        pipeline.run()
+        with open(output_file, 'rb') as f:
+            data = bytearray(f.read())
+        assert pipeline.sha256 == hashlib.sha256(data).hexdigest()
+
+        result = verify_file(output_file, pipeline.sha256)
+        print(f"Archivo intacto: hash={result['hash_ok']}, stream={result['stream_ok']}")
+        assert result['hash_ok'] and result['stream_ok']
+
+        # Dañar el CRC final del gzip
+        data[-5] ^= 0xff
+        with open(output_file, 'wb') as f:
+            f.write(data)
+        result = verify_file(output_file, pipeline.sha256)
+        print(f"Archivo dañado: hash={result['hash_ok']}, stream={result['stream_ok']}")
+        assert result['hash_ok'] is False and result['stream_ok'] is False
+
+    print("OK")
+    return True
+
+
+def test_retention_plan():
+    """Prueba el plan de retencion diario/semanal/mensual"""
+    print("\n=== Test: Politica de Retencion ===")
+    from datetime import datetime, timedelta
+
+    newest = datetime(2024, 6, 30, 2, 0, 0)
+    backups = [
+        {'timestamp': (newest - timedelta(days=i)).strftime("%Y-%m-%d_%H-%M-%S"),
+         'status': 'SUCCESS', 'size_bytes': 1}
+        for i in range(90)
+    ]
+    keep, delete = plan_retention(backups, daily=3, weekly=2, monthly=3)
+    kept = [backup['timestamp'][:10] for backup, _ in keep]
+    print(f"Conservados: {kept}")
+    assert kept == ['2024-06-30', '2024-06-29', '2024-06-28', '2024-06-23', '2024-05-31', '2024-04-30']
+    assert len(delete) == 84
+
+    print("OK")
+    return True
+
+
+def test_throttle():
+    """Prueba el limite de ancho de banda y las opciones de prioridad"""
+    print("\n=== Test: Limites de Respaldo ===")
+    throttle = Throttle(nice=10, io_class='idle', rate_limit_mb=1)
+    assert throttle.command(['gzip', '-c'])[-2:] == ['gzip', '-c']
+    assert Throttle().command(['gzip', '-c']) == ['gzip', '-c']
+
+    # 3 MB a 1 MB/s (con rafaga inicial de 1 MB) debe tardar unos 2 segundos
+    started = time.monotonic()
+    for _ in range(12):
+        throttle.consume(256 * 1024)
+    elapsed = time.monotonic() - started
+    print(f"3 MB a 1 MB/s: {elapsed:.2f}s ({throttle.describe()})")
+    assert 1.8 <= elapsed < 3
+
+    print("OK")
+    return True
+
+
+def _start_fake_s3(kms=False):
+    """
+    Servidor S3 minimo en memoria (PUT/HEAD/GET, listados y multipart)
+    Con kms=True responde como un bucket con SSE-KMS (ETag que no es el MD5)
+    """
+    import hashlib
+    import re
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, unquote, urlsplit
+
+    objects = {}
+    uploads = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, body=b'', headers=None):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(body)
+
+        def _request(self):
+            url = urlsplit(self.path)
+            key = unquote(url.path).split('/', 2)[2] if url.path.count('/') > 1 else ''
+            query = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            meta = {k: v for k, v in self.headers.items() if k.lower().startswith('x-amz-meta-')}
+            return key, query, body, meta
+
+        def do_HEAD(self):
+            key = self._request()[0]
+            if key not in objects:
+                return self._reply(404)
+            self._reply(200, headers=objects[key][1])
+
+        def do_GET(self):
+            key, query, _, _ = self._request()
+            if 'list-type' in query:
+                items = ''.join(f"<Contents><Key>{k}</Key><Size>{len(v[0])}</Size></Contents>"
+                                for k, v in sorted(objects.items()) if k.startswith(query['prefix']))
+                return self._reply(200, f"<R>{items}<IsTruncated>false</IsTruncated></R>".encode())
+            if 'uploadId' in query:
+                parts = ''.join(
+                    f"<Part><PartNumber>{n}</PartNumber><ETag>{hashlib.md5(d).hexdigest()}</ETag>"
+                    f"<Size>{len(d)}</Size></Part>" for n, d in sorted(uploads[query['uploadId']][1].items()))
+                return self._reply(200, f"<R>{parts}<IsTruncated>false</IsTruncated></R>".encode())
+            if key not in objects:
+                return self._reply(404, b"<Error><Code>NoSuchKey</Code></Error>")
+            self._reply(200, objects[key][0])
+
+        def do_PUT(self):
+            key, query, body, meta = self._request()
+            if 'uploadId' in query:
+                uploads[query['uploadId']][1][int(query['partNumber'])] = body
+            else:
+                objects[key] = (body, meta)
+            if kms:
+                self._reply(200, headers={'ETag': f'"{hashlib.sha1(body).hexdigest()}"',
+                                          'x-amz-server-side-encryption': 'aws:kms'})
+            else:
+                self._reply(200, headers={'ETag': f'"{hashlib.md5(body).hexdigest()}"'})
+
+        def do_POST(self):
+            key, query, body, meta = self._request()
+            if 'uploads' in query:
+                upload_id = f"u{len(uploads) + 1}"
+                uploads[upload_id] = (meta, {})
+                return self._reply(200, f"<R><UploadId>{upload_id}</UploadId></R>".encode())
+            meta, parts = uploads.pop(query['uploadId'])
+            numbers = [int(n) for n in re.findall(rb'<PartNumber>(\d+)</PartNumber>', body)]
+            objects[key] = (b''.join(parts[n] for n in numbers), meta)
+            self._reply(200, b"<R/>")
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, objects
+
+
+def test_remote_replication():
+    """Prueba la subida multipart reanudable y la lectura en streaming"""
+    print("\n=== Test: Replicacion Remota ===")
+    import hashlib
+    import io
+    import tempfile
+
+    server, objects = _start_fake_s3()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            backup_dir = os.path.join(tmp, 'testing', '2024-01-15_10-30-00')
+            os.makedirs(backup_dir)
+            big = os.path.join(backup_dir, 'moodledata_2024-01-15_10-30-00.tar.gz')
+            data = os.urandom(12 * 1024 * 1024)
+            with open(big, 'wb') as f:
+                f.write(data)
+            with open(os.path.join(backup_dir, 'DB_INFO.txt'), 'w') as f:
+                f.write('moodle\n')
+
+            client = S3Client(f"http://127.0.0.1:{server.server_port}", 'respaldos', 'clave', 'secreto')
+            replicator = RemoteReplicator(client, tmp, workers=3, part_size=5 * 1024 * 1024)
+
+            # Subida interrumpida: solo la primera parte llego al servidor
+            key = replicator.backup_key('testing', '2024-01-15_10-30-00', os.path.basename(big))
+            upload, _ = replicator._start_multipart(key, big, len(data), hashlib.sha256(data).hexdigest())
+            replicator._upload_part(upload, 1)
+
+            first = replicator.upload_backup('testing', '2024-01-15_10-30-00')
+            second = replicator.upload_backup('testing', '2024-01-15_10-30-00')
+            print(f"Primera subida: {first['uploaded']} archivos, {first['bytes']} bytes")
+            print(f"Segunda subida: {second['uploaded']} archivos, {second['skipped']} sin cambios")
+            assert objects[key][0] == data
+            # La primera parte no se vuelve a enviar
+            assert first['bytes'] == len(data) - 5 * 1024 * 1024 + len('moodle\n')
+            assert second['uploaded'] == 0 and second['skipped'] == 2
+
+            stream = io.BytesIO()
+            replicator.stream_file('testing', '2024-01-15_10-30-00', os.path.basename(big), stream)
+            assert stream.getvalue() == data
+    finally:
+        server.shutdown()
+
+    # Con SSE-KMS el ETag no es el MD5 y no se compara
+    server, objects = _start_fake_s3(kms=True)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            backup_dir = os.path.join(tmp, 'testing', '2024-01-15_10-30-00')
+            os.makedirs(backup_dir)
+            data = os.urandom(6 * 1024 * 1024)
+            with open(os.path.join(backup_dir, 'moodle_2024-01-15_10-30-00.sql.gz'), 'wb') as f:
+                f.write(data)
+            with open(os.path.join(backup_dir, 'DB_INFO.txt'), 'w') as f:
+                f.write('moodle\n')
+            client = S3Client(f"http://127.0.0.1:{server.server_port}", 'respaldos', 'clave', 'secreto')
+            replicator = RemoteReplicator(client, tmp, workers=2, part_size=5 * 1024 * 1024)
+            stats = replicator.upload_backup('testing', '2024-01-15_10-30-00')
+            print(f"Subida con SSE-KMS: {stats['uploaded']} archivos")
+            assert stats['uploaded'] == 2
+            key = replicator.backup_key('testing', '2024-01-15_10-30-00', 'moodle_2024-01-15_10-30-00.sql.gz')
+            assert objects[key][0] == data
+    finally:
+        server.shutdown()
+
+    print("OK")
+    return True
+
+
+def test_moodledata_exclusions():
+    """Prueba que cache/temp no se respaldan ni se borran al restaurar"""
+    print("\n=== Test: Exclusiones de Moodledata ===")
+    import tempfile
+
+    excludes = parse_excludes(' cache/, ./temp,,cache ')
+    assert excludes == ['cache', 'temp']
+    assert parse_excludes(None)[0] == 'cache' and parse_excludes('') == []
+    assert tar_exclude_args(excludes) == ['--exclude=./cache', '--exclude=./temp']
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'moodledata')
+        for directory in ('lang', 'cache/theme', 'temp'):
+            os.makedirs(os.path.join(source, directory))
+        for name in ('lang/es.txt', 'cache/theme/all.css', 'temp/upload.tmp'):
+            with open(os.path.join(source, name), 'w') as f:
+                f.write(name)
+
+        store = BlobStore(os.path.join(tmp, 'blobs'))
+        manifest = os.path.join(tmp, 'm.manifest.json.gz')
+        stats = store.snapshot(source, manifest, exclude=excludes)
+        print(f"Archivos respaldados: {stats['files']}")
+        assert stats['files'] == 1
+
+        # Los directorios excluidos del volumen se conservan en la restauracion diferencial
+        restore = DifferentialRestore(source, workers=2, exclude=excludes)
+        result = restore.restore_manifest(manifest, os.path.join(tmp, 'blobs'))
+        print(f"Eliminados: {result['removed']}")
+        assert result['removed'] == 0
+        assert os.path.exists(os.path.join(source, 'cache', 'theme', 'all.css'))
+
+    print("OK")
+    return True
+
+
+def test_binlog_point_in_time():
+    """Prueba la lectura de binlogs en streaming y el plan de recuperacion"""
+    print("\n=== Test: Recuperacion a un Instante (binlogs) ===")
+    import gzip
+    import tempfile
+
+    data = BINLOG_MAGIC
+    for timestamp in (1000, 1005, 1003, 1010):
+        data += EVENT_HEADER.pack(timestamp, 2, 1, EVENT_HEADER.size + 30, 0, 0) + b'x' * 30
+    scanner = BinlogScanner()
+    # Bloques pequeños: las cabeceras quedan partidas entre bloques
+    for offset in range(0, len(data), 7):
+        scanner.feed(data[offset:offset + 7])
+    print(f"Eventos: {scanner.events}, rango: {scanner.first_event}-{scanner.last_event}")
+    assert scanner.events == 4 and scanner.first_event == 1000 and scanner.last_event == 1010
+
+    binlogs = [
+        {'name': 'mysql-bin.000007', 'first_event': 100, 'last_event': 200},
+        {'name': 'mysql-bin.000008', 'first_event': 200, 'last_event': 300},
+        {'name': 'mysql-bin.000009', 'first_event': 300, 'last_event': 400},
+        {'name': 'mysql-bin.000010', 'first_event': 400, 'last_event': 500},
+    ]
+    plan = plan_replay(binlogs, 'mysql-bin.000008', 250, 350)
+    assert [b['name'] for b in plan] == ['mysql-bin.000008', 'mysql-bin.000009']
+    try:
+        plan_replay(binlogs[:2] + binlogs[3:], 'mysql-bin.000008', 250, 450)
+        assert False, "Se esperaba un error por el binlog faltante"
+    except ValueError as e:
+        print(f"Hueco detectado: {e}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with gzip.open(os.path.join(tmp, 'moodle_2024-01-15_10-30-00.sql.gz'), 'wt') as f:
+            f.write("-- MySQL dump 10.13\n--\n")
+            f.write("-- CHANGE REPLICATION SOURCE TO SOURCE_LOG_FILE='mysql-bin.000008', SOURCE_LOG_POS=157;\n")
+            f.write("CREATE TABLE t (id int);\n")
+        position = dump_position(tmp)
+        print(f"Posicion del dump: {position}")
+        assert position == ('mysql-bin.000008', 157)
+
+    print("OK")
+    return True
+
+def test_volume_tar_filter():
+    """Prueba el filtro de exclusiones sobre el stream tar del volumen"""
+    print("\n=== Test: Stream de Volumenes (API de Docker) ===")
+    import io
+    import tarfile
+    import tempfile
+
+    long_name = './lang/' + 'x' * 150 + '.txt'
+    for tar_format in (tarfile.PAX_FORMAT, tarfile.GNU_FORMAT):
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode='w', format=tar_format) as tar:
+            for name, content in (('./lang/es.txt', b'hola'), (long_name, b'largo'),
+                                  ('./cache/' + 'y' * 150, b'cache'), ('./temp/upload.tmp', b'tmp'),
+                                  ('./cachedir/keep.txt', b'keep')):
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                info.uid = 33
+                tar.addfile(info, io.BytesIO(content))
+        data.seek(0)
+
+        output = io.BytesIO()
+        tar_filter = TarFilter(['cache', 'temp'])
+        tar_filter.copy(data, output)
+        output.seek(0)
+        with tarfile.open(fileobj=output) as tar:
+            members = {member.name: tar.extractfile(member).read() for member in tar.getmembers()}
+        print(f"Formato {tar_format}: {len(members)} entradas, {tar_filter.skipped} omitidas")
+        assert tar_filter.skipped == 2
+        assert members == {'./lang/es.txt': b'hola', long_name: b'largo', './cachedir/keep.txt': b'keep'}
+
+    class FakeStream:
+        volume = 'moodledata_testing'
+
+        def export(self, output, exclude=()):
+            data.seek(0)
+            return TarFilter(exclude).copy(data, output)
+
+    # La exportacion en un hilo se usa como productor de StreamPipeline
+    with tempfile.TemporaryDirectory() as tmp:
+        output_file = os.path.join(tmp, 'moodledata.tar.gz')
+        pipeline = StreamPipeline(lambda: VolumeExport(FakeStream(), ['temp']), get_codec('gzip'), output_file)
+        stats = pipeline.run()
+        assert stats['source']['bytes'] > 0
+        with tarfile.open(output_file) as tar:
+            names = tar.getnames()
+        assert './temp/upload.tmp' not in names and './lang/es.txt' in names
+
+    # Sin acceso al punto de montaje se vacia con un contenedor temporal de la
+    # imagen del servicio, aunque este detenido (restore.sh, clone.py)
+    class FakeDocker:
+        socket_path = '/var/run/docker.sock'
+
+        def __init__(self):
+            self.helpers = []
+
+        def available(self):
+            return True
+
+        def json(self, method, path, body=None):
+            return {'Mountpoint': '/no/accesible'}
+
+        def volume_containers(self, volume):
+            return [('moodle_testing', '/var/moodledata', False)]
+
+        def inspect(self, container):
+            return {'Config': {'Image': 'moodle:4.3'}}
+
+        def run_helper(self, image, volume, destination, command):
+            self.helpers.append((image, volume, destination, command[-1]))
+            return 0
+
+    client = FakeDocker()
+    VolumeStream('moodledata_testing', client).clear()
+    assert client.helpers == [('moodle:4.3', 'moodledata_testing', '/volume', '/volume')]
+
+    print("OK")
+    return True
+
+def test_benchmark_dataset():
+    """Prueba el generador de datos sinteticos y la comparacion de corridas"""
+    print("\n=== Test: Benchmark de Respaldos ===")
+    import hashlib
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        stats = SyntheticMoodledata(4 * 1024 * 1024, seed=7).write_dir(os.path.join(tmp, 'a'))
+        again = SyntheticMoodledata(4 * 1024 * 1024, seed=7).write_dir(os.path.join(tmp, 'b'))
+        print(f"Moodledata: {stats['files']} archivos, {stats['bytes']} bytes")
+        assert stats == again and stats['bytes'] + stats['regenerable_bytes'] == 4 * 1024 * 1024
+
+        # filedir/ab/cd/<sha1 del contenido>
+        total = 0
+        for root, _, files in os.walk(os.path.join(tmp, 'a', 'filedir')):
+            for name in files:
+                with open(os.path.join(root, name), 'rb') as f:
+                    data = f.read()
+                assert hashlib.sha1(data).hexdigest() == name and root.endswith(f"{name[:2]}/{name[2:4]}")
+                total += len(data)
+        assert total == stats['bytes']
+
+    database = SyntheticDatabase(2000, seed=7)
+    sql = ''.join(database.statements())
+    counts = database.table_rows()
+    assert sum(counts.values()) == 2000 and sql.count('CREATE TABLE') == len(counts)
+    assert sql.count('INSERT INTO mdl_logstore_standard_log') == 3
+
+    stats = {'database': {'source': {'seconds': 4.0, 'bytes': 100}, 'compress': {'seconds': 4.2, 'bytes': 20}},
+             'moodledata': {'source': {'seconds': 9.0, 'bytes': 500}, 'compress': {'seconds': 9.1, 'bytes': 450}}}
+    stages = stage_times(stats)
+    assert set(stages) == {'dump', 'dump_compress', 'archive', 'archive_compress'}
+    rows = compare_runs({'timings': {'backup': 10.0, 'restore': 20.0}},
+                        {'timings': {'backup': 12.0, 'restore': 19.0}}, threshold=0.10)
+    print(f"Comparacion: {[(r['metric'], r['change'], r['regression']) for r in rows]}")
+    assert [r['regression'] for r in rows] == [True, False]
+
+    print("OK")
+    return True
+
+def test_send_mail_streaming():
+    """Prueba los adjuntos por bloques, la sesion SMTP compartida y el correo de resumen"""
+    print("\n=== Test: Notificaciones por Email ===")
+    import email
+    import glob
+    import json
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        small = os.path.join(tmp, 'small.bin')
+        with open(small, 'wb') as f:
+            f.write(os.urandom(300 * 1024))
+        big = os.path.join(tmp, 'backup.log')
+        with open(big, 'w') as f:
+            for i in range(20000):
+                f.write(f"linea {i} del respaldo\n")
+
+        message = MensajeStreaming('backup@example.com', ['a@example.com'], 'Respaldo ñ', 'Cuerpo',
+                                   [small, big], limite_adjuntos=400 * 1024)
+        chunks = list(message.bloques())
+        print(f"Bloques: {len(chunks)}, mayor: {max(len(c) for c in chunks)} bytes")
+        assert max(len(c) for c in chunks) < 2 * 1024 * 1024
+
+        parsed = email.message_from_bytes(b''.join(chunks))
+        parts = [part for part in parsed.walk() if not part.is_multipart()]
+        assert parts[0].get_payload(decode=True).decode('utf-8').startswith('Cuerpo')
+        # El log supera el limite: se reemplaza por su tamaño y sus ultimas lineas
+        assert 'Adjunto omitido: backup.log' in parts[0].get_payload(decode=True).decode('utf-8')
+        assert 'linea 19999 del respaldo' in parts[0].get_payload(decode=True).decode('utf-8')
+        with open(small, 'rb') as f:
+            assert len(parts) == 2 and parts[1].get_payload(decode=True) == f.read()
+
+        class FakeSMTP:
+            def __init__(self):
+                self.data = []
+
+            def mail(self, sender):
+                return 250, b'OK'
+
+            def rcpt(self, recipient):
+                return 250, b'OK'
+
+            def docmd(self, command):
+                return 354, b'Go ahead'
+
+            def send(self, data):
+                self.data.append(data)
+
+            def getreply(self):
+                return 250, b'Queued'
+
+        connections = []
+        session = SesionSMTP('localhost', 465, 'backup@example.com', 'secreto', 'Respaldos')
+        session.conectar = lambda: (connections.append(1), setattr(session, 'smtp', FakeSMTP()))
+        session.enviar(message)
+        session.enviar(MensajeStreaming('backup@example.com', ['a@example.com'], 'Otro', 'Texto'))
+        print(f"Conexiones SMTP para 2 correos: {len(connections)}")
+        assert len(connections) == 1 and session.smtp.data[-1] == b'.\r\n'
+
+        spool = os.path.join(tmp, 'spool')
+        encolar_correo(spool, 'a@example.com', '[Backup Moodle] testing - EXITOSO', 'ok')
+        encolar_correo(spool, 'a@example.com', '[Backup Moodle] production - FALLIDO', 'error', [big])
+        notices = []
+        for path in sorted(glob.glob(os.path.join(spool, '*.json'))):
+            with open(path) as f:
+                notices.append(json.load(f))
+        subject, body, attachments = armar_resumen(notices)
+        print(f"Resumen: {subject}")
+        assert subject == '[Backup Moodle] Resumen: 2 notificaciones (1 con errores)'
+        assert 'production - FALLIDO' in body and attachments == [big]
+
+    print("OK")
+    return True
+
+def test_scheduler_daemon():
+    """Prueba las expresiones cron, la cola de trabajos, los locks y el limite de concurrencia"""
+    print("\n=== Test: Servicio de Respaldos Programados ===")
+    import tempfile
+    from datetime import datetime
+
+    after = datetime(2024, 6, 30, 2, 30)  # domingo
+    assert CronExpression('0 2 * * *').next_after(after) == datetime(2024, 7, 1, 2, 0)
+    assert CronExpression('*/15 * * * *').next_after(after) == datetime(2024, 6, 30, 2, 45)
+    assert CronExpression('0 2 * * 0').next_after(after) == datetime(2024, 7, 7, 2, 0)
+    assert CronExpression('0 0 29 2 *').next_after(after) == datetime(2028, 2, 29, 0, 0)
+    # Dia del mes y dia de la semana restringidos: basta con uno (1 de julio o domingo)
+    assert CronExpression('0 3 1 * 0').next_after(datetime(2024, 7, 1, 4, 0)) == datetime(2024, 7, 7, 3, 0)
+    for invalid in ('0 2 * *', '60 * * * *', '*/0 * * * *'):
+        try:
+            CronExpression(invalid)
+            assert False, f"Se esperaba un error para '{invalid}'"
+        except ValueError:
+            pass
+
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = JobQueue(tmp)
+        daemon = SchedulerDaemon(queue, tmp, max_jobs=1, jitter=0,
+                                 command=lambda job: [sys.executable, '-c', 'import time; time.sleep(0.5)'])
+        now = time.time()
+        queue.set_schedule('moodle-backup-testing', 'backup', 'testing', '0 2 * * *', now - 1)
+        queue.set_schedule('moodle-backup-production', 'backup', 'production', '0 3 * * *', now - 1)
+        queue.set_schedule('moodle-backup-binlog-testing', 'binlog', 'testing', '*/5 * * * *', now - 1)
+
+        daemon.enqueue_due(now)
+        started = daemon.start_queued()
+        # Un solo respaldo pesado a la vez; el archivado de binlogs no cuenta para el limite
+        print(f"Iniciados: {[job['job_id'] for job in started]}")
+        assert sorted(job['kind'] for job in started) == ['backup', 'binlog']
+        waiting = [job['environment'] for job in queue.jobs(status='queued')]
+        assert len(waiting) == 1 and waiting[0] not in [job['environment'] for job in started if job['kind'] == 'backup']
+        assert all(s['next_run'] > now for s in queue.list_schedules())
+
+        # El horario vence otra vez mientras el trabajo sigue activo: se omite
+        job_id = f"moodle-backup-{waiting[0]}"
+        queue.set_schedule(job_id, 'backup', waiting[0], '0 2 * * *', now - 1)
+        assert daemon.enqueue_due(now) == [(job_id, 'skipped')]
+
+        # Un respaldo manual del ambiente en espera tiene el lock: su trabajo sigue en la cola
+        manual = EnvironmentLock(tmp, waiting[0])
+        assert manual.acquire()
+        # ... y una restauracion del mismo ambiente falla sin tocar nada
+        settings = Settings()
+        settings.BASE_PATH = tmp
+        manager = BackupManager(settings)
+        manager.backup_path = tmp
+        assert manager.restore_backup(waiting[0], '2024-01-15_02-00-00') is False
+        deadline = time.time() + 10
+        while daemon.children and time.time() < deadline:
+            time.sleep(0.1)
+            daemon.reap()
+        assert daemon.start_queued() == []
+        manual.release()
+        assert [job['environment'] for job in daemon.start_queued()] == waiting
+        while daemon.children and time.time() < deadline:
+            time.sleep(0.1)
+            daemon.reap()
+
+        statuses = [(job['job_id'], job['status']) for job in queue.jobs()]
+        print(f"Historial: {statuses}")
+        assert (job_id, 'skipped') in statuses
+        assert [status for _, status in statuses].count('done') == 3
+        last = {s['job_id']: s['last_status'] for s in queue.list_schedules()}
+        assert last['moodle-backup-testing'] == last['moodle-backup-production'] == 'done'
+
+    print("OK")
+    return True
+
+
+def test_progress_events():
+    """Prueba los eventos de progreso: conteo de filas y archivos, ETA e historial"""
+    print("\n=== Test: Progreso y ETA de Backups ===")
+    import io
+    import tarfile
+    import tempfile
+
+    dump = b"INSERT INTO `mdl_user` VALUES (1,'a'),(2,'b'),(3,'c');\nINSERT INTO `mdl_log` VALUES (1,'x');\n"
+    assert count_rows(dump) == 4
+
+    # Archivos de un tar entregado en bloques pequeños (con nombres largos en cabeceras PAX)
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w', format=tarfile.PAX_FORMAT) as tar:
+        for i in range(5):
+            data = os.urandom(700)
+            info = tarfile.TarInfo(f"filedir/{'x' * 120}/{i}")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        tar.addfile(tarfile.TarInfo('vacio'))
+        directory = tarfile.TarInfo('filedir')
+        directory.type = tarfile.DIRTYPE
+        tar.addfile(directory)
+    counter = TarCounter()
+    data = buffer.getvalue()
+    assert sum(counter.feed(data[i:i + 333]) for i in range(0, len(data), 333)) == 6
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = progress_file(tmp, 'backup', 'testing')
+        reporter = ProgressReporter(path, interval=0.05).start('backup', 'testing', {'database': 2000})
+        meter = reporter.stage('database')
+        meter.add(500, rows=10)
+        time.sleep(0.2)
+        view = load_view(path)
+        summary = view.summary()
+        print(f"Durante: {view.render()}")
+        assert summary['bytes'] == 500 and summary['rows'] == 10
+        assert summary['percent'] == 25.0 and summary['eta_seconds'] is not None
+
+        # Un medidor de backup.sh escribe en el mismo archivo desde otro proceso
+        os.environ['BACKUP_PROGRESS_FILE'] = path
+        try:
+            target = io.BytesIO()
+            copy_metered(io.BytesIO(data), target, 'moodledata', 'tar')
+        finally:
+            del os.environ['BACKUP_PROGRESS_FILE']
+        assert target.getvalue() == data
+
+        meter.add(1500, rows=30)
+        reporter.finish('SUCCESS')
+        view = load_view(path)
+        print(f"Final: {view.render()}")
+        assert view.finished and view.summary()['percent'] == 100.0
+        assert view.stages['moodledata']['files'] == 6
+
+        # La proxima ejecucion usa los tamaños de esta para la ETA
+        assert record_history(tmp, path)
+        assert expected_from_history(tmp, 'backup', 'testing') == {'database': 2000, 'moodledata': len(data)}
+
+        # Una ejecucion fallida no reemplaza el historial
+        failed = ProgressReporter(path).start('backup', 'testing')
+        failed.stage('database').add(10)
+        failed.finish('FAILED')
+        assert not record_history(tmp, path)
+        assert expected_from_history(tmp, 'backup', 'testing')['database'] == 2000
+
+    print("OK")
+    return True
+
+
+def test_environment_clone():
+    """Prueba el clonado en streaming de la base de datos entre ambientes"""
+    print("\n=== Test: Clonado de Ambientes ===")
+    import io
+    import tempfile
+
+    seen = []
+    reader = MeteredReader(io.BytesIO(b'x' * 10), lambda chunk: seen.append(len(chunk)))
+    assert reader.read(4) == b'xxxx' and reader.read() == b'x' * 6 and reader.read() == b''
+    assert seen == [4, 6]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = Settings()
+        settings.BASE_PATH = tmp
+        settings.set_env_var('PROD_DB_NAME', 'moodle_prod')
+        settings.set_env_var('PROD_DB_PASS', 'clave_prod')
+        settings.set_env_var('TEST_DB_NAME', 'moodle_test')
+        settings.set_env_var('TEST_DB_ROOT_PASS', 'clave_root_test')
+
+        for source, target in (('testing', 'testing'), ('testing', 'production')):
+            try:
+                EnvironmentClone(settings, source, target)
+                assert False, f"Se esperaba un error al clonar {source} en {target}"
+            except ValueError:
+                pass
+
+        dump_sql = b"INSERT INTO `mdl_user` VALUES (1,'a'),(2,'b');\n" * 5000
+        dump_file = os.path.join(tmp, 'dump.sql')
+        loaded = os.path.join(tmp, 'cargado.sql')
+        with open(dump_file, 'wb') as f:
+            f.write(dump_sql)
+
+        class LocalClone(EnvironmentClone):
+            """Reemplaza docker exec por procesos locales con las mismas contraseñas"""
+            load_code = 0
+
+            def _container_running(self, name):
+                return True
+
+            def database_commands(self):
+                (dump, dump_env), (load, load_env) = super().database_commands()
+                assert dump[-1] == 'moodle_prod' and load[-1] == 'moodle_test'
+                assert 'clave_prod' not in dump and dump_env['MYSQL_PWD'] == 'clave_prod'
+                assert load_env['MYSQL_PWD'] == 'clave_root_test'
+                dump = [sys.executable, '-c', f"import sys; sys.stdout.buffer.write(open({dump_file!r}, 'rb').read())"]
+                load = [sys.executable, '-c',
+                        f"import sys; open({loaded!r}, 'wb').write(sys.stdin.buffer.read()); "
+                        f"sys.exit({self.load_code})"]
+                return (dump, dump_env), (load, load_env)
+
+        os.makedirs(settings.LOGS_PATH)
+        reporter = ProgressReporter(progress_file(tmp, 'clone', 'testing')).start('clone', 'testing')
+        clone = LocalClone(settings, 'production', 'testing', progress=reporter)
+        assert clone._tracked('database', clone.clone_database)
+        reporter.finish('SUCCESS')
+        with open(loaded, 'rb') as f:
+            assert f.read() == dump_sql
+        stage = load_view(reporter.path).stages['database']
+        print(f"Base de datos: {stage['bytes']} bytes, {stage['rows']} filas")
+        assert stage['bytes'] == len(dump_sql) and stage['rows'] == 10000
+
+        # Un error de mysql en el destino hace fallar la etapa
+        clone.load_code = 1
+        assert not clone.clone_database()
+
+    print("OK")
+    return True
+
+
+def test_seekable_dump():
+    """Prueba el dump por marcos con indice y la extraccion de tablas sueltas"""
+    print("\n=== Test: Dump con Indice de Tablas ===")
+    import gzip
+    import io
+    import tempfile
+
+    header = (b"-- MySQL dump 10.13\n/*!40101 SET NAMES utf8mb4 */;\n"
+              b"/*!40014 SET @OLD_FOREIGN_KEY_CHECKS=@@FOREIGN_KEY_CHECKS, FOREIGN_KEY_CHECKS=0 */;\n")
+    footer = (b"/*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;\n"
+              b"/*!40014 SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS */;\n-- Dump completed\n")
+
+    def table(name, rows):
+        values = b",".join(b"(%d,'fila %d')" % (i, i) for i in range(rows))
+        return (b"--\n-- Table structure for table `%s`\n--\n\nDROP TABLE IF EXISTS `%s`;\n"
+                b"CREATE TABLE `%s` (`id` bigint NOT NULL, `v` text);\n\n"
+                b"--\n-- Dumping data for table `%s`\n--\n\nLOCK TABLES `%s` WRITE;\n"
+                b"INSERT INTO `%s` VALUES %s;\nUNLOCK TABLES;\n\n") % ((name,) * 6 + (values,))
+
+    tables = {b'mdl_course': 20, b'mdl_quiz_attempts': 3000, b'mdl_user': 500}
+    dump = header + b''.join(table(n, r) for n, r in tables.items()) + \
+        b"--\n-- Dumping routines for database 'moodle'\n--\n" + footer
+
+    # El separador corta en las mismas secciones aunque los bloques partan las lineas
+    splitter = SectionSplitter()
+    items = [item for i in range(0, len(dump), 97) for item in splitter.feed(dump[i:i + 97])]
+    items += splitter.finish()
+    sections = [item[1:] for item in items if item[0] == 'section']
+    assert sections == [('table', 'mdl_course'), ('table', 'mdl_quiz_attempts'), ('table', 'mdl_user'),
+                        ('routines', None), ('footer', None)]
+    assert b''.join(item[1] for item in items if item[0] == 'data') == dump
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'mysqldump.sql')
+        with open(source, 'wb') as f:
+            f.write(dump)
+        output = os.path.join(tmp, 'moodle_2024-01-15_10-30-00.sql.gz')
+        pipeline = FramedDumpPipeline(
+            [sys.executable, '-c', f"import sys; sys.stdout.buffer.write(open({source!r}, 'rb').read())"],
+            get_codec('gzip'), output, level=1)
+        pipeline.run()
+
+        # El archivo sigue siendo un .sql.gz normal (restore.sh, verificacion)
+        with open(output, 'rb') as f:
+            assert gzip.decompress(f.read()) == dump
+        assert os.path.exists(output + '.index.json') and pipeline.index_sha256
+
+        reader = DumpReader(output)
+        assert reader.mode == 'indexed'
+        listed = {t['name']: t['rows'] for t in reader.tables()}
+        print(f"Tablas: {listed}")
+        assert listed == {name.decode(): rows for name, rows in tables.items()}
+
+        # Se leen solo los marcos pedidos: dañar otra tabla no afecta la extraccion
+        frames = {f['name']: f for f in reader.index['frames']}
+        with open(output, 'r+b') as f:
+            f.seek(frames['mdl_user']['offset'] + 10)
+            f.write(b'\0' * 16)
+        extracted = io.BytesIO()
+        stats = reader.extract(['mdl_quiz_attempts'], extracted)
+        expected = header + table(b'mdl_quiz_attempts', 3000) + footer
+        assert extracted.getvalue() == expected and stats['tables'] == ['mdl_quiz_attempts']
+
+        # Un dump sin indice (backup.sh) se recorre completo con el mismo resultado
+        plain = os.path.join(tmp, 'moodle_plano.sql.gz')
+        with open(plain, 'wb') as f:
+            f.write(gzip.compress(dump))
+        extracted = io.BytesIO()
+        DumpReader(plain).extract(['mdl_quiz_attempts'], extracted)
+        assert extracted.getvalue() == expected
+
+        for path in (output, plain):
+            try:
+                DumpReader(path).extract(['mdl_no_existe'], io.BytesIO())
+                assert False, "Se esperaba un error por tabla inexistente"
+            except ValueError:
+                pass
+
+        # Una interrupcion a mitad del dump termina mysqldump, el compresor del
+        # marco y borra el parcial (el productor anota su pid antes de escribir)
+        pid_file = os.path.join(tmp, 'mysqldump.pid')
+
+        def interrupt(chunk):
+            raise KeyboardInterrupt()
+        interrupted = os.path.join(tmp, 'moodle_interrumpido.sql.gz')
+        try:
+            FramedDumpPipeline(['sh', '-c', f"echo $$ > {pid_file}; exec yes"], get_codec('gzip'),
+                               interrupted, level=1, observer=interrupt).run()
+            assert False, "El pipeline debio interrumpirse"
+        except KeyboardInterrupt:
+            pass
+        with open(pid_file) as f:
+            pid = int(f.read())
+        try:
+            os.kill(pid, 0)
+            assert False, "mysqldump sigue en ejecucion"
+        except ProcessLookupError:
+            pass
+        assert not os.path.exists(interrupted + '.part') and not os.path.exists(interrupted)
+
+    print("OK")
+    return True
+
+
+def test_physical_backup():
+    """Prueba el respaldo fisico: tar del clon, intercambio de directorios y vuelta atras"""
+    print("\n=== Test: Respaldo Fisico de MySQL ===")
+    import gzip
+    import io
+    import json
+    import shutil
+    import subprocess
+    import tarfile
+    import tempfile
+
+    assert compatible('8.0.36', '8.0.36-log') and compatible('8.0.34', '8.0.36')
+    assert not compatible('8.0.36', '8.0.34') and not compatible('8.0.36', '8.4.0')
+
+    settings = Settings()
+    settings.env_vars.update({'BACKUP_DB_MODE': 'single', 'PROD_BACKUP_DB_MODE': "'physical'"})
+    assert settings.backup_db_mode('production') == 'physical'
+    assert settings.backup_db_mode('testing') == 'single'
+
+    def tar_of(files, prefix):
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode='w') as tar:
+            for name, content in files.items():
+                info = tarfile.TarInfo(f"{prefix}/{name}")
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        return data.getvalue()
+
+    def read_dir(path):
+        found = {}
+        for root, _, names in os.walk(path):
+            for name in names:
+                with open(os.path.join(root, name), 'rb') as f:
+                    found[os.path.relpath(os.path.join(root, name), path)] = f.read()
+        return found
+
+    class FakeDocker:
+        """Cliente de Docker sobre un directorio local (el volumen mysql_testing)"""
+
+        def __init__(self, datadir, archive=b'', healthy=True):
+            self.datadir = datadir
+            self.archive = archive
+            self.healthy = healthy
+            self.calls = []
+
+        def _host(self, path):
+            return path.replace('/var/lib/mysql', self.datadir, 1)
+
+        def get_archive(self, container, path):
+            return io.BytesIO(self.archive)
+
+        def put_archive(self, container, path, source):
+            with tarfile.open(fileobj=source, mode='r|') as tar:
+                tar.extractall(self._host(path))
+
+        def exec_run(self, container, command):
+            if command[0] == 'rm':
+                shutil.rmtree(self._host(command[-1]), ignore_errors=True)
+                return 0
+            return 0 if self.healthy else 1
+
+        def inspect(self, container):
+            return {'Mounts': [{'Destination': '/var/lib/mysql', 'Name': 'mysql_testing'}],
+                    'Config': {'Image': 'mysql:8.0'}, 'State': {'Running': True}}
+
+        def start(self, container):
+            self.calls.append('start')
+
+        def stop(self, container, timeout=60):
+            self.calls.append('stop')
+
+        def run_helper(self, image, volume, destination, command):
+            return subprocess.run(command[:3] + [self.datadir] + command[4:]).returncode
+
+    clone_files = {'ibdata1': b'I' * 5000, 'mysql.ibd': b'M' * 300, 'moodle/mdl_user.ibd': b'U' * 800,
+                   '#innodb_redo/#ib_redo0': b'R' * 100}
+    old_files = {'ibdata1': b'viejo', 'binlog.000001': b'B' * 10, 'moodle/mdl_user.ibd': b'u'}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # El tar del clon (entradas physical-<fecha>/...) se comprime como un volumen
+        name = 'physical-2024-01-15_02-00-00'
+        source = CloneSource('mysql_testing', 'secreto', name,
+                             client=FakeDocker(tmp, tar_of(clone_files, name)))
+        output = os.path.join(tmp, 'mysql_physical_2024-01-15_02-00-00.tar.gz')
+        StreamPipeline(lambda: source.export_process(), get_codec('gzip'), output, level=1).run()
+        with tarfile.open(output) as tar:
+            names = sorted(tar.getnames())
+        assert names == sorted(f"{name}/{n}" for n in clone_files), names
+
+        metadata = {'format': 'physical', 'mysql_version': '8.0.36', 'directory': name,
+                    'binlog': {'file': 'binlog.000042', 'position': 157}}
+        with open(os.path.join(tmp, METADATA_FILE), 'w') as f:
+            json.dump(metadata, f)
+        assert dump_position(tmp) == ('binlog.000042', 157)
+
+        for healthy in (True, False):
+            datadir = os.path.join(tmp, f'datadir_{healthy}')
+            os.makedirs(os.path.join(datadir, 'moodle'))
+            for path, content in old_files.items():
+                with open(os.path.join(datadir, path), 'wb') as f:
+                    f.write(content)
+
+            client = FakeDocker(datadir, healthy=healthy)
+            copied = []
+            restore = PhysicalRestore('mysql_testing', metadata, 'secreto', client=client,
+                                      timeout=5 if healthy else 0, progress=copied.append)
+            with open(output, 'rb') as f:
+                restore.stage(io.BytesIO(gzip.decompress(f.read())))
+            assert os.path.isdir(os.path.join(datadir, name)) and sum(copied) > 0
+
+            if healthy:
+                restore.swap()
+                assert read_dir(datadir) == clone_files
+            else:
+                try:
+                    restore.swap()
+                    assert False, "Se esperaba un error si MySQL no arranca"
+                except RuntimeError:
+                    pass
+                # Se recuperan los datos anteriores sin restos del intercambio
+                assert read_dir(datadir) == old_files
+            assert not os.path.exists(os.path.join(datadir, PREVIOUS_DIR))
+            assert client.calls[:2] == ['stop', 'start']
+            print(f"MySQL {'arranca' if healthy else 'no arranca'}: {client.calls}")
+
+    print("OK")
+    return True
+
+
+def test_backup_tiering():
+    """Prueba el paso de respaldos antiguos al almacenamiento frio"""
+    print("\n=== Test: Almacenamiento Frio ===")
+    import gzip
+    import hashlib
+    import io
+    import json
+    import tarfile
+    import tempfile
+    from datetime import datetime
+
+    cold_codec = 'zstd' if get_codec('zstd').is_available() else 'gzip'
+    dump = b''.join(b"--\n-- Table structure for table `mdl_t%d`\n--\n\nCREATE TABLE `mdl_t%d` (id int);\n"
+                    b"INSERT INTO `mdl_t%d` VALUES (1),(2);\n\n" % (i, i, i) for i in range(3))
+    dump = b"-- MySQL dump\n" + dump + b"-- Dump completed\n"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backups = os.path.join(tmp, 'backups')
+        cold = os.path.join(tmp, 'frio')
+        source = os.path.join(tmp, 'dump.sql')
+        with open(source, 'wb') as f:
+            f.write(dump)
+
+        contents = {}
+        for timestamp in ('2024-01-01_02-00-00', '2024-01-05_02-00-00', '2024-01-15_02-00-00'):
+            backup_dir = os.path.join(backups, 'production', timestamp)
+            os.makedirs(backup_dir)
+            FramedDumpPipeline(
+                [sys.executable, '-c', f"import sys; sys.stdout.buffer.write(open({source!r}, 'rb').read())"],
+                get_codec('gzip'), os.path.join(backup_dir, f'moodle_{timestamp}.sql.gz'), level=1).run()
+            data = io.BytesIO()
+            with tarfile.open(fileobj=data, mode='w') as tar:
+                info = tarfile.TarInfo('moodledata/config.txt')
+                info.size = 4000
+                tar.addfile(info, io.BytesIO(b'x' * 4000))
+            with open(os.path.join(backup_dir, f'moodledata_{timestamp}.tar.gz'), 'wb') as f:
+                f.write(gzip.compress(data.getvalue()))
+            with open(os.path.join(backup_dir, 'STATS.json'), 'w') as f:
+                json.dump({'status': 'success', 'codec': 'gzip'}, f)
+            # Como el motor: STATS.json no lleva checksum
+            names = sorted(n for n in os.listdir(backup_dir) if n != 'STATS.json')
+            with open(os.path.join(backup_dir, 'SHA256SUMS'), 'w') as f:
+                for name in names:
+                    with open(os.path.join(backup_dir, name), 'rb') as src:
+                        f.write(f"{hashlib.sha256(src.read()).hexdigest()}  {name}\n")
+            contents[timestamp] = data.getvalue()
+
+        manager = TieringManager(backups, cold, after_days=7, codec=cold_codec, level=3)
+        now = datetime(2024, 1, 16).timestamp()
+        planned = [b['timestamp'] for b in manager.plan('production', now=now)]
+        assert planned == ['2024-01-01_02-00-00', '2024-01-05_02-00-00'], planned
+
+        moved = manager.run('production', now=now)
+        assert [m['timestamp'] for m in moved] == planned
+        print(f"Movidos: {[(m['timestamp'], m['bytes_before'], m['bytes_after']) for m in moved]}")
+
+        extension = get_codec(cold_codec).extension
+        for timestamp in planned:
+            path = os.path.join(backups, 'production', timestamp)
+            assert os.path.islink(path) and backup_tier(path) == TIER_COLD
+            assert os.path.realpath(path) == os.path.realpath(os.path.join(cold, 'production', timestamp))
+            # Mismo contenido, nuevo codec, checksums validos y tablas extraibles desde el indice
+            for name, digest in read_checksums(path).items():
+                result = verify_file(os.path.join(path, name), digest)
+                assert result['hash_ok'] and result['stream_ok'] is not False, name
+            dump_file = os.path.join(path, f'moodle_{timestamp}.sql{extension}')
+            reader = DumpReader(dump_file)
+            assert reader.mode == 'indexed' and reader.index['codec'] == cold_codec
+            extracted = io.BytesIO()
+            reader.extract(['mdl_t1'], extracted)
+            assert b"INSERT INTO `mdl_t1`" in extracted.getvalue()
+            assert b"mdl_t2" not in extracted.getvalue()
+            with open(os.path.join(path, 'STATS.json')) as f:
+                assert json.load(f)['tiering']['codec'] == cold_codec
+            assert BackupCatalog(backups).get_backup('production', timestamp)['tier'] == TIER_COLD
+        assert not os.path.islink(os.path.join(backups, 'production', '2024-01-15_02-00-00'))
+        assert manager.plan('production', now=now) == []
+
+        # La retencion borra el enlace y el directorio frio
+        deleted = RetentionManager(backups, daily=1, weekly=0, monthly=0).apply('production', background=False)
+        assert sorted(b['timestamp'] for b in deleted) == planned
+        assert not os.listdir(os.path.join(cold, 'production'))
+        assert os.listdir(os.path.join(backups, 'production')) == ['2024-01-15_02-00-00']
+
+    print("OK")
+    return True
+
+
+def test_blob_gc_cold_backups():
+    """Prueba que la limpieza de blobs respeta los respaldos en almacenamiento frio"""
+    print("\n=== Test: Limpieza de Blobs con Almacenamiento Frio ===")
+    import json
+    import shutil
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backups = os.path.join(tmp, 'backups')
+        source = os.path.join(tmp, 'moodledata')
+        os.makedirs(os.path.join(source, 'filedir'))
+        with open(os.path.join(source, 'filedir', 'a.txt'), 'w') as f:
+            f.write('contenido solo del respaldo frio')
+
+        store = BlobStore(os.path.join(backups, 'blobs'))
+        timestamp = '2024-01-01_02-00-00'
+        backup_dir = os.path.join(backups, 'production', timestamp)
+        os.makedirs(backup_dir)
+        store.snapshot(source, os.path.join(backup_dir, f'moodledata_{timestamp}.manifest.json.gz'))
+        with open(os.path.join(backup_dir, 'STATS.json'), 'w') as f:
+            json.dump({'status': 'success'}, f)
+
+        cold = os.path.join(tmp, 'frio')
+        TieringManager(backups, cold, after_days=7, codec='gzip').migrate('production', timestamp)
+        assert backup_tier(backup_dir) == TIER_COLD
+        blobs = [name for _, _, files in os.walk(store.root) for name in files if store.has_blob(name)]
+        assert len(blobs) == 1
+
+        # El manifiesto solo existe tras el enlace: sus blobs siguen referenciados
+        assert store.collect_garbage(backups) == (0, 0)
+        assert store.has_blob(blobs[0])
+
+        # Con el volumen frio sin montar no se borra nada
+        shutil.rmtree(cold)
+        try:
+            store.collect_garbage(backups)
+            assert False, "La limpieza debio fallar con un enlace roto"
+        except RuntimeError as e:
+            print(f"Limpieza omitida: {e}")
+        assert store.has_blob(blobs[0])
+
+    print("OK")
+    return True
+
+
+def test_adaptive_compression():
+    """Prueba la compresion adaptativa del tar de moodledata"""
+    print("\n=== Test: Compresion Adaptativa de Moodledata ===")
+    import gzip
+    import io
+    import random
+    import tarfile
+    import tempfile
+
+    rng = random.Random(23)
+    assert classify(b'\xff\xd8\xff\xe0' + rng.randbytes(1000)) == (False, 'jpeg')
+    assert classify(b'\0\0\0\x18ftypmp42' + rng.randbytes(1000)) == (False, 'mp4')
+    assert classify(b'PK\x03\x04' + b'a' * 1000) == (False, 'zip')
+    assert classify(b'INSERT INTO mdl_log VALUES (1);\n' * 100) == (True, 'muestra')
+    assert classify(rng.randbytes(SAMPLE_SIZE)) == (False, 'muestra')
+
+    # Marco zstd raw: cabecera, bloques de 128 KB y el ultimo marcado
+    encoder = StoredZstd()
+    frame = encoder.compress(rng.randbytes(200 * 1024)) + encoder.flush()
+    assert frame[:4] == b'\x28\xb5\x2f\xfd' and len(frame) == 6 + 200 * 1024 + 6
+    first = int.from_bytes(frame[6:9], 'little')
+    assert first >> 3 == 128 * 1024 and first & 7 == 0
+    last = int.from_bytes(frame[9 + 128 * 1024:12 + 128 * 1024], 'little')
+    assert last >> 3 == 72 * 1024 and last & 7 == 1
+
+    files = {
+        'filedir/3f/a1/' + 'c' * 40: b'<html>curso</html>\n' * 30000,
+        'filedir/9b/02/' + 'd' * 40: b'\xff\xd8\xff\xe0' + rng.randbytes(400 * 1024),
+        'filedir/e4/77/' + 'e' * 40: rng.randbytes(300 * 1024),
+        'filedir/e4/78/' + 'f' * 40: b'\xff\xd8\xff' + rng.randbytes(1000),
+        'lang/es/' + 'x' * 120 + '.php': b"<?php $string['x'] = 'y';\n" * 100,
+    }
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode='w', format=tarfile.PAX_FORMAT) as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    raw = data.getvalue()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'moodledata.tar')
+        with open(source, 'wb') as f:
+            f.write(raw)
+        output = os.path.join(tmp, 'moodledata_2024-01-15_02-00-00.tar.gz')
+        pipeline = AdaptiveTarPipeline(['cat', source], get_codec('gzip'), output, level=6,
+                                       min_size=256 * 1024)
+        pipeline.run()
+        adaptive = pipeline.adaptive
+        print(f"Adaptativa: {adaptive}")
+
+        # El tar se reproduce byte a byte y el archivo es un .tar.gz normal
+        with open(output, 'rb') as f:
+            assert gzip.decompress(f.read()) == raw
+        assert verify_file(output)['stream_ok']
+        assert adaptive['stored_files'] == 2 and adaptive['stored_bytes'] == 700 * 1024 + 4
+        assert adaptive['formats'] == {'jpeg': 400 * 1024 + 4, 'muestra': 300 * 1024}
+        assert adaptive['stored_frames'] == 1 and adaptive['frames'] == 3
+        assert adaptive['bytes_saved'] == len(raw) - os.path.getsize(output) > 0
+
+        # Sin archivos grandes todo va al compresor en un solo marco
+        small = AdaptiveTarPipeline(['cat', source], get_codec('gzip'), output, level=6, min_size=1024 * 1024)
+        small.run()
+        assert small.adaptive['stored_files'] == 0 and small.adaptive['frames'] == 1
+
+    print("OK")
+    return True
+
+
+def test_moodledata_archive_index():
+    """Prueba el indice de archivos del tar de moodledata"""
+    print("\n=== Test: Indice de Archivos de Moodledata ===")
+    import gzip
+    import io
+    import random
+    import subprocess
+    import tarfile
+    import tempfile
+
+    rng = random.Random(24)
+    files = {}
+    for number in range(12):
+        contenthash = f"{number:02x}" + 'a' * 38
+        files[f"filedir/{contenthash[:2]}/{contenthash[2:4]}/{contenthash}"] = rng.randbytes(3000 + number * 500)
+    files['lang/es/moodle.php'] = b"<?php $string['x'] = 'y';\n" * 200
+    files['lang/es/admin.php'] = b"<?php $string['a'] = 'b';\n" * 50
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode='w', format=tarfile.PAX_FORMAT) as tar:
+        directory = tarfile.TarInfo('lang/es')
+        directory.type = tarfile.DIRTYPE
+        tar.addfile(directory)
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    raw = data.getvalue()
+
+    def members(tar_bytes):
+        with tarfile.open(fileobj=io.BytesIO(tar_bytes), mode='r:') as tar:
+            return {m.name: tar.extractfile(m).read() for m in tar.getmembers() if m.isfile()}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'moodledata.tar')
+        with open(source, 'wb') as f:
+            f.write(raw)
+        backup_dir = os.path.join(tmp, '2024-01-15_02-00-00')
+        os.makedirs(backup_dir)
+        output = os.path.join(backup_dir, 'moodledata_2024-01-15_02-00-00.tar.gz')
+        pipeline = AdaptiveTarPipeline(['cat', source], get_codec('gzip'), output, level=6,
+                                       min_size=None, frame_size=8 * 1024, index=True)
+        pipeline.run()
+
+        # Varios marcos y el archivo sigue siendo un .tar.gz normal
+        with open(output, 'rb') as f:
+            assert gzip.decompress(f.read()) == raw
+        header = read_index_header(pipeline.index_file)
+        print(f"Marcos: {len(header['frames'])}, entradas: {header['entries']}")
+        assert header['codec'] == 'gzip' and len(header['frames']) > 3
+        assert header['entries'] == len(files) + 1
+        assert find_archive(backup_dir) == output
+
+        indexed = ArchiveReader(output)
+        assert indexed.mode == 'indexed'
+        items = list(indexed.entries())
+        target = 'filedir/07/aa/07' + 'a' * 38
+        item = next(i for i in items if i['path'] == target)
+        assert item['contenthash'] == '07' + 'a' * 38 and item['size'] == 6500 and item['frame'] > 0
+        assert 'contenthash' not in next(i for i in items if i['path'] == 'lang/es/moodle.php')
+
+        assert [i['path'] for i in indexed.search('07aa')] == [target]
+        assert len(list(indexed.list('lang/es'))) == 3
+
+        # Por ruta, subdirectorio y contenthash
+        selected = io.BytesIO()
+        stats = indexed.extract([target, 'lang/es', '0b' + 'a' * 38], selected)
+        expected = {name: content for name, content in files.items()
+                    if name in (target, 'filedir/0b/aa/0b' + 'a' * 38) or name.startswith('lang/')}
+        assert members(selected.getvalue()) == expected
+        assert stats['files'] == 4 and stats['entries'] == 5
+
+        try:
+            indexed.extract(['filedir/ff/ff/no-existe'], io.BytesIO())
+            assert False, "Deberia fallar con una ruta inexistente"
+        except ValueError:
+            pass
+
+        # Sin indice se recorre el archivo completo con el mismo resultado
+        os.remove(pipeline.index_file)
+        plain = ArchiveReader(output)
+        assert plain.mode == 'plain'
+        assert [i['path'] for i in plain.search('07aa')] == [target]
+        unindexed = io.BytesIO()
+        plain.extract([target, 'lang/es', '0b' + 'a' * 38], unindexed)
+        assert members(unindexed.getvalue()) == expected
+
+        # Una interrupcion termina el productor y no deja el parcial ni el indice a medias
+        interrupted_dir = os.path.join(tmp, 'interrumpido')
+        os.makedirs(interrupted_dir)
+        sources = []
+
+        def source_cmd():
+            sources.append(subprocess.Popen(['cat', source, '/dev/zero'], stdout=subprocess.PIPE))
+            return sources[0]
+
+        def interrupt(data):
+            raise KeyboardInterrupt()
+        try:
+            AdaptiveTarPipeline(source_cmd, get_codec('gzip'), os.path.join(interrupted_dir, 'moodledata.tar.gz'),
+                                level=6, index=True, observer=interrupt).run()
+            assert False, "El pipeline debio interrumpirse"
+        except KeyboardInterrupt:
+            pass
+        assert sources[0].poll() is not None
+        assert os.listdir(interrupted_dir) == []
+
+    print("OK")
+    return True
+
+
+def test_sharded_moodledata():
+    """Prueba el respaldo de moodledata en fragmentos por prefijo de filedir"""
+    print("\n=== Test: Moodledata en Fragmentos ===")
+    import io
+    import random
+    import subprocess
+    import tarfile
+    import tempfile
+
+    plan = shard_plan(['00', '3f', '40', 'ff'], 4)
+    assert [(shard['name'], shard['prefixes']) for shard in plan] == [
+        ('other', []), ('filedir-00-3f', ['00', '3f']), ('filedir-40-7f', ['40']), ('filedir-c0-ff', ['ff'])]
+    assert len(shard_plan([f"{n:02x}" for n in range(256)], 1000)) == 257
+
+    rng = random.Random(25)
+    files = {'filedir/warning.txt': b'No borrar', 'lang/es/moodle.php': b"<?php $string['x'] = 'y';\n" * 50,
+             'cache/objetos.bin': b'c' * 100}
+    for number in range(0, 256, 9):
+        contenthash = f"{number:02x}" + f"{number:02x}" * 19
+        files[f"filedir/{contenthash[:2]}/{contenthash[2:4]}/{contenthash}"] = rng.randbytes(2000 + number * 40)
+    expected = {name: content for name, content in files.items() if not name.startswith('cache/')}
+
+    class FakeDocker:
+        """Cliente de Docker que extrae put_archive en un directorio local"""
+
+        def __init__(self, target, mountpoint=None):
+            self.target = target
+            self.mountpoint = mountpoint
+            self.calls = []
+
+        def available(self):
+            return True
+
+        def json(self, method, path, body=None):
+            return {'Mountpoint': self.mountpoint}
+
+        def volume_containers(self, volume):
+            return [('moodle', '/var/moodledata', False)]
+
+        def put_archive(self, container, path, source):
+            with tarfile.open(fileobj=source, mode='r|') as tar:
+                names = []
+                for member in tar:
+                    names.append(member.name)
+                    tar.extract(member, self.target)
+            self.calls.append(names)
+
+    def read_dir(path):
+        found = {}
+        for root, _, names in os.walk(path):
+            for name in names:
+                with open(os.path.join(root, name), 'rb') as f:
+                    found[os.path.relpath(os.path.join(root, name), path)] = f.read()
+        return found
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source_dir = os.path.join(tmp, 'moodledata')
+        for name, content in files.items():
+            os.makedirs(os.path.dirname(os.path.join(source_dir, name)), exist_ok=True)
+            with open(os.path.join(source_dir, name), 'wb') as f:
+                f.write(content)
+
+        backup_dir = os.path.join(tmp, '2024-01-15_02-00-00')
+        shard_dir = os.path.join(backup_dir, SHARD_DIR)
+        archiver = ShardedArchiver(
+            source_dir, shard_dir, get_codec('gzip'),
+            lambda command, output: AdaptiveTarPipeline(command, get_codec('gzip'), output, level=6,
+                                                        min_size=None, frame_size=16 * 1024, index=True),
+            shards=4, workers=3, exclude=['cache'])
+        manifest = archiver.archive()
+        print(f"Fragmentos: {[(s['name'], len(s['prefixes']), s['bytes']) for s in manifest['shards']]}")
+
+        assert read_manifest(shard_dir) == manifest
+        assert [shard['name'] for shard in manifest['shards']] == [
+            'other', 'filedir-00-3f', 'filedir-40-7f', 'filedir-80-bf', 'filedir-c0-ff']
+        assert set(archiver.checksums) == ({'manifest.json'} | {s['file'] for s in manifest['shards']} |
+                                           {s['index'] for s in manifest['shards']})
+
+        # Cada fragmento es un .tar.gz normal con rutas relativas a la raiz del volumen
+        with tarfile.open(os.path.join(shard_dir, 'other.tar.gz')) as tar:
+            other = tar.getnames()
+        assert './filedir/warning.txt' in other and './lang/es/moodle.php' in other
+        assert not any(name.startswith('./filedir/') and name.count('/') > 2 for name in other)
+        assert not any(name.startswith('./cache/') for name in other)
+
+        # Un solo tar con todos los fragmentos (restauracion diferencial)
+        combined = io.BytesIO()
+        write_tar(shard_dir, combined)
+        combined.seek(0)
+        with tarfile.open(fileobj=combined, mode='r:') as tar:
+            assert {m.name[2:]: tar.extractfile(m).read() for m in tar.getmembers() if m.isfile()} == expected
+
+        # Restauracion en paralelo con tar en el punto de montaje del volumen
+        target = os.path.join(tmp, 'restaurado')
+        os.makedirs(target)
+        client = FakeDocker(None, mountpoint=target)
+        stats = ShardedRestore(shard_dir, 'moodledata_testing', workers=3, client=client).restore()
+        assert stats['shards'] == 5 and stats['bytes'] == manifest['bytes'] and stats['workers'] == 3
+        assert client.calls == []
+        assert read_dir(target) == expected
+
+        # Sin punto de montaje accesible, por la API uno tras otro y el de resto primero
+        target = os.path.join(tmp, 'restaurado_api')
+        client = FakeDocker(target)
+        stats = ShardedRestore(shard_dir, 'moodledata_testing', workers=3, client=client).restore()
+        assert stats['workers'] == 1
+        assert './filedir/warning.txt' in client.calls[0] and len(client.calls) == 5
+        assert read_dir(target) == expected
+
+        # Recuperar archivos sueltos lee los indices de los fragmentos
+        reader = open_archive(backup_dir)
+        assert isinstance(reader, ArchiveSet) and reader.mode == 'indexed'
+        contenthash = '48' * 20
+        assert [item['path'] for item in reader.search('4848')] == [f"filedir/48/48/{contenthash}"]
+        selected = io.BytesIO()
+        reader.extract([contenthash, 'lang/es'], selected)
+        selected.seek(0)
+        with tarfile.open(fileobj=selected, mode='r:') as tar:
+            assert {m.name[2:]: tar.extractfile(m).read() for m in tar.getmembers() if m.isfile()} == {
+                f"filedir/48/48/{contenthash}": files[f"filedir/48/48/{contenthash}"],
+                'lang/es/moodle.php': files['lang/es/moodle.php']}
+        try:
+            reader.extract(['filedir/ff/ff/no-existe'], io.BytesIO())
+            assert False, "Deberia fallar con una ruta inexistente"
+        except ValueError:
+            pass
+
+        # Modo 'sharded' de backup.sh: los checksums van al SHA256SUMS del respaldo
+        shell_dir = os.path.join(tmp, 'shell')
+        env = dict(os.environ, BACKUP_COMPRESSION='gzip', BACKUP_MOODLEDATA_SHARDS='2',
+                   BACKUP_PARALLEL_WORKERS='2', BACKUP_MOODLEDATA_EXCLUDE='cache')
+        env.pop('BACKUP_PROGRESS_FILE', None)
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backup', 'sharded.py')
+        result = subprocess.run([sys.executable, script, 'backup', source_dir, os.path.join(shell_dir, SHARD_DIR)],
+                                env=env, capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        print(f"sharded.py backup: {result.stdout.strip()}")
+        checksums = read_checksums(shell_dir)
+        assert {name.split('/', 1)[1] for name in checksums} == {
+            'manifest.json', 'other.tar.gz', 'filedir-00-7f.tar.gz', 'filedir-80-ff.tar.gz'}
+        for name, digest in checksums.items():
+            assert verify_file(os.path.join(shell_dir, name), digest)['hash_ok'], name
+        combined = io.BytesIO()
+        write_tar(os.path.join(shell_dir, SHARD_DIR), combined)
+        combined.seek(0)
+        with tarfile.open(fileobj=combined, mode='r:') as tar:
+            assert {m.name[2:]: tar.extractfile(m).read() for m in tar.getmembers() if m.isfile()} == expected
+
+    print("OK")
+    return True
+
+
 def run_all_tests():
     """Ejecuta todas las pruebas"""
     print("\n" + "="*60)
@@ -85,7 +1798,32 @@ def run_all_tests():
         test_os_detection,
         test_password_generation,
         test_validator,
-        test_settings
+        test_settings,
+        test_stream_pipeline,
+        test_compression_codecs,
+        test_incremental_blob_store,
+        test_parallel_dump,
+        test_backup_catalog,
+        test_differential_restore,
+        test_integrity_checksums,
+        test_retention_plan,
+        test_throttle,
+        test_remote_replication,
+        test_moodledata_exclusions,
+        test_binlog_point_in_time,
+        test_volume_tar_filter,
+        test_benchmark_dataset,
+        test_send_mail_streaming,
+        test_scheduler_daemon,
+        test_progress_events,
+        test_environment_clone,
+        test_seekable_dump,
+        test_physical_backup,
+        test_backup_tiering,
+        test_blob_gc_cold_backups,
+        test_adaptive_compression,
+        test_moodledata_archive_index,
+        test_sharded_moodledata
     ]
     
     results = []